@@ -0,0 +1,175 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Admission control of heavy operations on one docker host.
+
+Builds, pulls, pushes and exports (docker save for pulp) are limited separately;
+operations which write to disk are also admitted only when there's enough free
+space in docker's root dir and in tmpdir. Operations over the limit wait until
+they are admitted, they don't fail:
+
+    admission.controller.configure(limits={'build': 2, 'pull': 4},
+                                   min_free_bytes=10 * 1024 ** 3,
+                                   paths=['/var/lib/docker', tempfile.gettempdir()])
+
+    with admission.admit('pull'):
+        tasker.pull_image(...)
+
+Nothing is limited by default. When builds are spread across several docker hosts,
+every host has its own controller, which is used for operations of taskers of
+that host (see DockerTasker's admission_controller).
+"""
+
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from dock import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+OPERATIONS = ('build', 'pull', 'push', 'export')
+# these write images or tarballs to disk
+DISK_OPERATIONS = ('build', 'pull', 'export')
+
+ADMISSION_WAIT_SECONDS = metrics.histogram('dock_admission_wait_seconds',
+                                           'Time operations waited for admission', ['operation'])
+
+
+def get_free_bytes(path):
+    """
+    :param path: str
+    :return: int, bytes available to unprivileged users on filesystem with path
+    """
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize
+
+
+class AdmissionController(object):
+    def __init__(self, limits=None, min_free_bytes=0, paths=None, poll_interval=5.0,
+                 free_bytes=get_free_bytes):
+        """
+        :param limits: dict, operation -> max number of concurrent operations (None is unlimited)
+        :param min_free_bytes: int, disk operations wait until all paths have this much space
+        :param paths: list of str, paths to check for free space (default is tmpdir)
+        :param poll_interval: float, seconds between checks of free space
+        :param free_bytes: function path -> free bytes
+        """
+        self._cond = threading.Condition()
+        self._running = dict((operation, 0) for operation in OPERATIONS)
+        self._waiting = dict((operation, 0) for operation in OPERATIONS)
+        self.free_bytes = free_bytes
+        self.configure(limits, min_free_bytes, paths, poll_interval)
+
+    def configure(self, limits=None, min_free_bytes=0, paths=None, poll_interval=5.0):
+        """ set limits; operations which are already running are not affected """
+        limits = limits or {}
+        unknown = set(limits) - set(OPERATIONS)
+        if unknown:
+            raise ValueError("unknown operations: %s" % sorted(unknown))
+        with self._cond:
+            self.limits = dict((operation, limits.get(operation)) for operation in OPERATIONS)
+            self.min_free_bytes = min_free_bytes
+            self.paths = paths if paths is not None else [tempfile.gettempdir()]
+            self.poll_interval = poll_interval
+            self._cond.notify_all()
+
+    def _low_on_space(self):
+        """
+        :return: str, path with not enough free space, or None
+        """
+        if not self.min_free_bytes:
+            return None
+        for path in self.paths:
+            try:
+                free = self.free_bytes(path)
+            except OSError as ex:
+                # e.g. docker root of host isn't visible from build container
+                logger.debug("can't find out free space in '%s': %s", path, repr(ex))
+                continue
+            if free < self.min_free_bytes:
+                return path
+        return None
+
+    def _blocker(self, operation):
+        limit = self.limits[operation]
+        if limit is not None and self._running[operation] >= limit:
+            return "%d %s operations running" % (self._running[operation], operation)
+        if operation in DISK_OPERATIONS:
+            path = self._low_on_space()
+            if path is not None:
+                return "less than %d bytes free in '%s'" % (self.min_free_bytes, path)
+        return None
+
+    @contextmanager
+    def admit(self, operation, timeout=None):
+        """
+        context manager: wait until operation is admitted, run it
+
+        :param operation: str, one of OPERATIONS
+        :param timeout: float, raise RuntimeError when not admitted within this many seconds
+        """
+        if operation not in OPERATIONS:
+            raise ValueError("unknown operation '%s'" % operation)
+        start = time.time()
+        deadline = None if timeout is None else start + timeout
+        with self._cond:
+            blocker = self._blocker(operation)
+            if blocker:
+                logger.info("waiting for admission of %s: %s", operation, blocker)
+                self._waiting[operation] += 1
+                try:
+                    while blocker:
+                        wait = self.poll_interval
+                        if deadline is not None:
+                            wait = min(wait, deadline - time.time())
+                            if wait <= 0:
+                                raise RuntimeError("%s wasn't admitted within %s seconds: %s" %
+                                                   (operation, timeout, blocker))
+                        self._cond.wait(wait)
+                        blocker = self._blocker(operation)
+                finally:
+                    self._waiting[operation] -= 1
+            self._running[operation] += 1
+        waited = time.time() - start
+        ADMISSION_WAIT_SECONDS.labels(operation=operation).observe(waited)
+        if waited >= 1:
+            logger.info("%s admitted after %.1f seconds", operation, waited)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running[operation] -= 1
+                self._cond.notify_all()
+
+    def stats(self):
+        """
+        :return: dict, operation -> {'running': int, 'waiting': int, 'limit': int or None}
+        """
+        with self._cond:
+            return dict((operation, {'running': self._running[operation],
+                                     'waiting': self._waiting[operation],
+                                     'limit': self.limits[operation]})
+                        for operation in OPERATIONS)
+
+
+controller = AdmissionController()
+
+
+def admit(operation, timeout=None, tasker=None):
+    """
+    context manager: admission of operation by controller of docker host of tasker,
+    the process-wide controller by default
+    """
+    host_controller = getattr(tasker, 'admission_controller', None) or controller
+    return host_controller.admit(operation, timeout=timeout)
@@ -7,9 +7,10 @@ of the BSD license. See the LICENSE file for details.
 
 
 Python API for dock. This is the official way of interacting with dock.
+
+Modules which import docker and git are imported within functions: this module is
+imported by 'import dock' (and hence by CLI) and it should stay cheap to import.
 """
-from dock.inner import DockerBuildWorkflow
-from dock.outer import PrivilegedBuildManager, DockerhostBuildManager
 
 
 __all__ = (
@@ -51,6 +52,7 @@ def build_image_in_privileged_container(build_image, git_url, image,
         "target_registries_insecure": target_registries_insecure,
     }
     build_json.update(kwargs)
+    from dock.outer import PrivilegedBuildManager
     m = PrivilegedBuildManager(build_image, build_json)
     build_response = m.build()
     if push_buildroot_to:
@@ -92,6 +94,7 @@ def build_image_using_hosts_docker(build_image, git_url, image,
         "target_registries_insecure": target_registries_insecure,
     }
     build_json.update(kwargs)
+    from dock.outer import DockerhostBuildManager
     m = DockerhostBuildManager(build_image, build_json)
     build_response = m.build()
     if push_buildroot_to:
@@ -129,6 +132,7 @@ def build_image_here(git_url, image,
         "target_registries_insecure": target_registries_insecure,
     }
     build_json.update(kwargs)
+    from dock.inner import DockerBuildWorkflow
     m = DockerBuildWorkflow(**build_json)
     return m.build_docker_image()
 
@@ -0,0 +1,207 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Local store of build artefacts (tarballs listed in dist-git 'sources' file).
+
+Artefacts are identified by checksum, so they are stored as
+
+    <path>/<hash type>/<checksum>
+
+and hard-linked (or copied, when hard link is not possible) into clones.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import shutil
+import stat
+import tempfile
+
+import requests
+
+
+logger = logging.getLogger(__name__)
+
+
+CHUNK_SIZE = 1024 * 1024
+
+# "SHA512 (foo-1.0.tar.gz) = 0a1b..."
+TAGGED_SOURCES_RE = re.compile(r'^(?P<hashtype>\w+) \((?P<filename>.+)\) = (?P<checksum>[0-9a-fA-F]+)$')
+# "0a1b...  foo-1.0.tar.gz"
+SOURCES_RE = re.compile(r'^(?P<checksum>[0-9a-fA-F]+)\s+(?P<filename>.+)$')
+
+
+class Artefact(object):
+    def __init__(self, filename, hashtype, checksum):
+        self.filename = filename
+        self.hashtype = hashtype.lower()
+        self.checksum = checksum.lower()
+
+    def __repr__(self):
+        return "Artefact(%s, %s:%s)" % (self.filename, self.hashtype, self.checksum)
+
+
+def check_filename(filename):
+    """
+    artefacts are put into root of git repo, their names come from the repo
+
+    :param filename: str
+    :raises RuntimeError: name is a path, not a name of file
+    """
+    if os.path.isabs(filename) or '/' in filename or '\0' in filename or \
+            filename in ('.', '..'):
+        raise RuntimeError("invalid name of artefact in sources file: '%s'" % filename)
+
+
+def get_target_path(target_dir, filename):
+    """
+    :return: str, path of artefact in target_dir
+    :raises RuntimeError: path would be outside of target_dir
+    """
+    check_filename(filename)
+    target = os.path.join(target_dir, filename)
+    if os.path.dirname(os.path.abspath(target)) != os.path.abspath(target_dir):
+        raise RuntimeError("artefact '%s' would be outside of '%s'" % (filename, target_dir))
+    return target
+
+
+def parse_sources(content):
+    """
+    :param content: str, content of 'sources' file
+    :return: list of Artefact
+    :raises RuntimeError: when some file name isn't a plain name of file
+    """
+    artefacts = []
+    for line in content.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        match = TAGGED_SOURCES_RE.match(line)
+        if match:
+            artefact = Artefact(match.group('filename'), match.group('hashtype'),
+                                match.group('checksum'))
+        else:
+            match = SOURCES_RE.match(line)
+            if not match:
+                logger.warning("can't parse line of sources file: '%s'", line)
+                continue
+            artefact = Artefact(match.group('filename'), 'md5', match.group('checksum'))
+        check_filename(artefact.filename)
+        artefacts.append(artefact)
+    return artefacts
+
+
+def compute_checksum(path, hashtype):
+    checksum = hashlib.new(hashtype)
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(CHUNK_SIZE), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+class ArtefactStore(object):
+    def __init__(self, path):
+        """
+        :param path: str, directory of the store
+        """
+        self.path = path
+
+    def get_path(self, artefact):
+        return os.path.join(self.path, artefact.hashtype, artefact.checksum)
+
+    def contains(self, artefact):
+        return os.path.isfile(self.get_path(artefact))
+
+    def _prepare_dir(self, artefact):
+        directory = os.path.dirname(self.get_path(artefact))
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created by someone else in the meantime
+                if not os.path.isdir(directory):
+                    raise
+        return directory
+
+    def _commit(self, artefact, tmp_path):
+        # artefacts are hard-linked into clones, don't let anyone change them
+        os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.rename(tmp_path, self.get_path(artefact))
+
+    def link(self, artefact, target_dir):
+        """
+        put stored artefact into target_dir
+
+        :param artefact: Artefact
+        :param target_dir: str
+        """
+        source = self.get_path(artefact)
+        target = get_target_path(target_dir, artefact.filename)
+        if os.path.lexists(target):
+            os.remove(target)
+        try:
+            os.link(source, target)
+        except OSError as ex:
+            # different filesystem or no hard links
+            logger.debug("can't hard-link '%s' (%s), copying", artefact.filename, repr(ex))
+            shutil.copyfile(source, target)
+
+    def add(self, artefact, path):
+        """
+        store copy of existing file, checksum is verified
+
+        :param artefact: Artefact
+        :param path: str, path to the file
+        """
+        directory = self._prepare_dir(artefact)
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        os.close(fd)
+        try:
+            shutil.copyfile(path, tmp_path)
+            checksum = compute_checksum(tmp_path, artefact.hashtype)
+            if checksum != artefact.checksum:
+                raise RuntimeError("checksum of '%s' doesn't match: %s != %s" %
+                                   (artefact.filename, checksum, artefact.checksum))
+            self._commit(artefact, tmp_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def download(self, artefact, url, session=None):
+        """
+        download artefact into the store; checksum is computed while downloading
+
+        :param artefact: Artefact
+        :param url: str
+        :param session: requests.Session instance
+        """
+        logger.info("downloading '%s' from '%s'", artefact.filename, url)
+        session = session or requests
+        directory = self._prepare_dir(artefact)
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        checksum = hashlib.new(artefact.hashtype)
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                response = session.get(url, stream=True)
+                try:
+                    response.raise_for_status()
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        checksum.update(chunk)
+                        fp.write(chunk)
+                finally:
+                    response.close()
+            if checksum.hexdigest() != artefact.checksum:
+                raise RuntimeError("checksum of '%s' doesn't match: %s != %s" %
+                                   (artefact.filename, checksum.hexdigest(), artefact.checksum))
+            self._commit(artefact, tmp_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
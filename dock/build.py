@@ -12,14 +12,23 @@ Logic above these classes has to set the workflow itself.
 
 import logging
 
-from dock.core import DockerTasker, LastLogger
-from dock.util import get_baseimage_from_dockerfile, LazyGit, wait_for_command, \
-    figure_out_dockerfile, ImageName
+import re
+
+from docker.errors import APIError
+
+from dock import admission, metrics, registry
+from dock.core import DockerTasker, LastLogger, DOCKER_SECONDS
+from dock.dockerfile import Dockerfile
+from dock.util import LazyGit, wait_for_command, figure_out_dockerfile, ImageName
 
 
 logger = logging.getLogger(__name__)
 
 
+BASE_IMAGE_PULLS = metrics.counter('dock_base_image_pulls_total', 'Pulls of base images',
+                                   ['result'])
+
+
 class ImageAlreadyBuilt(Exception):
     """ This method expects image not to be built but it already is """
 
@@ -80,14 +89,18 @@ class InsideBuilder(LastLogger, LazyGit, BuilderStateMachine):
                  git_dockerfile_path=None,
                  git_commit=None,
                  tmpdir=None,
+                 tasker=None,
+                 git_cache_dir=None,
                  **kwargs):
         """
+        :param tasker: DockerTasker, new one is created by default
+        :param git_cache_dir: str, keep mirror of git repo in this dir (clone it from scratch by default)
         """
         LastLogger.__init__(self)
-        LazyGit.__init__(self, git_url, git_commit, tmpdir=tmpdir)
+        LazyGit.__init__(self, git_url, git_commit, tmpdir=tmpdir, cache_dir=git_cache_dir)
         BuilderStateMachine.__init__(self)
 
-        self.tasker = DockerTasker()
+        self.tasker = tasker or DockerTasker()
 
         # arguments for build
         self.git_url = git_url
@@ -97,13 +110,17 @@ class InsideBuilder(LastLogger, LazyGit, BuilderStateMachine):
         self.image = ImageName.parse(image)
         self.git_dockerfile_path = git_dockerfile_path
         self.git_commit = git_commit
+        # {'image': str, 'digest': str or None, 'skipped': bool}, set by pull_base_image
+        self.base_image_pull = None
 
         # get info about base image from dockerfile
         self.df_path, self.df_dir = figure_out_dockerfile(self.git_path, self.git_dockerfile_path)
-        self.base_image = ImageName.parse(get_baseimage_from_dockerfile(self.df_path))
+        # plugins alter this in memory, it's written to disk right before build
+        self.dockerfile = Dockerfile(self.df_path)
+        self.base_image = ImageName.parse(self.dockerfile.baseimage)
         logger.debug("image specified in dockerfile = '%s'", self.base_image)
         if not self.base_image.tag:
-            self.base_image.tag = 'latest'
+            self.base_image = self.base_image.copy(tag='latest')
 
     def pull_base_image(self, source_registry, insecure=False):
         """
@@ -125,10 +142,18 @@ class InsideBuilder(LastLogger, LazyGit, BuilderStateMachine):
                 "Registry specified in dockerfile doesn't match provided one. Dockerfile: '%s', Provided: '%s'"
                 % (self.base_image.registry, source_registry))
 
-        base_image_with_registry = self.base_image.copy()
-        base_image_with_registry.registry = source_registry
+        base_image_with_registry = self.base_image.copy(registry=source_registry)
 
-        base_image = self.tasker.pull_image(base_image_with_registry, insecure=insecure)
+        digest = registry.get_manifest_digest(base_image_with_registry, insecure=insecure)
+        skipped = digest is not None and digest in self._local_digests(base_image_with_registry)
+        if skipped:
+            logger.info("base image '%s' matches registry (%s), not pulling it",
+                        base_image_with_registry, digest)
+            base_image = base_image_with_registry.to_str()
+        else:
+            base_image = self.tasker.pull_image(base_image_with_registry, insecure=insecure)
+        BASE_IMAGE_PULLS.labels(result='skipped' if skipped else 'pulled').inc()
+        self.base_image_pull = {'image': base_image, 'digest': digest, 'skipped': skipped}
 
         if not self.base_image.registry:
             response = self.tasker.tag_image(base_image_with_registry, self.base_image, force=True)
@@ -138,6 +163,17 @@ class InsideBuilder(LastLogger, LazyGit, BuilderStateMachine):
         logger.debug("image '%s' is available", response)
         return response
 
+    def _local_digests(self, image):
+        """
+        :return: set of str, digests of local image, empty if image isn't present
+        """
+        try:
+            inspect = self.tasker.inspect_image(image)
+        except APIError as ex:
+            logger.debug("image '%s' is not present: %s", image, repr(ex))
+            return set()
+        return registry.local_digests(inspect or {}, image)
+
     def build(self):
         """
         build image inside current environment;
@@ -147,13 +183,18 @@ class InsideBuilder(LastLogger, LazyGit, BuilderStateMachine):
         """
         logger.info("build image inside current environment")
         self._ensure_not_built()
-        logs_gen = self.tasker.build_image_from_path(
-            self.df_dir,
-            self.image,
-        )
-        logger.debug("build is submitted, waiting for it to finish")
-        command_result = wait_for_command(logs_gen)  # wait for build to finish
+        self.dockerfile.write()
+        with admission.admit('build', tasker=self.tasker):
+            logs_gen = self.tasker.build_image_from_path(
+                self.df_dir,
+                self.image,
+            )
+            logger.debug("build is submitted, waiting for it to finish")
+            with DOCKER_SECONDS.labels(operation='build').time():
+                command_result = wait_for_command(logs_gen)  # wait for build to finish
         logger.info("was build successful? %s", not command_result.is_failed())
+        if command_result.is_failed():
+            self._log_failed_instruction(command_result.logs)
         self.is_built = True
         if not command_result.is_failed():
             self.built_image_info = self.get_built_image_info()
@@ -162,6 +203,25 @@ class InsideBuilder(LastLogger, LazyGit, BuilderStateMachine):
         build_result = BuildResult(command_result, self.image_id)
         return build_result
 
+    def _log_failed_instruction(self, logs):
+        """
+        find the last step docker started and log which dockerfile instruction it was
+
+        :param logs: list of str, build logs
+        """
+        for log in reversed(logs):
+            match = re.search(r'Step (\d+)(/\d+)? :', log)
+            if match:
+                step = int(match.group(1))
+                if match.group(2):
+                    # 'Step 1/5 :' -- newer docker counts from 1
+                    step -= 1
+                instruction = self.dockerfile.get_instruction_by_step(step)
+                if instruction is not None:
+                    logger.error("build failed at dockerfile line %d: %s",
+                                 instruction.startline + 1, instruction.content.strip())
+                return
+
     def push_built_image(self, registry, insecure=False):
         """
         push built image to provided registry
@@ -184,8 +244,7 @@ class InsideBuilder(LastLogger, LazyGit, BuilderStateMachine):
                 "Registry in image name doesn't match target registry. Image: '%s', Target: '%s'"
                 % (self.image.registry, registry))
 
-        target_image = self.image.copy()
-        target_image.registry = registry
+        target_image = self.image.copy(registry=registry)
 
         response = self.tasker.tag_and_push_image(self.image, target_image, insecure=insecure)
         self.tasker.remove_image(target_image)
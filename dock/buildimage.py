@@ -11,7 +11,13 @@ supported use cases:
  * build image from remote git (without specifying address)
  * build image from local git repo
  * build image using provided tarball (made with sdist)
+
+sdist tarballs are cached: for remote git repos by commit of HEAD (which is found out
+with 'git ls-remote', so nothing is cloned when the tarball is cached), for local
+paths by hash of the tree. Cached tarball is byte-identical, so docker cache can be
+used for the build: layers are rebuilt only when content of the tarball changes.
 """
+import hashlib
 import os
 import shutil
 import subprocess
@@ -20,6 +26,9 @@ import logging
 from glob import glob
 import uuid
 
+import git
+
+from dock.constants import DOCK_CACHE_DIR
 from dock.core import DockerTasker
 from dock.util import LazyGit, wait_for_command, ImageName
 
@@ -30,11 +39,56 @@ logger = logging.getLogger(__name__)
 DOCK_GIT_URL = "https://github.com/DBuildService/dock.git"
 DOCKERFILE_DOCK_TARBALL_NAME = "dock.tar.gz"
 
+# not part of sdist, don't invalidate cached tarball
+TREE_HASH_IGNORED_DIRS = ('.git', '__pycache__', 'build', 'dist', '.tox', '.cache')
+TREE_HASH_IGNORED_SUFFIXES = ('.pyc', '.pyo', '.egg-info', '.swp')
+
+
+def get_tree_hash(path):
+    """
+    compute hash of content of directory tree
+
+    :param path: str, directory
+    :return: str, hex digest
+    """
+    tree_hash = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted(d for d in dirnames if d not in TREE_HASH_IGNORED_DIRS and
+                             not d.endswith(TREE_HASH_IGNORED_SUFFIXES))
+        for filename in sorted(filenames):
+            if filename.endswith(TREE_HASH_IGNORED_SUFFIXES):
+                continue
+            file_path = os.path.join(dirpath, filename)
+            if not os.path.isfile(file_path):
+                continue
+            tree_hash.update(os.path.relpath(file_path, path).encode('utf-8') + b'\0')
+            with open(file_path, 'rb') as fp:
+                tree_hash.update(hashlib.sha256(fp.read()).digest())
+    return tree_hash.hexdigest()
+
+
+def get_remote_head(git_url):
+    """
+    :param git_url: str, URL of git repo
+    :return: str, commit of HEAD or None if it can't be found out
+    """
+    try:
+        output = git.Git().ls_remote(git_url, 'HEAD')
+    except git.exc.GitCommandError as ex:
+        logger.warning("can't get HEAD of '%s': %s", git_url, repr(ex))
+        return None
+    for line in output.splitlines():
+        commit, _, ref = line.partition('\t')
+        if ref == 'HEAD':
+            return commit
+    return None
+
 
 class BuildImageBuilder(object):
     def __init__(self, dock_tarball_path=None, dock_local_path=None,
-                 dock_remote_path=None, use_official_dock_git=False):
+                 dock_remote_path=None, use_official_dock_git=False, cache_dir=None):
         self.tasker = DockerTasker()
+        self.cache_dir = cache_dir or os.path.join(DOCK_CACHE_DIR, 'sdist')
         self.dock_tarball_path = dock_tarball_path
         self.dock_local_path = dock_local_path
         self.dock_remote_path = dock_remote_path
@@ -47,12 +101,14 @@ class BuildImageBuilder(object):
             raise RuntimeError("You have to specify dock source: either local gitrepo, "
                                "path to dock tarball, or use upstream git repo.")
 
-    def create_image(self, df_dir_path, image, use_cache=False):
+    def create_image(self, df_dir_path, image, use_cache=True):
         """
         create image: get dock sdist tarball, build image and tag it
 
         :param df_path:
         :param image:
+        :param use_cache: bool, use docker cache; dock tarball is cached, so layers
+                          are rebuilt only when dock changes
         :return:
         """
         logger.debug("df_dir_path = '%s', image = '%s'", df_dir_path, image)
@@ -69,12 +125,13 @@ class BuildImageBuilder(object):
         logger.debug("tmp dir with dock '%s' created", git_tmpdir)
         try:
             for f in glob(os.path.join(df_dir_path, '*')):
-                shutil.copy(f, df_tmpdir)
+                # keep metadata, so docker cache can be used
+                shutil.copy2(f, df_tmpdir)
                 logger.debug("cp '%s' -> '%s'", f, df_tmpdir)
             logger.debug("df dir: %s", os.listdir(df_tmpdir))
             dock_tarball = self.get_dock_tarball_path(tmpdir=git_tmpdir)
             dock_tb_path = os.path.join(df_tmpdir, DOCKERFILE_DOCK_TARBALL_NAME)
-            shutil.copy(dock_tarball, dock_tb_path)
+            shutil.copy2(dock_tarball, dock_tb_path)
 
             image_name = ImageName.parse(image)
             logs_gen = self.tasker.build_image_from_path(df_tmpdir, image_name, stream=True, use_cache=use_cache)
@@ -84,7 +141,7 @@ class BuildImageBuilder(object):
 
     def get_dock_tarball_path(self, tmpdir):
         """
-        generate dock tarball
+        generate dock tarball, or get it from cache
         :return:
         """
         if self.dock_tarball_path:
@@ -96,11 +153,23 @@ class BuildImageBuilder(object):
             if not os.path.isdir(self.dock_local_path):
                 logger.error("local dock git clone does not exist: '%s'", self.dock_local_path)
                 raise RuntimeError("Local dock git repo does not exist: '%s'" % self.dock_local_path)
+            cache_key = "tree-" + get_tree_hash(self.dock_local_path)
             local_dock_git_path = self.dock_local_path
         else:
             if self.use_official_dock_git:
                 self.dock_remote_path = DOCK_GIT_URL
-
+            head = get_remote_head(self.dock_remote_path)
+            cache_key = "commit-" + head if head else None
+            local_dock_git_path = None
+
+        cached_tarball = self.get_cached_tarball(cache_key)
+        if cached_tarball:
+            logger.info("using cached dock tarball '%s'", cached_tarball)
+            tarball = os.path.join(tmpdir, os.path.basename(cached_tarball))
+            shutil.copy2(cached_tarball, tarball)
+            return tarball
+
+        if local_dock_git_path is None:
             g = LazyGit(self.dock_remote_path, tmpdir=tmpdir)
             local_dock_git_path = g.git_path
 
@@ -113,10 +182,41 @@ class BuildImageBuilder(object):
             os.chdir(cwd)
         candidates_list = glob(os.path.join(tmpdir, 'dock-*.tar.gz'))
         if len(candidates_list) == 1:
-            return candidates_list[0]
+            tarball = candidates_list[0]
         else:
             logger.warning("len(dock-*.tar.gz) != 1: '%s'", candidates_list)
             try:
-                return candidates_list[0]
+                tarball = candidates_list[0]
             except IndexError:
                 raise RuntimeError("No dock tarball built.")
+        self.store_tarball(cache_key, tarball)
+        return tarball
+
+    def get_cached_tarball(self, cache_key):
+        """
+        :param cache_key: str or None
+        :return: str, path to cached tarball or None
+        """
+        if not cache_key:
+            return None
+        candidates_list = glob(os.path.join(self.cache_dir, cache_key, 'dock-*.tar.gz'))
+        if candidates_list:
+            return candidates_list[0]
+        return None
+
+    def store_tarball(self, cache_key, tarball):
+        if not cache_key:
+            return
+        target_dir = os.path.join(self.cache_dir, cache_key)
+        tmp_dir = None
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            tmp_dir = tempfile.mkdtemp(dir=self.cache_dir)
+            shutil.copy2(tarball, tmp_dir)
+            # atomic, so nobody sees partially written tarball
+            os.rename(tmp_dir, target_dir)
+        except (IOError, OSError) as ex:
+            logger.warning("can't cache dock tarball: %s", repr(ex))
+            if tmp_dir:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
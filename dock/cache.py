@@ -0,0 +1,126 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Process-wide in-memory caches.
+
+Plugin modules are loaded again every time a plugin runner is created, so
+plugins can't keep state in module globals; caches which should survive
+between builds within one process are registered here instead:
+
+    targets = get_cache('koji-targets', lambda: TTLCache(ttl=60))
+"""
+
+import logging
+import threading
+import time
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python 2.6
+    from ordereddict import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache(object):
+    """ thread-safe mapping where entries expire after ttl seconds """
+
+    def __init__(self, ttl, clock=time.time):
+        """
+        :param ttl: int or float, lifetime of entries in seconds
+        :param clock: function returning current time in seconds
+        """
+        self.ttl = ttl
+        self.clock = clock
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None, allow_expired=False):
+        """
+        :param key: hashable
+        :param default: returned when there's no (valid) entry
+        :param allow_expired: bool, return also expired entry (e.g. for revalidation)
+        :return: cached value or default
+        """
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return default
+        if not allow_expired and expires <= self.clock():
+            return default
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (self.clock() + self.ttl, value)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class LRUCache(object):
+    """ thread-safe mapping which holds at most maxsize least recently used entries """
+
+    def __init__(self, maxsize):
+        """
+        :param maxsize: int, maximal number of entries
+        """
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name, factory):
+    """
+    get process-wide cache, create it if it doesn't exist yet
+
+    :param name: str, name of the cache
+    :param factory: function without arguments which creates the cache
+    :return: object created by factory
+    """
+    with _caches_lock:
+        try:
+            return _caches[name]
+        except KeyError:
+            logger.debug("creating cache '%s'", name)
+            cache = _caches[name] = factory()
+            return cache
@@ -11,19 +11,22 @@ import argparse
 import logging
 import os
 import sys
-import pkg_resources
+import tempfile
 
 from dock import build_image_here, build_image_in_privileged_container, \
-    build_image_using_hosts_docker, set_logging
-from dock.constants import CONTAINER_BUILD_JSON_PATH, CONTAINER_RESULTS_JSON_PATH
-from dock.buildimage import BuildImageBuilder
-from dock.inner import BuildResultsEncoder, build_inside, BuildResults
+    build_image_using_hosts_docker, set_logging, tracing
+from dock.constants import CONTAINER_BUILD_JSON_PATH, CONTAINER_RESULTS_JSON_PATH, \
+    DAEMON_SOCKET_PATH, DOCK_CACHE_DIR
+
+# modules which need docker, git or pkg_resources are imported within subcommands,
+# so 'dock --help' and argument parsing stay fast
 
 
 logger = logging.getLogger('dock')
 
 
 def cli_create_build_image(args):
+    from dock.buildimage import BuildImageBuilder
     b = BuildImageBuilder(dock_tarball_path=args.dock_tarball_path,
                           dock_local_path=args.dock_local_path,
                           dock_remote_path=args.dock_remote_git,
@@ -37,6 +40,18 @@ def cli_create_build_image(args):
 
 
 def cli_build_image(args):
+    if args.trace_file:
+        tracing.tracer.enable(process_name='dock build')
+    try:
+        return_code = _build_image(args)
+    finally:
+        if args.trace_file:
+            tracing.tracer.write(args.trace_file)
+    sys.exit(return_code)
+
+
+def _build_image(args):
+    from dock.inner import BuildResults
     if args.plugin_files:
         args.plugin_files = [os.path.abspath(f) for f in args.plugin_files]
     if args.json:
@@ -67,19 +82,121 @@ def cli_build_image(args):
 
     if response.return_code != 0:
         logger.error("build failed")
-    sys.exit(response.return_code)
+    return response.return_code
 
 
 def cli_inside_build(args):
+    from dock.inner import build_inside
     build_inside(input=args.input, input_args=args.input_arg, substitutions=args.substitute)
 
 
+def cli_serve(args):
+    from dock import admission
+    from dock.daemon import BuildDaemon, DaemonServer
+    from dock.dispatch import Dispatcher, Endpoint
+    from dock.scheduler import Scheduler
+    git_cache_dir = None if args.no_git_cache else args.git_cache_dir
+    min_free_bytes = int(args.min_free_space * 1024 ** 3)
+    docker_urls = args.docker_url or [None]
+    limits = {'build': args.max_builds, 'pull': args.max_pulls, 'push': args.max_pushes,
+              'export': args.max_exports}
+    dispatcher = None
+    controllers = []  # per docker URL
+    if len(docker_urls) > 1:
+        # limits apply per host; free space of remote hosts is checked by dispatcher
+        endpoints = []
+        for url in docker_urls:
+            endpoint = Endpoint(url, capacity=args.host_capacity)
+            paths = [tempfile.gettempdir()]
+            if endpoint.is_local:
+                paths.append(_get_docker_root(url))
+            endpoint.controller.configure(limits=limits, paths=paths,
+                                          min_free_bytes=min_free_bytes)
+            endpoints.append(endpoint)
+            controllers.append(endpoint.controller)
+        dispatcher = Dispatcher(endpoints, min_free_bytes=min_free_bytes)
+    else:
+        paths = [tempfile.gettempdir(), args.docker_root or _get_docker_root(docker_urls[0])]
+        admission.controller.configure(limits=limits, paths=paths, min_free_bytes=min_free_bytes)
+        controllers.append(admission.controller)
+    owner_weights = {}
+    for owner_weight in args.owner_weight or []:
+        owner, weight = owner_weight.rsplit('=', 1)
+        owner_weights[owner] = float(weight)
+    scheduler = Scheduler(owner_weights=owner_weights, max_queued=args.max_queued)
+    daemon = BuildDaemon(workers=args.workers, docker_url=docker_urls[0],
+                         git_cache_dir=git_cache_dir, queue=scheduler, dispatcher=dispatcher)
+    prewarmers = []
+    if args.prewarm_top:
+        from dock.core import DockerTasker
+        from dock.prewarm import PreWarmer
+        prewarmers = [PreWarmer(DockerTasker(base_url=url, admission_controller=controller),
+                                top=args.prewarm_top, interval=args.prewarm_interval,
+                                insecure=args.prewarm_insecure, controller=controller)
+                      for url, controller in zip(docker_urls, controllers)]
+    if args.port is not None:
+        server = DaemonServer(daemon, address=args.address, port=args.port)
+    else:
+        server = DaemonServer(daemon, socket_path=args.socket)
+    daemon.start()
+    for prewarmer in prewarmers:
+        prewarmer.start()
+    try:
+        server.serve_forever()
+    finally:
+        for prewarmer in prewarmers:
+            prewarmer.stop()
+        daemon.stop()
+
+
+def cli_gc(args):
+    from dock.core import DockerTasker
+    from dock.imagegc import ImageGarbageCollector
+    budget = None if args.budget is None else int(args.budget * 1000 ** 3)
+    collector = ImageGarbageCollector(DockerTasker(base_url=args.docker_url),
+                                      budget_bytes=budget, hot_uses=args.hot_uses)
+    result = collector.collect(dry_run=args.dry_run)
+    for name in result['removed']:
+        print(name)
+    logger.info("%d images %sremoved, %d bytes freed, %d bytes used",
+                len(result['removed']), 'would be ' if args.dry_run else '',
+                result['freed_bytes'], result['used_bytes'])
+
+
+def _get_docker_root(docker_url):
+    from dock.core import DockerTasker
+    try:
+        return DockerTasker(base_url=docker_url).d.info()['DockerRootDir']
+    except Exception as ex:
+        logger.warning("can't get root dir of docker, using default: %s", repr(ex))
+        return '/var/lib/docker'
+
+
 def store_result(results):
     # TODO: move this to api, it shouldnt be part of CLI
+    from dock.inner import BuildResultsEncoder
     with open(CONTAINER_RESULTS_JSON_PATH, 'w') as results_json_fd:
         json.dump(results, results_json_fd, cls=BuildResultsEncoder)
 
 
+class VersionAction(argparse.Action):
+    """ like action='version', but version is found out only when requested """
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS,
+                 help="show program's version number and exit"):
+        super(VersionAction, self).__init__(option_strings=option_strings, dest=dest,
+                                            default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        import pkg_resources
+        try:
+            version = pkg_resources.get_distribution("dock").version
+        except pkg_resources.DistributionNotFound:
+            version = "GIT"
+        print(version)
+        parser.exit()
+
+
 class CLI(object):
     def __init__(self):
         self.parser = argparse.ArgumentParser(
@@ -87,15 +204,10 @@ class CLI(object):
         )
 
     def set_arguments(self):
-        try:
-            version = pkg_resources.get_distribution("dock").version
-        except pkg_resources.DistributionNotFound:
-            version = "GIT"
-
         exclusive_group = self.parser.add_mutually_exclusive_group()
         exclusive_group.add_argument("-q", "--quiet", action="store_true")
         exclusive_group.add_argument("-v", "--verbose", action="store_true")
-        exclusive_group.add_argument("-V", "--version", action="version", version=version)
+        exclusive_group.add_argument("-V", "--version", action=VersionAction)
 
         subparsers = self.parser.add_subparsers(help='commands')
 
@@ -133,6 +245,9 @@ class CLI(object):
                                        "inside container, 'privileged' spawns privileged container and "
                                        "runs separate docker instance inside and finally 'here' executes"
                                        "build in current environment")
+        build_parser.add_argument("--trace-file", action='store', metavar="PATH",
+                                  help="write trace of the build to this file (Chrome trace "
+                                       "event format, open it in chrome://tracing)")
 
         # CREATE BUILD IMAGE
 
@@ -152,8 +267,12 @@ class CLI(object):
                                help="path to directory with Dockerfile")
         bi_parser.add_argument("image", action='store', metavar="IMAGE",
                                help="name under the image will be accessible")
-        bi_parser.add_argument("--use-cache", action='store_true', default=False,
-                               help="use cache to build image (may be faster, but not up to date)")
+        bi_parser.add_argument("--no-cache", action='store_false', dest='use_cache',
+                               help="don't use cache to build image (cache is used by default; "
+                                    "dock tarball is cached per commit, so layers are rebuilt "
+                                    "only when dock changes)")
+        bi_parser.add_argument("--use-cache", action='store_true', dest='use_cache',
+                               help="deprecated, does nothing: cache is used by default")
 
         # inside build
         ib_parser = subparsers.add_parser(
@@ -170,6 +289,81 @@ class CLI(object):
                                     "plugin_type.plugin_name.key=value)")
         ib_parser.set_defaults(func=cli_inside_build)
 
+        # BUILD DAEMON
+
+        serve_parser = subparsers.add_parser('serve', help='run daemon which builds images '
+                                                           'submitted over HTTP API')
+        serve_parser.set_defaults(func=cli_serve)
+        listen_group = serve_parser.add_mutually_exclusive_group()
+        listen_group.add_argument("--socket", action='store', default=DAEMON_SOCKET_PATH,
+                                  metavar="PATH",
+                                  help="listen on this UNIX socket (default: %(default)s)")
+        listen_group.add_argument("--port", action='store', type=int,
+                                  help="listen on this TCP port instead of UNIX socket")
+        serve_parser.add_argument("--address", action='store', default='127.0.0.1',
+                                  help="address to listen on with --port (default: %(default)s)")
+        serve_parser.add_argument("--workers", action='store', type=int, default=2,
+                                  help="number of concurrent builds (default: %(default)s)")
+        serve_parser.add_argument("--docker-url", action='append', metavar="URL",
+                                  help="URL of docker daemon (default: $DOCKER_CONNECTION "
+                                       "or local socket); when specified multiple times, "
+                                       "builds are spread across the hosts")
+        serve_parser.add_argument("--host-capacity", action='store', type=int, default=2,
+                                  help="number of concurrent builds per docker host when "
+                                       "there are several (default: %(default)s)")
+        serve_parser.add_argument("--git-cache-dir", action='store', metavar="PATH",
+                                  default=os.path.join(DOCK_CACHE_DIR, 'git'),
+                                  help="keep mirrors of git repos here (default: %(default)s)")
+        serve_parser.add_argument("--no-git-cache", action='store_true',
+                                  help="clone git repos from scratch for every build")
+        serve_parser.add_argument("--max-queued", action='store', type=int,
+                                  help="capacity of queue; when it's full, jobs with higher "
+                                       "priority push out queued jobs with lower priority")
+        serve_parser.add_argument("--max-builds", action='store', type=int,
+                                  help="max number of concurrent docker builds (default: no limit)")
+        serve_parser.add_argument("--max-pulls", action='store', type=int,
+                                  help="max number of concurrent pulls (default: no limit)")
+        serve_parser.add_argument("--max-pushes", action='store', type=int,
+                                  help="max number of concurrent pushes (default: no limit)")
+        serve_parser.add_argument("--max-exports", action='store', type=int,
+                                  help="max number of concurrent exports of images, e.g. to "
+                                       "pulp (default: no limit)")
+        serve_parser.add_argument("--min-free-space", action='store', type=float, default=0,
+                                  metavar="GB",
+                                  help="builds, pulls and exports wait until docker root dir "
+                                       "and tmpdir have this much free space")
+        serve_parser.add_argument("--docker-root", action='store', metavar="PATH",
+                                  help="root dir of docker (default: asked from docker)")
+        serve_parser.add_argument("--owner-weight", action='append', metavar="OWNER=WEIGHT",
+                                  help="fair share weight of owner (default is 1, can be "
+                                       "specified multiple times)")
+        serve_parser.add_argument("--prewarm-top", action='store', type=int, default=0,
+                                  metavar="N",
+                                  help="keep N most used base images pulled and up to date "
+                                       "(default: off)")
+        serve_parser.add_argument("--prewarm-interval", action='store', type=float,
+                                  default=3600, metavar="SECONDS",
+                                  help="check base images this often (default: %(default)s)")
+        serve_parser.add_argument("--prewarm-insecure", action='store_true',
+                                  help="allow plain http when checking and pulling base images")
+
+        # IMAGE GC
+
+        gc_parser = subparsers.add_parser('gc', help='remove dangling and least recently '
+                                                     'used images')
+        gc_parser.set_defaults(func=cli_gc)
+        gc_parser.add_argument("--budget", action='store', type=float, metavar="GB",
+                               help="remove least recently used images until images take "
+                                    "less space (default: remove only dangling images)")
+        gc_parser.add_argument("--hot-uses", action='store', type=int, default=3,
+                               help="base images used this many times in last week are "
+                                    "removed last (default: %(default)s)")
+        gc_parser.add_argument("--docker-url", action='store', metavar="URL",
+                               help="URL of docker daemon (default: $DOCKER_CONNECTION "
+                                    "or local socket)")
+        gc_parser.add_argument("--dry-run", action='store_true',
+                               help="only print images which would be removed")
+
     def run(self):
         self.set_arguments()
         args = self.parser.parse_args()
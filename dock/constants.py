@@ -19,6 +19,21 @@ CONTAINER_SECRET_PATH = ''
 CONTAINER_BUILD_JSON_PATH = os.path.join(CONTAINER_SHARE_PATH, BUILD_JSON)
 CONTAINER_RESULTS_JSON_PATH = os.path.join(CONTAINER_SHARE_PATH, RESULTS_JSON)
 CONTAINER_DOCKERFILE_PATH = os.path.join(CONTAINER_SHARE_PATH, 'Dockerfile')
+CONTAINER_METRICS_PATH = os.path.join(CONTAINER_SHARE_PATH, 'metrics.prom')
+TRACE_JSON = 'trace.json'
+CONTAINER_TRACE_PATH = os.path.join(CONTAINER_SHARE_PATH, TRACE_JSON)
+# directory with usage file of images (see dock.imagegc) of host, mounted into build container
+CONTAINER_IMAGE_USAGE_PATH = '/run/dock-image-usage/'
 
 HOST_SECRET_PATH = ''
 
+# 'dock serve' listens here by default
+DAEMON_SOCKET_PATH = '/run/dock/dock.sock'
+
+
+# persistent caches (artefacts, repo files, packages, ...) live here
+DOCK_CACHE_DIR = os.environ.get('DOCK_CACHE_DIR',
+                                os.path.join(os.path.expanduser('~'), '.cache', 'dock'))
+
+# address of host on default docker bridge; containers can reach services of host here
+DOCKER0_ADDRESS = '172.17.42.1'
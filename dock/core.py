@@ -23,14 +23,20 @@ I've tried to be as much consistent (man pages were source) with docker as possi
 
 """
 import os
+import re
+import json
+import time
+import codecs
 import shutil
 import logging
 import tempfile
 
 import docker
+import requests
 from docker.errors import APIError
 
-from dock.constants import CONTAINER_SHARE_PATH, BUILD_JSON
+from dock import admission, imagegc, metrics, registry, tracing
+from dock.constants import CONTAINER_SHARE_PATH, CONTAINER_IMAGE_USAGE_PATH, BUILD_JSON
 from dock.util import ImageName, wait_for_command, clone_git_repo, figure_out_dockerfile
 
 
@@ -38,6 +44,89 @@ DOCKER_SOCKET_PATH = '/var/run/docker.sock'
 
 logger = logging.getLogger(__name__)
 
+DOCKER_SECONDS = metrics.histogram('dock_docker_seconds', 'Time spent in docker operations',
+                                   ['operation'])
+PUSHED_BYTES = metrics.counter('dock_pushed_bytes_total', 'Bytes of layers pushed to registries',
+                               ['registry'])
+PUSHES = metrics.counter('dock_pushes_total', 'Tags pushed to registries; skipped when registry '
+                         'had the image, tagged when only manifest was put under new tag',
+                         ['result'])
+
+
+class PushLogParser(object):
+    """
+    incremental parser of output of 'docker push': progress lines, which are the
+    bulk of the output, are only used to sum sizes of uploaded layers; other
+    lines (layer pushed, layer exists, digest, errors) are kept
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.error = None
+        self.digest = None
+        self._sizes = {}  # layer id -> size
+        self._buffer = ''
+        self._decoder = codecs.getincrementaldecoder('utf-8')('replace')
+
+    def feed(self, chunk):
+        """
+        :param chunk: str or bytes, part of output; it may hold several lines or part of one
+        """
+        if isinstance(chunk, bytes):
+            chunk = self._decoder.decode(chunk)
+        lines = (self._buffer + chunk).split('\n')
+        self._buffer = lines.pop()
+        for line in lines:
+            self._parse_line(line.strip())
+
+    def close(self):
+        self._parse_line((self._buffer + self._decoder.decode(b'', True)).strip())
+        self._buffer = ''
+
+    def _parse_line(self, line):
+        if not line:
+            return
+        try:
+            item = json.loads(line)
+        except ValueError:
+            item = None
+        if not isinstance(item, dict):
+            self.lines.append(line)
+            return
+        if item.get('status') == 'Pushing':
+            total = (item.get('progressDetail') or {}).get('total')
+            if total:
+                layer_id = item.get('id')
+                self._sizes[layer_id] = max(total, self._sizes.get(layer_id, 0))
+            return
+        if 'error' in item:
+            self.error = item['error']
+        match = re.search(r'digest: (sha256:[0-9a-f]+)', item.get('status') or '')
+        if match:
+            self.digest = match.group(1)
+        self.lines.append(line)
+
+    @property
+    def pushed_bytes(self):
+        return sum(self._sizes.values())
+
+    @property
+    def logs(self):
+        return '\n'.join(self.lines)
+
+
+def get_pushed_bytes(logs):
+    """
+    sum sizes of layers which were uploaded according to output of 'docker push'
+
+    :param logs: str or bytes, newline separated jsons
+    :return: int
+    """
+    parser = PushLogParser()
+    parser.feed(logs)
+    parser.close()
+    return parser.pushed_bytes
+
 
 class LastLogger(object):
     """
@@ -107,6 +196,11 @@ class BuildContainerFactory(object):
             logger.error("Looks like docker is not running because there is no socket at: %s", DOCKER_SOCKET_PATH)
             raise RuntimeError("docker socket not found: %s" % DOCKER_SOCKET_PATH)
 
+        # build uses images of the host, so it has to see and hold leases of other builds
+        usage_dir = os.path.dirname(imagegc.usage.path)
+        if not os.path.isdir(usage_dir):
+            os.makedirs(usage_dir)
+
         volume_bindings = {
             DOCKER_SOCKET_PATH: {
                 'bind': DOCKER_SOCKET_PATH,
@@ -116,11 +210,15 @@ class BuildContainerFactory(object):
                 'bind': CONTAINER_SHARE_PATH,
                 'rw': True,
             },
+            usage_dir: {
+                'bind': CONTAINER_IMAGE_USAGE_PATH,
+                'rw': True,
+            },
         }
 
         container_id = self.tasker.run(
             ImageName.parse(build_image),
-            create_kwargs={'volumes': [DOCKER_SOCKET_PATH, json_args_path]},
+            create_kwargs={'volumes': [DOCKER_SOCKET_PATH, json_args_path, usage_dir]},
             start_kwargs={'binds': volume_bindings},
         )
 
@@ -154,8 +252,15 @@ class BuildContainerFactory(object):
 
 
 class DockerTasker(LastLogger):
-    def __init__(self, base_url=None, **kwargs):
+    def __init__(self, base_url=None, admission_controller=None, **kwargs):
+        """
+        :param base_url: str, URL of docker daemon
+        :param admission_controller: AdmissionController of the docker host; process-wide
+                                     dock.admission.controller is used by default
+        """
         super(DockerTasker, self).__init__(**kwargs)
+        self.base_url = base_url
+        self.admission_controller = admission_controller
         if base_url:
             self.d = docker.Client(base_url=base_url)
         elif os.environ.get('DOCKER_CONNECTION'):
@@ -163,6 +268,16 @@ class DockerTasker(LastLogger):
         else:
             self.d = docker.Client()
 
+    def clone(self):
+        """
+        docker-py client (and its requests session) isn't meant to be shared by threads;
+        get a tasker for other thread with this one
+
+        :return: DockerTasker for the same docker and admission controller
+        """
+        return DockerTasker(base_url=self.base_url, admission_controller=self.admission_controller)
+
+    @tracing.traced(category='docker')
     def build_image_from_path(self, path, image, stream=False, use_cache=False, remove_im=True):
         """
         build image from provided path and tag it
@@ -183,6 +298,7 @@ class DockerTasker(LastLogger):
                                 rm=remove_im)  # returns generator
         return response
 
+    @tracing.traced(category='docker')
     def build_image_from_git(self, url, image, git_path=None, git_commit=None, copy_dockerfile_to=None,
                              stream=False, use_cache=False):
         """
@@ -219,6 +335,7 @@ class DockerTasker(LastLogger):
         logger.info("build finished")
         return response
 
+    @tracing.traced(category='docker')
     def run(self, image, command=None, create_kwargs=None, start_kwargs=None):
         """
         create container from provided image and start it
@@ -246,6 +363,7 @@ class DockerTasker(LastLogger):
         self.d.start(container_id, **start_kwargs)  # returns None
         return container_id
 
+    @tracing.traced(category='docker')
     def commit_container(self, container_id, image=None, message=None):
         """
         create image from provided container
@@ -270,6 +388,7 @@ class DockerTasker(LastLogger):
             logger.error("ID missing from commit response")
             raise RuntimeError("ID missing from commit response")
 
+    @tracing.traced(category='docker')
     def get_image_info_by_image_id(self, image_id):
         """
         using `docker images`, provide information about an image
@@ -295,6 +414,7 @@ class DockerTasker(LastLogger):
         else:
             return image_dict
 
+    @tracing.traced(category='docker')
     def get_image_info_by_image_name(self, image, exact_tag=True):
         """
         using `docker images`, provide information about an image
@@ -326,6 +446,7 @@ class DockerTasker(LastLogger):
         logger.debug("%d matching images found", len(images))
         return images
 
+    @tracing.traced(category='docker')
     def pull_image(self, image, insecure=False):
         """
         pull provided image from registry
@@ -336,15 +457,19 @@ class DockerTasker(LastLogger):
         """
         logger.info("pull image from registry")
         logger.debug("image = '%s', insecure = '%s'", image, insecure)
-        try:
-            logs_gen = self.d.pull(image.to_str(tag=False), tag=image.tag, insecure_registry=insecure, stream=True)
-        except TypeError:
-            # because changing api is fun
-            logs_gen = self.d.pull(image.to_str(tag=False), tag=image.tag, stream=True)
-        command_result = wait_for_command(logs_gen)
+        with admission.admit('pull', tasker=self):
+            with DOCKER_SECONDS.labels(operation='pull').time():
+                try:
+                    logs_gen = self.d.pull(image.to_str(tag=False), tag=image.tag,
+                                           insecure_registry=insecure, stream=True)
+                except TypeError:
+                    # because changing api is fun
+                    logs_gen = self.d.pull(image.to_str(tag=False), tag=image.tag, stream=True)
+                command_result = wait_for_command(logs_gen)
         self.last_logs = command_result.logs
         return image.to_str()
 
+    @tracing.traced(category='docker')
     def tag_image(self, image, target_image, force=False):
         """
         tag provided image with specified image_name, registry and tag
@@ -364,38 +489,152 @@ class DockerTasker(LastLogger):
             raise RuntimeError("Failed to tag image '%s': target_image = '%s'" % image, target_image)
         return target_image.to_str()  # this will be the proper name, not just repo/img
 
+    @tracing.traced(category='docker')
     def push_image(self, image, insecure=False):
         """
         push provided image to registry
 
         :param image: ImageName
         :param insecure: bool, allow connecting to registry over plain http
-        :return: str, logs from push
+        :return: str, logs from push without progress lines
+        """
+        return self.push_image_with_stats(image, insecure=insecure)['logs']
+
+    def push_image_with_stats(self, image, insecure=False):
+        """
+        push provided image to registry; output of push is parsed while it's streamed
+
+        :param image: ImageName
+        :param insecure: bool, allow connecting to registry over plain http
+        :return: dict, {'logs': str, 'bytes': int, 'seconds': float,
+                        'bytes_per_second': float, 'digest': str, 'error': str}
         """
         logger.info("push image")
         logger.debug("image: '%s', insecure: '%s'", image, insecure)
-        try:
-            # push returns string composed of newline separated jsons; exactly what 'docker push' outputs
-            logs = self.d.push(image.to_str(tag=False), tag=image.tag, insecure_registry=insecure, stream=False)
-        except TypeError:
-            # because changing api is fun
-            logs = self.d.push(image.to_str(tag=False), tag=image.tag, stream=False)
-        return logs
+        parser = PushLogParser()
+        with admission.admit('push', tasker=self):
+            start = time.time()
+            with DOCKER_SECONDS.labels(operation='push').time():
+                try:
+                    # generator of chunks of newline separated jsons; exactly what 'docker push' outputs
+                    output = self.d.push(image.to_str(tag=False), tag=image.tag,
+                                         insecure_registry=insecure, stream=True)
+                except TypeError:
+                    # because changing api is fun
+                    output = self.d.push(image.to_str(tag=False), tag=image.tag, stream=True)
+                if isinstance(output, (bytes, type(u''))):
+                    output = [output]
+                for chunk in output:
+                    parser.feed(chunk)
+                parser.close()
+            seconds = time.time() - start
+        PUSHED_BYTES.labels(registry=image.registry or '').inc(parser.pushed_bytes)
+        if parser.error:
+            logger.error("push of '%s' failed: %s", image, parser.error)
+        else:
+            logger.info("'%s' pushed: %d bytes in %.1f seconds", image, parser.pushed_bytes,
+                        seconds)
+        return {'logs': parser.logs, 'bytes': parser.pushed_bytes, 'seconds': seconds,
+                'bytes_per_second': parser.pushed_bytes / seconds if seconds else None,
+                'digest': parser.digest, 'error': parser.error}
 
-    def tag_and_push_image(self, image, target_image, insecure=False):
+    @tracing.traced(category='docker')
+    def tag_and_push_image(self, image, target_image, insecure=False, force=False):
         """
-        tag provided image and push it to registry
+        tag provided image and push it to registry; push is skipped when registry
+        already has the image under this name
 
         :param image: str or ImageName, image id or name
         :param target_image: ImageName, img
         :param insecure: bool, allow connecting to registry over plain http
-        :return: str, image (reg.com/img:v1)
+        :param force: bool, push even when registry already has the image
+        :return: str, logs from push ('' when it was skipped)
         """
         logger.info("tag and push image")
         logger.debug("image = '%s', target_image = '%s'", image, target_image)
         self.tag_image(image, target_image)
-        return self.push_image(target_image, insecure=insecure)
+        if not force and self.get_registry_digest(target_image, insecure=insecure):
+            logger.info("registry already has image '%s', not pushing it", target_image)
+            PUSHES.labels(result='skipped').inc()
+            return ''
+        logs = self.push_image(target_image, insecure=insecure)
+        PUSHES.labels(result='pushed').inc()
+        return logs
+
+    @tracing.traced(category='docker')
+    def tag_and_push_images(self, image, target_images, insecure=False):
+        """
+        tag image with several names and push them; layers are uploaded once per
+        repository: first tag is pushed, other tags in the same repository just
+        point to manifest which is already in registry
 
+        :param image: str or ImageName, image id or name
+        :param target_images: list of ImageName
+        :param insecure: bool, allow connecting to registry over plain http
+        :return: dict, name of target image -> {'result': 'pushed', 'skipped', 'tagged'
+                 or 'failed', 'seconds': float, 'bytes': int, 'bytes_per_second': float,
+                 'error': str}
+        """
+        results = {}
+        digests = {}  # repository -> digest of image in registry
+        for target_image in target_images:
+            repository = target_image.to_str(tag=False)
+            start = time.time()
+            stats = {'bytes': 0, 'bytes_per_second': None, 'error': None}
+            self.tag_image(image, target_image)
+            digest = self.get_registry_digest(target_image, insecure=insecure)
+            if digest:
+                logger.info("registry already has image '%s', not pushing it", target_image)
+                result = 'skipped'
+            elif repository in digests:
+                try:
+                    digest = registry.RegistrySession(
+                        target_image.registry, insecure=insecure).put_manifest_tag(
+                            target_image, digests[repository])
+                except requests.exceptions.RequestException as ex:
+                    logger.warning("can't tag manifest in registry, pushing '%s': %s",
+                                   target_image, repr(ex))
+                    result = None
+                else:
+                    logger.info("manifest of '%s' tagged in registry", target_image)
+                    result = 'tagged'
+            else:
+                result = None
+            if result is None:
+                stats = self.push_image_with_stats(target_image, insecure=insecure)
+                del stats['logs']
+                digest = stats.pop('digest') or \
+                    self.get_registry_digest(target_image, insecure=insecure)
+                result = 'failed' if stats['error'] else 'pushed'
+            if digest and result != 'failed':
+                digests.setdefault(repository, digest)
+            PUSHES.labels(result=result).inc()
+            stats['result'] = result
+            stats['seconds'] = time.time() - start
+            results[target_image.to_str()] = stats
+        return results
+
+    def get_registry_digest(self, image, insecure=False):
+        """
+        find out whether registry has local image under the same name
+
+        :param image: ImageName, with registry
+        :param insecure: bool, allow connecting to registry over plain http
+        :return: str, digest of manifest if registry has the image, None otherwise
+        """
+        digest = registry.get_manifest_digest(image, insecure=insecure)
+        if digest is None:
+            return None
+        try:
+            inspect = self.d.inspect_image(image.to_str())
+        except APIError as ex:
+            logger.warning(repr(ex))
+            return None
+        if digest in registry.local_digests(inspect or {}, image):
+            return digest
+        return None
+
+    @tracing.traced(category='docker')
     def inspect_image(self, image_id):
         """
         return detailed metadata about provided image (see 'man docker-inspect')
@@ -410,6 +649,22 @@ class DockerTasker(LastLogger):
         image_metadata = self.d.inspect_image(image_id)
         return image_metadata
 
+    @tracing.traced(category='docker')
+    def get_image(self, image):
+        """
+        stream image as tarball (see 'man docker-save'); the tarball is not
+        buffered, read it sequentially
+
+        :param image: str or ImageName, id or name of the image
+        :return: file-like object
+        """
+        logger.info("get image")
+        logger.debug("image = '%s'", image)
+        if isinstance(image, ImageName):
+            image = image.to_str()
+        return self.d.get_image(image)
+
+    @tracing.traced(category='docker')
     def remove_image(self, image_id, force=False, noprune=False):
         """
         remove provided image from filesystem
@@ -425,6 +680,7 @@ class DockerTasker(LastLogger):
             image_id = image_id.to_str()
         self.d.remove_image(image_id, force=force, noprune=noprune)  # returns None
 
+    @tracing.traced(category='docker')
     def remove_container(self, container_id, force=False):
         """
         remove provided container from filesystem
@@ -437,6 +693,7 @@ class DockerTasker(LastLogger):
         logger.debug("container_id = '%s'", container_id)
         self.d.remove_container(container_id, force=force)  # returns None
 
+    @tracing.traced(category='docker')
     def logs(self, container_id, stderr=True, stream=True):
         """
         acquire output (stdout, stderr) from provided container
@@ -454,6 +711,7 @@ class DockerTasker(LastLogger):
             response = [line for line in response.split('\n') if line]
         return response
 
+    @tracing.traced(category='docker')
     def wait(self, container_id):
         """
         wait for container to finish the job (may run infinitely)
@@ -467,6 +725,7 @@ class DockerTasker(LastLogger):
         logger.debug("container finished with exit code %s", response)
         return response
 
+    @tracing.traced(category='docker')
     def image_exists(self, image_id):
         """
         does provided image exists?
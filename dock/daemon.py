@@ -0,0 +1,823 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Long-running build daemon ('dock serve').
+
+Every 'dock build' is a new process which pays for interpreter startup, loading
+plugins, connecting to docker and cloning git repo from scratch. Daemon accepts
+build jsons over HTTP (UNIX socket or local TCP port), queues them and runs them
+on a pool of workers which share warm state:
+
+ * plugin files are loaded once (PluginsRunner.module_cache)
+ * every worker keeps its own DockerTasker
+ * git repos are cloned from local mirrors (clone_git_repo_cached)
+ * process-wide caches (dock.cache) and metrics survive between builds
+
+API (all bodies are json):
+
+    POST   /builds               submit build json, returns {"id": ..., "state": "queued"};
+                                 query parameters priority and owner are used by scheduler
+    GET    /builds               list of jobs
+    GET    /builds/<id>          state and result of job
+    GET    /builds/<id>/logs     events of job (json lines); with ?follow=1 the
+                                 response is streamed until job finishes
+    DELETE /builds/<id>          cancel queued job
+    GET    /queue                statistics of queue per priority class
+    GET    /admission            running and waiting operations (see dock.admission)
+    GET    /endpoints            docker hosts and their load (see dock.dispatch)
+    GET    /metrics              metrics in Prometheus text format
+
+DaemonClient implements the client side.
+"""
+
+import errno
+import json
+import logging
+import os
+import re
+import socket
+import threading
+import time
+import uuid
+
+from dock import admission, metrics
+from dock.constants import DAEMON_SOCKET_PATH
+from dock.scheduler import Scheduler, QueueFullError
+from dock.util import ImageName, get_thread_context, set_thread_context
+
+try:
+    # py2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+    from urlparse import urlsplit, parse_qs
+    from urllib import quote
+    import httplib
+except ImportError:
+    # py3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn, UnixStreamServer
+    from urllib.parse import urlsplit, parse_qs, quote
+    import http.client as httplib
+
+
+logger = logging.getLogger(__name__)
+
+
+DAEMON_JOBS = metrics.counter('dock_daemon_jobs_total', 'Jobs finished by build daemon',
+                              ['state'])
+DAEMON_QUEUE_SECONDS = metrics.histogram('dock_daemon_queue_seconds',
+                                         'Time jobs spent waiting in queue of build daemon')
+
+# nothing is pushed before build finishes, so such build may be repeated on other host
+RETRYABLE_PHASES = (None, 'clone', 'pull', 'prebuild_plugins', 'build')
+
+
+class BuildJob(object):
+    """
+    build submitted to daemon; events (logs and state changes) are kept, so clients
+    may connect any time and replay them
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    CANCELED = 'canceled'
+    FINISHED_STATES = (SUCCEEDED, FAILED, CANCELED)
+
+    def __init__(self, build_json, priority=None, owner=None):
+        """
+        :param build_json: dict, arguments of DockerBuildWorkflow
+        :param priority: str, priority class (see dock.scheduler)
+        :param owner: str, who submitted the job, used for fair share
+        """
+        self.id = uuid.uuid4().hex[:12]
+        self.build_json = build_json
+        self.priority = priority
+        self.owner = owner
+        self.state = self.QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.events = []
+        self._cond = threading.Condition()
+
+    @property
+    def is_finished(self):
+        return self.state in self.FINISHED_STATES
+
+    def add_event(self, event_type, **data):
+        data['type'] = event_type
+        data['time'] = time.time()
+        with self._cond:
+            self.events.append(data)
+            self._cond.notify_all()
+
+    def set_state(self, state, result=None):
+        with self._cond:
+            self.state = state
+            if state == self.RUNNING:
+                self.started = time.time()
+            elif state in self.FINISHED_STATES:
+                self.finished = time.time()
+                self.result = result
+        self.add_event('state', state=state)
+
+    def iter_events(self, follow=False, timeout=None):
+        """
+        :param follow: bool, wait for new events until the job finishes
+        :param timeout: float, stop following after this many seconds
+        :return: generator of dicts
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        index = 0
+        while True:
+            with self._cond:
+                while follow and index >= len(self.events) and not self.is_finished:
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        return
+                    self._cond.wait(remaining if remaining is not None else 1.0)
+                events = self.events[index:]
+                finished = self.is_finished
+            for event in events:
+                yield event
+            index += len(events)
+            if not follow or (finished and index >= len(self.events)):
+                return
+
+    def wait(self, timeout=None):
+        """
+        :param timeout: float, seconds
+        :return: bool, whether the job is finished
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while not self.is_finished:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining if remaining is not None else 1.0)
+            return self.is_finished
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'state': self.state,
+            'image': self.build_json.get('image'),
+            'priority': self.priority,
+            'owner': self.owner,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'result': self.result,
+        }
+
+
+class JobQueue(object):
+    """
+    FIFO queue of jobs; get() blocks until there's a job or the queue is closed
+    """
+
+    def __init__(self):
+        self._jobs = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._running = 0
+        self._started = 0
+        self._finished = 0
+
+    def put(self, job):
+        """
+        :return: list of jobs pushed out of the queue (always empty)
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("queue is closed")
+            self._jobs.append(job)
+            self._cond.notify()
+        return []
+
+    def get(self, timeout=None):
+        """
+        :param timeout: float, seconds; None waits until job comes or queue is closed
+        :return: BuildJob or None (queue was closed or timeout expired)
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while not self._jobs and not self._closed:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining if remaining is not None else 1.0)
+            if self._closed:
+                return None
+            self._running += 1
+            self._started += 1
+            return self._jobs.pop(0)
+
+    def remove(self, job):
+        """
+        :return: bool, whether the job was waiting in queue
+        """
+        with self._cond:
+            try:
+                self._jobs.remove(job)
+            except ValueError:
+                return False
+            return True
+
+    def done(self, job):
+        """ job returned by get() finished """
+        with self._cond:
+            self._running -= 1
+            self._finished += 1
+
+    def close(self):
+        """ wake up all waiting workers, get() returns None from now on """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def jobs(self):
+        with self._cond:
+            return list(self._jobs)
+
+    def stats(self):
+        """
+        :return: dict, {'default': counts of queued, running, started and finished jobs};
+                 same shape as stats of dock.scheduler.Scheduler, with one class
+        """
+        with self._cond:
+            return {
+                'default': {
+                    'queued': len(self._jobs),
+                    'running': self._running,
+                    'started': self._started,
+                    'finished': self._finished,
+                },
+            }
+
+    def __len__(self):
+        with self._cond:
+            return len(self._jobs)
+
+
+class JobLogHandler(logging.Handler):
+    """
+    routes log records of worker threads to events of jobs they run; job is attached
+    to worker thread as its context, so threads started by plugins with
+    dock.util.thread_pool() log into the job as well
+    """
+
+    def __init__(self, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        self._jobs = set()  # jobs attached by this handler
+        self._lock = threading.Lock()
+
+    def attach(self, job):
+        with self._lock:
+            self._jobs.add(job)
+        set_thread_context(job)
+
+    def detach(self):
+        job = get_thread_context()
+        set_thread_context(None)
+        with self._lock:
+            self._jobs.discard(job)
+
+    def emit(self, record):
+        job = get_thread_context()
+        if job is None or job not in self._jobs:
+            return
+        try:
+            job.add_event('log', level=record.levelname, logger=record.name,
+                          message=record.getMessage())
+        except Exception:
+            self.handleError(record)
+
+
+def _normalize_image(image):
+    return ImageName.parse(image).to_str(explicit_tag=True)
+
+
+def _get_affinity(build_json):
+    """
+    :return: list of str, images a build profits from: the image itself (layer cache of
+             previous builds) and base image, when it's set by change_from_in_dockerfile
+    """
+    images = [build_json['image']]
+    for plugin in build_json.get('prebuild_plugins') or []:
+        if plugin.get('name') == 'change_from_in_dockerfile':
+            base_image = (plugin.get('args') or {}).get('base_image')
+            if base_image:
+                images.append(base_image)
+    return [_normalize_image(i) for i in images]
+
+
+def _to_json(obj):
+    """ plugin results may contain anything, make them serializable """
+    return json.loads(json.dumps(obj, default=repr))
+
+
+class BuildDaemon(object):
+    """
+    queue of builds and pool of workers which run them
+    """
+
+    def __init__(self, workers=2, docker_url=None, git_cache_dir=None, queue=None,
+                 keep_finished=100, dispatcher=None):
+        """
+        :param workers: int, number of builds running concurrently
+        :param docker_url: str, URL of docker daemon (see DockerTasker)
+        :param git_cache_dir: str, dir with mirrors of git repos, None disables mirroring
+        :param queue: queue of jobs (see JobQueue), dock.scheduler.Scheduler by default
+        :param keep_finished: int, number of finished jobs to remember
+        :param dispatcher: dock.dispatch.Dispatcher, spread builds across several docker
+                           hosts instead of using docker_url
+        """
+        self.workers = workers
+        self.docker_url = docker_url
+        self.dispatcher = dispatcher
+        self.git_cache_dir = git_cache_dir
+        self.queue = queue if queue is not None else Scheduler()
+        self.keep_finished = keep_finished
+        self._jobs = {}  # id -> job
+        self._finished = []  # ids, oldest first
+        self._lock = threading.Lock()
+        self._threads = []
+        self._log_handler = JobLogHandler()
+
+    def start(self):
+        from dock.plugin import PluginsRunner
+        if PluginsRunner.module_cache is None:
+            PluginsRunner.module_cache = {}
+        logging.getLogger('dock').addHandler(self._log_handler)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name="dock-worker-%d" % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        logger.info("build daemon started with %d workers", self.workers)
+        return self
+
+    def stop(self, timeout=None):
+        """ stop accepting jobs; running builds are finished """
+        self.queue.close()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        logging.getLogger('dock').removeHandler(self._log_handler)
+        logger.info("build daemon stopped")
+
+    def submit(self, build_json, priority=None, owner=None):
+        """
+        :param build_json: dict, arguments of DockerBuildWorkflow
+        :param priority: str, priority class
+        :param owner: str, who submits the job
+        :return: BuildJob
+        """
+        if not isinstance(build_json, dict):
+            raise ValueError("build json has to be an object")
+        for key in ('git_url', 'image'):
+            if not build_json.get(key):
+                raise ValueError("build json doesn't contain '%s'" % key)
+        job = BuildJob(build_json, priority=priority, owner=owner)
+        with self._lock:
+            self._jobs[job.id] = job
+        job.add_event('state', state=job.state)
+        try:
+            preempted = self.queue.put(job)
+        except Exception:
+            with self._lock:
+                del self._jobs[job.id]
+            raise
+        logger.info("job %s queued: %s", job.id, build_json['image'])
+        for other in preempted:
+            self._finish(other, BuildJob.CANCELED,
+                         {'error': "preempted by job %s with higher priority" % job.id})
+        return job
+
+    def get_job(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self):
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda j: j.created)
+
+    def cancel(self, job_id):
+        """
+        cancel queued job; running jobs can't be canceled
+
+        :return: bool, whether the job was canceled
+        """
+        job = self.get_job(job_id)
+        if job is None or not self.queue.remove(job):
+            return False
+        self._finish(job, BuildJob.CANCELED)
+        return True
+
+    def _finish(self, job, state, result=None):
+        if job.state == BuildJob.RUNNING:
+            self.queue.done(job)
+        job.set_state(state, result)
+        DAEMON_JOBS.labels(state=state).inc()
+        with self._lock:
+            self._finished.append(job.id)
+            while len(self._finished) > self.keep_finished:
+                self._jobs.pop(self._finished.pop(0), None)
+
+    def _worker(self):
+        from dock.core import DockerTasker
+        # docker connection is kept for the lifetime of worker
+        tasker = None
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            if tasker is None and self.dispatcher is None:
+                tasker = DockerTasker(base_url=self.docker_url)
+            self._run_job(job, tasker)
+
+    def _build(self, job, tasker, workflows=None):
+        """
+        :param workflows: list, workflow is appended to it before it starts
+        :return: tuple, ((workflow, build result), list of images now present at docker host)
+        """
+        from dock.inner import DockerBuildWorkflow
+        kwargs = dict(job.build_json)
+        kwargs['tasker'] = tasker
+        kwargs.setdefault('git_cache_dir', self.git_cache_dir)
+        workflow = DockerBuildWorkflow(**kwargs)
+        if workflows is not None:
+            workflows.append(workflow)
+        build_result = workflow.build_docker_image()
+        images = [job.build_json['image']]
+        if workflow.builder is not None and getattr(workflow.builder, 'base_image', None):
+            images.append(workflow.builder.base_image.to_str())
+        return (workflow, build_result), [_normalize_image(i) for i in images]
+
+    def _run_job(self, job, tasker):
+        DAEMON_QUEUE_SECONDS.observe(time.time() - job.created)
+        job.set_state(BuildJob.RUNNING)
+        self._log_handler.attach(job)
+        state, result = BuildJob.FAILED, {}
+        try:
+            if self.dispatcher is None:
+                (workflow, build_result), _ = self._build(job, tasker)
+            else:
+                workflows = []  # one per attempt
+                (workflow, build_result), endpoint = self.dispatcher.run(
+                    lambda endpoint_tasker: self._build(job, endpoint_tasker, workflows),
+                    affinity=_get_affinity(job.build_json),
+                    can_retry=lambda: not workflows or workflows[-1].phase in RETRYABLE_PHASES)
+                result['docker_url'] = endpoint.url
+            if build_result is not None and not build_result.is_failed():
+                state = BuildJob.SUCCEEDED
+                result['image_id'] = build_result.image_id
+            result['base_image_pull'] = workflow.base_image_pull
+            result['push_stats'] = workflow.push_stats
+            result['prebuild_results'] = _to_json(workflow.prebuild_results)
+            result['postbuild_results'] = _to_json(workflow.postbuild_results)
+        except Exception as ex:
+            logger.exception("job %s failed", job.id)
+            result['error'] = repr(ex)
+        finally:
+            self._log_handler.detach()
+            self._finish(job, state, result)
+        logger.info("job %s %s", job.id, state)
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # (method, path regex, handler name)
+    ROUTES = [
+        ('POST', r'^/builds/?$', 'submit'),
+        ('GET', r'^/builds/?$', 'list'),
+        ('GET', r'^/builds/(?P<job_id>[0-9a-f]+)$', 'get'),
+        ('GET', r'^/builds/(?P<job_id>[0-9a-f]+)/logs$', 'logs'),
+        ('DELETE', r'^/builds/(?P<job_id>[0-9a-f]+)$', 'cancel'),
+        ('GET', r'^/queue$', 'queue'),
+        ('GET', r'^/admission$', 'admission'),
+        ('GET', r'^/endpoints$', 'endpoints'),
+        ('GET', r'^/metrics$', 'metrics'),
+    ]
+    COMPILED_ROUTES = [(method, re.compile(regex), name) for method, regex, name in ROUTES]
+
+    @property
+    def daemon(self):
+        return self.server.build_daemon
+
+    def log_message(self, fmt, *args):
+        logger.debug(fmt, *args)
+
+    def address_string(self):
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def send_body(self, body, status=200, content_type='application/json'):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, obj, status=200):
+        self.send_body(json.dumps(obj), status)
+
+    def send_error_json(self, status, message):
+        self.send_json({'error': message}, status)
+
+    def dispatch(self, method):
+        url = urlsplit(self.path)
+        self.query = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+        for route_method, regex, name in self.COMPILED_ROUTES:
+            match = regex.match(url.path)
+            if route_method == method and match:
+                getattr(self, 'do_' + name)(**match.groupdict())
+                return
+        self.send_error_json(404, "not found: %s %s" % (method, url.path))
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def _get_job(self, job_id):
+        job = self.daemon.get_job(job_id)
+        if job is None:
+            self.send_error_json(404, "no such job: %s" % job_id)
+        return job
+
+    def do_submit(self):
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        try:
+            build_json = json.loads(self.rfile.read(length).decode('utf-8'))
+            job = self.daemon.submit(build_json, priority=self.query.get('priority'),
+                                     owner=self.query.get('owner'))
+        except ValueError as ex:
+            self.send_error_json(400, str(ex))
+            return
+        except QueueFullError as ex:
+            self.send_error_json(503, str(ex))
+            return
+        self.send_json({'id': job.id, 'state': job.state}, 201)
+
+    def do_list(self):
+        self.send_json([job.to_dict() for job in self.daemon.list_jobs()])
+
+    def do_get(self, job_id):
+        job = self._get_job(job_id)
+        if job is not None:
+            self.send_json(job.to_dict())
+
+    def do_logs(self, job_id):
+        job = self._get_job(job_id)
+        if job is None:
+            return
+        follow = self.query.get('follow') in ('1', 'true')
+        # response is delimited by closing connection, so it can be streamed
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for event in job.iter_events(follow=follow):
+                self.wfile.write(json.dumps(event).encode('utf-8') + b'\n')
+                self.wfile.flush()
+        except socket.error as ex:
+            # client went away
+            logger.debug("streaming logs of job %s interrupted: %s", job.id, repr(ex))
+
+    def do_cancel(self, job_id):
+        job = self._get_job(job_id)
+        if job is None:
+            return
+        if self.daemon.cancel(job_id):
+            self.send_json(job.to_dict())
+        else:
+            self.send_error_json(409, "job %s is %s, only queued jobs can be canceled" %
+                                 (job.id, job.state))
+
+    def do_queue(self):
+        self.send_json(self.daemon.queue.stats())
+
+    def do_admission(self):
+        self.send_json(admission.controller.stats())
+
+    def do_endpoints(self):
+        dispatcher = self.daemon.dispatcher
+        if dispatcher is None:
+            self.send_json({'waiting': 0, 'endpoints': [{'url': self.daemon.docker_url}]})
+        else:
+            self.send_json(dispatcher.stats())
+
+    def do_metrics(self):
+        self.send_body(metrics.registry.to_text(), content_type='text/plain; version=0.0.4')
+
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class TCPHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class DaemonServer(object):
+    """
+    HTTP API of build daemon, listens either on UNIX socket or TCP port
+    """
+
+    def __init__(self, build_daemon, socket_path=None, address='127.0.0.1', port=None):
+        """
+        :param build_daemon: BuildDaemon
+        :param socket_path: str, path to UNIX socket
+        :param address: str, address to listen on when port is provided
+        :param port: int, TCP port; 0 picks a free one
+        """
+        if (socket_path is None) == (port is None):
+            raise RuntimeError("specify either socket path or port")
+        self.build_daemon = build_daemon
+        self.socket_path = socket_path
+        self.address = address
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        if self.socket_path:
+            return 'unix://' + self.socket_path
+        return 'http://%s:%d' % (self.address, self.port)
+
+    def _create_server(self):
+        if self.socket_path:
+            try:
+                os.remove(self.socket_path)
+            except OSError as ex:
+                if ex.errno != errno.ENOENT:
+                    raise
+            server = UnixHTTPServer(self.socket_path, DaemonRequestHandler)
+        else:
+            server = TCPHTTPServer((self.address, self.port), DaemonRequestHandler)
+            self.port = server.server_address[1]
+        server.build_daemon = self.build_daemon
+        return server
+
+    def start(self):
+        """ serve in background thread """
+        self._server = self._create_server()
+        self._thread = threading.Thread(target=self._server.serve_forever, name="dock-server")
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info("listening on %s", self.url)
+        return self
+
+    def serve_forever(self):
+        self._server = self._create_server()
+        logger.info("listening on %s", self.url)
+        try:
+            self._server.serve_forever()
+        finally:
+            self._close()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._close()
+
+    def _close(self):
+        self._server.server_close()
+        self._server = None
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        httplib.HTTPConnection.__init__(self, 'localhost')
+        self.socket_path = socket_path
+        self.socket_timeout = timeout
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.socket_timeout is not None:
+            sock.settimeout(self.socket_timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class DaemonClient(object):
+    """
+    client of daemon's HTTP API
+
+        client = DaemonClient('unix:///run/dock/dock.sock')
+        job_id = client.submit({"git_url": "...", "image": "..."})['id']
+        for event in client.follow(job_id):
+            ...
+    """
+
+    def __init__(self, url='unix://' + DAEMON_SOCKET_PATH, timeout=None):
+        """
+        :param url: str, unix://<path> or http://<host>:<port>
+        :param timeout: float, socket timeout in seconds
+        """
+        self.url = url
+        self.timeout = timeout
+
+    def _connection(self):
+        if self.url.startswith('unix://'):
+            return UnixHTTPConnection(self.url[len('unix://'):], timeout=self.timeout)
+        netloc = urlsplit(self.url).netloc
+        return httplib.HTTPConnection(netloc, timeout=self.timeout)
+
+    def _request(self, method, path, body=None):
+        conn = self._connection()
+        headers = {}
+        if body is not None:
+            body = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        conn.request(method, path, body=body, headers=headers)
+        return conn, conn.getresponse()
+
+    def _json_request(self, method, path, body=None):
+        conn, response = self._request(method, path, body)
+        try:
+            data = response.read().decode('utf-8')
+        finally:
+            conn.close()
+        if response.status >= 400:
+            try:
+                message = json.loads(data)['error']
+            except (ValueError, KeyError, TypeError):
+                message = data
+            raise RuntimeError("%s %s failed (%d): %s" % (method, path, response.status, message))
+        return json.loads(data)
+
+    def submit(self, build_json, priority=None, owner=None):
+        """
+        :param build_json: dict
+        :param priority: str, priority class
+        :param owner: str, who submits the job
+        :return: dict, {"id": ..., "state": ...}
+        """
+        query = '&'.join('%s=%s' % (key, quote(value)) for key, value in
+                         (('priority', priority), ('owner', owner)) if value)
+        return self._json_request('POST', '/builds' + ('?' + query if query else ''), build_json)
+
+    def queue_stats(self):
+        return self._json_request('GET', '/queue')
+
+    def get(self, job_id):
+        return self._json_request('GET', '/builds/%s' % job_id)
+
+    def list(self):
+        return self._json_request('GET', '/builds')
+
+    def cancel(self, job_id):
+        return self._json_request('DELETE', '/builds/%s' % job_id)
+
+    def follow(self, job_id, follow=True):
+        """
+        :param job_id: str
+        :param follow: bool, stream events until the job finishes
+        :return: generator of events (dicts)
+        """
+        conn, response = self._request('GET', '/builds/%s/logs%s' %
+                                       (job_id, '?follow=1' if follow else ''))
+        try:
+            if response.status != 200:
+                raise RuntimeError("can't get logs of job %s (%d): %s" %
+                                   (job_id, response.status, response.read()))
+            while True:
+                line = response.fp.readline()
+                if not line:
+                    break
+                yield json.loads(line.decode('utf-8'))
+        finally:
+            conn.close()
+
+    def wait(self, job_id):
+        """
+        block until the job finishes
+
+        :return: dict, job
+        """
+        for _ in self.follow(job_id):
+            pass
+        return self.get(job_id)
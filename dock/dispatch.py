@@ -0,0 +1,330 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Dispatching of builds across several docker hosts.
+
+Dispatcher holds a set of docker endpoints and places every build on the host
+with the lowest load, where load is
+
+    (builds placed there + other running containers) / capacity
+
+Hosts which already have the base image or which built the same image recently
+(warm layer cache) get a bonus. Hosts with too little free space in docker's
+storage are skipped. Every host has its own admission controller (see dock.admission),
+so limits of builds, pulls and pushes apply per host. When a build fails because
+its host stopped responding (docker doesn't answer ping), the host is marked as
+down for a while and the build is retried on another one, unless it already got
+too far (e.g. pushed something):
+
+    dispatcher = Dispatcher([Endpoint('tcp://builder1:2375'), Endpoint('tcp://builder2:2375')])
+    dispatcher.run(lambda tasker: build(tasker), affinity=['fedora:22', 'my-image'])
+"""
+
+import logging
+import re
+import socket
+import threading
+import time
+
+import docker
+import requests
+
+from dock import admission, metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+DISPATCHED_BUILDS = metrics.counter('dock_dispatched_builds_total', 'Builds placed on docker hosts',
+                                    ['endpoint', 'affinity'])
+ENDPOINT_FAILURES = metrics.counter('dock_endpoint_failures_total',
+                                    'Docker hosts found unreachable', ['endpoint'])
+
+# raised by docker-py when daemon isn't reachable
+CONNECTION_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                     socket.error)
+
+SIZE_UNITS = {'b': 1, 'kb': 1000, 'mb': 1000 ** 2, 'gb': 1000 ** 3, 'tb': 1000 ** 4}
+
+
+def parse_size(size):
+    """
+    '10.5 GB' -> 10500000000; docker info reports sizes this way
+
+    :return: int or None
+    """
+    match = re.match(r'^\s*([\d.]+)\s*([kmgt]?b)\s*$', size or '', re.IGNORECASE)
+    if not match:
+        return None
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).lower()])
+
+
+class NoEndpointAvailable(RuntimeError):
+    """ all docker hosts are down or full """
+
+
+class Endpoint(object):
+    """ one docker host """
+
+    def __init__(self, url, capacity=2, name=None, controller=None):
+        """
+        :param url: str, URL of docker daemon
+        :param capacity: int, number of concurrent builds which host handles well
+        :param name: str, name in logs and metrics (default is url)
+        :param controller: AdmissionController for operations on this host; new
+                           one without limits is created by default
+        """
+        self.url = url
+        self.capacity = capacity
+        self.name = name or url
+        self.controller = controller or admission.AdmissionController()
+        self.running = 0  # builds placed on this host by dispatcher
+        self.other_containers = 0  # running containers not started by dispatcher
+        self.free_bytes = None  # free space of docker storage, None when unknown
+        self.images = set()  # names and IDs of images present on host
+        self.recent = []  # affinity keys of recent builds, newest last
+        self.down_until = 0
+        self.last_refresh = None
+        self._local = threading.local()
+
+    def get_tasker(self):
+        """ :return: DockerTasker, one per thread """
+        tasker = getattr(self._local, 'tasker', None)
+        if tasker is None:
+            from dock.core import DockerTasker
+            tasker = self._local.tasker = DockerTasker(base_url=self.url,
+                                                       admission_controller=self.controller)
+        return tasker
+
+    @property
+    def is_local(self):
+        """ docker runs on this machine, so its root dir is visible here """
+        return not self.url or self.url.startswith('unix:')
+
+    def ping(self):
+        """ :return: bool, whether docker responds """
+        try:
+            self.get_tasker().d.ping()
+        except CONNECTION_ERRORS + (docker.errors.APIError, ) as ex:
+            logger.debug("ping of docker at %s failed: %s", self.name, repr(ex))
+            return False
+        return True
+
+    def is_up(self, now=None):
+        return (now or time.time()) >= self.down_until
+
+    @property
+    def load(self):
+        return (self.running + self.other_containers) / float(self.capacity)
+
+    def has_affinity(self, keys):
+        return any(key in self.images or key in self.recent for key in keys)
+
+    def refresh(self):
+        """ ask docker for its state; raises CONNECTION_ERRORS when host is down """
+        tasker = self.get_tasker()
+        info = tasker.d.info()
+        if 'ContainersRunning' in info:
+            self.other_containers = max(0, info['ContainersRunning'] - self.running)
+        free_bytes = None
+        for key, value in info.get('DriverStatus') or []:
+            if key == 'Data Space Available':  # devicemapper
+                free_bytes = parse_size(value)
+        if free_bytes is None and self.is_local and info.get('DockerRootDir'):
+            # other drivers store images in docker root dir
+            try:
+                free_bytes = admission.get_free_bytes(info['DockerRootDir'])
+            except OSError as ex:
+                logger.debug("can't find out free space in '%s': %s",
+                             info['DockerRootDir'], repr(ex))
+        if free_bytes is None and self.free_bytes is None and self.last_refresh is None:
+            logger.warning("free space of docker storage at %s is unknown", self.name)
+        self.free_bytes = free_bytes
+        images = set()
+        for image in tasker.d.images():
+            images.add(image['Id'])
+            images.update(image.get('RepoTags') or [])
+            images.update(image.get('RepoDigests') or [])
+        self.images = images
+
+    def to_dict(self):
+        return {
+            'url': self.url,
+            'name': self.name,
+            'up': self.is_up(),
+            'running': self.running,
+            'other_containers': self.other_containers,
+            'capacity': self.capacity,
+            'free_bytes': self.free_bytes,
+            'images': len(self.images),
+            'admission': self.controller.stats(),
+        }
+
+
+class Dispatcher(object):
+    def __init__(self, endpoints, affinity_bonus=0.5, min_free_bytes=0, down_interval=60,
+                 refresh_interval=30, max_attempts=3, recent_size=50):
+        """
+        :param endpoints: list of Endpoint
+        :param affinity_bonus: float, load subtracted for hosts with affinity; 0.5 with
+                               capacity 2 means one more build is fine on such host
+        :param min_free_bytes: int, skip hosts with less free space in docker storage
+        :param down_interval: float, seconds for which unreachable host isn't used
+        :param refresh_interval: float, seconds after which state of host is refreshed
+        :param max_attempts: int, number of hosts to try for one build
+        :param recent_size: int, number of affinity keys of recent builds kept per host
+        """
+        if not endpoints:
+            raise RuntimeError("no docker endpoints provided")
+        self.endpoints = endpoints
+        self.affinity_bonus = affinity_bonus
+        self.min_free_bytes = min_free_bytes
+        self.down_interval = down_interval
+        self.refresh_interval = refresh_interval
+        self.max_attempts = max_attempts
+        self.recent_size = recent_size
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def mark_down(self, endpoint, ex):
+        logger.warning("docker at %s is not reachable, not using it for %d seconds: %s",
+                       endpoint.name, self.down_interval, repr(ex))
+        ENDPOINT_FAILURES.labels(endpoint=endpoint.name).inc()
+        with self._cond:
+            endpoint.down_until = time.time() + self.down_interval
+            self._cond.notify_all()
+
+    def refresh(self, force=False):
+        """ refresh state of hosts which are up and weren't refreshed recently """
+        now = time.time()
+        for endpoint in self.endpoints:
+            if not endpoint.is_up(now):
+                continue
+            if not force and endpoint.last_refresh is not None and \
+                    now - endpoint.last_refresh < self.refresh_interval:
+                continue
+            try:
+                endpoint.refresh()
+            except CONNECTION_ERRORS as ex:
+                self.mark_down(endpoint, ex)
+            else:
+                endpoint.last_refresh = now
+
+    def _candidates(self, exclude):
+        now = time.time()
+        return [e for e in self.endpoints
+                if e.is_up(now) and e not in exclude and
+                (not self.min_free_bytes or e.free_bytes is None or
+                 e.free_bytes >= self.min_free_bytes)]
+
+    def score(self, endpoint, affinity):
+        """ :return: tuple, lower is better """
+        has_affinity = bool(affinity) and endpoint.has_affinity(affinity)
+        bonus = self.affinity_bonus if has_affinity else 0
+        free = endpoint.free_bytes or 0
+        return (endpoint.load - bonus, not has_affinity, -free, self.endpoints.index(endpoint))
+
+    def acquire(self, affinity=None, exclude=(), timeout=None):
+        """
+        pick host for a build and count the build as running there; waits while all
+        hosts are at capacity
+
+        :param affinity: list of str, names of images the build profits from
+        :param exclude: hosts not to use
+        :param timeout: float, seconds
+        :return: Endpoint
+        """
+        affinity = affinity or []
+        self.refresh()
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            self.waiting += 1
+            try:
+                while True:
+                    candidates = self._candidates(exclude)
+                    if not candidates:
+                        raise NoEndpointAvailable("no docker host is available")
+                    free = [e for e in candidates if e.running < e.capacity]
+                    if free:
+                        endpoint = min(free, key=lambda e: self.score(e, affinity))
+                        endpoint.running += 1
+                        break
+                    wait = 1.0 if deadline is None else min(1.0, deadline - time.time())
+                    if wait <= 0:
+                        raise NoEndpointAvailable("all docker hosts are busy")
+                    self._cond.wait(wait)
+            finally:
+                self.waiting -= 1
+        has_affinity = endpoint.has_affinity(affinity)
+        DISPATCHED_BUILDS.labels(endpoint=endpoint.name,
+                                 affinity='yes' if has_affinity else 'no').inc()
+        logger.info("build placed on %s (load %.2f, affinity %s)",
+                    endpoint.name, endpoint.load, has_affinity)
+        return endpoint
+
+    def release(self, endpoint, affinity=None):
+        """
+        build on endpoint finished
+
+        :param affinity: list of str, images which are now present on host
+        """
+        with self._cond:
+            endpoint.running -= 1
+            for key in affinity or []:
+                if key in endpoint.recent:
+                    endpoint.recent.remove(key)
+                endpoint.recent.append(key)
+            del endpoint.recent[:-self.recent_size]
+            self._cond.notify_all()
+
+    def run(self, func, affinity=None, timeout=None, can_retry=None):
+        """
+        run func on the best host, retry on another one when host is unreachable
+
+        :param func: function tasker -> result; it may return tuple (result, list of
+                     affinity keys to remember for the host)
+        :param affinity: list of str, names of images the build profits from
+        :param timeout: float, seconds to wait for free host
+        :param can_retry: function () -> bool, whether failed func may be run again on
+                          other host; func is always retried by default
+        :return: tuple (result of func, Endpoint)
+        """
+        tried = []
+        last_error = None
+        for _ in range(self.max_attempts):
+            try:
+                endpoint = self.acquire(affinity, exclude=tried, timeout=timeout)
+            except NoEndpointAvailable:
+                if last_error is not None:
+                    raise last_error
+                raise
+            tried.append(endpoint)
+            learned = []
+            try:
+                result = func(endpoint.get_tasker())
+                if isinstance(result, tuple):
+                    result, learned = result
+                return result, endpoint
+            except CONNECTION_ERRORS as ex:
+                # also raised by plugins talking to other services and, on python 3,
+                # for any OSError; only failures of docker itself are retried
+                # (ping catches exceptions, so bare raise would re-raise those on python 2)
+                if endpoint.ping():
+                    raise ex
+                self.mark_down(endpoint, ex)
+                if can_retry is not None and not can_retry():
+                    raise ex
+                last_error = ex
+            finally:
+                self.release(endpoint, learned)
+        raise last_error
+
+    def stats(self):
+        with self._cond:
+            return {'waiting': self.waiting,
+                    'endpoints': [e.to_dict() for e in self.endpoints]}
@@ -0,0 +1,198 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Dockerfile model shared by all plugins which need to read or alter dockerfile.
+
+Dockerfile is parsed once, plugins mutate it in memory and it's written to
+disk once, right before the build. Parsing follows docker:
+
+ * instructions are case insensitive
+ * lines ending with backslash are joined with the following line
+ * comments (lines starting with '#') and empty lines are skipped, even
+   inside of a continued instruction
+"""
+
+import logging
+import re
+
+
+logger = logging.getLogger(__name__)
+
+
+INSTRUCTION_RE = re.compile(r'^\s*(?P<instruction>\w+)(\s+(?P<value>.*))?$', re.DOTALL)
+
+
+class Instruction(object):
+    """ single instruction of dockerfile; it may span several lines """
+
+    def __init__(self, instruction, value, startline, endline, content):
+        """
+        :param instruction: str, name of instruction, upper case (e.g. 'FROM')
+        :param value: str, arguments of instruction, continued lines are joined
+        :param startline: int, index of first line of instruction (starting at 0)
+        :param endline: int, index of last line of instruction
+        :param content: str, instruction as it's written in dockerfile
+        """
+        self.instruction = instruction
+        self.value = value
+        self.startline = startline
+        self.endline = endline
+        self.content = content
+
+    def __repr__(self):
+        return "Instruction(%s %r, lines %d-%d)" % (self.instruction, self.value,
+                                                  self.startline + 1, self.endline + 1)
+
+
+def parse_lines(lines):
+    """
+    parse dockerfile
+
+    :param lines: list of str, lines of dockerfile including line endings
+    :return: list of Instruction
+    """
+    instructions = []
+    startline = None
+    fragments = []
+    for index, line in enumerate(lines):
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            continue
+        if startline is None:
+            startline = index
+        line = line.rstrip('\r\n')
+        continued = line.endswith('\\')
+        if continued:
+            fragments.append(line[:-1])
+            continue
+        fragments.append(line)
+        logical_line = ''.join(fragments)
+        match = INSTRUCTION_RE.match(logical_line)
+        if match:
+            instructions.append(Instruction(match.group('instruction').upper(),
+                                            (match.group('value') or '').strip(),
+                                            startline, index,
+                                            ''.join(lines[startline:index + 1])))
+        else:
+            logger.warning("can't parse dockerfile line %d: '%s'", startline + 1, logical_line)
+        startline = None
+        fragments = []
+    if fragments:
+        logger.warning("dockerfile ends with continued line %d", startline + 1)
+    return instructions
+
+
+class Dockerfile(object):
+    """
+    usage:
+
+        dockerfile = Dockerfile(path)
+        for instruction in dockerfile.get_instructions('RUN'):
+            ...
+        dockerfile.insert_before(dockerfile.instructions[-1], 'LABEL "a"="b"')
+        dockerfile.write()
+    """
+
+    def __init__(self, path=None, content=None):
+        """
+        :param path: str, path to dockerfile; it's read if content is not provided
+        :param content: str, content of dockerfile
+        """
+        self.path = path
+        if content is None:
+            with open(path, 'r') as fd:
+                content = fd.read()
+        self._lines = content.splitlines(True)
+        self.instructions = parse_lines(self._lines)
+        self.modified = False
+
+    @property
+    def lines(self):
+        return list(self._lines)
+
+    @property
+    def content(self):
+        return ''.join(self._lines)
+
+    @property
+    def baseimage(self):
+        """ image from the first FROM instruction, None if there is none """
+        for instruction in self.instructions:
+            if instruction.instruction == 'FROM':
+                return instruction.value.split()[0]
+        return None
+
+    def get_instructions(self, instruction):
+        """
+        :param instruction: str, name of instruction (case insensitive)
+        :return: list of Instruction
+        """
+        instruction = instruction.upper()
+        return [i for i in self.instructions if i.instruction == instruction]
+
+    def get_instruction_by_step(self, step):
+        """
+        :param step: int, number of build step as reported by docker (starting at 0)
+        :return: Instruction or None
+        """
+        try:
+            return self.instructions[step]
+        except IndexError:
+            return None
+
+    def _change_lines(self, start, end, new_lines):
+        self._lines[start:end] = new_lines
+        self.instructions = parse_lines(self._lines)
+        self.modified = True
+
+    def replace(self, instruction, content):
+        """
+        replace provided instruction; offsets of following instructions
+        change, so when replacing several instructions, go from the last one
+
+        :param instruction: Instruction, instruction to replace
+        :param content: str, new instruction, e.g. 'FROM fedora:22'
+        """
+        logger.debug("replacing '%s' with '%s'", instruction, content)
+        last_line = self._lines[instruction.endline]
+        line_end = last_line[len(last_line.rstrip('\r\n')):]
+        self._change_lines(instruction.startline, instruction.endline + 1, [content + line_end])
+
+    def insert_before(self, instruction, content):
+        """
+        :param instruction: Instruction, insert content before this instruction
+        :param content: str, new instruction, e.g. 'LABEL "a"="b"'
+        """
+        logger.debug("inserting '%s' before '%s'", content, instruction)
+        self._change_lines(instruction.startline, instruction.startline, [content + '\n'])
+
+    def append(self, content):
+        """
+        :param content: str, new instruction, e.g. 'CMD date'
+        """
+        logger.debug("appending '%s'", content)
+        if self._lines and not self._lines[-1].endswith('\n'):
+            self._lines[-1] += '\n'
+        self._change_lines(len(self._lines), len(self._lines), [content + '\n'])
+
+    def write(self, path=None):
+        """
+        serialize dockerfile
+
+        :param path: str, where to write it; when not specified, the file dockerfile
+                     was loaded from is overwritten, but only if it was modified
+        """
+        if path is None:
+            if not self.modified:
+                return
+            path = self.path
+        logger.debug("writing dockerfile to '%s'", path)
+        with open(path, 'w') as fd:
+            fd.write(self.content)
+        if path == self.path:
+            self.modified = False
@@ -0,0 +1,412 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Garbage collection of images on docker host.
+
+Every build records which images it used (base image, built image) in a usage
+file shared by all builds on the host, and holds a lease on them while it runs.
+Builds running in a container using docker of the host (DockerhostBuildManager)
+get the directory with the usage file of the host mounted, see use_mounted_usage().
+The collector then
+
+ * removes dangling images,
+ * removes least recently used images until docker uses less than budget;
+   base images which were used often recently ("hot") go last,
+ * never touches images which are leased by running builds or used by containers.
+
+    ImageGarbageCollector(DockerTasker(), budget_bytes=20 * 1000 ** 3).collect()
+"""
+
+import errno
+import fcntl
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+
+from docker.errors import APIError
+
+from dock import metrics
+from dock.constants import CONTAINER_IMAGE_USAGE_PATH, DOCK_CACHE_DIR
+from dock.util import ImageName
+
+
+logger = logging.getLogger(__name__)
+
+
+USAGE_FILE = 'image-usage.json'
+DEFAULT_USAGE_PATH = os.path.join(DOCK_CACHE_DIR, USAGE_FILE)
+NONE_TAG = '<none>:<none>'
+
+REMOVED_IMAGES = metrics.counter('dock_gc_removed_images_total', 'Images removed by GC', ['reason'])
+FREED_BYTES = metrics.counter('dock_gc_freed_bytes_total', 'Bytes freed by GC (estimate)')
+
+
+def _normalize(name):
+    return ImageName.parse(name).to_str(explicit_tag=True)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as ex:
+        return ex.errno != errno.ESRCH
+    return True
+
+
+class ImageUsageStore(object):
+    """
+    JSON file with usage of images and leases of running builds; it's locked
+    while being updated, so builds in different processes may share it
+    """
+
+    def __init__(self, path=DEFAULT_USAGE_PATH, history_size=50, max_age=7 * 24 * 3600,
+                 clock=time.time):
+        """
+        :param path: str, path to the usage file
+        :param history_size: int, number of timestamps of use kept per image
+        :param max_age: float, uses older than this many seconds are forgotten; should
+                        be at least hot_window of the collector
+        :param clock: function returning current time
+        """
+        self.path = path
+        self.history_size = history_size
+        self.max_age = max_age
+        self.clock = clock
+
+    def _read(self):
+        try:
+            with open(self.path) as fp:
+                data = json.load(fp)
+        except IOError as ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            data = {}
+        except ValueError:
+            logger.warning("usage file '%s' is corrupted, starting from scratch", self.path)
+            data = {}
+        data.setdefault('images', {})
+        data.setdefault('leases', {})
+        return data
+
+    def _update(self, func):
+        directory = os.path.dirname(self.path)
+        try:
+            os.makedirs(directory)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                data = self._read()
+                result = func(data)
+                tmp_path = '%s.%s.tmp' % (self.path, os.getpid())
+                with open(tmp_path, 'w') as fp:
+                    json.dump(data, fp)
+                os.rename(tmp_path, self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return result
+
+    def _is_stale(self, lease, now):
+        if lease['expires'] < now:
+            return True
+        return lease.get('host') == socket.gethostname() and not _pid_alive(lease['pid'])
+
+    def load(self):
+        """
+        :return: dict, {'images': {name: {'used': [timestamps], 'base': bool}},
+                        'leases': {token: {'images': [names], ...}}}; stale leases
+                 are left out
+        """
+        data = self._read()
+        now = self.clock()
+        data['leases'] = dict((token, lease) for token, lease in data['leases'].items()
+                              if not self._is_stale(lease, now))
+        return data
+
+    def _prune(self, data, now):
+        """ forget old uses and images which weren't used for max_age """
+        since = now - self.max_age
+        for name in list(data['images']):
+            record = data['images'][name]
+            record['used'] = [t for t in record['used'] if t >= since]
+            if not record['used']:
+                del data['images'][name]
+
+    def _record(self, data, names, base):
+        now = self.clock()
+        self._prune(data, now)
+        for name in names:
+            record = data['images'].setdefault(_normalize(name), {'used': [], 'base': False})
+            record['used'].append(now)
+            del record['used'][:-self.history_size]
+            record['base'] = record['base'] or base
+
+    def record_use(self, names, base=False):
+        """
+        :param names: list of str, names of images which were used
+        :param base: bool, are the images base images of a build?
+        """
+        self._update(lambda data: self._record(data, names, base))
+
+    def acquire_lease(self, names, base_images=(), ttl=6 * 3600):
+        """
+        protect images from GC until the lease is released or expires; records use
+        of the images as well
+
+        :param names: list of str, names of images
+        :param base_images: list of str, names of base images (also protected)
+        :param ttl: float, seconds after which lease expires (build crashed hard)
+        :return: str, token of the lease
+        """
+        token = uuid.uuid4().hex
+        names = [_normalize(name) for name in names]
+        base_images = [_normalize(name) for name in base_images]
+
+        def update(data):
+            now = self.clock()
+            for stale in [t for t, lease in data['leases'].items() if self._is_stale(lease, now)]:
+                del data['leases'][stale]
+            data['leases'][token] = {'images': names + base_images, 'pid': os.getpid(),
+                                     'host': socket.gethostname(), 'expires': now + ttl}
+            self._record(data, names, False)
+            self._record(data, base_images, True)
+        self._update(update)
+        return token
+
+    def release_lease(self, token):
+        self._update(lambda data: data['leases'].pop(token, None))
+
+    def forget(self, names):
+        """
+        :param names: list of str, names of images which were removed from the host
+        """
+        def update(data):
+            for name in names:
+                data['images'].pop(_normalize(name), None)
+        self._update(update)
+
+    def base_image_popularity(self, window=7 * 24 * 3600):
+        """
+        :param window: float, count uses within this many seconds
+        :return: list of tuples (name, number of uses), most used first
+        """
+        since = self.clock() - window
+        popularity = []
+        for name, record in self.load()['images'].items():
+            uses = len([t for t in record['used'] if t >= since])
+            if record['base'] and uses:
+                popularity.append((name, uses))
+        return sorted(popularity, key=lambda item: (-item[1], item[0]))
+
+
+usage = ImageUsageStore()
+
+
+def use_mounted_usage(path=CONTAINER_IMAGE_USAGE_PATH):
+    """
+    within build container: use usage file of the host if its directory is mounted
+    at path, so leases and usage history are shared with other builds
+
+    :return: bool, is the file of the host used?
+    """
+    global usage
+    if not os.path.isdir(path):
+        return False
+    usage = ImageUsageStore(os.path.join(path, USAGE_FILE))
+    return True
+
+
+def acquire_lease(names, base_images=()):
+    """
+    lease images in the host-wide usage file; failure to write the file
+    (read-only home, ...) doesn't fail the build
+
+    :return: str, token or None
+    """
+    try:
+        return usage.acquire_lease(names, base_images=base_images)
+    except (IOError, OSError) as ex:
+        logger.warning("can't record usage of images in '%s': %s", usage.path, repr(ex))
+        return None
+
+
+def release_lease(token):
+    if token is None:
+        return
+    try:
+        usage.release_lease(token)
+    except (IOError, OSError) as ex:
+        logger.warning("can't release lease of images in '%s': %s", usage.path, repr(ex))
+
+
+class ImageGarbageCollector(object):
+    def __init__(self, tasker, budget_bytes=None, store=None, hot_uses=3,
+                 hot_window=7 * 24 * 3600):
+        """
+        :param tasker: DockerTasker instance
+        :param budget_bytes: int, max size of images; None removes only dangling images
+        :param store: ImageUsageStore (default is the host-wide one)
+        :param hot_uses: int, base image used this many times within hot_window is hot
+        :param hot_window: float, seconds
+        """
+        self.tasker = tasker
+        self.budget_bytes = budget_bytes
+        self.store = store or usage
+        self.hot_uses = hot_uses
+        self.hot_window = hot_window
+
+    def _protected(self, images, leased):
+        """
+        :return: set of IDs of images which must not be removed
+        """
+        by_name = {}
+        for image in images:
+            for tag in image.get('RepoTags') or []:
+                by_name[tag] = image['Id']
+        protected = set(by_name[name] for name in leased if name in by_name)
+        for container in self.tasker.d.containers(all=True):
+            image_id = container.get('ImageID')
+            if not image_id:
+                name = container['Image']
+                image_id = by_name.get(name) or by_name.get(_normalize(name))
+            if not image_id:
+                # short ID
+                image_id = next((i['Id'] for i in images
+                                 if i['Id'].split(':')[-1].startswith(container['Image'])), None)
+            if image_id:
+                protected.add(image_id)
+        return protected
+
+    def _last_use(self, image, records, now):
+        """
+        :return: tuple (hot, last use) -- eviction order key
+        """
+        used = []
+        base = False
+        for tag in image.get('RepoTags') or []:
+            record = records.get(tag)
+            if record:
+                used.extend(record['used'])
+                base = base or record['base']
+        recent_uses = len([t for t in used if t >= now - self.hot_window])
+        hot = base and recent_uses >= self.hot_uses
+        # images built or pulled before we started recording
+        return hot, max(used) if used else image.get('Created', 0)
+
+    @staticmethod
+    def _exclusive_size(image_id, layers, children, tagged):
+        """
+        size freed by removing image: its layer and parent layers which are used
+        by nothing else; children counts are updated as if image was removed
+        """
+        if children.get(image_id):
+            # only untagged
+            return 0
+        size = 0
+        layer_id = image_id
+        while layer_id in layers:
+            layer = layers[layer_id]
+            size += layer.get('Size') or 0
+            parent_id = layer.get('ParentId')
+            if not parent_id or parent_id not in layers:
+                break
+            children[parent_id] -= 1
+            if children[parent_id] > 0 or parent_id in tagged:
+                break
+            layer_id = parent_id
+        return size
+
+    def _remove(self, image, dry_run):
+        tags = [tag for tag in image.get('RepoTags') or [] if tag != NONE_TAG]
+        try:
+            if dry_run:
+                return True
+            # untagging the last tag removes the image
+            for tag in tags or [image['Id']]:
+                self.tasker.remove_image(tag)
+        except APIError as ex:
+            # e.g. container was just started from it
+            logger.warning("can't remove image %s: %s", tags or image['Id'], repr(ex))
+            return False
+        return True
+
+    def collect(self, dry_run=False):
+        """
+        remove dangling images and least recently used images over budget
+
+        :param dry_run: bool, only report what would be removed
+        :return: dict, {'removed': [names or IDs], 'freed_bytes': int, 'used_bytes': int}
+        """
+        now = self.store.clock()
+        data = self.store.load()
+        leased = set()
+        for lease in data['leases'].values():
+            leased.update(lease['images'])
+
+        layers = dict((layer['Id'], layer) for layer in self.tasker.d.images(all=True))
+        children = dict((layer_id, 0) for layer_id in layers)
+        for layer in layers.values():
+            if layer.get('ParentId') in children:
+                children[layer['ParentId']] += 1
+        images = self.tasker.d.images()
+        tagged = set(i['Id'] for i in images
+                     if [tag for tag in i.get('RepoTags') or [] if tag != NONE_TAG])
+        protected = self._protected(images, leased)
+        used_bytes = sum(layer.get('Size') or 0 for layer in layers.values())
+
+        removed = []
+        removed_tags = []
+        freed = [0]
+
+        def remove(image, reason):
+            if image['Id'] in protected:
+                return
+            tags = [tag for tag in image.get('RepoTags') or [] if tag != NONE_TAG]
+            if not self._remove(image, dry_run):
+                return
+            tagged.discard(image['Id'])
+            size = self._exclusive_size(image['Id'], layers, children, tagged)
+            freed[0] += size
+            removed.append(', '.join(tags) or image['Id'])
+            removed_tags.extend(tags)
+            REMOVED_IMAGES.labels(reason=reason).inc()
+            logger.info("%s image %s removed, %d bytes freed", reason,
+                        removed[-1], size)
+
+        for image in images:
+            if image['Id'] not in tagged:
+                remove(image, 'dangling')
+
+        if self.budget_bytes is not None:
+            candidates = [i for i in images if i['Id'] in tagged and i['Id'] not in protected]
+            candidates.sort(key=lambda i: self._last_use(i, data['images'], now))
+            while candidates and used_bytes - freed[0] > self.budget_bytes:
+                # parents of other images free nothing until their children are gone
+                leaves = [i for i in candidates if not children.get(i['Id'])]
+                if not leaves:
+                    break
+                candidates.remove(leaves[0])
+                remove(leaves[0], 'lru')
+            if used_bytes - freed[0] > self.budget_bytes:
+                logger.warning("images still take %d bytes, budget is %d; the rest is in use",
+                               used_bytes - freed[0], self.budget_bytes)
+
+        if not dry_run:
+            FREED_BYTES.inc(freed[0])
+            if removed_tags:
+                try:
+                    self.store.forget(removed_tags)
+                except (IOError, OSError) as ex:
+                    logger.warning("can't forget removed images in '%s': %s",
+                                   self.store.path, repr(ex))
+        return {'removed': removed, 'freed_bytes': freed[0], 'used_bytes': used_bytes - freed[0]}
@@ -11,16 +11,34 @@ Script for building docker image. This is expected to run inside container.
 
 import json
 import logging
+import os
 import shutil
 import tempfile
+from contextlib import contextmanager
 
+from dock import imagegc, metrics, tracing
 from dock.build import InsideBuilder
+from dock.constants import CONTAINER_SHARE_PATH, CONTAINER_METRICS_PATH, CONTAINER_TRACE_PATH
 from dock.plugin import PostBuildPluginsRunner, PreBuildPluginsRunner, InputPluginsRunner, PrePublishPluginsRunner, \
     PluginFailedException
 
 
 logger = logging.getLogger(__name__)
 
+BUILD_PHASE_SECONDS = metrics.histogram('dock_build_phase_seconds', 'Time spent in phases of builds',
+                                        ['phase'])
+BUILD_SECONDS = metrics.histogram('dock_build_seconds', 'Duration of whole builds')
+BUILDS = metrics.counter('dock_builds_total', 'Finished builds', ['result'])
+
+
+@contextmanager
+def _phase(workflow, name):
+    """ phase of build: measured and traced """
+    workflow.phase = name
+    with tracing.span(name, category='phase'):
+        with BUILD_PHASE_SECONDS.labels(phase=name).time():
+            yield
+
 
 class BuildResults(object):
     build_logs = None
@@ -129,7 +147,7 @@ class DockerBuildWorkflow(object):
                  git_commit=None, parent_registry=None, target_registries=None,
                  prebuild_plugins=None, prepublish_plugins=None, postbuild_plugins=None,
                  plugin_files=None, parent_registry_insecure=False,
-                 target_registries_insecure=False, **kwargs):
+                 target_registries_insecure=False, tasker=None, git_cache_dir=None, **kwargs):
         """
         :param git_url: str, URL to git repo
         :param image: str, tag for built image ([registry/]image_name[:tag])
@@ -143,6 +161,8 @@ class DockerBuildWorkflow(object):
         :param plugin_files: list of str, load plugins also from these files
         :param parent_registry_insecure: bool, allow connecting to parent registry over plain http
         :param target_registries_insecure: bool, allow connecting to target registries over plain http
+        :param tasker: DockerTasker, used by builder; new one is created by default
+        :param git_cache_dir: str, clone git repo from local mirror kept in this dir
         """
         self.git_url = git_url
         self.image = image
@@ -160,20 +180,27 @@ class DockerBuildWorkflow(object):
         self.prebuild_results = {}
         self.postbuild_results = {}
         self.plugin_files = plugin_files
+        self.tasker = tasker
+        self.git_cache_dir = git_cache_dir
 
         self.kwargs = kwargs
 
         self.builder = None
+        self.phase = None  # name of phase which runs or ran last
         self.build_logs = None
         self.built_image_inspect = None
 
         self.pulled_base_image = None
+        self.base_image_pull = None  # digest of base image, was the pull skipped?
 
         # TODO: ensure this is the only way to tag and push images,
         #       get rid of target_reg*, push_built_img
         self.tag_and_push_conf = TagAndPushConf()
+        # per pushed image: result, duration, bytes, throughput; filled by tag_and_push
+        self.push_stats = []
 
         self.repos = {}  # this should be filled by plugins
+        self.yum_cache_proxy = None  # started by plugin yum_cache_proxy
 
     def build_docker_image(self):
         """
@@ -181,13 +208,40 @@ class DockerBuildWorkflow(object):
 
         :return: BuildResults
         """
+        build_result = None
+        with tracing.span('build_docker_image', image=self.image, git_url=self.git_url) as span:
+            with BUILD_SECONDS.time():
+                try:
+                    build_result = self._build_docker_image()
+                finally:
+                    failed = build_result is None or build_result.is_failed()
+                    BUILDS.labels(result='failed' if failed else 'succeeded').inc()
+                    span.set_attribute('failed', failed)
+        return build_result
+
+    def _build_docker_image(self):
         tmpdir = tempfile.mkdtemp()
-        self.builder = InsideBuilder(self.git_url, self.image, git_dockerfile_path=self.git_dockerfile_path,
-                                     git_commit=self.git_commit, tmpdir=tmpdir)
+        lease = None
         try:
+            # repo is cloned right away, dockerfile is parsed
+            with _phase(self, 'clone'):
+                self.builder = InsideBuilder(self.git_url, self.image,
+                                             git_dockerfile_path=self.git_dockerfile_path,
+                                             git_commit=self.git_commit, tmpdir=tmpdir,
+                                             tasker=self.tasker, git_cache_dir=self.git_cache_dir)
+            # image GC doesn't remove images of running build; base image is
+            # recorded under the name it's pulled as, so it can be pre-pulled
+            names = [self.image]
+            base_image = self.builder.base_image
             if self.parent_registry:
-                self.pulled_base_image = self.builder.pull_base_image(
-                    self.parent_registry, insecure=self.parent_registry_insecure)
+                names.append(base_image.to_str())
+                base_image = base_image.copy(registry=self.parent_registry)
+            lease = imagegc.acquire_lease(names, base_images=[base_image.to_str()])
+            if self.parent_registry:
+                with _phase(self, 'pull'):
+                    self.pulled_base_image = self.builder.pull_base_image(
+                        self.parent_registry, insecure=self.parent_registry_insecure)
+                    self.base_image_pull = self.builder.base_image_pull
 
             # time to run pre-build plugins, so they can access cloned repo,
             # base image
@@ -195,12 +249,14 @@ class DockerBuildWorkflow(object):
             prebuild_runner = PreBuildPluginsRunner(self.builder.tasker, self, self.prebuild_plugins_conf,
                                                     plugin_files=self.plugin_files)
             try:
-                prebuild_runner.run()
+                with _phase(self, 'prebuild_plugins'):
+                    prebuild_runner.run()
             except PluginFailedException as ex:
                 logger.error("One or more prebuild plugins failed: %s", ex)
                 return
 
-            build_result = self.builder.build()
+            with _phase(self, 'build'):
+                build_result = self.builder.build()
             self.build_logs = build_result.logs
 
             if not build_result.is_failed():
@@ -210,26 +266,33 @@ class DockerBuildWorkflow(object):
             prepublish_runner = PrePublishPluginsRunner(self.builder.tasker, self, self.prepublish_plugins_conf,
                                                         plugin_files=self.plugin_files)
             try:
-                prepublish_runner.run()
+                with _phase(self, 'prepublish_plugins'):
+                    prepublish_runner.run()
             except PluginFailedException as ex:
                 logger.error("One or more prepublish plugins failed: %s", ex)
                 return
 
             if not build_result.is_failed():
                 if self.target_registries:
-                    for target_registry in self.target_registries:
-                        self.builder.push_built_image(target_registry, insecure=self.target_registries_insecure)
+                    with _phase(self, 'push'):
+                        for target_registry in self.target_registries:
+                            self.builder.push_built_image(target_registry,
+                                                          insecure=self.target_registries_insecure)
 
             postbuild_runner = PostBuildPluginsRunner(self.builder.tasker, self, self.postbuild_plugins_conf,
                                                       plugin_files=self.plugin_files)
             try:
-                postbuild_runner.run()
+                with _phase(self, 'postbuild_plugins'):
+                    postbuild_runner.run()
             except PluginFailedException as ex:
                 logger.error("One or more postbuild plugins failed: %s", ex)
                 return
 
             return build_result
         finally:
+            if self.yum_cache_proxy is not None:
+                self.yum_cache_proxy.stop()
+            imagegc.release_lease(lease)
             shutil.rmtree(tmpdir)
 
     def _prepare_response(self):
@@ -281,8 +344,24 @@ def build_inside(input, input_args=None, substitutions=None):
     if not build_json:
         raise RuntimeError("No valid build json!")
     # TODO: validate json
+    trace_context = build_json.pop(tracing.TRACE_CONTEXT_KEY, None)
+    if trace_context:
+        tracing.tracer.enable(trace_context, process_name='dock inside-build')
+    # usage file of the host, mounted by BuildContainerFactory.build_image_dockerhost
+    imagegc.use_mounted_usage()
     dbw = DockerBuildWorkflow(**build_json)
-    build_result = dbw.build_docker_image()
+    try:
+        with tracing.span('build_inside', input=input):
+            build_result = dbw.build_docker_image()
+    finally:
+        # host (or whoever runs the build container) collects metrics and trace from the shared dir
+        if os.path.isdir(CONTAINER_SHARE_PATH):
+            try:
+                metrics.registry.write(CONTAINER_METRICS_PATH)
+                if tracing.tracer.enabled:
+                    tracing.tracer.write(CONTAINER_TRACE_PATH)
+            except (IOError, OSError) as ex:
+                logger.warning("can't write metrics or trace: %s", repr(ex))
     if not build_result or build_result.is_failed():
         raise RuntimeError("no image built")
     else:
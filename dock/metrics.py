@@ -0,0 +1,291 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Metrics of builds: counters and histograms which can be exported in Prometheus
+text format (https://prometheus.io/docs/instrumenting/exposition_formats/).
+
+Metrics are registered in process-wide registry; registering metric with the same
+name again returns the existing one, so modules (and plugins, which are loaded
+repeatedly) can define their metrics at import time:
+
+    PULL_SECONDS = metrics.histogram('dock_pull_seconds', 'Time spent pulling images',
+                                     ['registry'])
+
+    with PULL_SECONDS.labels(registry='example.com').time():
+        ...
+
+    metrics.registry.write(path)
+"""
+
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# seconds; builds take from seconds to hours
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, float('inf'))
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return '%d' % value
+    return repr(float(value))
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape_label_value(value))
+                             for name, value in labels)
+
+
+class _Timer(object):
+    def __init__(self, child):
+        self.child = child
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.child.observe(time.time() - self.start)
+
+
+class _CounterChild(object):
+    def __init__(self, lock):
+        self._lock = lock
+        self.value = 0
+
+    def inc(self, amount=1):
+        if amount < 0:
+            raise ValueError("counters can only be increased")
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramChild(object):
+    def __init__(self, lock, buckets):
+        self._lock = lock
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def time(self):
+        """ context manager which observes its duration """
+        return _Timer(self)
+
+
+class Metric(object):
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        :param name: str, name of the metric
+        :param documentation: str, help text
+        :param labelnames: sequence of str, names of labels
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}  # tuple of label values -> child
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+    def labels(self, **labels):
+        """
+        :return: child metric for provided label values
+        """
+        if set(labels) != set(self.labelnames):
+            raise ValueError("metric '%s' has labels %s, got %s" %
+                             (self.name, list(self.labelnames), sorted(labels)))
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+        return child
+
+    def _unlabeled(self):
+        if self.labelnames:
+            raise ValueError("metric '%s' has labels, use labels()" % self.name)
+        return self.labels()
+
+    def samples(self):
+        """
+        :return: list of tuples (name, list of (label name, value) tuples, value)
+        """
+        raise NotImplementedError()
+
+    def reset(self):
+        """ forget all observed values """
+        with self._lock:
+            self._children.clear()
+
+    def _sorted_children(self):
+        with self._lock:
+            children = sorted(self._children.items())
+        return [(list(zip(self.labelnames, key)), child) for key, child in children]
+
+    def to_text(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation.replace('\n', ' ')),
+                 '# TYPE %s %s' % (self.name, self.metric_type)]
+        for name, labels, value in self.samples():
+            lines.append('%s%s %s' % (name, _format_labels(labels), _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild(threading.Lock())
+
+    def inc(self, amount=1):
+        self._unlabeled().inc(amount)
+
+    def samples(self):
+        return [(self.name, labels, child.value) for labels, child in self._sorted_children()]
+
+
+class Histogram(Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        buckets = tuple(sorted(buckets))
+        if buckets[-1] != float('inf'):
+            buckets += (float('inf'), )
+        self.buckets = buckets
+
+    def _new_child(self):
+        return _HistogramChild(threading.Lock(), self.buckets)
+
+    def observe(self, value):
+        self._unlabeled().observe(value)
+
+    def time(self):
+        return self._unlabeled().time()
+
+    def samples(self):
+        samples = []
+        for labels, child in self._sorted_children():
+            cumulative = 0
+            for bound, count in zip(child.buckets, child.counts):
+                cumulative += count
+                samples.append((self.name + '_bucket', labels + [('le', _format_value(bound))],
+                                cumulative))
+            samples.append((self.name + '_sum', labels, child.sum))
+            samples.append((self.name + '_count', labels, child.count))
+        return samples
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}  # name -> Metric
+
+    def _register(self, metric_class, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, documentation, labelnames,
+                                                            **kwargs)
+            elif not isinstance(metric, metric_class) or metric.labelnames != tuple(labelnames):
+                raise ValueError("metric '%s' is already registered with different type or labels"
+                                 % name)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def get(self, name):
+        with self._lock:
+            return self._metrics.get(name)
+
+    def reset(self):
+        """ forget all observed values; metrics stay registered """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.reset()
+
+    def to_text(self):
+        """
+        :return: str, all metrics in Prometheus text format
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        return ''.join(metric.to_text() + '\n' for _, metric in metrics)
+
+    def write(self, path):
+        """
+        write metrics to file atomically, so scrapers never see partial content
+
+        :param path: str
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                fp.write(self.to_text())
+            os.rename(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        logger.debug("metrics written to '%s'", path)
+
+
+registry = MetricsRegistry()
+
+
+def counter(name, documentation, labelnames=()):
+    """ register counter in the process-wide registry (or return registered one) """
+    return registry.counter(name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """ register histogram in the process-wide registry (or return registered one) """
+    return registry.histogram(name, documentation, labelnames, buckets=buckets)
+
+
+CACHE_REQUESTS = counter('dock_cache_requests_total', 'Lookups in caches of dock',
+                         ['cache', 'result'])
+
+
+def record_cache_lookup(cache, hit):
+    """
+    :param cache: str, name of the cache
+    :param hit: bool
+    """
+    CACHE_REQUESTS.labels(cache=cache, result='hit' if hit else 'miss').inc()
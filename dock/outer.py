@@ -13,7 +13,8 @@ import tempfile
 import datetime
 import logging
 
-from dock.constants import BUILD_JSON
+from dock import tracing
+from dock.constants import BUILD_JSON, TRACE_JSON
 from dock.build import BuilderStateMachine
 from dock.core import DockerTasker, BuildContainerFactory
 from dock.inner import BuildResults
@@ -48,16 +49,28 @@ class BuildManager(BuilderStateMachine):
         """
         logger.info("build image")
         self._ensure_not_built()
+        with tracing.span('BuildManager.build', image=self.image, git_url=self.git_url,
+                          build_image=self.build_image):
+            return self._run_build_container(build_method)
+
+    def _run_build_container(self, build_method):
         self.temp_dir = tempfile.mkdtemp()
         temp_path = os.path.join(self.temp_dir, BUILD_JSON)
         try:
+            build_args = dict(self.build_args)
+            trace_context = tracing.tracer.get_context()
+            if trace_context:
+                build_args[tracing.TRACE_CONTEXT_KEY] = trace_context
             with open(temp_path, 'w') as build_json:
-                json.dump(self.build_args, build_json)
-            self.build_container_id = build_method(self.build_image, self.temp_dir)
+                json.dump(build_args, build_json)
+            with tracing.span('start_build_container'):
+                self.build_container_id = build_method(self.build_image, self.temp_dir)
             try:
-                logs_gen = self.dt.logs(self.build_container_id, stream=True)
-                wait_for_command(logs_gen)
-                return_code = self.dt.wait(self.build_container_id)
+                # from here on, time until first span of 'dock inside-build' is boot of the container
+                with tracing.span('wait_for_build_container', container_id=self.build_container_id):
+                    logs_gen = self.dt.logs(self.build_container_id, stream=True)
+                    wait_for_command(logs_gen)
+                    return_code = self.dt.wait(self.build_container_id)
             except KeyboardInterrupt:
                 logger.info("Killing build container on user's request")
                 self.dt.remove_container(self.build_container_id, force=True)
@@ -69,8 +82,19 @@ class BuildManager(BuilderStateMachine):
                 results.return_code = return_code
                 return results
         finally:
+            self._load_trace()
             shutil.rmtree(self.temp_dir)
 
+    def _load_trace(self):
+        """ merge spans recorded within build container """
+        if not tracing.tracer.enabled:
+            return
+        trace_path = os.path.join(self.temp_dir, TRACE_JSON)
+        try:
+            tracing.tracer.add_events(tracing.load_events(trace_path))
+        except (IOError, OSError, ValueError, KeyError) as ex:
+            logger.warning("can't load trace of build container: %s", repr(ex))
+
     def _load_results(self, container_id):
         """
         load results from recent build
@@ -117,8 +141,7 @@ class BuildManager(BuilderStateMachine):
         logger.info("push buildroot to registry")
         self._ensure_is_built()
 
-        image_name_with_registry = self.buildroot_image_name.copy()
-        image_name_with_registry.registry = registry
+        image_name_with_registry = self.buildroot_image_name.copy(registry=registry)
 
         return self.dt.tag_and_push_image(
             self.buildroot_image_id,
@@ -13,13 +13,21 @@ plugins are supposed to be run when image is built and we need to extract some i
 import copy
 import logging
 import os
+import threading
 import traceback
 import imp
 
+from dock import metrics, tracing
+
 
 MODULE_EXTENSIONS = ('.py', '.pyc', '.pyo')
 logger = logging.getLogger(__name__)
 
+PLUGIN_SECONDS = metrics.histogram('dock_plugin_seconds', 'Time spent running plugins',
+                                   ['phase', 'plugin'])
+PLUGIN_FAILURES = metrics.counter('dock_plugin_failures_total', 'Plugins which raised an exception',
+                                  ['phase', 'plugin'])
+
 
 def get_plugin_conf(build_json, plugin_type, plugin_name):
     """
@@ -113,6 +121,10 @@ class BuildPlugin(Plugin):
 
 
 class PluginsRunner(object):
+    # (path, mtime) -> module; set it to dict to load every plugin file only once per
+    # process (long-running daemon does that), by default files are loaded by every runner
+    module_cache = None
+    _module_cache_lock = threading.Lock()
 
     def __init__(self, plugin_class_name, plugins_conf, *args, **kwargs):
         """
@@ -124,6 +136,8 @@ class PluginsRunner(object):
         self.plugins_results = getattr(self, "plugins_results", {})
         self.plugins_conf = plugins_conf or []
         self.plugin_files = kwargs.get("plugin_files", [])
+        # PreBuildPlugin -> prebuild
+        self.phase = plugin_class_name.replace('Plugin', '').lower()
         self.plugin_classes = self.load_plugins(plugin_class_name)
 
     def load_plugins(self, plugin_class_name):
@@ -145,7 +159,7 @@ class PluginsRunner(object):
             logger.debug("load file '%s'", f)
             module_name = os.path.basename(f).rsplit('.', 1)[0]
             try:
-                f_module = imp.load_source("dock.plugins.%s" % module_name, f)
+                f_module = self._load_module(module_name, f)
             except (IOError, OSError, ImportError) as ex:
                 logger.warning("can't load module '%s': %s", f, repr(ex))
                 continue
@@ -164,6 +178,17 @@ class PluginsRunner(object):
                     plugin_classes[binding.key] = binding
         return plugin_classes
 
+    def _load_module(self, module_name, path):
+        if self.module_cache is None:
+            return imp.load_source("dock.plugins.%s" % module_name, path)
+        key = (path, os.path.getmtime(path))
+        with self._module_cache_lock:
+            module = self.module_cache.get(key)
+            if module is None:
+                module = imp.load_source("dock.plugins.%s" % module_name, path)
+                self.module_cache[key] = module
+        return module
+
     def create_instance_from_plugin(self, plugin_class, plugin_conf):
         """
         create instance from plugin using the plugin class and configuration passed to for it
@@ -208,8 +233,11 @@ class PluginsRunner(object):
             plugin_instance = self.create_instance_from_plugin(plugin_class, plugin_conf)
 
             try:
-                plugin_response = plugin_instance.run()
+                with tracing.span(plugin_name, category='plugin', phase=self.phase):
+                    with PLUGIN_SECONDS.labels(phase=self.phase, plugin=plugin_name).time():
+                        plugin_response = plugin_instance.run()
             except Exception as ex:
+                PLUGIN_FAILURES.labels(phase=self.phase, plugin=plugin_name).inc()
                 msg = "Plugin '%s' raised an exception: '%s'" % (plugin_instance.key, repr(ex))
                 logger.warning(msg)
                 logger.debug(traceback.format_exc())
@@ -11,6 +11,7 @@ from __future__ import print_function, unicode_literals
 Push built image to pulp registry
 """
 
+from dock import admission
 from dock.plugin import PostBuildPlugin
 from dock.util import ImageName
 
@@ -168,7 +169,8 @@ class PulpServer(object):
         else:
             upload_id = self._upload_id
             self.logger.info('Uploading image using ID "{0}"'.format(upload_id))
-            self._upload_docker_image(upload_id, image)
+            with admission.admit('export', tasker=self.tasker):
+                self._upload_docker_image(upload_id, image)
             self._import_upload(upload_id, repo_id)
             self._delete_upload_id(upload_id)
 
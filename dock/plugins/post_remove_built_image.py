@@ -7,7 +7,12 @@ of the BSD license. See the LICENSE file for details.
 
 
 Remove built image (this only makes sense if you store the image in some registry first)
+
+With image_budget, images are not removed right away: image GC keeps images
+on host within the budget, so base images used by other builds don't have
+to be pulled again.
 """
+from dock.imagegc import ImageGarbageCollector
 from dock.plugin import PostBuildPlugin
 from dock.util import ImageName
 
@@ -19,19 +24,25 @@ class GarbageCollectionPlugin(PostBuildPlugin):
     key = "remove_built_image"
     can_fail = True
 
-    def __init__(self, tasker, workflow, remove_pulled_base_image=True):
+    def __init__(self, tasker, workflow, remove_pulled_base_image=True, image_budget=None):
         """
         constructor
 
         :param tasker: DockerTasker instance
         :param workflow: DockerBuildWorkflow instance
         :param remove_pulled_base_image: bool, remove also base image? default=True
+        :param image_budget: int, bytes; when set, least recently used images over
+                             this budget are removed instead of built and base image
         """
         # call parent constructor
         super(GarbageCollectionPlugin, self).__init__(tasker, workflow)
         self.remove_base_image = remove_pulled_base_image
+        self.image_budget = image_budget
 
     def run(self):
+        if self.image_budget is not None:
+            # images of this build are leased, they are not removed now
+            return ImageGarbageCollector(self.tasker, budget_bytes=self.image_budget).collect()
         image = self.workflow.builder.image_id
         if not image:
             self.log.error("no built image, nothing to remove")
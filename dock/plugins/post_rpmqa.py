@@ -4,9 +4,26 @@ All rights reserved.
 
 This software may be modified and distributed under the terms
 of the BSD license. See the LICENSE file for details.
+
+
+List packages installed in built image. Output of this plugin is columnar,
+typed package table (see dock.rpmdb.create_package_table):
+
+{
+    "packages": {"name": [...], "version": [...], ..., "buildtime": [...]},
+    "base_image": "fedora:latest",
+    "base_image_diff": {"added": {...}, "changed": {...}, "removed": {...}}
+}
+
+Inventory of base image is cached per layer on disk (in DOCK_CACHE_DIR by
+default), so only the first build on top of a base image pays for querying it.
 """
 
+import os
+
+from dock.constants import DOCK_CACHE_DIR
 from dock.plugin import PostBuildPlugin
+from dock.rpmdb import get_rpm_packages, create_package_table, diff_package_tables
 
 
 __all__ = ('PostBuildRPMqaPlugin', )
@@ -15,25 +32,45 @@ __all__ = ('PostBuildRPMqaPlugin', )
 class PostBuildRPMqaPlugin(PostBuildPlugin):
     key = "all_rpm_packages"
 
-    def __init__(self, tasker, workflow, image_id):
+    def __init__(self, tasker, workflow, image_id, extract_rpmdb=False, cache_dir=None,
+                 diff_base_image=True):
         """
         constructor
 
         :param tasker: DockerTasker instance
         :param workflow: DockerBuildWorkflow instance
+        :param image_id: str, image to query
+        :param extract_rpmdb: bool, don't run rpm inside a container, extract rpm database
+                              from image layers and query it using rpm from current environment
+        :param cache_dir: str, directory where package lists are persisted (per layer ID)
+        :param diff_base_image: bool, compare packages with packages of base image
         """
         # call parent constructor
         super(PostBuildRPMqaPlugin, self).__init__(tasker, workflow)
         self.image_id = image_id
+        self.extract_rpmdb = extract_rpmdb
+        self.cache_dir = cache_dir or os.path.join(DOCK_CACHE_DIR, 'rpmqa')
+        self.diff_base_image = diff_base_image
+
+    def get_package_table(self, image):
+        rpm_output = get_rpm_packages(self.tasker, image, extract=self.extract_rpmdb,
+                                      cache_dir=self.cache_dir)
+        return create_package_table(rpm_output)
 
     def run(self):
-        container_id = self.tasker.run(
-            self.image_id,
-            command="-qa --qf '%{NAME},%{VERSION},%{RELEASE},%{ARCH},%{EPOCH},%{SIZE},%{SIGMD5},%{BUILDTIME}\n'",
-            create_kwargs={"entrypoint": "/bin/rpm"},
-            start_kwargs={},
-        )
-        self.tasker.wait(container_id)
-        plugin_output = self.tasker.logs(container_id, stream=False)
-        self.tasker.remove_container(container_id)
-        return plugin_output
+        packages = self.get_package_table(self.image_id)
+        result = {
+            "packages": packages,
+            "base_image": None,
+            "base_image_diff": None,
+        }
+        if self.diff_base_image:
+            base_image = self.workflow.builder.base_image
+            result["base_image"] = base_image.to_str()
+            try:
+                base_packages = self.get_package_table(base_image)
+            except Exception as ex:
+                self.log.warning("can't list packages of base image '%s': %s", base_image, repr(ex))
+            else:
+                result["base_image_diff"] = diff_package_tables(base_packages, packages)
+        return result
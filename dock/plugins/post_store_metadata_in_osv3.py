@@ -8,7 +8,7 @@ of the BSD license. See the LICENSE file for details.
 
 import json
 import os
-from osbs.core import Openshift
+from dock.rpmdb import format_package_table
 from dock.util import ImageName
 
 try:
@@ -39,6 +39,21 @@ class StoreMetadataInOSv3Plugin(PostBuildPlugin):
         self.verify_ssl = verify_ssl
         self.use_auth = use_auth
 
+    def get_rpm_packages(self):
+        """
+        render output of all_rpm_packages plugin
+
+        :return: tuple, (str, full package list one per line; str, json with diff against base image)
+        """
+        rpm_packages = self.workflow.postbuild_results.get("all_rpm_packages", None)
+        if not isinstance(rpm_packages, dict):
+            return "", ""
+        packages = "\n".join(format_package_table(rpm_packages["packages"]))
+        diff = rpm_packages.get("base_image_diff", None)
+        if diff is None:
+            return packages, ""
+        return packages, json.dumps(diff, separators=(',', ':'), sort_keys=True)
+
     def run(self):
         try:
             build_json = json.loads(os.environ["BUILD"])
@@ -55,6 +70,9 @@ class StoreMetadataInOSv3Plugin(PostBuildPlugin):
         api_url = urljoin(self.url, "/osapi/v1beta1/")
         oauth_url = urljoin(self.url, "/oauth/authorize")  # MUST NOT END WITH SLASH
 
+        # plugins are loaded on every build, import osbs only when it's used
+        from osbs.core import Openshift
+
         # initial setup will use host based auth: apache will be set to accept everything
         # from specific IP and will set specific X-Remote-User for such requests
         o = Openshift(api_url, oauth_url, None, use_auth=self.use_auth, verify_ssl=self.verify_ssl)
@@ -71,13 +89,12 @@ class StoreMetadataInOSv3Plugin(PostBuildPlugin):
                 image_name = ImageName.parse(image)
                 if image_name.registry:
                     assert image_name.registry == registry_uri
-                image_name.registry = registry_uri
+                image_name = image_name.copy(registry=registry_uri)
                 primary_repositories.append(image_name.to_str())
 
         unique_repositories = []
-        target_image = self.workflow.builder.image.copy()
         for registry in self.workflow.target_registries:
-            target_image.registry = registry
+            target_image = self.workflow.builder.image.copy(registry=registry)
             unique_repositories.append(target_image.to_str())
 
         repositories = {
@@ -85,11 +102,14 @@ class StoreMetadataInOSv3Plugin(PostBuildPlugin):
             "unique": unique_repositories,
         }
 
+        rpm_packages, rpm_packages_diff = self.get_rpm_packages()
+
         labels = {
             "dockerfile": self.workflow.prebuild_results.get("dockerfile_content", ""),
             "artefacts": self.workflow.prebuild_results.get("distgit_fetch_artefacts", ""),
             "logs": "\n".join(self.workflow.build_logs),
-            "rpm-packages": "\n".join(self.workflow.postbuild_results.get("all_rpm_packages", "")),
+            "rpm-packages": rpm_packages,
+            "rpm-packages-diff": rpm_packages_diff,
             "repositories": json.dumps(repositories),
         }
         o.set_annotations_on_build(build_id, labels)
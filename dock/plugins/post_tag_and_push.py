@@ -4,10 +4,21 @@ All rights reserved.
 
 This software may be modified and distributed under the terms
 of the BSD license. See the LICENSE file for details.
+
+
+Tag built image and push it to registries.
+
+Registries are pushed to concurrently; within one registry, at most
+max_pushes_per_registry repositories are pushed at once. Tags of the same
+repository are pushed one after another, so they share the upload of layers.
+Every worker thread pushes with its own DockerTasker (see DockerTasker.clone).
+When any push fails, the plugin fails after all pushes finish.
 """
 
+import threading
+
 from dock.plugin import PostBuildPlugin
-from dock.util import ImageName
+from dock.util import ImageName, thread_pool
 
 
 __all__ = ('TagAndPushPlugin', )
@@ -17,7 +28,7 @@ class TagAndPushPlugin(PostBuildPlugin):
     key = "tag_and_push"
     can_fail = False
 
-    def __init__(self, tasker, workflow, mapping=None, insecure=False):
+    def __init__(self, tasker, workflow, mapping=None, insecure=False, max_pushes_per_registry=2):
         """
         constructor
 
@@ -36,16 +47,54 @@ class TagAndPushPlugin(PostBuildPlugin):
             "...": {...}
           }
         :param insecure: bool, allow connection to registry to be insecure
+        :param max_pushes_per_registry: int, number of repositories pushed to one
+                                        registry concurrently
         """
         # call parent constructor
         super(TagAndPushPlugin, self).__init__(tasker, workflow)
         self.mapping = mapping
         self.insecure = insecure
+        self.max_pushes_per_registry = max_pushes_per_registry
+        self._local = threading.local()
+
+    def get_tasker(self):
+        """ :return: DockerTasker of current worker thread """
+        tasker = getattr(self._local, 'tasker', None)
+        if tasker is None:
+            tasker = self._local.tasker = self.tasker.clone()
+        return tasker
+
+    def push_repository(self, args):
+        """
+        :param args: tuple (list of ImageName in one repository, bool insecure)
+        :return: dict, see DockerTasker.tag_and_push_images
+        """
+        target_images, insecure = args
+        return self.get_tasker().tag_and_push_images(self.workflow.builder.image_id,
+                                                     target_images, insecure=insecure)
+
+    def push_registry(self, args):
+        """
+        :param args: tuple (list of lists of ImageName, one per repository, bool insecure)
+        :return: dict, see DockerTasker.tag_and_push_images
+        """
+        repositories, insecure = args
+        pool = thread_pool(max(1, min(self.max_pushes_per_registry, len(repositories))))
+        try:
+            results = pool.map(self.push_repository,
+                               [(target_images, insecure) for target_images in repositories])
+        finally:
+            pool.close()
+            pool.join()
+        merged = {}
+        for result in results:
+            merged.update(result)
+        return merged
 
     def run(self):
-        pushed_images = []
         self.workflow.tag_and_push_conf.merge_with_mapping(self.mapping)
-        for registry_uri in self.workflow.tag_and_push_conf.registries:
+        registries = []  # tuples (registry, list of ImageName, insecure)
+        for registry_uri in sorted(self.workflow.tag_and_push_conf.registries):
             registry_conf = self.workflow.tag_and_push_conf[registry_uri]
             insecure = registry_conf.get("insecure", self.insecure)
             try:
@@ -53,12 +102,47 @@ class TagAndPushPlugin(PostBuildPlugin):
             except KeyError:
                 self.log.error("Registry '%s' doesn't have any image names, skipping...", registry_uri)
                 continue
+            target_images = []
             for image in image_names:
                 image_name = ImageName.parse(image)
                 if image_name.registry:
                     assert image_name.registry == registry_uri
-                image_name.registry = registry_uri
-                self.tasker.tag_and_push_image(self.workflow.builder.image_id, image_name,
-                                               insecure=insecure)
-                pushed_images.append(image_name.to_str())
+                target_images.append(image_name.copy(registry=registry_uri))
+            if target_images:
+                registries.append((registry_uri, target_images, insecure))
+        if not registries:
+            return []
+
+        work = []
+        for registry_uri, target_images, insecure in registries:
+            repositories = {}
+            for image_name in target_images:
+                repositories.setdefault(image_name.to_str(tag=False), []).append(image_name)
+            work.append((list(repositories.values()), insecure))
+        pool = thread_pool(len(work))
+        try:
+            results = pool.map(self.push_registry, work)
+        finally:
+            pool.close()
+            pool.join()
+
+        # order of configuration, no matter which push finished first
+        pushed_images = []
+        failed_images = []
+        for (registry_uri, target_images, insecure), registry_results in zip(registries, results):
+            for image_name in target_images:
+                name = image_name.to_str()
+                stats = dict(registry_results[name], image=name)
+                self.workflow.push_stats.append(stats)
+                if stats['result'] == 'failed':
+                    self.log.error("%s: push failed: %s", name, stats['error'])
+                    failed_images.append(name)
+                    continue
+                self.log.info("%s: %s in %.1f seconds%s", name, stats['result'], stats['seconds'],
+                              ", %.1f MB/s" % (stats['bytes_per_second'] / 1e6)
+                              if stats['bytes_per_second'] else "")
+                pushed_images.append(name)
+        if failed_images:
+            # all pushes are finished by now, so the others are in registries and push_stats
+            raise RuntimeError("failed to push images: %s" % ", ".join(failed_images))
         return pushed_images
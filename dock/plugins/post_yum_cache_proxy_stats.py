@@ -0,0 +1,37 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Stop yum caching proxy started by prebuild plugin yum_cache_proxy and
+return its statistics:
+
+{
+    "requests": 120,
+    "hits": 100,
+    "misses": 20,
+    "hit_ratio": 0.83,
+    "bytes_saved": 52428800,
+    "bytes_downloaded": 1048576
+}
+"""
+from dock.plugin import PostBuildPlugin
+
+
+class YumCacheProxyStatsPlugin(PostBuildPlugin):
+    key = "yum_cache_proxy_stats"
+    can_fail = True
+
+    def run(self):
+        """
+        run the plugin
+        """
+        proxy = self.workflow.yum_cache_proxy
+        if proxy is None:
+            self.log.info("yum cache proxy is not running")
+            return None
+        proxy.stop()
+        return proxy.stats.as_dict()
@@ -58,9 +58,6 @@ class AddLabelsPlugin(PreBuildPlugin):
         """
         run the plugin
         """
-        with open(self.workflow.builder.df_path, 'r') as fp:
-            lines = fp.readlines()
-
         # correct syntax is:
         #   LABEL "key"="value" "key2"="value2"
 
@@ -85,9 +82,10 @@ class AddLabelsPlugin(PreBuildPlugin):
             content += " " + label
 
         # put it before last instruction
-        lines.insert(-1, content + '\n')
-
-        with open(self.workflow.builder.df_path, 'w') as fp:
-            fp.writelines(lines)
+        dockerfile = self.workflow.builder.dockerfile
+        if dockerfile.instructions:
+            dockerfile.insert_before(dockerfile.instructions[-1], content)
+        else:
+            dockerfile.append(content)
 
         return content
@@ -11,6 +11,10 @@ repos which should be injected into built image.
 
 This plugin has to run _BEFORE_ yum inject plugin.
 
+Repo files are fetched concurrently; responses are cached on disk with
+their ETag/Last-Modified, so unchanged repo files are only revalidated.
+Repos are added in the order of repourls (and sections within a file).
+
 Example configuration to add content of repo file at URL:
 
 {
@@ -21,7 +25,15 @@ Example configuration to add content of repo file at URL:
 }
 
 """
+import hashlib
+import json
+import os
+import tempfile
+
+from dock import metrics
+from dock.constants import DOCK_CACHE_DIR
 from dock.plugin import PreBuildPlugin
+from dock.util import thread_pool
 import requests
 try:
     # py2
@@ -35,32 +47,110 @@ except ImportError:
     from configparser import SafeConfigParser
 
 
+class RepoFileCache(object):
+    """ repo files stored on disk together with their ETag and Last-Modified """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _path(self, url):
+        return os.path.join(self.cache_dir,
+                            hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, url):
+        """
+        :param url: str
+        :return: dict with keys 'text', 'etag', 'last_modified' or None
+        """
+        try:
+            with open(self._path(url), 'r') as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def put(self, url, text, etag, last_modified):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(fd, 'w') as fp:
+            json.dump({'url': url, 'text': text, 'etag': etag,
+                       'last_modified': last_modified}, fp)
+        os.rename(tmp_path, self._path(url))
+
+
 class AddYumRepoByUrlPlugin(PreBuildPlugin):
     key = "add_yum_repo_by_url"
     can_fail = False
 
-    def __init__(self, tasker, workflow, repourls):
+    def __init__(self, tasker, workflow, repourls, cache_dir=None, max_workers=4):
         """
         constructor
 
         :param tasker: DockerTasker instance
         :param workflow: DockerBuildWorkflow instance
         :param repourls: list of str, URLs to the repo files
+        :param cache_dir: str, where repo files are cached
+        :param max_workers: int, how many repo files are fetched at once
         """
         # call parent constructor
         super(AddYumRepoByUrlPlugin, self).__init__(tasker, workflow)
         self.repourls = repourls
+        self.cache = RepoFileCache(cache_dir or os.path.join(DOCK_CACHE_DIR, 'repofiles'))
+        self.max_workers = max_workers
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def fetch(self, repourl):
+        """
+        get content of repo file, revalidate cached copy if there is one
+
+        :param repourl: str, URL of repo file
+        :return: str, content of repo file
+        """
+        cached = self.cache.get(repourl)
+        headers = {}
+        if cached is not None:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+        response = self.session.get(repourl, headers=headers)
+        if cached is not None and response.status_code == 304:
+            self.log.debug("repo file '%s' not modified", repourl)
+            metrics.record_cache_lookup('repofiles', True)
+            return cached['text']
+        response.raise_for_status()
+        metrics.record_cache_lookup('repofiles', False)
+        etag = response.headers.get('ETag', None)
+        last_modified = response.headers.get('Last-Modified', None)
+        if etag or last_modified:
+            try:
+                self.cache.put(repourl, response.text, etag, last_modified)
+            except (IOError, OSError) as ex:
+                self.log.warning("can't cache repo file '%s': %s", repourl, repr(ex))
+        return response.text
 
     def run(self):
         """
         run the plugin
         """
         self.workflow.repos.setdefault("yum", [])
-        for repourl in self.repourls:
+        if not self.repourls:
+            return
+
+        pool = thread_pool(min(self.max_workers, len(self.repourls)))
+        try:
+            # map keeps order of repourls
+            texts = pool.map(self.fetch, self.repourls)
+        finally:
+            pool.close()
+            pool.join()
+
+        for text in texts:
             repoconfig = SafeConfigParser()
-            response = requests.get(repourl)
-            response.raise_for_status()
-            repoconfig.readfp(StringIO(response.text))
+            repoconfig.readfp(StringIO(text))
             for name in repoconfig.sections():
                 repo = dict(repoconfig.items(name))
                 repo['name'] = name
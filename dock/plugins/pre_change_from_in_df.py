@@ -8,9 +8,6 @@ of the BSD license. See the LICENSE file for details.
 
 Pre build plugin which changes FROM instruction
 """
-import fileinput
-import re
-import sys
 from dock.plugin import PreBuildPlugin
 from dock.util import ImageName
 
@@ -42,11 +39,10 @@ class ChangeFromPlugin(PreBuildPlugin):
             self.log.error("Id is missing in inspection: '%s'", base_image_inspect)
             return
         self.log.debug("Using base image '%s', id '%s'", base_image, base_image_id)
-        for line in fileinput.input(self.workflow.builder.df_path, inplace=1):
-            re_match = re.match(r"^FROM .+$", line)
-            if re_match:
-                new_from = "FROM %s" % base_image_id
-                sys.stdout.write(new_from + '\n')
-                self.log.info("Changed FROM: '%s' -> '%s'", re_match.group(0), new_from)
-            else:
-                sys.stdout.write(line)
+        dockerfile = self.workflow.builder.dockerfile
+        new_from = "FROM %s" % base_image_id
+        # go from the end, so offsets of instructions which are not processed yet don't change
+        for instruction in reversed(dockerfile.get_instructions('FROM')):
+            dockerfile.replace(instruction, new_from)
+            self.log.info("Changed FROM on line %d: '%s' -> '%s'",
+                          instruction.startline + 1, instruction.content.strip(), new_from)
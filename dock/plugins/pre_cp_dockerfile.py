@@ -9,8 +9,6 @@ of the BSD license. See the LICENSE file for details.
 This plugin copies dockerfile to provided path. Useful when building from
 command line, or directly on host
 """
-import shutil
-
 from dock.plugin import PreBuildPlugin
 
 
@@ -37,7 +35,7 @@ class CpDockerfilePlugin(PreBuildPlugin):
         response from plugin is kept and used in json result response
         """
         try:
-            shutil.copyfile(self.workflow.builder.df_path, self.path)
+            self.workflow.builder.dockerfile.write(self.path)
         except (IOError, OSError) as ex:
             msg = "Couldn't copy dockerfile: %s" % repr(ex)
             self.log.error(msg)
@@ -11,13 +11,30 @@ Pre build plugin which injects custom yum repository in dockerfile.
 import os
 import re
 import uuid
+from dock.dockerfile import Dockerfile
 from dock.plugin import PreBuildPlugin
 
 
+YUM_COMMAND_RE = re.compile(r"^yum(\s|$)")
+
+
+def wrap_yum_commands(dockerfile, wrap_str):
+    """
+    replace every 'RUN yum ...' instruction with wrap_str
+
+    :param dockerfile: Dockerfile instance
+    :param wrap_str: str, new instruction, '%(yum_command)s' is replaced with original command
+    """
+    # go from the end, so offsets of instructions which are not processed yet don't change
+    for instruction in reversed(dockerfile.get_instructions('RUN')):
+        if YUM_COMMAND_RE.match(instruction.value):
+            dockerfile.replace(instruction, wrap_str % {'yum_command': instruction.value})
+
+
 def alter_yum_commands(df, wrap_str):
-    regex = re.compile(r"RUN\s+(?P<yum_command>yum((\s.+\\\n)+)?(.+))", re.MULTILINE)
-    sub_func = lambda match: wrap_str % {'yum_command': match.group('yum_command').rstrip()}
-    return regex.sub(sub_func, df)
+    dockerfile = Dockerfile(content=df)
+    wrap_yum_commands(dockerfile, wrap_str)
+    return dockerfile.content
 
 
 class InjectYumRepoPlugin(PreBuildPlugin):
@@ -59,9 +76,4 @@ class InjectYumRepoPlugin(PreBuildPlugin):
             ' >%(repo_path)s && %%(yum_command)s && yum clean all && rm -f %(repo_path)s' \
             % {'repo_path': self.repo_path}
 
-        with open(self.workflow.builder.df_path, "r+") as fd:
-            df = fd.read()
-            out = alter_yum_commands(df, wrap_cmd)
-            fd.seek(0)
-            fd.truncate()
-            fd.write(out)
+        wrap_yum_commands(self.workflow.builder.dockerfile, wrap_cmd)
@@ -7,17 +7,42 @@ of the BSD license. See the LICENSE file for details.
 
 
 Pre build plugin for koji build system
+
+Resolution of target to repo URL is cached process-wide for target_ttl
+seconds (keyed by hub and target). Target and its repo are fetched in one
+multicall: repo is asked for the build tag of expired entry, or, for unknown
+target, for "<target>-build" (koji's naming convention); only when the guess
+is wrong, another call is needed. The URL changes only when repo ID does.
 """
-import koji
+import threading
 
+from dock import metrics
+from dock.cache import get_cache, TTLCache
 from dock.plugin import PreBuildPlugin
 
 
+DEFAULT_TARGET_TTL = 60
+BUILD_TAG_GUESS = "%s-build"
+
+
+def get_session(hub):
+    """ koji sessions are reused within thread (ClientSession is not thread-safe) """
+    import koji  # plugins are loaded on every build, import koji only when it's used
+    sessions = get_cache('koji-sessions', threading.local)
+    if not hasattr(sessions, 'by_hub'):
+        sessions.by_hub = {}
+    try:
+        return sessions.by_hub[hub]
+    except KeyError:
+        session = sessions.by_hub[hub] = koji.ClientSession(hub)
+        return session
+
+
 class KojiPlugin(PreBuildPlugin):
     key = "koji"
     can_fail = False
 
-    def __init__(self, tasker, workflow, target, hub, root):
+    def __init__(self, tasker, workflow, target, hub, root, target_ttl=DEFAULT_TARGET_TTL):
         """
         constructor
 
@@ -26,24 +51,95 @@ class KojiPlugin(PreBuildPlugin):
         :param target: string, koji target to use as a source
         :param hub: string, koji hub (xmlrpc)
         :param root: string, koji root (storage)
+        :param target_ttl: int, for how many seconds is resolved repo of target cached
         """
         # call parent constructor
         super(KojiPlugin, self).__init__(tasker, workflow)
         self.target = target
-        self.xmlrpc = koji.ClientSession(hub)
-        self.pathinfo = koji.PathInfo(topdir=root)
+        self.hub = hub
+        self.root = root
+        self.target_ttl = target_ttl
+        # one cache per TTL, so every instance gets the TTL it asked for
+        self.cache = get_cache('koji-targets-%ss' % target_ttl, lambda: TTLCache(ttl=target_ttl))
+        self.xmlrpc = None
 
-    def run(self):
+    def multicall(self, *calls):
         """
-        run the plugin
+        :param calls: tuples (method name, arg, ...)
+        :return: list of tuples (result, fault); fault is None or dict with 'faultString'
+        """
+        self.xmlrpc.multicall = True
+        for call in calls:
+            getattr(self.xmlrpc, call[0])(*call[1:])
+        results = []
+        for result in self.xmlrpc.multiCall(strict=False):
+            if isinstance(result, dict):
+                results.append((None, result))
+            else:
+                results.append((result[0], None))
+        return results
+
+    def resolve(self, cached):
+        """
+        :param cached: dict (expired cache entry) or None
+        :return: dict with keys 'build_tag_name', 'repo_id'
         """
-        target_info = self.xmlrpc.getBuildTarget(self.target)
+        if cached is not None:
+            # tag of target is most probably the same
+            guessed_tag = cached['build_tag_name']
+        else:
+            guessed_tag = BUILD_TAG_GUESS % self.target
+        (target_info, target_fault), (repo_info, repo_fault) = self.multicall(
+            ('getBuildTarget', self.target), ('getRepo', guessed_tag))
+        if target_fault is not None:
+            raise RuntimeError("Can't get target '%s': %s" %
+                               (self.target, target_fault.get('faultString')))
         if target_info is None:
             self.log.error("provided target '%s' doesn't exist", self.target)
             raise RuntimeError("Provided target '%s' doesn't exist!" % self.target)
-        tag_info = self.xmlrpc.getTag(target_info['build_tag_name'])
-        repo_info = self.xmlrpc.getRepo(tag_info['id'])
-        baseurl = self.pathinfo.repo(repo_info['id'], tag_info['name']) + r'/\$basearch'
+        build_tag_name = target_info['build_tag_name']
+        if build_tag_name != guessed_tag:
+            self.log.debug("build tag of target '%s' is '%s', not '%s'", self.target,
+                           build_tag_name, guessed_tag)
+            repo_info = self.xmlrpc.getRepo(build_tag_name)
+        elif repo_fault is not None:
+            raise RuntimeError("Can't get repo of tag '%s': %s" %
+                               (build_tag_name, repo_fault.get('faultString')))
+        if repo_info is None:
+            raise RuntimeError("Tag '%s' doesn't have a repo!" % build_tag_name)
+        return {'build_tag_name': build_tag_name, 'repo_id': repo_info['id']}
+
+    def get_repo(self):
+        """
+        resolve target, use cache when possible
+
+        :return: dict with keys 'build_tag_name', 'repo_id'
+        """
+        cache_key = (self.hub, self.target)
+        resolved = self.cache.get(cache_key)
+        metrics.record_cache_lookup('koji_targets', resolved is not None)
+        if resolved is not None:
+            self.log.debug("repo of target '%s' found in cache", self.target)
+            return resolved
+        cached = self.cache.get(cache_key, allow_expired=True)
+        resolved = self.resolve(cached)
+        if cached is not None and cached['repo_id'] != resolved['repo_id']:
+            self.log.info("repo of target '%s' changed: %s -> %s", self.target,
+                          cached['repo_id'], resolved['repo_id'])
+        self.cache.set(cache_key, resolved)
+        return resolved
+
+    def run(self):
+        """
+        run the plugin
+        """
+        import koji
+        self.xmlrpc = get_session(self.hub)
+        self.pathinfo = koji.PathInfo(topdir=self.root)
+
+        resolved = self.get_repo()
+        baseurl = self.pathinfo.repo(resolved['repo_id'], resolved['build_tag_name']) + \
+            r'/\$basearch'
 
         self.workflow.repos.setdefault('yum', [])
         repo = {
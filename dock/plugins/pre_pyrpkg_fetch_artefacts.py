@@ -9,18 +9,49 @@ of the BSD license. See the LICENSE file for details.
 To have everything for a build in dist-git you need to fetch artefacts using 'fedpkg sources'.
 
 This plugin should do it.
+
+Artefacts are kept in local store keyed by checksum from 'sources' file
+(see dock.artefacts) and linked into the clone. Only missing artefacts are
+fetched: when lookaside_url is set, they are downloaded from lookaside cache
+in parallel and verified while downloading, otherwise command is executed and
+its results are added to the store. Cached artefacts are linked into the clone
+before the command runs, so 'fedpkg sources' finds them with the right
+checksum and downloads only the missing ones.
+
+Example configuration:
+
+{
+    "name": "distgit_fetch_artefacts",
+    "args": {
+        "command": "fedpkg sources",
+        "lookaside_url": "http://pkgs.example.com/repo/pkgs/%(package)s/%(filename)s/%(checksum)s/%(filename)s"
+    }
+}
 """
 import os
 import subprocess
 
+import requests
+
+from dock import metrics
+from dock.artefacts import ArtefactStore, get_target_path, parse_sources
+from dock.constants import DOCK_CACHE_DIR
 from dock.plugin import PreBuildPlugin
+from dock.util import thread_pool
+try:
+    # py2
+    from urllib import quote
+except ImportError:
+    # py3
+    from urllib.parse import quote
 
 
 class DistgitFetchArtefactsPlugin(PreBuildPlugin):
     key = "distgit_fetch_artefacts"
     can_fail = False
 
-    def __init__(self, tasker, workflow, command):
+    def __init__(self, tasker, workflow, command, cache_dir=None, lookaside_url=None,
+                 package=None, max_workers=4):
         """
         constructor
 
@@ -28,16 +59,65 @@ class DistgitFetchArtefactsPlugin(PreBuildPlugin):
         :param workflow: DockerBuildWorkflow instance
         :param command: str, command to use to get artefacts (e.g. 'make sources')
                              it is executed in cloned git repo
+        :param cache_dir: str, directory of artefact store
+        :param lookaside_url: str, template of URL of artefact; keys: package, filename,
+                              checksum, hashtype
+        :param package: str, name of package for lookaside_url, name of git repo by default
+        :param max_workers: int, how many artefacts are downloaded at once
         """
         # call parent constructor
         super(DistgitFetchArtefactsPlugin, self).__init__(tasker, workflow)
         self.command = command
+        self.store = ArtefactStore(cache_dir or os.path.join(DOCK_CACHE_DIR, 'artefacts'))
+        self.lookaside_url = lookaside_url
+        self.package = package
+        self.max_workers = max_workers
+
+    def get_package(self):
+        if self.package:
+            return self.package
+        name = os.path.basename(self.workflow.git_url.rstrip('/'))
+        if name.endswith('.git'):
+            name = name[:-len('.git')]
+        return name
+
+    def download(self, missing):
+        session = requests.Session()
+        package = self.get_package()
+
+        def download_one(artefact):
+            url = self.lookaside_url % {
+                'package': package,
+                'filename': quote(artefact.filename),
+                'checksum': artefact.checksum,
+                'hashtype': artefact.hashtype,
+            }
+            self.store.download(artefact, url, session=session)
+
+        pool = thread_pool(min(self.max_workers, len(missing)))
+        try:
+            pool.map(download_one, missing)
+        finally:
+            pool.close()
+            pool.join()
+
+    def run_command(self, missing):
+        git_path = self.workflow.builder.git_path
+        subprocess.check_call(self.command.split(), cwd=git_path)
+        for artefact in missing:
+            path = get_target_path(git_path, artefact.filename)
+            if os.path.isfile(path):
+                # fails on checksum mismatch
+                self.store.add(artefact, path)
+            else:
+                self.log.warning("'%s' didn't fetch '%s'", self.command, artefact.filename)
 
     def run(self):
         """
         fetch artefacts
         """
-        sources_file_path = os.path.join(self.workflow.builder.git_path, 'sources')
+        git_path = self.workflow.builder.git_path
+        sources_file_path = os.path.join(git_path, 'sources')
         artefacts = ""
         try:
             with open(sources_file_path, 'r') as f:
@@ -49,8 +129,21 @@ class DistgitFetchArtefactsPlugin(PreBuildPlugin):
             else:
                 raise
         else:
-            cur_dir = os.getcwd()
-            os.chdir(self.workflow.builder.git_path)
-            subprocess.check_call(self.command.split())
-            os.chdir(cur_dir)
+            entries = parse_sources(artefacts)
+            missing = [a for a in entries if not self.store.contains(a)]
+            for artefact in entries:
+                metrics.record_cache_lookup('artefacts', artefact not in missing)
+            self.log.info("%d artefacts cached, %d missing",
+                          len(entries) - len(missing), len(missing))
+            cached = [a for a in entries if a not in missing]
+            for artefact in cached:
+                self.store.link(artefact, git_path)
+            if missing or not entries:
+                if self.lookaside_url and entries:
+                    self.download(missing)
+                else:
+                    self.run_command(missing)
+            for artefact in missing:
+                if self.store.contains(artefact):
+                    self.store.link(artefact, git_path)
         return artefacts
@@ -27,12 +27,6 @@ class CpDockerfilePlugin(PreBuildPlugin):
 
     def run(self):
         """
-        try open dockerfile, output an error if there is one
+        return dockerfile as it looks like at this point of the build
         """
-        try:
-            with open(self.workflow.builder.df_path, 'r') as fd:
-                return fd.read()
-        except (IOError, OSError) as ex:
-            msg = "Couldn't retrieve dockerfile: %s" % repr(ex)
-            self.log.error(msg)
-            return msg
+        return self.workflow.builder.dockerfile.content
@@ -0,0 +1,82 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Start caching proxy for yum repos and point baseurls of all yum repos
+collected so far to it (see dock.yum_proxy).
+
+This plugin has to run _AFTER_ all plugins which add yum repos (koji,
+add_yum_repo, add_yum_repo_by_url) and _BEFORE_ yum inject plugin.
+Proxy is stopped and its statistics are reported by postbuild plugin
+yum_cache_proxy_stats.
+
+Example configuration:
+
+{
+    "name": "yum_cache_proxy",
+    "args": {
+        "cache_dir": "/var/cache/dock/yum",
+        "max_size": 10737418240
+    }
+}
+"""
+import os
+
+from dock.constants import DOCK_CACHE_DIR, DOCKER0_ADDRESS
+from dock.plugin import PreBuildPlugin
+from dock.yum_proxy import YumCacheProxy
+
+
+DEFAULT_MAX_SIZE = 10 * 1024 ** 3
+
+
+class YumCacheProxyPlugin(PreBuildPlugin):
+    key = "yum_cache_proxy"
+    can_fail = True  # build works without proxy, only slower
+
+    def __init__(self, tasker, workflow, cache_dir=None, max_size=DEFAULT_MAX_SIZE,
+                 host=DOCKER0_ADDRESS, bind_address=None, port=0):
+        """
+        constructor
+
+        :param tasker: DockerTasker instance
+        :param workflow: DockerBuildWorkflow instance
+        :param cache_dir: str, where packages and repodata are stored
+        :param max_size: int, size cap of the cache in bytes
+        :param host: str, hostname or IP where build containers reach the proxy
+        :param bind_address: str, address where the proxy listens, host by default, so
+                             only containers on the docker bridge reach it; use '0.0.0.0'
+                             to listen on all interfaces
+        :param port: int, port where the proxy listens, random free port by default
+        """
+        # call parent constructor
+        super(YumCacheProxyPlugin, self).__init__(tasker, workflow)
+        self.cache_dir = cache_dir or os.path.join(DOCK_CACHE_DIR, 'yum')
+        self.max_size = max_size
+        self.host = host
+        self.bind_address = bind_address
+        self.port = port
+
+    def run(self):
+        """
+        run the plugin
+        """
+        repos = self.workflow.repos.get('yum', [])
+        if not repos:
+            self.log.info("no yum repos to proxy")
+            return None
+
+        proxy = YumCacheProxy(self.cache_dir, self.max_size, self.host,
+                              bind_address=self.bind_address, port=self.port)
+        proxy.start()
+        self.workflow.yum_cache_proxy = proxy
+
+        for repo in repos:
+            # metalink and mirrorlist point to mirrors which can't be rewritten upfront
+            if 'baseurl' in repo:
+                repo['baseurl'] = proxy.add_upstream(repo['baseurl'])
+        return proxy.url
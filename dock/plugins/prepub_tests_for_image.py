@@ -28,16 +28,54 @@ The test module has to satisfy two conditions:
     2. second value is bool, whether test suite passed
 
 third optional argument of run function is logger (if not specified, all logs are 'print'ed to stdout)
+
+When tests are listed, they are split into shards which run in parallel (workers),
+run function is called once per shard with tests=[...] and results of shards
+are merged (dicts are updated, lists are extended; results of other shapes
+are returned as a dict test -> results). Shards which passed are cached per
+(image ID, commit of test repo, tests), so rerunning tests of the same image is
+free. Test repo is cloned from a local mirror kept in cache_dir.
+
+Shards are threads of the build process; containers are started by the test module
+itself, so shards are isolated from each other this way: every shard gets its own
+instance of the test module and its own results_dir/<test> directory. Test module
+has to be able to run several times at once against one image.
 """
 
-import os
+import hashlib
 import imp
+import json
+import os
+import re
 import shutil
 import tempfile
 
-
+from dock import metrics
+from dock.constants import DOCK_CACHE_DIR
 from dock.plugin import PrePublishPlugin
-from dock.util import LazyGit
+from dock.util import clone_git_repo_cached, thread_pool
+
+
+def merge_results(shard_results):
+    """
+    :param shard_results: list of tuples (test, results of shard)
+    :return: merged results: dict or list if all shards returned dicts or lists,
+             results of the only shard, otherwise dict test -> results
+    """
+    results = [r for _, r in shard_results]
+    if len(results) == 1:
+        return results[0]
+    if all(isinstance(r, dict) for r in results):
+        merged = {}
+        for r in results:
+            merged.update(r)
+        return merged
+    if all(isinstance(r, list) for r in results):
+        merged = []
+        for r in results:
+            merged.extend(r)
+        return merged
+    return dict(shard_results)
 
 
 class ImageTestPlugin(PrePublishPlugin):
@@ -45,7 +83,7 @@ class ImageTestPlugin(PrePublishPlugin):
     can_fail = False
 
     def __init__(self, tasker, workflow, git_uri, git_commit, image_id, tests_git_path="tests.py",
-                 tests = None, results_dir="results", **kwargs):
+                 tests = None, results_dir="results", workers=4, cache_dir=None, **kwargs):
         """
         constructor
 
@@ -54,6 +92,9 @@ class ImageTestPlugin(PrePublishPlugin):
         :param git_uri: str, URI to git repo (URL, path -- this is passed to 'git clone')
         :param image_id: str, ID of image to process
         :param tests_git_path: str, relative path within git repo to file with tests (default=tests.py)
+        :param tests: list of str, tests to run; each one is a shard
+        :param workers: int, how many shards run at once
+        :param cache_dir: str, directory with mirror of test repo and results of passed shards
         :param config_file: str, relative path within git to config file for tests (default=config.json)
         :param kwargs: dict, additional arguments for tests
         """
@@ -65,8 +106,68 @@ class ImageTestPlugin(PrePublishPlugin):
         self.tests_git_path = tests_git_path
         self.tests = tests
         self.results_dir = results_dir
+        self.workers = workers
+        self.cache_dir = cache_dir or os.path.join(DOCK_CACHE_DIR, 'image-tests')
         self.kwargs = kwargs
 
+    def _results_cache_path(self, commit, test):
+        key = json.dumps([self.image_id, commit, test])
+        return os.path.join(self.cache_dir, 'results',
+                            hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+    def load_cached_results(self, commit, test):
+        try:
+            with open(self._results_cache_path(commit, test), 'r') as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def store_results(self, commit, test, results):
+        path = self._results_cache_path(commit, test)
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(results, fp)
+            os.rename(tmp_path, path)
+        except (IOError, OSError, TypeError, ValueError) as ex:
+            # results may not be serializable
+            self.log.warning("can't cache results of '%s': %s", test, repr(ex))
+
+    def load_tests_module(self, git_path, test):
+        """ every shard gets its own instance of the module (module-level state isn't shared) """
+        tests_file = os.path.abspath(os.path.join(git_path, self.tests_git_path))
+        self.log.debug("loading file with tests: '%s'", tests_file)
+        module_name, module_ext = os.path.splitext(os.path.basename(self.tests_git_path))
+        if test is not None:
+            module_name = "%s_%s" % (module_name, re.sub(r'\W', '_', test))
+        return imp.load_source(module_name, tests_file)
+
+    def get_results_dir(self, test):
+        if test is None:
+            return self.results_dir
+        return os.path.join(self.results_dir, re.sub(r'[^\w.-]', '_', test))
+
+    def run_shard(self, git_path, commit, test):
+        """
+        :return: tuple, (results, passed)
+        """
+        cached = self.load_cached_results(commit, test)
+        metrics.record_cache_lookup('image_tests', cached is not None)
+        if cached is not None:
+            self.log.info("test '%s' already passed for image '%s'", test, self.image_id)
+            return cached, True
+        tests = None if test is None else [test]
+        tests_module = self.load_tests_module(git_path, test)
+        results, passed = tests_module.run(image_id=self.image_id, tests=tests,
+                                           git_repo_path=git_path, logger=self.log,
+                                           results_dir=self.get_results_dir(test),
+                                           **self.kwargs)
+        if passed:
+            self.store_results(commit, test, results)
+        return results, passed
+
     def run(self):
         """
         this method will:
@@ -79,18 +180,21 @@ class ImageTestPlugin(PrePublishPlugin):
             self.log.warning("no image_id specified (build probably failed)")
             return
         tmpdir = tempfile.mkdtemp()
-        g = LazyGit(self.git_uri, self.git_commit, tmpdir)
-        with g:
-            tests_file = os.path.abspath(os.path.join(g.git_path, self.tests_git_path))
-            self.log.debug("loading file with tests: '%s'", tests_file)
-            module_name, module_ext = os.path.splitext(self.tests_git_path)
-            tests_module = imp.load_source(module_name, tests_file)
-
-            results, passed = tests_module.run(image_id=self.image_id, tests=self.tests,
-                                               git_repo_path = tmpdir, logger=self.log,
-                                               results_dir=self.results_dir, **self.kwargs)
-
-        shutil.rmtree(tmpdir)
+        try:
+            commit = clone_git_repo_cached(self.git_uri, tmpdir, os.path.join(self.cache_dir, 'git'),
+                                           self.git_commit)
+            shards = self.tests or [None]
+            pool = thread_pool(max(1, min(self.workers, len(shards))))
+            try:
+                shard_results = pool.map(lambda test: self.run_shard(tmpdir, commit, test), shards)
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            shutil.rmtree(tmpdir)
+
+        results = merge_results([(test, r) for test, (r, _) in zip(shards, shard_results)])
+        passed = all(p for _, p in shard_results)
         if not passed:
             self.log.error("tests failed: %s", results)
             raise RuntimeError("Tests didn't pass!")
@@ -0,0 +1,143 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Pre-pulling of popular base images.
+
+Builds record their base images in the usage file of image GC (see
+dock.imagegc). PreWarmer periodically pulls the most used ones, so they are
+present when a build needs them -- on a fresh host or after GC -- and pulls
+them again when the registry has a new digest for the tag.
+
+Pre-warming has low priority: it pulls one image at a time and only when no
+other pull is running or waiting for admission, so it doesn't slow down
+pulls of base images by builds.
+"""
+
+import logging
+import threading
+
+from docker.errors import APIError
+
+from dock import admission, imagegc, metrics, registry
+from dock.util import ImageName
+
+
+logger = logging.getLogger(__name__)
+
+
+PREWARM_PULLS = metrics.counter('dock_prewarm_pulls_total', 'Base images checked by pre-warmer',
+                                ['result'])
+
+
+class PreWarmer(object):
+    def __init__(self, tasker, top=5, interval=3600, window=7 * 24 * 3600, store=None,
+                 insecure=False, controller=None):
+        """
+        :param tasker: DockerTasker instance
+        :param top: int, number of most used base images to keep warm
+        :param interval: float, seconds between rounds
+        :param window: float, popularity is counted over this many seconds
+        :param store: ImageUsageStore (default is the host-wide one)
+        :param insecure: bool, allow plain http to registries
+        :param controller: AdmissionController, to find out about other pulls
+        """
+        self.tasker = tasker
+        self.top = top
+        self.interval = interval
+        self.window = window
+        self.store = store
+        self.insecure = insecure
+        self.controller = controller
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _busy(self):
+        """ :return: bool, are other pulls running or waiting? """
+        stats = (self.controller or admission.controller).stats()['pull']
+        return stats['running'] > 0 or stats['waiting'] > 0
+
+    def popular_images(self):
+        """ :return: list of str, names of most used base images """
+        store = self.store or imagegc.usage
+        return [name for name, _ in store.base_image_popularity(self.window)[:self.top]]
+
+    def is_up_to_date(self, image):
+        """
+        :param image: ImageName
+        :return: bool, is image present and does it match the registry?
+        """
+        try:
+            inspect = self.tasker.d.inspect_image(image.to_str())
+        except APIError:
+            return False
+        remote = registry.get_manifest_digest(image, insecure=self.insecure)
+        if remote is None:
+            # registry doesn't tell, image is present: good enough
+            return True
+        return remote in registry.local_digests(inspect, image)
+
+    def warm(self, name):
+        """
+        pull image unless it's up to date
+
+        :param name: str
+        :return: str, 'up-to-date', 'pulled', 'postponed' or 'failed'
+        """
+        image = ImageName.parse(name)
+        if self._busy():
+            result = 'postponed'
+        elif self.is_up_to_date(image):
+            result = 'up-to-date'
+        elif self._busy():
+            result = 'postponed'
+        else:
+            logger.info("pre-pulling base image '%s'", name)
+            try:
+                self.tasker.pull_image(image, insecure=self.insecure)
+            except Exception as ex:
+                logger.warning("pre-pull of '%s' failed: %s", name, repr(ex))
+                result = 'failed'
+            else:
+                result = 'pulled'
+        PREWARM_PULLS.labels(result=result).inc()
+        return result
+
+    def run_once(self):
+        """
+        :return: dict, image name -> result of warm()
+        """
+        results = {}
+        try:
+            names = self.popular_images()
+        except (IOError, OSError) as ex:
+            logger.warning("can't read usage of images: %s", repr(ex))
+            return results
+        for name in names:
+            if self._stop.is_set():
+                break
+            results[name] = self.warm(name)
+        return results
+
+    def _run(self):
+        while not self._stop.is_set():
+            results = self.run_once()
+            # postponed images are tried again soon
+            postponed = 'postponed' in results.values()
+            self._stop.wait(min(self.interval, 60) if postponed else self.interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='prewarm')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
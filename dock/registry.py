@@ -0,0 +1,181 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Lightweight client of docker registry API v2: it asks for digests of manifests
+with HEAD requests, so it's cheap to find out whether an image changed without
+pulling it.
+
+Only anonymous access is supported (bearer tokens are requested anonymously);
+callers should treat None as "don't know" and fall back to pulling/pushing.
+"""
+
+import logging
+import re
+
+import requests
+
+from dock.util import ImageName
+
+
+logger = logging.getLogger(__name__)
+
+
+DOCKER_HUB_REGISTRIES = ('docker.io', 'index.docker.io', 'registry-1.docker.io')
+DOCKER_HUB_API = 'registry-1.docker.io'
+
+MANIFEST_V2 = 'application/vnd.docker.distribution.manifest.v2+json'
+MANIFEST_LIST_V2 = 'application/vnd.docker.distribution.manifest.list.v2+json'
+MANIFEST_V1_SIGNED = 'application/vnd.docker.distribution.manifest.v1+prettyjws'
+MANIFEST_ACCEPT = ', '.join((MANIFEST_V2, MANIFEST_LIST_V2, MANIFEST_V1_SIGNED))
+
+
+def _parse_challenge(header):
+    """
+    'Bearer realm="https://auth.docker.io/token",service="registry.docker.io"'
+    -> {'realm': ..., 'service': ...}
+    """
+    if not header or not header.lower().startswith('bearer '):
+        return None
+    return dict(re.findall(r'(\w+)="([^"]*)"', header))
+
+
+class RegistrySession(object):
+    """ connection to one registry """
+
+    def __init__(self, registry, insecure=False, timeout=30):
+        """
+        :param registry: str, e.g. 'registry.example.com:5000'; None is docker hub
+        :param insecure: bool, allow plain http and unverified https
+        :param timeout: float, seconds
+        """
+        registry = registry or DOCKER_HUB_API
+        if registry in DOCKER_HUB_REGISTRIES:
+            registry = DOCKER_HUB_API
+        self.registry = registry
+        self.insecure = insecure
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._scheme = 'https'
+        self._tokens = {}  # scope -> token
+
+    def _request(self, method, path, headers, scope, data):
+        url = '%s://%s%s' % (self._scheme, self.registry, path)
+        headers = dict(headers)
+        if scope in self._tokens:
+            headers['Authorization'] = 'Bearer ' + self._tokens[scope]
+        return self.session.request(method, url, headers=headers, data=data,
+                                    timeout=self.timeout, verify=not self.insecure)
+
+    def request(self, method, path, headers=None, scope=None, data=None):
+        """
+        :param method: str, HTTP method
+        :param path: str, e.g. '/v2/fedora/manifests/22'
+        :param headers: dict
+        :param scope: str, scope of bearer token, e.g. 'repository:fedora:pull'
+        :param data: bytes, body of request
+        :return: requests.Response
+        """
+        try:
+            response = self._request(method, path, headers or {}, scope, data)
+        except (requests.exceptions.SSLError, requests.exceptions.ConnectionError):
+            if not self.insecure or self._scheme == 'http':
+                raise
+            logger.debug("registry %s doesn't speak https, trying http", self.registry)
+            self._scheme = 'http'
+            response = self._request(method, path, headers or {}, scope, data)
+        if response.status_code == 401 and scope not in self._tokens:
+            challenge = _parse_challenge(response.headers.get('WWW-Authenticate'))
+            if challenge and 'realm' in challenge:
+                params = {'service': challenge.get('service'), 'scope': scope}
+                token_response = self.session.get(challenge['realm'], params=params,
+                                                  timeout=self.timeout)
+                token_response.raise_for_status()
+                body = token_response.json()
+                self._tokens[scope] = body.get('token') or body.get('access_token')
+                response = self._request(method, path, headers or {}, scope, data)
+        return response
+
+    def repository(self, image):
+        """ :return: str, name of repository of image within this registry """
+        return image.to_str(registry=False, tag=False,
+                            explicit_namespace=self.registry == DOCKER_HUB_API)
+
+    def get_manifest_digest(self, image):
+        """
+        :param image: ImageName (registry part is ignored)
+        :return: str, digest of manifest ('sha256:...') or None if the tag doesn't exist
+        """
+        repository = self.repository(image)
+        response = self.request('HEAD', '/v2/%s/manifests/%s' % (repository, image.tag or 'latest'),
+                                headers={'Accept': MANIFEST_ACCEPT},
+                                scope='repository:%s:pull' % repository)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.headers.get('Docker-Content-Digest')
+
+    def put_manifest_tag(self, image, digest):
+        """
+        point tag of image to manifest which is already in the repository; nothing
+        but the manifest is transferred
+
+        :param image: ImageName, repository and the new tag
+        :param digest: str, digest of manifest in the same repository
+        :return: str, digest of the manifest under the new tag
+        """
+        repository = self.repository(image)
+        scope = 'repository:%s:pull,push' % repository
+        response = self.request('GET', '/v2/%s/manifests/%s' % (repository, digest),
+                                headers={'Accept': MANIFEST_ACCEPT}, scope=scope)
+        response.raise_for_status()
+        media_type = response.headers.get('Content-Type', MANIFEST_V2).split(';')[0]
+        response = self.request('PUT', '/v2/%s/manifests/%s' % (repository, image.tag or 'latest'),
+                                headers={'Content-Type': media_type}, scope=scope,
+                                data=response.content)
+        response.raise_for_status()
+        return response.headers.get('Docker-Content-Digest')
+
+
+def get_manifest_digest(image, insecure=False, timeout=30):
+    """
+    ask registry for digest of image; errors are logged, not raised
+
+    :param image: ImageName or str, with registry (none is docker hub)
+    :param insecure: bool
+    :param timeout: float, seconds
+    :return: str, digest, or None if it's unknown
+    """
+    if not isinstance(image, ImageName):
+        image = ImageName.parse(image)
+    try:
+        return RegistrySession(image.registry, insecure=insecure,
+                               timeout=timeout).get_manifest_digest(image)
+    except (requests.exceptions.RequestException, ValueError) as ex:
+        logger.warning("can't get digest of '%s' from registry: %s", image, repr(ex))
+        return None
+
+
+def _repository_key(image):
+    if image.registry in DOCKER_HUB_REGISTRIES:
+        image = image.copy(registry=None)
+    return image.to_str(tag=False)
+
+
+def local_digests(inspect, image):
+    """
+    :param inspect: dict, output of docker inspect of local image
+    :param image: ImageName
+    :return: set of str, digests under which the image is known in image's repository
+    """
+    repository = _repository_key(image)
+    digests = set()
+    for repo_digest in inspect.get('RepoDigests') or []:
+        name, _, digest = repo_digest.partition('@')
+        if _repository_key(ImageName.parse(name)) == repository:
+            digests.add(digest)
+    return digests
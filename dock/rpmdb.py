@@ -0,0 +1,371 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Query RPM database of an image without running a container.
+
+Only files from /var/lib/rpm are extracted from image layers (image tarball is
+streamed, it is never unpacked as a whole), layers are applied on top of each
+other (whiteouts included) and the resulting database is queried with rpm on
+the host. rpm on the host has to be able to read the database format of the image.
+"""
+
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+
+from dock.cache import LRUCache
+
+
+logger = logging.getLogger(__name__)
+
+
+RPMDB_PATH = 'var/lib/rpm'
+RPM_QUERY_FORMAT = '%{NAME},%{VERSION},%{RELEASE},%{ARCH},%{EPOCH},%{SIZE},%{SIGMD5},%{BUILDTIME}\n'
+WHITEOUT_PREFIX = '.wh.'
+WHITEOUT_OPAQUE = WHITEOUT_PREFIX + WHITEOUT_PREFIX + '.opq'
+
+# top layer ID -> list of str (output of rpm -qa); 'dock serve' keeps running for long
+_packages_cache = LRUCache(maxsize=64)
+
+
+class LayerRPMDB(object):
+    """ content of rpm database within one image layer """
+
+    def __init__(self, layer_id, path):
+        self.layer_id = layer_id
+        self.path = path  # directory with files extracted from this layer
+        self.parent = None
+        self.whiteouts = []  # file names removed by this layer
+        self.opaque = False  # this layer hides whole database of lower layers
+
+
+def _normalize_member_name(name):
+    if name.startswith('./'):
+        name = name[2:]
+    return name.lstrip('/')
+
+
+def _extract_layer_rpmdb(layer_fileobj, layer):
+    """
+    read layer tarball sequentially and extract only rpm database
+
+    :param layer_fileobj: file-like object, layer.tar
+    :param layer: LayerRPMDB
+    """
+    rpmdb_whiteout = os.path.join(os.path.dirname(RPMDB_PATH),
+                                  WHITEOUT_PREFIX + os.path.basename(RPMDB_PATH))
+    layer_tar = tarfile.open(fileobj=layer_fileobj, mode='r|')
+    try:
+        for member in layer_tar:
+            name = _normalize_member_name(member.name)
+            if name == rpmdb_whiteout:
+                layer.opaque = True
+                continue
+            if os.path.dirname(name) != RPMDB_PATH:
+                continue
+            file_name = os.path.basename(name)
+            if file_name == WHITEOUT_OPAQUE:
+                layer.opaque = True
+            elif file_name.startswith(WHITEOUT_PREFIX):
+                layer.whiteouts.append(file_name[len(WHITEOUT_PREFIX):])
+            elif member.isfile():
+                source = layer_tar.extractfile(member)
+                with open(os.path.join(layer.path, file_name), 'wb') as target:
+                    shutil.copyfileobj(source, target)
+    finally:
+        layer_tar.close()
+
+
+def _order_layers(layers, layer_order=None):
+    """
+    sort layers from the base one to the top one
+
+    :param layers: dict, layer ID -> LayerRPMDB
+    :param layer_order: list of layer IDs (from manifest.json), or None
+    :return: list of LayerRPMDB
+    """
+    if layer_order:
+        return [layers[layer_id] for layer_id in layer_order if layer_id in layers]
+    parents = set(layer.parent for layer in layers.values())
+    tops = [layer for layer_id, layer in layers.items() if layer_id not in parents]
+    if len(tops) != 1:
+        raise RuntimeError("can't figure out top layer of image: %s" % [l.layer_id for l in tops])
+    ordered = []
+    layer = tops[0]
+    while layer is not None:
+        ordered.append(layer)
+        layer = layers.get(layer.parent)
+    ordered.reverse()
+    return ordered
+
+
+def extract_rpmdb(image_stream, target_dir):
+    """
+    extract rpm database from image tarball (output of 'docker save')
+
+    :param image_stream: file-like object, image tarball, read sequentially
+    :param target_dir: str, directory where the database is put
+    :return: str, target_dir
+    """
+    workdir = tempfile.mkdtemp()
+    layers = {}
+    layer_order = None
+
+    def get_layer(layer_id):
+        try:
+            return layers[layer_id]
+        except KeyError:
+            layer_path = os.path.join(workdir, layer_id)
+            os.mkdir(layer_path)
+            layer = layers[layer_id] = LayerRPMDB(layer_id, layer_path)
+            return layer
+
+    try:
+        image_tar = tarfile.open(fileobj=image_stream, mode='r|')
+        try:
+            for member in image_tar:
+                name = _normalize_member_name(member.name)
+                layer_id, _, file_name = name.partition('/')
+                if name == 'manifest.json':
+                    manifest = json.loads(image_tar.extractfile(member).read().decode('utf-8'))
+                    layer_order = [os.path.dirname(l) for l in manifest[0]['Layers']]
+                elif file_name == 'json':
+                    layer_json = json.loads(image_tar.extractfile(member).read().decode('utf-8'))
+                    get_layer(layer_id).parent = layer_json.get('parent', None)
+                elif file_name == 'layer.tar':
+                    logger.debug("reading rpm database from layer '%s'", layer_id)
+                    _extract_layer_rpmdb(image_tar.extractfile(member), get_layer(layer_id))
+        finally:
+            image_tar.close()
+
+        if not os.path.isdir(target_dir):
+            os.makedirs(target_dir)
+        for layer in _order_layers(layers, layer_order):
+            if layer.opaque:
+                for file_name in os.listdir(target_dir):
+                    os.remove(os.path.join(target_dir, file_name))
+            for file_name in layer.whiteouts:
+                try:
+                    os.remove(os.path.join(target_dir, file_name))
+                except OSError:
+                    pass
+            for file_name in os.listdir(layer.path):
+                shutil.move(os.path.join(layer.path, file_name),
+                            os.path.join(target_dir, file_name))
+    finally:
+        shutil.rmtree(workdir)
+    return target_dir
+
+
+def query_rpmdb(dbpath, query_format=RPM_QUERY_FORMAT):
+    """
+    run 'rpm -qa' against provided database
+
+    :param dbpath: str, path to directory with rpm database
+    :param query_format: str, see 'man rpm', --queryformat
+    :return: list of str
+    """
+    logger.debug("querying rpm database '%s'", dbpath)
+    command = ["rpm", "--dbpath", dbpath, "-qa", "--qf", query_format]
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, error = proc.communicate()
+    if proc.returncode != 0:
+        logger.error("rpm query failed: %s", error)
+        raise RuntimeError("rpm query failed with exit code %s" % proc.returncode)
+    return [line for line in output.decode("utf-8").split('\n') if line]
+
+
+def run_rpm_in_container(tasker, image_id, query_format=RPM_QUERY_FORMAT):
+    """
+    run 'rpm -qa' inside a container created from provided image
+
+    :param tasker: DockerTasker instance
+    :param image_id: str or ImageName, image to query
+    :param query_format: str, see 'man rpm', --queryformat
+    :return: list of str
+    """
+    container_id = tasker.run(
+        image_id,
+        command="-qa --qf '%s'" % query_format,
+        create_kwargs={"entrypoint": "/bin/rpm"},
+        start_kwargs={},
+    )
+    tasker.wait(container_id)
+    output = tasker.logs(container_id, stream=False)
+    tasker.remove_container(container_id)
+    return output
+
+
+def query_image_rpmdb(tasker, image_id):
+    """
+    extract rpm database from provided image and run 'rpm -qa' against it
+
+    :param tasker: DockerTasker instance
+    :param image_id: str or ImageName, image to query
+    :return: list of str
+    """
+    dbpath = tempfile.mkdtemp()
+    try:
+        image_stream = tasker.get_image(image_id)
+        try:
+            extract_rpmdb(image_stream, dbpath)
+        finally:
+            image_stream.close()
+        return query_rpmdb(dbpath)
+    finally:
+        shutil.rmtree(dbpath)
+
+
+def get_rpm_packages(tasker, image_id, extract=True, cache_dir=None):
+    """
+    list packages installed in provided image; result is cached per top layer ID
+
+    :param tasker: DockerTasker instance
+    :param image_id: str or ImageName, image to query
+    :param extract: bool, extract rpm database from image instead of running rpm in container
+    :param cache_dir: str, directory where results are persisted for other processes (optional)
+    :return: list of str, one line per package, see RPM_QUERY_FORMAT
+    """
+    top_layer_id = tasker.inspect_image(image_id)['Id']
+    packages = _packages_cache.get(top_layer_id)
+    if packages is not None:
+        logger.info("rpm packages of layer '%s' found in cache", top_layer_id)
+        return packages
+
+    cache_path = None
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, "%s.json" % top_layer_id)
+        try:
+            with open(cache_path, 'r') as cache_fp:
+                packages = json.load(cache_fp)
+        except (IOError, OSError, ValueError):
+            packages = None
+        else:
+            logger.info("rpm packages of layer '%s' loaded from '%s'", top_layer_id, cache_path)
+
+    if packages is None:
+        if extract:
+            packages = query_image_rpmdb(tasker, image_id)
+        else:
+            packages = run_rpm_in_container(tasker, image_id)
+        if cache_path:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, 'w') as cache_fp:
+                json.dump(packages, cache_fp)
+            os.rename(tmp_path, cache_path)
+
+    _packages_cache.set(top_layer_id, packages)
+    return packages
+
+
+def _convert_optional(value, convert):
+    if value == '(none)':
+        return None
+    return convert(value)
+
+
+def _identity(value):
+    return value
+
+
+# column name -> conversion function for output of rpm (see RPM_QUERY_FORMAT)
+PACKAGE_COLUMNS = (
+    ('name', _identity),
+    ('version', _identity),
+    ('release', _identity),
+    ('arch', _identity),
+    ('epoch', int),
+    ('size', int),
+    ('sigmd5', _identity),
+    ('buildtime', int),
+)
+PACKAGE_COLUMN_NAMES = tuple(name for name, _ in PACKAGE_COLUMNS)
+
+
+def _empty_table():
+    return dict((name, []) for name in PACKAGE_COLUMN_NAMES)
+
+
+def _append_row(table, row):
+    for name, value in zip(PACKAGE_COLUMN_NAMES, row):
+        table[name].append(value)
+
+
+def _iter_rows(table):
+    return zip(*[table[name] for name in PACKAGE_COLUMN_NAMES])
+
+
+def create_package_table(rpm_output):
+    """
+    turn output of 'rpm -qa' into columnar table sorted by (name, arch)
+
+      {"name": ["bash", ...], "version": ["4.3.39", ...], ..., "epoch": [None, ...]}
+
+    epoch, size and buildtime are ints ('(none)' is turned into None)
+
+    :param rpm_output: list of str, lines formatted with RPM_QUERY_FORMAT
+    :return: dict, column name -> list of values
+    """
+    rows = []
+    for line in rpm_output:
+        fields = line.strip().split(',')
+        if len(fields) != len(PACKAGE_COLUMNS):
+            logger.warning("unexpected rpm output, skipping: '%s'", line)
+            continue
+        rows.append(tuple(_convert_optional(value, convert)
+                          for value, (_, convert) in zip(fields, PACKAGE_COLUMNS)))
+    rows.sort(key=lambda row: (row[0], row[3]))
+    table = _empty_table()
+    for row in rows:
+        _append_row(table, row)
+    return table
+
+
+def format_package_table(table):
+    """
+    inverse of create_package_table
+
+    :param table: dict, columnar package table
+    :return: list of str, lines formatted with RPM_QUERY_FORMAT (without newline)
+    """
+    return [",".join("(none)" if value is None else str(value) for value in row)
+            for row in _iter_rows(table)]
+
+
+def diff_package_tables(base_table, table):
+    """
+    compare package tables of base image and built image; packages are
+    identified by (name, arch)
+
+    :param base_table: dict, columnar package table of base image
+    :param table: dict, columnar package table of built image
+    :return: dict with keys 'added', 'changed' (rows of built image) and
+             'removed' (rows of base image), each a columnar package table
+    """
+    def index(t):
+        return dict(((row[0], row[3]), row) for row in _iter_rows(t))
+
+    base_rows = index(base_table)
+    rows = index(table)
+    diff = {'added': _empty_table(), 'changed': _empty_table(), 'removed': _empty_table()}
+    for key in sorted(rows):
+        row = rows[key]
+        base_row = base_rows.get(key, None)
+        if base_row is None:
+            _append_row(diff['added'], row)
+        elif base_row != row:
+            _append_row(diff['changed'], row)
+    for key in sorted(set(base_rows) - set(rows)):
+        _append_row(diff['removed'], base_rows[key])
+    return diff
@@ -0,0 +1,282 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Scheduling of queued builds.
+
+Scheduler is a drop-in replacement of dock.daemon.JobQueue. Every job has a
+priority class and an owner; the next job is picked like this:
+
+ 1. class: the one with highest effective priority of its oldest job, where
+    effective priority = priority of class + aging_rate * seconds in queue;
+    so batch builds get their turn eventually, even if urgent ones keep coming
+ 2. owner: within the class, the owner with smallest usage / weight, where usage
+    is decayed build time of finished jobs plus build time of running ones;
+    one team's rebuild of hundreds of images doesn't starve others
+ 3. job: FIFO within owner
+
+Only queued jobs are ever preempted, running builds are left alone: higher
+priority jobs overtake queued ones and, when the queue is full (max_queued),
+a new job pushes the lowest ranked queued job out of the queue.
+"""
+
+import logging
+import math
+import threading
+import time
+
+from dock import metrics
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python 2.6
+    from ordereddict import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+SCHEDULER_QUEUE_SECONDS = metrics.histogram('dock_scheduler_queue_seconds',
+                                            'Time jobs waited in queue per priority class',
+                                            ['priority'])
+SCHEDULER_RUN_SECONDS = metrics.histogram('dock_scheduler_run_seconds',
+                                          'Time jobs ran per priority class', ['priority'])
+SCHEDULER_PREEMPTED = metrics.counter('dock_scheduler_preempted_total',
+                                      'Queued jobs pushed out of full queue', ['priority'])
+
+DEFAULT_PRIORITY_CLASSES = {
+    'urgent': 100,
+    'normal': 50,
+    'batch': 0,
+}
+DEFAULT_PRIORITY = 'normal'
+DEFAULT_OWNER = 'default'
+
+
+class QueueFullError(RuntimeError):
+    """ queue is full and the job doesn't outrank any queued job """
+
+
+class Scheduler(object):
+    """
+    priority and fair-share queue of jobs; jobs need attributes priority, owner and created
+    """
+
+    def __init__(self, priority_classes=None, owner_weights=None, aging_rate=0.1,
+                 usage_half_life=3600, max_queued=None, clock=time.time):
+        """
+        :param priority_classes: dict, name of class -> priority (higher is served first)
+        :param owner_weights: dict, owner -> weight (default 1); owner with weight 2 gets
+                              twice the build time of owner with weight 1
+        :param aging_rate: float, priority gained by every second in queue
+        :param usage_half_life: float, seconds after which past usage of owner counts half
+        :param max_queued: int, capacity of queue, None for unlimited
+        :param clock: function returning current time in seconds
+        """
+        self.priority_classes = priority_classes or DEFAULT_PRIORITY_CLASSES
+        self.owner_weights = owner_weights or {}
+        self.aging_rate = aging_rate
+        self.usage_half_life = usage_half_life
+        self.max_queued = max_queued
+        self.clock = clock
+        # class -> owner -> list of jobs
+        self._queues = dict((name, OrderedDict()) for name in self.priority_classes)
+        self._running = {}  # job -> start time
+        self._usage = {}  # owner -> (usage in seconds, time of last update)
+        self._stats = dict((name, {'started': 0, 'wait_seconds': 0.0,
+                                   'finished': 0, 'run_seconds': 0.0})
+                           for name in self.priority_classes)
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def _job_class(self, job):
+        priority = getattr(job, 'priority', None) or DEFAULT_PRIORITY
+        if priority not in self.priority_classes:
+            raise ValueError("unknown priority class '%s', choose from %s" %
+                             (priority, sorted(self.priority_classes)))
+        return priority
+
+    @staticmethod
+    def _job_owner(job):
+        return getattr(job, 'owner', None) or DEFAULT_OWNER
+
+    def effective_priority(self, job, now=None):
+        now = self.clock() if now is None else now
+        return (self.priority_classes[self._job_class(job)] +
+                self.aging_rate * max(0.0, now - job.created))
+
+    def _usage_of(self, owner, now):
+        usage, updated = self._usage.get(owner, (0.0, now))
+        usage *= math.pow(0.5, (now - updated) / float(self.usage_half_life))
+        for job, started in self._running.items():
+            if self._job_owner(job) == owner:
+                # running job counts at least one second, so concurrent starts spread
+                usage += max(1.0, now - started)
+        return usage
+
+    def share(self, owner, now=None):
+        """
+        :return: float, usage of owner divided by its weight; smaller goes first
+        """
+        now = self.clock() if now is None else now
+        return self._usage_of(owner, now) / float(self.owner_weights.get(owner, 1))
+
+    def _queued(self):
+        for owners in self._queues.values():
+            for jobs in owners.values():
+                for job in jobs:
+                    yield job
+
+    def _pick(self, now):
+        best_class, best_priority = None, None
+        for name, owners in self._queues.items():
+            if not owners:
+                continue
+            oldest = min((jobs[0] for jobs in owners.values()), key=lambda j: j.created)
+            priority = self.effective_priority(oldest, now)
+            if best_priority is None or priority > best_priority:
+                best_class, best_priority = name, priority
+        if best_class is None:
+            return None
+        owners = self._queues[best_class]
+        owner = min(owners, key=lambda o: (self.share(o, now), owners[o][0].created))
+        return owners[owner][0]
+
+    def _remove(self, job):
+        owners = self._queues[self._job_class(job)]
+        jobs = owners.get(self._job_owner(job))
+        if not jobs or job not in jobs:
+            return False
+        jobs.remove(job)
+        if not jobs:
+            del owners[self._job_owner(job)]
+        return True
+
+    def put(self, job):
+        """
+        :param job: BuildJob
+        :return: list of jobs pushed out of the queue to make place for this one
+        """
+        job_class = self._job_class(job)
+        owner = self._job_owner(job)
+        preempted = []
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("queue is closed")
+            if self.max_queued is not None and len(self) >= self.max_queued:
+                now = self.clock()
+                victim = min(self._queued(),
+                             key=lambda j: (self.effective_priority(j, now), -j.created))
+                if self.effective_priority(victim, now) >= self.effective_priority(job, now):
+                    raise QueueFullError("queue is full (%d jobs)" % self.max_queued)
+                self._remove(victim)
+                SCHEDULER_PREEMPTED.labels(priority=self._job_class(victim)).inc()
+                logger.info("job %s preempted by job %s", victim.id, job.id)
+                preempted.append(victim)
+            self._queues[job_class].setdefault(owner, []).append(job)
+            self._cond.notify()
+        return preempted
+
+    def get(self, timeout=None):
+        """
+        :param timeout: float, seconds; None waits until job comes or queue is closed
+        :return: job or None (queue was closed or timeout expired)
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while not self._closed:
+                now = self.clock()
+                job = self._pick(now)
+                if job is not None:
+                    self._remove(job)
+                    self._running[job] = now
+                    job_class = self._job_class(job)
+                    waited = now - job.created
+                    self._stats[job_class]['started'] += 1
+                    self._stats[job_class]['wait_seconds'] += waited
+                    SCHEDULER_QUEUE_SECONDS.labels(priority=job_class).observe(waited)
+                    return job
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining if remaining is not None else 1.0)
+            return None
+
+    def done(self, job):
+        """ job returned by get() finished; account its build time to its owner """
+        with self._cond:
+            started = self._running.pop(job, None)
+            if started is None:
+                return
+            now = self.clock()
+            owner = self._job_owner(job)
+            usage, updated = self._usage.get(owner, (0.0, now))
+            usage *= math.pow(0.5, (now - updated) / float(self.usage_half_life))
+            self._usage[owner] = (usage + now - started, now)
+            job_class = self._job_class(job)
+            self._stats[job_class]['finished'] += 1
+            self._stats[job_class]['run_seconds'] += now - started
+            SCHEDULER_RUN_SECONDS.labels(priority=job_class).observe(now - started)
+
+    def remove(self, job):
+        """
+        :return: bool, whether the job was waiting in queue
+        """
+        with self._cond:
+            return self._remove(job)
+
+    def close(self):
+        """ wake up all waiting workers, get() returns None from now on """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def jobs(self):
+        """
+        :return: list of queued jobs, the one which would be started now comes first
+        """
+        with self._cond:
+            queued = list(self._queued())
+            now = self.clock()
+            result = []
+            # simulate picking without touching usage of owners
+            queues, self._queues = self._queues, dict(
+                (name, OrderedDict((o, list(jobs)) for o, jobs in owners.items()))
+                for name, owners in self._queues.items())
+            try:
+                for _ in queued:
+                    job = self._pick(now)
+                    self._remove(job)
+                    result.append(job)
+            finally:
+                self._queues = queues
+            return result
+
+    def stats(self):
+        """
+        :return: dict, priority class -> counts of queued, running, started and finished
+                 jobs and mean wait and run time in seconds
+        """
+        with self._cond:
+            result = {}
+            for name, stats in self._stats.items():
+                result[name] = {
+                    'queued': sum(len(jobs) for jobs in self._queues[name].values()),
+                    'running': len([j for j in self._running if self._job_class(j) == name]),
+                    'started': stats['started'],
+                    'finished': stats['finished'],
+                    'mean_wait_seconds': stats['wait_seconds'] / stats['started']
+                    if stats['started'] else None,
+                    'mean_run_seconds': stats['run_seconds'] / stats['finished']
+                    if stats['finished'] else None,
+                }
+            return result
+
+    def __len__(self):
+        with self._cond:
+            return sum(len(jobs) for owners in self._queues.values() for jobs in owners.values())
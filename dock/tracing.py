@@ -0,0 +1,272 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Tracing of builds: nested timed spans exported as Chrome trace events
+(https://github.com/catapult-project/catapult/wiki/Trace-Event-Format), the
+file can be opened in chrome://tracing, Perfetto UI or speedscope.
+
+Tracing is off by default and span() costs nothing then:
+
+    tracing.tracer.enable()
+    with tracing.span('pull', image='fedora:22'):
+        ...
+    tracing.tracer.write('trace.json')
+
+Trace spans processes: BuildManager puts context of its span into build.json
+(key 'trace_context'), build_inside continues the trace within build container
+and writes its events to the shared dir, BuildManager merges them when the
+container finishes.
+"""
+
+import functools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import types
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+TRACE_CONTEXT_KEY = 'trace_context'
+
+try:
+    # py2
+    string_types = basestring
+except NameError:
+    # py3
+    string_types = str
+
+
+def _new_id():
+    return uuid.uuid4().hex[:16]
+
+
+def _now_us():
+    # wall clock: processes in containers share it with host, so their events line up
+    return int(time.time() * 1000000)
+
+
+class Span(object):
+    def __init__(self, name, category, parent_id, attributes):
+        self.name = name
+        self.category = category
+        self.span_id = _new_id()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.thread_id = threading.current_thread().ident
+        self.start = _now_us()
+        self.end = None
+        self.open = False  # span() doesn't finish it, finish_span() has to be called
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_event(self, pid):
+        args = dict(self.attributes)
+        args['span_id'] = self.span_id
+        if self.parent_id:
+            args['parent_id'] = self.parent_id
+        return {
+            'name': self.name,
+            'cat': self.category,
+            'ph': 'X',
+            'ts': self.start,
+            'dur': (self.end or _now_us()) - self.start,
+            'pid': pid,
+            'tid': self.thread_id,
+            'args': args,
+        }
+
+
+class _NoopSpan(object):
+    span_id = None
+
+    def set_attribute(self, key, value):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer(object):
+    def __init__(self, process_name='dock'):
+        self.enabled = False
+        self.process_name = process_name
+        self.trace_id = None
+        self.remote_parent_id = None  # span of other process which started this one
+        self._lock = threading.Lock()
+        self._events = []
+        self._local = threading.local()
+
+    def enable(self, trace_context=None, process_name=None):
+        """
+        start recording spans
+
+        :param trace_context: dict, context of parent process (see get_context())
+        :param process_name: str, name of this process in the trace
+        """
+        trace_context = trace_context or {}
+        self.trace_id = trace_context.get('trace_id') or uuid.uuid4().hex
+        self.remote_parent_id = trace_context.get('parent_id')
+        if process_name:
+            self.process_name = process_name
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        with self._lock:
+            self._events = []
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current_span_id(self):
+        stack = self._stack()
+        return stack[-1].span_id if stack else self.remote_parent_id
+
+    def get_context(self):
+        """
+        :return: dict, context to pass into child process, None when tracing is off
+        """
+        if not self.enabled:
+            return None
+        return {'trace_id': self.trace_id, 'parent_id': self.current_span_id()}
+
+    @contextmanager
+    def span(self, name, category='dock', **attributes):
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+        span = Span(name, category, self.current_span_id(), attributes)
+        stack = self._stack()
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as ex:
+            span.set_attribute('error', repr(ex))
+            raise
+        finally:
+            stack.pop()
+            if not span.open:
+                self.finish_span(span)
+
+    def finish_span(self, span):
+        """ record span; span() does it when its block ends """
+        span.end = _now_us()
+        event = span.to_event(os.getpid())
+        with self._lock:
+            self._events.append(event)
+
+    def add_events(self, events):
+        """ merge events recorded by other process """
+        with self._lock:
+            self._events.extend(events)
+
+    def get_events(self):
+        with self._lock:
+            events = list(self._events)
+        metadata = {'name': 'process_name', 'ph': 'M', 'pid': os.getpid(),
+                    'args': {'name': self.process_name}}
+        return [metadata] + sorted(events, key=lambda e: e.get('ts', 0))
+
+    def to_chrome_trace(self):
+        return {
+            'traceEvents': self.get_events(),
+            'displayTimeUnit': 'ms',
+            'otherData': {'trace_id': self.trace_id},
+        }
+
+    def write(self, path):
+        """
+        write trace as json file (atomically)
+
+        :param path: str
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.trace-')
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(self.to_chrome_trace(), fp)
+            os.rename(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        logger.debug("trace written to '%s'", path)
+
+
+def load_events(path):
+    """
+    :param path: str, trace written by Tracer.write
+    :return: list of events
+    """
+    with open(path, 'r') as fp:
+        return json.load(fp)['traceEvents']
+
+
+tracer = Tracer()
+
+
+def span(name, category='dock', **attributes):
+    """ context manager: span in the process-wide tracer """
+    return tracer.span(name, category=category, **attributes)
+
+
+def _describe(value):
+    value = value.to_str() if hasattr(value, 'to_str') else value
+    return str(value)[:200]
+
+
+def _finish_when_consumed(generator, span):
+    try:
+        for item in generator:
+            yield item
+    except GeneratorExit:
+        # consumer stopped early
+        raise
+    except BaseException as ex:
+        span.set_attribute('error', repr(ex))
+        raise
+    finally:
+        tracer.finish_span(span)
+
+
+def traced(category='dock'):
+    """
+    decorator: run method within span named '<class>.<method>'; string arguments
+    (and image names) are recorded as attributes
+
+    when the method returns generator (streamed docker output), span ends when
+    iteration over the generator ends, not when the method returns
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not tracer.enabled:
+                return func(self, *args, **kwargs)
+            attributes = dict(('arg%d' % i, _describe(a)) for i, a in enumerate(args)
+                              if isinstance(a, string_types) or hasattr(a, 'to_str'))
+            with tracer.span('%s.%s' % (self.__class__.__name__, func.__name__),
+                             category=category, **attributes) as span:
+                result = func(self, *args, **kwargs)
+                if isinstance(result, types.GeneratorType):
+                    span.open = True
+            if isinstance(result, types.GeneratorType):
+                return _finish_when_consumed(result, span)
+            return result
+        return wrapper
+    return decorator
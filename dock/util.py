@@ -8,57 +8,99 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import print_function, unicode_literals
 
+import fcntl
+import hashlib
 import json
 import os
 import re
 import shutil
 import tempfile
+import threading
 import logging
-import git
+from dock import metrics
+from dock.cache import LRUCache
 from dock.constants import DOCKERFILE_FILENAME
+from dock.dockerfile import Dockerfile
 
 __author__ = 'ttomecek'
 
 logger = logging.getLogger(__name__)
 
+GIT_CLONE_SECONDS = metrics.histogram('dock_git_clone_seconds', 'Time spent cloning git repositories',
+                                      ['method'])
+
 
 class ImageName(object):
+    """
+    name of docker image: registry.org/namespace/repo:tag
+
+    instances are immutable (so they can be used as keys of dicts and in sets),
+    use copy() to get modified name:
+
+        image_name.copy(registry='registry.example.com')
+    """
+    __slots__ = ('registry', 'namespace', 'repo', 'tag', '_str_cache')
+
+    # image name -> ImageName, names of images are parsed over and over
+    _parse_cache = LRUCache(maxsize=1024)
+
     def __init__(self, registry=None, namespace=None, repo=None, tag=None):
-        self.registry = registry
-        self.namespace = namespace
-        self.repo = repo
-        self.tag = tag
+        object.__setattr__(self, 'registry', registry)
+        object.__setattr__(self, 'namespace', namespace)
+        object.__setattr__(self, 'repo', repo)
+        object.__setattr__(self, 'tag', tag)
+        object.__setattr__(self, '_str_cache', {})
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ImageName is immutable, use copy(%s=...)" % name)
+
+    def __delattr__(self, name):
+        raise AttributeError("ImageName is immutable")
 
     @classmethod
     def parse(cls, image_name):
-        result = cls()
+        result = cls._parse_cache.get((cls, image_name))
+        if result is None:
+            result = cls._parse(image_name)
+            cls._parse_cache.set((cls, image_name), result)
+        return result
+
+    @classmethod
+    def _parse(cls, image_name):
+        registry = namespace = tag = None
 
         # registry.org/namespace/repo:tag
         s = image_name.split('/', 2)
 
         if len(s) == 2:
             if '.' in s[0] or ':' in s[0]:
-                result.registry = s[0]
+                registry = s[0]
             else:
-                result.namespace = s[0]
+                namespace = s[0]
         elif len(s) == 3:
-            result.registry = s[0]
-            result.namespace = s[1]
-        if result.namespace == 'library':
+            registry = s[0]
+            namespace = s[1]
+        if namespace == 'library':
             # https://github.com/DBuildService/dock/issues/45
             logger.debug("namespace 'library' -> ''")
-            result.namespace = None
-        result.repo = s[-1]
+            namespace = None
+        repo = s[-1]
 
         try:
-            result.repo, result.tag = result.repo.rsplit(':', 1)
+            repo, tag = repo.rsplit(':', 1)
         except ValueError:
             pass
 
-        return result
+        return cls(registry=registry, namespace=namespace, repo=repo, tag=tag)
 
     def to_str(self, registry=True, tag=True, explicit_tag=False,
                explicit_namespace=False):
+        key = (registry, tag, explicit_tag, explicit_namespace)
+        try:
+            return self._str_cache[key]
+        except KeyError:
+            pass
+
         if self.repo is None:
             raise RuntimeError('No image repository specified')
 
@@ -77,27 +119,46 @@ class ImageName(object):
         if registry and self.registry:
             result = '{0}/{1}'.format(self.registry, result)
 
+        self._str_cache[key] = result
         return result
 
+    def _key(self):
+        return (self.registry, self.namespace, self.repo, self.tag)
+
     def __str__(self):
         return self.to_str(registry=True, tag=True)
 
+    def __repr__(self):
+        return "ImageName(registry=%r, namespace=%r, repo=%r, tag=%r)" % self._key()
+
     def __eq__(self, other):
-        return type(self) == type(other) and self.__dict__ == other.__dict__
+        return type(self) == type(other) and self._key() == other._key()
 
-    def copy(self):
-        return ImageName(
-            registry=self.registry,
-            namespace=self.namespace,
-            repo=self.repo,
-            tag=self.tag)
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __reduce__(self):
+        return (type(self), self._key())
+
+    def copy(self, **overrides):
+        """
+        :param overrides: registry, namespace, repo or tag to change
+        :return: ImageName
+        """
+        kwargs = dict(registry=self.registry, namespace=self.namespace,
+                      repo=self.repo, tag=self.tag)
+        for name in overrides:
+            if name not in kwargs:
+                raise TypeError("unexpected argument '%s'" % name)
+        kwargs.update(overrides)
+        return type(self)(**kwargs)
 
 
 def get_baseimage_from_dockerfile_path(path):
-    with open(path, 'r') as dockerfile:
-        for line in dockerfile:
-            if line.startswith("FROM"):
-                return line.split()[1]
+    return Dockerfile(path).baseimage
 
 
 def get_baseimage_from_dockerfile(git_path, path=''):
@@ -191,12 +252,51 @@ def clone_git_repo(git_url, target_dir, commit=None):
     :param commit: str, commit to checkout
     :return:
     """
+    import git  # importing GitPython is slow, don't do it until it's needed
     logger.info("clone git repo")
     logger.debug("url = '%s', dir = '%s', commit = '%s'",
                  git_url, target_dir, commit)
-    repo = git.Repo.clone_from(git_url, target_dir)
-    if commit:
-        repo.git.checkout(commit)
+    with GIT_CLONE_SECONDS.labels(method='clone').time():
+        repo = git.Repo.clone_from(git_url, target_dir)
+        if commit:
+            repo.git.checkout(commit)
+
+
+def clone_git_repo_cached(git_url, target_dir, cache_dir, commit=None):
+    """
+    clone provided git repo to target_dir using local mirror of the repo in cache_dir;
+    mirror is created by the first call and only fetched by the following ones
+
+    :param git_url: str, git repo to clone
+    :param target_dir: str, filesystem path where the repo should be cloned
+    :param cache_dir: str, directory with mirrors
+    :param commit: str, commit to checkout
+    :return: str, commit ID of checked out HEAD
+    """
+    import git
+    mirror_path = os.path.join(cache_dir,
+                               hashlib.sha256(git_url.encode('utf-8')).hexdigest()[:20] + '.git')
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    with GIT_CLONE_SECONDS.labels(method='mirror').time():
+        with open(mirror_path + '.lock', 'w') as lock_fp:
+            # other processes may update the same mirror
+            fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            mirror_exists = os.path.isdir(mirror_path)
+            metrics.record_cache_lookup('git_mirror', mirror_exists)
+            if mirror_exists:
+                logger.info("updating mirror of git repo '%s'", git_url)
+                git.Repo(mirror_path).git.fetch('--prune', 'origin')
+            else:
+                logger.info("creating mirror of git repo '%s'", git_url)
+                git.Repo.clone_from(git_url, mirror_path, mirror=True)
+        logger.debug("url = '%s', mirror = '%s', dir = '%s', commit = '%s'",
+                     git_url, mirror_path, target_dir, commit)
+        # objects are borrowed from the mirror, nothing is copied
+        repo = git.Repo.clone_from(mirror_path, target_dir, shared=True)
+        if commit:
+            repo.git.checkout(commit)
+    return repo.head.commit.hexsha
 
 
 def figure_out_dockerfile(absolute_path, local_path=None):
@@ -240,11 +340,14 @@ class LazyGit(object):
 
         lazy_git = LazyGit(git_url="...", tmpdir=tmp_dir)
         lazy_git.git_path
+
+    when cache_dir is provided, repo is cloned from local mirror (see clone_git_repo_cached)
     """
-    def __init__(self, git_url, commit=None, tmpdir=None):
+    def __init__(self, git_url, commit=None, tmpdir=None, cache_dir=None):
         self.git_url = git_url
         self.commit = commit
         self.provided_tmpdir = tmpdir
+        self.cache_dir = cache_dir
         self._git_path = None
 
     @property
@@ -254,7 +357,10 @@ class LazyGit(object):
     @property
     def git_path(self):
         if self._git_path is None:
-            clone_git_repo(self.git_url, self._tmpdir, self.commit)
+            if self.cache_dir:
+                clone_git_repo_cached(self.git_url, self._tmpdir, self.cache_dir, self.commit)
+            else:
+                clone_git_repo(self.git_url, self._tmpdir, self.commit)
             self._git_path = self._tmpdir
         return self._git_path
 
@@ -266,3 +372,33 @@ class LazyGit(object):
         if not self.provided_tmpdir:
             if self.our_tmpdir:
                 shutil.rmtree(self.our_tmpdir)
+
+
+_thread_context = threading.local()
+
+
+def get_thread_context():
+    """
+    :return: object attached to current thread by set_thread_context(), or None
+    """
+    return getattr(_thread_context, 'value', None)
+
+
+def set_thread_context(value):
+    """
+    attach value to current thread (e.g. job of build daemon which the thread works
+    on, so its logs are routed to the job); threads of thread_pool() inherit it
+    """
+    _thread_context.value = value
+
+
+def thread_pool(processes):
+    """
+    multiprocessing.pool.ThreadPool whose threads inherit context of current thread
+    (see set_thread_context)
+
+    :param processes: int, number of threads
+    """
+    from multiprocessing.pool import ThreadPool
+    return ThreadPool(processes, initializer=set_thread_context,
+                      initargs=(get_thread_context(),))
@@ -0,0 +1,473 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Caching HTTP proxy for yum repositories.
+
+Builds of images download the same packages and repodata over and over. The proxy
+is started within build process, baseurls of injected repos are rewritten to point
+to it and every file is stored on local disk:
+
+ * packages (*.rpm) are immutable: they are served from cache without asking upstream
+ * everything else (repodata) is revalidated with upstream using conditional request
+   (If-None-Match/If-Modified-Since) and served from cache when it's not modified
+
+Files are stored by checksum (sha256), so the same package available in several repos
+is stored once. Store has a size cap, least recently used files are evicted first.
+"""
+
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+import requests
+
+from dock import metrics
+
+try:
+    # py2
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit
+except ImportError:
+    # py3
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit
+
+
+logger = logging.getLogger(__name__)
+
+
+IMMUTABLE_EXTENSIONS = ('.rpm', '.drpm')
+CHUNK_SIZE = 1024 * 1024
+
+
+class CacheStats(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0  # served from cache
+        self.bytes_downloaded = 0  # fetched from upstream
+
+    def record(self, hit, size):
+        metrics.record_cache_lookup('yum_proxy', hit)
+        with self._lock:
+            self.requests += 1
+            if hit:
+                self.hits += 1
+                self.bytes_saved += size
+            else:
+                self.misses += 1
+                self.bytes_downloaded += size
+
+    @property
+    def hit_ratio(self):
+        if not self.requests:
+            return 0.0
+        return float(self.hits) / self.requests
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hit_ratio,
+            'bytes_saved': self.bytes_saved,
+            'bytes_downloaded': self.bytes_downloaded,
+        }
+
+
+class PackageStore(object):
+    """
+    content addressed store on local disk:
+
+      <path>/blobs/<sha256>  -- content; mtime is time of last use
+      <path>/urls/<sha256 of url>.json  -- {"digest": ..., "size": ..., "etag": ..., "last_modified": ...}
+
+    it's safe to share one store between several processes
+    """
+
+    def __init__(self, path, max_size):
+        """
+        :param path: str, directory of the store
+        :param max_size: int, size cap of the store in bytes
+        """
+        self.path = path
+        self.max_size = max_size
+        self.blobs_dir = os.path.join(path, 'blobs')
+        self.urls_dir = os.path.join(path, 'urls')
+        for directory in (self.blobs_dir, self.urls_dir):
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        # digest -> number of requests which are being served from the blob; guards
+        # blobs of this process from eviction (other processes may still evict them)
+        self._pinned = {}
+        self._lock = threading.Lock()
+
+    def _url_entry_path(self, url):
+        url_hash = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.urls_dir, url_hash + '.json')
+
+    def blob_path(self, digest):
+        return os.path.join(self.blobs_dir, digest)
+
+    def pin(self, digest):
+        """ keep blob out of eviction until unpin() is called """
+        with self._lock:
+            self._pinned[digest] = self._pinned.get(digest, 0) + 1
+
+    def unpin(self, digest):
+        with self._lock:
+            count = self._pinned.get(digest, 0) - 1
+            if count > 0:
+                self._pinned[digest] = count
+            else:
+                self._pinned.pop(digest, None)
+
+    def lookup(self, url, pin=False):
+        """
+        :param url: str, upstream URL
+        :param pin: bool, pin the blob if it's stored (caller has to unpin it)
+        :return: dict or None if the content is not stored
+        """
+        try:
+            with open(self._url_entry_path(url), 'r') as fp:
+                entry = json.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+        if pin:
+            self.pin(entry['digest'])
+        if not os.path.isfile(self.blob_path(entry['digest'])):
+            if pin:
+                self.unpin(entry['digest'])
+            return None
+        return entry
+
+    def touch(self, entry):
+        try:
+            os.utime(self.blob_path(entry['digest']), None)
+        except OSError:
+            pass
+
+    def store(self, url, content_path, digest, size, etag=None, last_modified=None, pin=False):
+        """
+        move downloaded file into the store
+
+        :param url: str, upstream URL
+        :param content_path: str, path to downloaded file, it's moved into the store
+        :param digest: str, sha256 of the content
+        :param size: int
+        :param pin: bool, pin the blob (caller has to unpin it)
+        :return: dict, entry
+        """
+        # the blob itself is never evicted right after it was stored
+        self.pin(digest)
+        try:
+            entry = self._store(url, content_path, digest, size, etag, last_modified)
+            self.evict()
+        except Exception:
+            self.unpin(digest)
+            raise
+        if not pin:
+            self.unpin(digest)
+        return entry
+
+    def _store(self, url, content_path, digest, size, etag, last_modified):
+        blob_path = self.blob_path(digest)
+        if os.path.isfile(blob_path):
+            os.remove(content_path)
+            self.touch({'digest': digest})
+        else:
+            os.rename(content_path, blob_path)
+        entry = {
+            'url': url,
+            'digest': digest,
+            'size': size,
+            'etag': etag,
+            'last_modified': last_modified,
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.urls_dir)
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(entry, fp)
+        os.rename(tmp_path, self._url_entry_path(url))
+        return entry
+
+    def evict(self):
+        """
+        remove least recently used blobs until the store fits into its size cap;
+        pinned blobs are kept
+        """
+        with self._lock:
+            blobs = []
+            total_size = 0
+            for digest in os.listdir(self.blobs_dir):
+                try:
+                    st = os.stat(self.blob_path(digest))
+                except OSError:
+                    continue
+                blobs.append((st.st_mtime, st.st_size, digest))
+                total_size += st.st_size
+            blobs.sort()
+            for _, size, digest in blobs:
+                if total_size <= self.max_size:
+                    break
+                if digest in self._pinned:
+                    continue
+                logger.debug("evicting '%s' (%d bytes)", digest, size)
+                try:
+                    os.remove(self.blob_path(digest))
+                except OSError as ex:
+                    if ex.errno != errno.ENOENT:
+                        raise
+                total_size -= size
+
+
+class ProxyRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, fmt, *args):
+        logger.debug("%s - %s", self.address_string(), fmt % args)
+
+    def do_GET(self):
+        self.server.proxy.handle_request(self)
+
+    def do_HEAD(self):
+        self.server.proxy.handle_head_request(self)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class YumCacheProxy(object):
+    """
+    usage:
+
+        proxy = YumCacheProxy(cache_dir, max_size, advertised_host)
+        proxy.start()
+        repo['baseurl'] = proxy.add_upstream(repo['baseurl'])
+        ...
+        proxy.stop()
+        proxy.stats.as_dict()
+    """
+
+    def __init__(self, cache_dir, max_size, advertised_host, bind_address=None, port=0):
+        """
+        :param cache_dir: str, directory with cached files
+        :param max_size: int, size cap of the cache in bytes
+        :param advertised_host: str, hostname or IP where containers reach the proxy
+        :param bind_address: str, address where the proxy listens, advertised_host by
+                             default; proxy isn't authenticated, '0.0.0.0' makes all
+                             upstreams reachable from the whole network
+        :param port: int, port where the proxy listens, 0 picks random free port
+        """
+        self.store = PackageStore(cache_dir, max_size)
+        self.advertised_host = advertised_host
+        self.bind_address = bind_address or advertised_host
+        self.port = port
+        self.stats = CacheStats()
+        self.upstreams = {}  # prefix -> scheme://netloc of upstream
+        self.session = requests.Session()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://%s:%d" % (self.advertised_host, self.port)
+
+    def add_upstream(self, baseurl):
+        """
+        register upstream repo
+
+        :param baseurl: str, baseurl of the repo, it may contain yum variables ($basearch)
+        :return: str, baseurl pointing to the proxy
+        """
+        parsed = urlsplit(baseurl)
+        if parsed.scheme not in ('http', 'https'):
+            logger.info("can't proxy '%s', only http(s) is supported", baseurl)
+            return baseurl
+        upstream = "%s://%s" % (parsed.scheme, parsed.netloc)
+        for prefix, known_upstream in self.upstreams.items():
+            if known_upstream == upstream:
+                break
+        else:
+            prefix = "r%d" % len(self.upstreams)
+            self.upstreams[prefix] = upstream
+        path = baseurl[len(upstream):]
+        proxied = "%s/%s%s" % (self.url, prefix, path)
+        logger.debug("baseurl '%s' -> '%s'", baseurl, proxied)
+        return proxied
+
+    def get_upstream_url(self, path):
+        """
+        :param path: str, path of request to the proxy
+        :return: str, URL of upstream or None if it's not known
+        """
+        prefix, _, rest = path.lstrip('/').partition('/')
+        try:
+            return "%s/%s" % (self.upstreams[prefix], rest)
+        except KeyError:
+            return None
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.bind_address, self.port), ProxyRequestHandler)
+        self._server.proxy = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="yum-cache-proxy")
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info("yum cache proxy is listening on %s:%d, advertised as %s",
+                    self.bind_address, self.port, self.url)
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        stats = self.stats
+        logger.info("yum cache proxy: %d requests, hit ratio %.2f, %d bytes saved, %d bytes downloaded",
+                    stats.requests, stats.hit_ratio, stats.bytes_saved, stats.bytes_downloaded)
+
+    def _download(self, url, response):
+        """ store body of response; checksum is computed while streaming """
+        fd, tmp_path = tempfile.mkstemp(dir=self.store.path)
+        sha256 = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    sha256.update(chunk)
+                    size += len(chunk)
+                    fp.write(chunk)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return self.store.store(url, tmp_path, sha256.hexdigest(), size,
+                                etag=response.headers.get('ETag', None),
+                                last_modified=response.headers.get('Last-Modified', None),
+                                pin=True)
+
+    def fetch(self, url):
+        """
+        get content of provided URL, either from cache or from upstream; blob of
+        returned entry is pinned, caller has to unpin it
+
+        :param url: str, upstream URL
+        :return: tuple, (entry, int status code of upstream)
+        """
+        entry = self.store.lookup(url, pin=True)
+        try:
+            result = self._fetch(url, entry)
+        except Exception:
+            if entry is not None:
+                self.store.unpin(entry['digest'])
+            raise
+        if entry is not None and result[0] is not entry:
+            self.store.unpin(entry['digest'])
+        return result
+
+    def _fetch(self, url, entry):
+        immutable = url.split('?', 1)[0].endswith(IMMUTABLE_EXTENSIONS)
+        if entry is not None and immutable:
+            self.stats.record(True, entry['size'])
+            self.store.touch(entry)
+            return entry, 200
+
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            response = self.session.get(url, headers=headers, stream=True)
+        except requests.exceptions.RequestException as ex:
+            if entry is None:
+                raise
+            logger.warning("can't revalidate '%s', serving cached content: %s", url, repr(ex))
+            self.stats.record(True, entry['size'])
+            return entry, 200
+        try:
+            if response.status_code == 304 and entry is not None:
+                self.stats.record(True, entry['size'])
+                self.store.touch(entry)
+                return entry, 200
+            if response.status_code != 200:
+                return None, response.status_code
+            entry = self._download(url, response)
+            self.stats.record(False, entry['size'])
+            return entry, 200
+        finally:
+            response.close()
+
+    def handle_request(self, handler):
+        url = self.get_upstream_url(handler.path)
+        if url is None:
+            handler.send_error(404)
+            return
+        try:
+            entry, status_code = self.fetch(url)
+        except Exception as ex:
+            logger.error("failed to fetch '%s': %s", url, repr(ex))
+            handler.send_error(502)
+            return
+        if entry is None:
+            handler.send_error(status_code)
+            return
+        try:
+            # open the blob before anything is sent: once it's open, eviction by
+            # other process doesn't break the response
+            try:
+                fp = open(self.store.blob_path(entry['digest']), 'rb')
+            except (IOError, OSError) as ex:
+                logger.error("cached content of '%s' is gone: %s", url, repr(ex))
+                handler.send_error(502)
+                return
+            with fp:
+                handler.send_response(200)
+                handler.send_header('Content-Length', str(os.fstat(fp.fileno()).st_size))
+                handler.end_headers()
+                shutil.copyfileobj(fp, handler.wfile, CHUNK_SIZE)
+        finally:
+            self.store.unpin(entry['digest'])
+
+    def handle_head_request(self, handler):
+        """ answer from cache or ask upstream; nothing is downloaded, stats are untouched """
+        url = self.get_upstream_url(handler.path)
+        if url is None:
+            handler.send_error(404)
+            return
+        entry = self.store.lookup(url)
+        if entry is not None and url.split('?', 1)[0].endswith(IMMUTABLE_EXTENSIONS):
+            status_code, size = 200, entry['size']
+        else:
+            try:
+                response = self.session.head(url, allow_redirects=True)
+            except requests.exceptions.RequestException as ex:
+                logger.error("failed to ask for '%s': %s", url, repr(ex))
+                handler.send_error(502)
+                return
+            response.close()
+            status_code = response.status_code
+            size = response.headers.get('Content-Length', None)
+        if status_code != 200:
+            handler.send_error(status_code)
+            return
+        handler.send_response(200)
+        if size is not None:
+            handler.send_header('Content-Length', str(size))
+        handler.end_headers()
@@ -0,0 +1,385 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Microbenchmarks of dock's own overhead; docker is mocked (see tests/docker_mock.py),
+so only time spent in dock is measured. Push benchmarks talk to fake docker daemon
+(tests/fake_docker.py) which pushes into fake registries (tests/fake_registry.py).
+
+usage:
+
+    # run benchmarks, store results
+    python -m tests.benchmark --output baseline.json
+
+    # run them again and compare with baseline; exit code is 1 on regression
+    # (2 when some benchmark failed, the others still run; see "errors" in output)
+    python -m tests.benchmark --output current.json --compare baseline.json
+
+    # smaller inputs (e.g. 10000 log lines instead of million)
+    python -m tests.benchmark --scale 0.01
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import docker
+import git
+from flexmock import flexmock
+try:
+    from flexmock import flexmock_teardown
+except ImportError:
+    # flexmock >= 0.11
+    from flexmock._api import flexmock_teardown
+
+from dock.build import InsideBuilder
+from dock.core import DockerTasker
+from dock.inner import DockerBuildWorkflow
+from dock.plugin import PreBuildPluginsRunner, PostBuildPluginsRunner, PostBuildPlugin
+from dock.util import ImageName, wait_for_command
+
+from tests.docker_mock import mock_docker, mock_build_logs
+from tests.fake_docker import FakeDocker
+from tests.fake_registry import FakeRegistry
+
+
+DEFAULT_THRESHOLD = 0.2
+
+BENCHMARKS = []
+
+
+def benchmark(repeat=5, number=1):
+    """
+    register benchmark; decorated function gets scale (float) and returns function
+    to measure (setup is done before returning it, so it's not measured)
+    """
+    def decorator(func):
+        BENCHMARKS.append((func.__name__, func, repeat, number))
+        return func
+    return decorator
+
+
+class X(object):
+    pass
+
+
+def make_workflow():
+    workflow = DockerBuildWorkflow("file:///nonexistent", "test-image")
+    workflow.builder = X()
+    workflow.builder.image_id = "asd123"
+    workflow.builder.base_image = ImageName(repo='fedora', tag='22')
+    workflow.builder.git_dockerfile_path = None
+    workflow.builder.git_path = "/tmp/nonexistent"
+    return workflow
+
+
+def make_local_git_repo():
+    git_repo = tempfile.mkdtemp()
+    repo = git.Repo.init(git_repo)
+    with open(os.path.join(git_repo, 'Dockerfile'), 'w') as fp:
+        fp.write("FROM fedora\nRUN yum install -y python\nCMD python\n")
+    repo.index.add(['Dockerfile'])
+    actor = git.Actor('Benchmark', 'benchmark@example.com')
+    repo.index.commit('dockerfile', author=actor, committer=actor)
+    return git_repo
+
+
+@benchmark(repeat=3)
+def wait_for_command_million_lines(scale):
+    lines = max(1, int(1000000 * scale))
+    logs = [('{"stream":"Step 1 : RUN make all, line %d\\n"}\r\n' % i).encode('utf-8')
+            for i in range(lines)]
+
+    def run():
+        wait_for_command(iter(logs))
+    return run
+
+
+@benchmark(repeat=5)
+def plugins_runner_load(scale):
+    workflow = make_workflow()
+
+    def run():
+        PreBuildPluginsRunner(workflow.builder, workflow, [])
+    return run
+
+
+class NoopPlugin(PostBuildPlugin):
+    key = "noop"
+
+    def __init__(self, tasker, workflow, base_image=None):
+        super(NoopPlugin, self).__init__(tasker, workflow)
+        self.base_image = base_image
+
+    def run(self):
+        return self.base_image
+
+
+@benchmark(repeat=5)
+def plugins_runner_run(scale):
+    workflow = make_workflow()
+    runner = PostBuildPluginsRunner(workflow.builder, workflow, [])
+    runner.plugin_classes = {NoopPlugin.key: NoopPlugin}
+    runner.plugins_conf = [{"name": NoopPlugin.key, "args": {"base_image": "BASE_IMAGE"}}] * \
+        max(1, int(1000 * scale))
+
+    def run():
+        runner.run()
+    return run
+
+
+@benchmark(repeat=5)
+def image_name_parse_format(scale):
+    names = ["registry-%d.example.com:5000/namespace/repo-%d:tag" % (i % 10, i)
+             for i in range(max(1, int(100000 * scale)))]
+
+    def run():
+        for name in names:
+            ImageName.parse(name).to_str()
+    return run
+
+
+@benchmark(repeat=5)
+def translate_special_values(scale):
+    workflow = make_workflow()
+    runner = PostBuildPluginsRunner(workflow.builder, workflow, [])
+    size = max(1, int(1000 * scale))
+    config = {
+        "plugins": [{"name": "plugin-%d" % i,
+                     "args": {"image_id": "BUILT_IMAGE_ID",
+                              "base": "BASE_IMAGE",
+                              "list": ["BUILD_GIT_PATH", "x", {"nested": "BUILD_DOCKERFILE_PATH"}]}}
+                    for i in range(size)],
+    }
+
+    def run():
+        runner._translate_special_values(config)
+    return run
+
+
+@benchmark(repeat=3)
+def build_docker_image(scale):
+    git_repo = make_local_git_repo()
+    mock_docker(provided_image_repotags=["test-image:latest"])
+    # mock_docker returns one iterator of build logs, every build needs fresh one
+    flexmock(docker.Client, build=lambda **kwargs: iter(mock_build_logs))
+    prebuild_plugins = [{"name": "change_from_in_dockerfile", "args": {"base_image": "fedora:22"}},
+                        {"name": "add_labels_in_dockerfile", "args": {"labels": {"a": "b"}}}]
+
+    def run():
+        workflow = DockerBuildWorkflow(git_repo, "test-image", prebuild_plugins=prebuild_plugins)
+        workflow.build_docker_image()
+
+    def cleanup():
+        # mocks would break benchmarks which talk to fake docker daemon
+        flexmock_teardown()
+        shutil.rmtree(git_repo)
+    run.cleanup = cleanup
+    return run
+
+
+@benchmark(repeat=5)
+def cli_import(scale):
+    # CLI is executed in every build container; fresh interpreter, so nothing is imported yet
+    dock_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable, "-c", "import dock.cli.main"]
+
+    def run():
+        subprocess.check_call(command, cwd=dock_root)
+    return run
+
+
+def start_push_environment(scale, registries_count):
+    """
+    :return: tuple, (tmpdir, FakeDocker, list of FakeRegistry, image ID of 'test-image')
+    """
+    tmpdir = tempfile.mkdtemp()
+    daemon = FakeDocker(os.path.join(tmpdir, 'docker.sock'), layers=5,
+                        layer_size=max(1024, int(1024 ** 2 * scale))).start()
+    registries = [FakeRegistry().start() for _ in range(registries_count)]
+    for registry in registries:
+        daemon.add_registry(registry)
+    image_id = daemon.state.add_image(tag='test-image')
+    return tmpdir, daemon, registries, image_id
+
+
+def stop_push_environment(tmpdir, daemon, registries):
+    for registry in registries:
+        registry.stop()
+    daemon.stop()
+    shutil.rmtree(tmpdir)
+
+
+@benchmark(repeat=3)
+def tag_and_push_many(scale):
+    tmpdir, daemon, registries, image_id = start_push_environment(scale, registries_count=4)
+    tags = max(1, int(25 * scale))
+    mapping = dict((registry.netloc, {"image_names": ["ns/image-%d:%d" % (i % 5, i)
+                                                     for i in range(tags)]})
+                   for registry in registries)
+    tasker = DockerTasker(base_url=daemon.base_url)
+
+    def run():
+        # mapping is merged into workflow, so every run needs fresh one
+        workflow = make_workflow()
+        workflow.builder.image_id = image_id
+        runner = PostBuildPluginsRunner(tasker, workflow, [{"name": "tag_and_push",
+                                                            "args": {"mapping": mapping}}])
+        runner.run()
+    run.cleanup = lambda: stop_push_environment(tmpdir, daemon, registries)
+    return run
+
+
+@benchmark(repeat=3)
+def push_built_image(scale):
+    tmpdir, daemon, registries, image_id = start_push_environment(
+        scale, registries_count=max(1, int(10 * scale)))
+    git_repo = make_local_git_repo()
+    builder = InsideBuilder(git_repo, "test-image", tmpdir=os.path.join(tmpdir, 'git'))
+    builder.tasker = DockerTasker(base_url=daemon.base_url)
+    builder.image_id = image_id
+    builder.is_built = True
+
+    def run():
+        for registry in registries:
+            builder.push_built_image(registry.netloc)
+
+    def cleanup():
+        stop_push_environment(tmpdir, daemon, registries)
+        shutil.rmtree(git_repo)
+    run.cleanup = cleanup
+    return run
+
+
+def measure(func, repeat, number):
+    """
+    :return: dict, times per one call in seconds
+    """
+    times = [t / number for t in timeit.repeat(func, repeat=repeat, number=number)]
+    times.sort()
+    return {
+        "min": times[0],
+        "median": times[len(times) // 2],
+        "mean": sum(times) / len(times),
+        "repeat": repeat,
+        "number": number,
+    }
+
+
+def run_benchmarks(scale=1.0, selected=None):
+    """
+    failure of a benchmark doesn't stop the run, it's reported in "errors"
+    """
+    results = {}
+    errors = {}
+    for name, func, repeat, number in BENCHMARKS:
+        if selected and name not in selected:
+            continue
+        print("running %s..." % name, file=sys.stderr)
+        bench_func = None
+        try:
+            bench_func = func(scale)
+            results[name] = measure(bench_func, repeat, number)
+        except Exception as ex:
+            print("%s failed: %s" % (name, repr(ex)), file=sys.stderr)
+            errors[name] = repr(ex)
+        finally:
+            cleanup = getattr(bench_func, 'cleanup', None)
+            if cleanup:
+                cleanup()
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+            "scale": scale,
+        },
+        "results": results,
+        "errors": errors,
+    }
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    compare minimal times of benchmarks present in both runs
+
+    :param baseline: dict, output of run_benchmarks
+    :param current: dict, output of run_benchmarks
+    :param threshold: float, relative slowdown which is considered a regression
+    :return: list of dicts with keys name, baseline, current, ratio, regression
+    """
+    comparison = []
+    for name in sorted(current["results"]):
+        if name not in baseline["results"]:
+            continue
+        base_time = baseline["results"][name]["min"]
+        cur_time = current["results"][name]["min"]
+        ratio = cur_time / base_time if base_time else float('inf')
+        comparison.append({
+            "name": name,
+            "baseline": base_time,
+            "current": cur_time,
+            "ratio": ratio,
+            "regression": ratio > 1 + threshold,
+        })
+    return comparison
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="benchmarks of dock")
+    parser.add_argument("--output", help="write results as json to this file")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare results with baseline json")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="relative slowdown considered a regression (default: %(default)s)")
+    parser.add_argument("--scale", type=float, default=1.0, help="scale sizes of inputs")
+    parser.add_argument("benchmarks", nargs="*", help="run only these benchmarks")
+    args = parser.parse_args(args)
+
+    # logging itself would dominate the measurements
+    dock_logger = logging.getLogger("dock")
+    log_level = dock_logger.level
+    dock_logger.setLevel(logging.ERROR)
+    try:
+        current = run_benchmarks(scale=args.scale, selected=args.benchmarks)
+    finally:
+        dock_logger.setLevel(log_level)
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(current, fp, indent=2, sort_keys=True)
+    for name, result in sorted(current["results"].items()):
+        print("%-35s %12.6f s" % (name, result["min"]))
+    for name, error in sorted(current["errors"].items()):
+        print("%-35s FAILED: %s" % (name, error))
+
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        comparison = compare(baseline, current, threshold=args.threshold)
+        print()
+        for c in comparison:
+            print("%-35s %12.6f -> %12.6f  %6.2fx%s" % (c["name"], c["baseline"], c["current"],
+                                                       c["ratio"],
+                                                       "  REGRESSION" if c["regression"] else ""))
+        if any(c["regression"] for c in comparison):
+            return 1
+    if current["errors"]:
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,25 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import pytest
+
+from dock import imagegc
+
+
+@pytest.fixture(autouse=True)
+def image_usage(request, tmpdir):
+    """ builds record usage of images in tmpdir, not in ~/.cache/dock """
+    usage = imagegc.usage
+    imagegc.usage = imagegc.ImageUsageStore(str(tmpdir.join('image-usage.json')))
+
+    def fin():
+        imagegc.usage = usage
+    request.addfinalizer(fin)
+    return imagegc.usage
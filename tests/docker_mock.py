@@ -60,6 +60,11 @@ mock_push_logs = \
     b'{"errorDetail":{"message":"Repository does not exist: localhost:5000/dock-tests-b3a11e13d27c428f8fa2914c8c6a6d96"},' \
     b'"error":"Repository does not exist: localhost:5000/dock-tests-b3a11e13d27c428f8fa2914c8c6a6d96"}\r\n'
 
+mock_push_logs_succeeded = \
+    b'{"status":"The push refers to a repository [localhost:5000/dock-test-image] (len: 1)"}\r\n' \
+    b'{"status":"Image successfully pushed","progressDetail":{},"id":"3ab9a7ed8a16"}\r\n' \
+    b'{"status":"latest: digest: sha256:1f8f3c4f4ed4b5b2c8e0a3b2f3a4b5c6d7e8f9a0b1c2d3e4f5a6b7c8d9e0f1a2 size: 1234"}\r\n'
+
 
 def mock_docker(build_should_fail=False,
                 inspect_should_fail=False,
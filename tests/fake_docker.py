@@ -0,0 +1,772 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Fake docker daemon: small subset of docker Engine API served over UNIX socket.
+
+Unlike tests/docker_mock.py, requests go through docker-py, HTTP and the socket,
+so costs of (de)serialization and streaming within dock are visible. Responses
+have tunable latency and sizes, so it can be used for load tests of concurrent
+builds and of build managers:
+
+    with FakeDocker('/tmp/fake-docker.sock', build_log_lines=10000) as daemon:
+        tasker = DockerTasker(base_url=daemon.base_url)
+        ...
+
+or standalone (then export DOCKER_CONNECTION=unix:///tmp/fake-docker.sock):
+
+    python -m tests.fake_docker --socket /tmp/fake-docker.sock --latency 0.01
+
+Supported: build (context is read as a stream), containers create/start/wait/logs/
+inspect/commit/remove, images list/inspect/tag/remove/push/pull (create) and get
+(docker save).
+
+Push and pull are only simulated, unless the image lives in a registry added via
+add_registry() (see tests.fake_registry): then layers are really transferred.
+Images have deterministic layers: all of them share base layers and have one
+layer of their own, so registries can deduplicate them.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import errno
+import hashlib
+import io
+import json
+import os
+import re
+import struct
+import tarfile
+import threading
+import time
+import uuid
+
+import requests
+
+from tests import fake_registry
+
+try:
+    # py2
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+    from urlparse import urlsplit, parse_qs
+except ImportError:
+    # py3
+    from http.server import BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn, UnixStreamServer
+    from urllib.parse import urlsplit, parse_qs
+
+
+API_VERSION_RE = re.compile(r'^/v[0-9.]+(/.*)$')
+STDOUT = 1
+
+
+def random_id():
+    return hashlib.sha256(uuid.uuid4().bytes).hexdigest()
+
+
+def split_image_name(name):
+    """ 'registry:5000/repo:tag' -> ('registry:5000/repo', 'tag') """
+    repo, _, tag = name.rpartition(':')
+    if not repo or '/' in tag:
+        return name, 'latest'
+    return repo, tag
+
+
+class FakeDockerState(object):
+    """ images and containers known to the fake daemon """
+
+    def __init__(self, layers=3, layer_size=1024):
+        self.lock = threading.Lock()
+        self.layers = layers
+        self.layer_size = layer_size
+        self.blobs = {}  # digest -> content of layer
+        self.images = {}  # image ID -> dict
+        self.tags = {}  # 'repo:tag' -> image ID
+        self.containers = {}  # container ID -> dict
+        self.requests = {}  # endpoint -> count
+
+    def count(self, endpoint):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def make_layer(self, seed):
+        """ deterministic content of layer; :return: str, digest """
+        block = hashlib.sha256(seed.encode('utf-8')).hexdigest().encode('ascii')
+        content = (block * (self.layer_size // len(block) + 1))[:self.layer_size]
+        digest = fake_registry.sha256_digest(content)
+        with self.lock:
+            self.blobs.setdefault(digest, content)
+        return digest
+
+    def add_image(self, tag=None, parent=None, layers=None, image_id=None):
+        """
+        :param tag: str, name of the image
+        :param parent: str, ID of parent image
+        :param layers: list of str, digests of layers (in self.blobs); shared base layers
+                       and one unique layer by default
+        :param image_id: str, ID of the image, random by default
+        :return: str, image ID
+        """
+        image_id = image_id or random_id()
+        if layers is None:
+            layers = [self.make_layer('base-%d' % i) for i in range(self.layers - 1)]
+            layers.append(self.make_layer(image_id))
+        with self.lock:
+            self.images[image_id] = {
+                'Id': image_id,
+                'ParentId': parent or '',
+                'Created': int(time.time()),
+                'Size': 0,
+                'VirtualSize': 0,
+                'RepoTags': [],
+                'RepoDigests': [],
+                'Layers': layers,
+            }
+        if tag:
+            self.tag(image_id, tag)
+        return image_id
+
+    def image_config(self, image):
+        return json.dumps({'id': image['Id'], 'rootfs': {'diff_ids': image['Layers']}},
+                          sort_keys=True).encode('utf-8')
+
+    def add_repo_digest(self, image_id, repo_digest):
+        with self.lock:
+            image = self.images[image_id]
+            if repo_digest not in image['RepoDigests']:
+                image['RepoDigests'].append(repo_digest)
+
+    def tag(self, image_id, name):
+        repo, tag = split_image_name(name)
+        name = '%s:%s' % (repo, tag)
+        with self.lock:
+            old_id = self.tags.get(name)
+            if old_id in self.images:
+                self.images[old_id]['RepoTags'].remove(name)
+            self.tags[name] = image_id
+            self.images[image_id]['RepoTags'].append(name)
+
+    def resolve_image(self, name):
+        """
+        :param name: str, image ID (or its prefix) or name
+        :return: dict or None
+        """
+        with self.lock:
+            if name in self.images:
+                return self.images[name]
+            repo, tag = split_image_name(name)
+            image_id = self.tags.get('%s:%s' % (repo, tag))
+            if image_id:
+                return self.images[image_id]
+            for image_id, image in self.images.items():
+                if len(name) >= 12 and image_id.startswith(name):
+                    return image
+        return None
+
+    def remove_image(self, name):
+        image = self.resolve_image(name)
+        if image is None:
+            return None
+        with self.lock:
+            if name in image['RepoTags'] or '%s:%s' % split_image_name(name) in image['RepoTags']:
+                tag = name if name in image['RepoTags'] else '%s:%s' % split_image_name(name)
+                image['RepoTags'].remove(tag)
+                del self.tags[tag]
+                if image['RepoTags']:
+                    return [{'Untagged': tag}]
+            for tag in image['RepoTags']:
+                del self.tags[tag]
+            del self.images[image['Id']]
+            used = set(d for i in self.images.values() for d in i['Layers'])
+            for digest in list(self.blobs):
+                if digest not in used:
+                    del self.blobs[digest]
+        return [{'Deleted': image['Id']}]
+
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # (method, path regex, handler name)
+    ROUTES = [
+        ('GET', r'^/_ping$', 'ping'),
+        ('GET', r'^/version$', 'version'),
+        ('GET', r'^/info$', 'info'),
+        ('POST', r'^/build$', 'build'),
+        ('GET', r'^/containers/json$', 'containers'),
+        ('POST', r'^/containers/create$', 'container_create'),
+        ('POST', r'^/containers/(?P<cid>[^/]+)/start$', 'container_start'),
+        ('POST', r'^/containers/(?P<cid>[^/]+)/wait$', 'container_wait'),
+        ('GET', r'^/containers/(?P<cid>[^/]+)/json$', 'container_inspect'),
+        ('GET', r'^/containers/(?P<cid>[^/]+)/logs$', 'container_logs'),
+        ('DELETE', r'^/containers/(?P<cid>[^/]+)$', 'container_remove'),
+        ('POST', r'^/commit$', 'commit'),
+        ('GET', r'^/images/json$', 'images'),
+        ('POST', r'^/images/create$', 'image_pull'),
+        ('GET', r'^/images/(?P<name>.+)/json$', 'image_inspect'),
+        ('GET', r'^/images/(?P<name>.+)/get$', 'image_get'),
+        ('POST', r'^/images/(?P<name>.+)/tag$', 'image_tag'),
+        ('POST', r'^/images/(?P<name>.+)/push$', 'image_push'),
+        ('DELETE', r'^/images/(?P<name>.+)$', 'image_remove'),
+    ]
+    COMPILED_ROUTES = [(method, re.compile(regex), name) for method, regex, name in ROUTES]
+
+    @property
+    def daemon(self):
+        return self.server.daemon
+
+    @property
+    def state(self):
+        return self.server.daemon.state
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def address_string(self):
+        return 'unix'
+
+    # request helpers
+
+    def read_body(self):
+        """ read whole body, content-length or chunked; returns number of bytes read """
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            total = 0
+            while True:
+                size = int(self.rfile.readline().strip().split(b';')[0], 16)
+                if size == 0:
+                    # trailers
+                    while self.rfile.readline().strip():
+                        pass
+                    return total
+                remaining = size
+                while remaining:
+                    remaining -= len(self.rfile.read(min(remaining, 65536)))
+                self.rfile.readline()
+                total += size
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        remaining = length
+        while remaining:
+            chunk = self.rfile.read(min(remaining, 65536))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+        return length
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        if not length:
+            self.read_body()
+            return {}
+        return json.loads(self.rfile.read(length).decode('utf-8'))
+
+    # response helpers
+
+    def send_json(self, obj, status=200):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_empty(self, status=204):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def send_not_found(self, message):
+        body = message.encode('utf-8')
+        self.send_response(404)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def start_stream(self, content_type='application/json'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def write_chunk(self, data):
+        if not data:
+            return
+        self.wfile.write(('%x\r\n' % len(data)).encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+        if self.daemon.stream_delay:
+            time.sleep(self.daemon.stream_delay)
+
+    def end_stream(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def write_json_line(self, line):
+        self.write_chunk(json.dumps(line).encode('utf-8') + b'\r\n')
+
+    def stream_json_lines(self, lines):
+        self.start_stream()
+        for line in lines:
+            self.write_json_line(line)
+        self.end_stream()
+
+    def padding(self, size):
+        return 'x' * max(0, size)
+
+    # dispatch
+
+    def dispatch(self, method):
+        url = urlsplit(self.path)
+        path = url.path
+        match = API_VERSION_RE.match(path)
+        if match:
+            path = match.group(1)
+        self.query = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+        for route_method, regex, name in self.COMPILED_ROUTES:
+            if route_method != method:
+                continue
+            match = regex.match(path)
+            if match:
+                self.state.count(name)
+                if self.daemon.latency:
+                    time.sleep(self.daemon.latency)
+                getattr(self, 'do_' + name)(**match.groupdict())
+                return
+        self.read_body()
+        self.send_not_found("page not found: %s %s" % (method, path))
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    # endpoints
+
+    def do_ping(self):
+        body = b'OK'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_version(self):
+        self.send_json({'Version': '1.6.0', 'ApiVersion': '1.18', 'GoVersion': 'fake'})
+
+    def do_info(self):
+        with self.state.lock:
+            containers = len(self.state.containers)
+            images = len(self.state.images)
+        # containers exit as soon as they are started
+        self.send_json({'Containers': containers, 'ContainersRunning': 0,
+                        'Images': images, 'DockerRootDir': '/var/lib/docker',
+                        'DriverStatus': [['Data Space Available', '%d B' % self.daemon.free_bytes]]})
+
+    def do_build(self):
+        context_size = self.read_body()
+        image_id = self.state.add_image(tag=self.query.get('t'))
+        daemon = self.daemon
+        lines = [{'stream': 'Sending build context to Docker daemon %d B\n' % context_size},
+                 {'stream': 'Step 0 : FROM fedora:latest\n'}]
+        for i in range(daemon.build_log_lines):
+            lines.append({'stream': 'line %d %s\n' % (i, self.padding(daemon.log_line_size))})
+        lines.append({'stream': 'Successfully built %s\n' % image_id[:12]})
+        self.stream_json_lines(lines)
+
+    def do_containers(self):
+        with self.state.lock:
+            containers = [{'Id': c['Id'], 'Image': c['Image'], 'Command': c['Command'],
+                           'Names': ['/' + c['Name']], 'Status': c['Status'],
+                           'Created': c['Created']}
+                          for c in self.state.containers.values()]
+        self.send_json(containers)
+
+    def do_container_create(self):
+        config = self.read_json()
+        image = config.get('Image', '')
+        if self.state.resolve_image(image) is None:
+            self.send_not_found("No such image: %s" % image)
+            return
+        container_id = random_id()
+        with self.state.lock:
+            self.state.containers[container_id] = {
+                'Id': container_id,
+                'Name': self.query.get('name') or container_id[:12],
+                'Image': image,
+                'Command': config.get('Cmd'),
+                'Created': int(time.time()),
+                'Status': 'Created',
+                'Config': {'Tty': bool(config.get('Tty'))},
+            }
+        self.send_json({'Id': container_id, 'Warnings': None}, status=201)
+
+    def _get_container(self, cid):
+        with self.state.lock:
+            for container_id, container in self.state.containers.items():
+                if container_id.startswith(cid) or container['Name'] == cid:
+                    return container
+        self.send_not_found("No such container: %s" % cid)
+        return None
+
+    def do_container_start(self, cid):
+        self.read_body()
+        container = self._get_container(cid)
+        if container is not None:
+            container['Status'] = 'Exited (0)'
+            self.send_empty()
+
+    def do_container_wait(self, cid):
+        self.read_body()
+        container = self._get_container(cid)
+        if container is not None:
+            self.send_json({'StatusCode': 0})
+
+    def do_container_inspect(self, cid):
+        container = self._get_container(cid)
+        if container is not None:
+            self.send_json({'Id': container['Id'], 'Name': '/' + container['Name'],
+                            'Image': container['Image'], 'Config': container['Config'],
+                            'State': {'Running': False, 'ExitCode': 0}})
+
+    def do_container_logs(self, cid):
+        container = self._get_container(cid)
+        if container is None:
+            return
+        self.start_stream(content_type='application/vnd.docker.raw-stream')
+        for i in range(self.daemon.container_log_lines):
+            line = ('line %d %s\n' % (i, self.padding(self.daemon.log_line_size))).encode('utf-8')
+            if container['Config']['Tty']:
+                self.write_chunk(line)
+            else:
+                # multiplexed stream: header is (stream type, 0, 0, 0, size)
+                self.write_chunk(struct.pack('>BxxxL', STDOUT, len(line)) + line)
+        self.end_stream()
+
+    def do_container_remove(self, cid):
+        container = self._get_container(cid)
+        if container is not None:
+            with self.state.lock:
+                self.state.containers.pop(container['Id'], None)
+            self.send_empty()
+
+    def do_commit(self):
+        self.read_body()
+        container = self._get_container(self.query.get('container', ''))
+        if container is None:
+            return
+        tag = None
+        if self.query.get('repo'):
+            tag = '%s:%s' % (self.query['repo'], self.query.get('tag') or 'latest')
+        image_id = self.state.add_image(tag=tag)
+        self.send_json({'Id': image_id}, status=201)
+
+    def do_images(self):
+        name = self.query.get('filter')
+        with self.state.lock:
+            images = [dict((k, v) for k, v in image.items() if k != 'Layers')
+                      for image in self.state.images.values()]
+        for image in images:
+            image['RepoTags'] = list(image['RepoTags']) or ['<none>:<none>']
+            image['RepoDigests'] = list(image['RepoDigests'])
+        if name:
+            images = [i for i in images
+                      if any(split_image_name(t)[0] == name for t in i['RepoTags'])]
+        self.send_json(images)
+
+    def do_image_inspect(self, name):
+        image = self.state.resolve_image(name)
+        if image is None:
+            self.send_not_found("No such image: %s" % name)
+            return
+        self.send_json({'Id': image['Id'], 'Parent': image['ParentId'],
+                        'Created': image['Created'], 'Size': image['Size'],
+                        'RepoTags': list(image['RepoTags']),
+                        'RepoDigests': list(image['RepoDigests']),
+                        'RootFS': {'Type': 'layers', 'Layers': list(image['Layers'])},
+                        'Config': {}})
+
+    def do_image_tag(self, name):
+        self.read_body()
+        image = self.state.resolve_image(name)
+        if image is None:
+            self.send_not_found("No such image: %s" % name)
+            return
+        self.state.tag(image['Id'], '%s:%s' % (self.query['repo'], self.query.get('tag') or 'latest'))
+        self.send_empty(status=201)
+
+    def do_image_remove(self, name):
+        result = self.state.remove_image(name)
+        if result is None:
+            self.send_not_found("No such image: %s" % name)
+            return
+        self.send_json(result)
+
+    def _layer_lines(self, status_prefix, name):
+        daemon = self.daemon
+        lines = []
+        for layer in range(daemon.layers):
+            layer_id = hashlib.sha256(('%s-%d' % (name, layer)).encode('utf-8')).hexdigest()[:12]
+            chunks = max(1, daemon.layer_size // daemon.progress_chunk)
+            for chunk in range(chunks):
+                lines.append({'status': status_prefix, 'id': layer_id,
+                              'progressDetail': {'current': (chunk + 1) * daemon.progress_chunk,
+                                                 'total': daemon.layer_size}})
+            lines.append({'status': '%s complete' % status_prefix, 'id': layer_id,
+                          'progressDetail': {}})
+        return lines
+
+    def do_image_push(self, name):
+        self.read_body()
+        tag = self.query.get('tag') or 'latest'
+        image = self.state.resolve_image('%s:%s' % (name, tag))
+        if image is None:
+            self.stream_json_lines([{'errorDetail': {'message': 'No such image: %s' % name},
+                                     'error': 'No such image: %s' % name}])
+            return
+        registry = self.daemon.get_registry(name)
+        if registry is not None:
+            self.push_to_registry(registry, name, tag, image)
+            return
+        lines = [{'status': 'The push refers to a repository [%s] (len: 1)' % name}]
+        lines += self._layer_lines('Pushing', name)
+        lines.append({'status': '%s: digest: sha256:%s size: %d' %
+                      (tag, hashlib.sha256(image['Id'].encode('utf-8')).hexdigest(),
+                       self.daemon.layer_size * self.daemon.layers)})
+        self.stream_json_lines(lines)
+
+    def push_to_registry(self, registry, name, tag, image):
+        repository = name.split('/', 1)[1]
+        with self.state.lock:
+            layers = [self.state.blobs[digest] for digest in image['Layers']]
+        self.start_stream()
+        self.write_json_line({'status': 'The push refers to a repository [%s]' % name})
+        session = requests.Session()
+        try:
+            for status, digest, size in fake_registry.push_image(
+                    session, registry.url, repository, tag, self.state.image_config(image), layers):
+                if status == 'manifest':
+                    self.state.add_repo_digest(image['Id'], '%s@%s' % (name, digest))
+                    self.write_json_line({'status': '%s: digest: %s size: %d' % (tag, digest, size)})
+                elif status == 'exists':
+                    self.write_json_line({'status': 'Layer already exists', 'id': digest[7:19],
+                                          'progressDetail': {}})
+                else:
+                    self.write_json_line({'status': 'Pushing', 'id': digest[7:19],
+                                          'progressDetail': {'current': size, 'total': size}})
+                    self.write_json_line({'status': 'Pushed', 'id': digest[7:19],
+                                          'progressDetail': {}})
+        except requests.exceptions.RequestException as ex:
+            self.write_json_line({'errorDetail': {'message': str(ex)}, 'error': str(ex)})
+        finally:
+            session.close()
+        self.end_stream()
+
+    def pull_from_registry(self, registry, name, tag):
+        repository = name.split('/', 1)[1]
+        full_name = '%s:%s' % (name, tag)
+        self.start_stream()
+        self.write_json_line({'status': 'Pulling from %s' % repository, 'id': tag})
+        session = requests.Session()
+        try:
+            pulled = fake_registry.pull_image(session, registry.url, repository, tag)
+        except (requests.exceptions.RequestException, RuntimeError) as ex:
+            self.write_json_line({'errorDetail': {'message': str(ex)}, 'error': str(ex)})
+        else:
+            if pulled is None:
+                message = 'manifest for %s not found' % full_name
+                self.write_json_line({'errorDetail': {'message': message}, 'error': message})
+            else:
+                digest, config, layers = pulled
+                layer_digests = []
+                with self.state.lock:
+                    for content in layers:
+                        layer_digest = fake_registry.sha256_digest(content)
+                        self.state.blobs.setdefault(layer_digest, content)
+                        layer_digests.append(layer_digest)
+                image_id = json.loads(config.decode('utf-8'))['id']
+                if self.state.resolve_image(image_id) is None:
+                    self.state.add_image(layers=layer_digests, image_id=image_id)
+                self.state.tag(image_id, full_name)
+                self.state.add_repo_digest(image_id, '%s@%s' % (name, digest))
+                self.write_json_line({'status': 'Digest: %s' % digest})
+                self.write_json_line({'status': 'Status: Downloaded newer image for %s' % full_name})
+        finally:
+            session.close()
+        self.end_stream()
+
+    def do_image_pull(self):
+        self.read_body()
+        name = self.query.get('fromImage', '')
+        tag = self.query.get('tag') or 'latest'
+        registry = self.daemon.get_registry(name)
+        if registry is not None:
+            self.pull_from_registry(registry, name, tag)
+            return
+        full_name = '%s:%s' % (name, tag)
+        lines = [{'status': 'Pulling repository %s' % name}]
+        lines += self._layer_lines('Downloading', full_name)
+        image = self.state.resolve_image(full_name)
+        if image is None:
+            self.state.add_image(tag=full_name)
+        lines.append({'status': 'Status: Downloaded newer image for %s' % full_name})
+        self.stream_json_lines(lines)
+
+    def do_image_get(self, name):
+        image = self.state.resolve_image(name)
+        if image is None:
+            self.send_not_found("No such image: %s" % name)
+            return
+        self.start_stream(content_type='application/x-tar')
+        # tarfile writes into this buffer, it's flushed as chunks
+        buf = io.BytesIO()
+        tar = tarfile.open(fileobj=buf, mode='w|')
+        layer = io.BytesIO()
+        layer_tar = tarfile.open(fileobj=layer, mode='w')
+        payload = b'x' * self.daemon.layer_size
+        info = tarfile.TarInfo('payload')
+        info.size = len(payload)
+        layer_tar.addfile(info, io.BytesIO(payload))
+        layer_tar.close()
+        for member_name, data in (('%s/json' % image['Id'],
+                                   json.dumps({'id': image['Id']}).encode('utf-8')),
+                                  ('%s/layer.tar' % image['Id'], layer.getvalue())):
+            info = tarfile.TarInfo(member_name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+            self.write_chunk(buf.getvalue())
+            buf.seek(0)
+            buf.truncate()
+        tar.close()
+        self.write_chunk(buf.getvalue())
+        self.end_stream()
+
+
+class FakeDockerServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class FakeDocker(object):
+    """
+    fake docker daemon running in a thread
+
+    :param socket_path: str, path to UNIX socket to listen on
+    :param latency: float, seconds added to every API call
+    :param stream_delay: float, seconds between chunks of streamed responses
+    :param build_log_lines: int, number of lines of build output
+    :param container_log_lines: int, number of lines of container logs
+    :param log_line_size: int, length of padding of every log line
+    :param layers: int, number of layers reported by push and pull
+    :param layer_size: int, bytes per layer (push/pull progress, size of layer in 'docker save')
+    :param progress_chunk: int, bytes per progress message of push and pull
+    :param free_bytes: int, free space in storage reported by /info
+    """
+
+    def __init__(self, socket_path, latency=0.0, stream_delay=0.0, build_log_lines=10,
+                 container_log_lines=10, log_line_size=50, layers=3, layer_size=1024 ** 2,
+                 progress_chunk=512 * 1024, free_bytes=100 * 1024 ** 3):
+        self.socket_path = socket_path
+        self.latency = latency
+        self.stream_delay = stream_delay
+        self.build_log_lines = build_log_lines
+        self.container_log_lines = container_log_lines
+        self.log_line_size = log_line_size
+        self.layers = layers
+        self.layer_size = layer_size
+        self.progress_chunk = progress_chunk
+        self.free_bytes = free_bytes
+        self.state = FakeDockerState(layers=layers, layer_size=layer_size)
+        self.registries = {}  # netloc -> FakeRegistry
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return 'unix://' + self.socket_path
+
+    def add_registry(self, registry):
+        """
+        push to and pull from provided registry for real
+
+        :param registry: tests.fake_registry.FakeRegistry
+        """
+        self.registries[registry.netloc] = registry
+
+    def get_registry(self, name):
+        """
+        :param name: str, name of image without tag
+        :return: FakeRegistry or None
+        """
+        if '/' not in name:
+            return None
+        return self.registries.get(name.split('/', 1)[0])
+
+    def start(self):
+        try:
+            os.remove(self.socket_path)
+        except OSError as ex:
+            if ex.errno != errno.ENOENT:
+                raise
+        self._server = FakeDockerServer(self.socket_path, FakeDockerHandler)
+        self._server.daemon = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-docker")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+            os.remove(self.socket_path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fake docker daemon")
+    parser.add_argument("--socket", default="/tmp/fake-docker.sock", help="path to UNIX socket")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every call")
+    parser.add_argument("--stream-delay", type=float, default=0.0,
+                        help="seconds between chunks of streamed responses")
+    parser.add_argument("--build-log-lines", type=int, default=10)
+    parser.add_argument("--container-log-lines", type=int, default=10)
+    parser.add_argument("--log-line-size", type=int, default=50)
+    parser.add_argument("--layers", type=int, default=3)
+    parser.add_argument("--layer-size", type=int, default=1024 ** 2)
+    parser.add_argument("--image", action="append", default=[],
+                        help="image available from the start (can be specified multiple times)")
+    args = parser.parse_args()
+    daemon = FakeDocker(args.socket, latency=args.latency, stream_delay=args.stream_delay,
+                        build_log_lines=args.build_log_lines,
+                        container_log_lines=args.container_log_lines,
+                        log_line_size=args.log_line_size, layers=args.layers,
+                        layer_size=args.layer_size)
+    for image in args.image:
+        daemon.state.add_image(tag=image)
+    daemon.start()
+    print("listening on %s" % daemon.base_url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,513 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Fake docker registry: in-process stand-in for docker registry (API v2).
+
+Supports what push and pull need: blob uploads (monolithic and chunked, cross
+repository mounts), blob HEAD/GET, manifests HEAD/GET/PUT and tag listing. Blobs
+are stored once for all repositories and the registry counts uploads of blobs it
+already has, so it's visible whether clients skip layers which are present.
+Transfer of blobs can be throttled to simulate slow links:
+
+    with FakeRegistry(bandwidth=10 * 1024 ** 2) as registry:
+        registry.netloc  # '127.0.0.1:<port>', use it as registry in image names
+        ...
+        registry.stats.as_dict()
+
+push_image() and pull_image() implement client side of push and pull, the same
+way docker does it (HEAD blob first, upload only if it's missing); tests.fake_docker
+uses them when pushing to/pulling from a registry known to it.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+
+import requests
+
+try:
+    # py2
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit, parse_qs
+except ImportError:
+    # py3
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit, parse_qs
+
+
+MANIFEST_MEDIA_TYPE = 'application/vnd.docker.distribution.manifest.v2+json'
+CONFIG_MEDIA_TYPE = 'application/vnd.docker.container.image.v1+json'
+LAYER_MEDIA_TYPE = 'application/vnd.docker.image.rootfs.diff.tar.gzip'
+CHUNK_SIZE = 64 * 1024
+
+
+def sha256_digest(data):
+    return 'sha256:' + hashlib.sha256(data).hexdigest()
+
+
+class Throttle(object):
+    """
+    token bucket shared by all connections, i.e. it models one link of given bandwidth
+    """
+
+    def __init__(self, bytes_per_second=None):
+        """
+        :param bytes_per_second: int or None, None means unlimited
+        """
+        self.rate = bytes_per_second
+        self._lock = threading.Lock()
+        self._next_free = time.time()
+
+    def consume(self, size):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next_free)
+            self._next_free = start + float(size) / self.rate
+            delay = self._next_free - now
+        time.sleep(delay)
+
+
+class RegistryStats(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}  # endpoint -> count
+        self.blob_uploads = 0  # finished uploads
+        self.duplicate_uploads = 0  # uploads of blobs which were already present
+        self.duplicate_bytes = 0
+        self.blob_mounts = 0
+        self.blob_head_hits = 0
+        self.blob_head_misses = 0
+        self.manifests_pushed = 0
+        self.bytes_received = 0  # blob data only
+        self.bytes_sent = 0
+
+    def count(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def add(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'requests': dict(self.requests),
+                'blob_uploads': self.blob_uploads,
+                'duplicate_uploads': self.duplicate_uploads,
+                'duplicate_bytes': self.duplicate_bytes,
+                'blob_mounts': self.blob_mounts,
+                'blob_head_hits': self.blob_head_hits,
+                'blob_head_misses': self.blob_head_misses,
+                'manifests_pushed': self.manifests_pushed,
+                'bytes_received': self.bytes_received,
+                'bytes_sent': self.bytes_sent,
+            }
+
+
+class FakeRegistryHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    NAME = r'(?P<name>[a-z0-9._/-]+?)'
+    ROUTES = [
+        ('GET', r'^/v2/$', 'base'),
+        ('HEAD', r'^/v2/%s/blobs/(?P<digest>sha256:[0-9a-f]{64})$' % NAME, 'blob_head'),
+        ('GET', r'^/v2/%s/blobs/(?P<digest>sha256:[0-9a-f]{64})$' % NAME, 'blob_get'),
+        ('POST', r'^/v2/%s/blobs/uploads/$' % NAME, 'upload_start'),
+        ('PATCH', r'^/v2/%s/blobs/uploads/(?P<upload>[0-9a-f-]+)$' % NAME, 'upload_chunk'),
+        ('PUT', r'^/v2/%s/blobs/uploads/(?P<upload>[0-9a-f-]+)$' % NAME, 'upload_finish'),
+        ('HEAD', r'^/v2/%s/manifests/(?P<reference>[^/]+)$' % NAME, 'manifest_head'),
+        ('GET', r'^/v2/%s/manifests/(?P<reference>[^/]+)$' % NAME, 'manifest_get'),
+        ('PUT', r'^/v2/%s/manifests/(?P<reference>[^/]+)$' % NAME, 'manifest_put'),
+        ('GET', r'^/v2/%s/tags/list$' % NAME, 'tags_list'),
+    ]
+    COMPILED_ROUTES = [(method, re.compile(regex), name) for method, regex, name in ROUTES]
+
+    @property
+    def registry(self):
+        return self.server.registry
+
+    def log_message(self, fmt, *args):
+        pass
+
+    # helpers
+
+    def read_body(self, throttled=False):
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        chunks = []
+        remaining = length
+        while remaining:
+            chunk = self.rfile.read(min(remaining, CHUNK_SIZE))
+            if not chunk:
+                break
+            if throttled:
+                self.registry.throttle.consume(len(chunk))
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b''.join(chunks)
+
+    def send_body(self, status, body=b'', headers=None, content_type='application/json',
+                  send_body=True, throttled=False):
+        self.send_response(status)
+        self.send_header('Docker-Distribution-API-Version', 'registry/2.0')
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if not send_body:
+            return
+        for start in range(0, len(body), CHUNK_SIZE):
+            chunk = body[start:start + CHUNK_SIZE]
+            if throttled:
+                self.registry.throttle.consume(len(chunk))
+            self.wfile.write(chunk)
+
+    def send_error_json(self, status, code, message):
+        body = json.dumps({'errors': [{'code': code, 'message': message}]}).encode('utf-8')
+        self.send_body(status, body)
+
+    # dispatch
+
+    def dispatch(self, method):
+        url = urlsplit(self.path)
+        self.query = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+        for route_method, regex, name in self.COMPILED_ROUTES:
+            if route_method != method:
+                continue
+            match = regex.match(url.path)
+            if match:
+                self.registry.stats.count(name)
+                if self.registry.latency:
+                    time.sleep(self.registry.latency)
+                getattr(self, 'do_' + name)(**match.groupdict())
+                return
+        self.read_body()
+        self.send_error_json(404, 'UNSUPPORTED', "%s %s" % (method, url.path))
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_HEAD(self):
+        self.dispatch('HEAD')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PATCH(self):
+        self.dispatch('PATCH')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    # endpoints
+
+    def do_base(self):
+        self.send_body(200, b'{}')
+
+    def do_blob_head(self, name, digest):
+        blob = self.registry.get_blob(digest)
+        if blob is None:
+            self.registry.stats.add(blob_head_misses=1)
+            self.send_body(404, send_body=False)
+            return
+        self.registry.stats.add(blob_head_hits=1)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(blob)))
+        self.send_header('Docker-Content-Digest', digest)
+        self.end_headers()
+
+    def do_blob_get(self, name, digest):
+        blob = self.registry.get_blob(digest)
+        if blob is None:
+            self.send_error_json(404, 'BLOB_UNKNOWN', digest)
+            return
+        self.registry.stats.add(bytes_sent=len(blob))
+        self.send_body(200, blob, headers={'Docker-Content-Digest': digest},
+                       content_type='application/octet-stream', throttled=True)
+
+    def do_upload_start(self, name):
+        mount = self.query.get('mount')
+        if mount and self.registry.get_blob(mount) is not None:
+            self.read_body()
+            self.registry.stats.add(blob_mounts=1)
+            self.send_body(201, headers={'Location': '/v2/%s/blobs/%s' % (name, mount),
+                                         'Docker-Content-Digest': mount})
+            return
+        data = self.read_body(throttled=True)
+        digest = self.query.get('digest')
+        if digest:
+            # monolithic upload
+            self.finish_upload(name, digest, data)
+            return
+        upload_id = self.registry.start_upload(data)
+        self.send_body(202, headers={'Location': '/v2/%s/blobs/uploads/%s' % (name, upload_id),
+                                     'Docker-Upload-UUID': upload_id,
+                                     'Range': '0-%d' % max(0, len(data) - 1)})
+
+    def do_upload_chunk(self, name, upload):
+        data = self.read_body(throttled=True)
+        size = self.registry.append_upload(upload, data)
+        if size is None:
+            self.send_error_json(404, 'BLOB_UPLOAD_UNKNOWN', upload)
+            return
+        self.send_body(202, headers={'Location': '/v2/%s/blobs/uploads/%s' % (name, upload),
+                                     'Docker-Upload-UUID': upload,
+                                     'Range': '0-%d' % max(0, size - 1)})
+
+    def do_upload_finish(self, name, upload):
+        data = self.read_body(throttled=True)
+        if self.registry.append_upload(upload, data) is None:
+            self.send_error_json(404, 'BLOB_UPLOAD_UNKNOWN', upload)
+            return
+        self.finish_upload(name, self.query.get('digest'), self.registry.pop_upload(upload))
+
+    def finish_upload(self, name, digest, data):
+        if digest != sha256_digest(data):
+            self.send_error_json(400, 'DIGEST_INVALID', "provided digest doesn't match content")
+            return
+        self.registry.put_blob(digest, data)
+        self.send_body(201, headers={'Location': '/v2/%s/blobs/%s' % (name, digest),
+                                     'Docker-Content-Digest': digest})
+
+    def do_manifest_head(self, name, reference):
+        self.do_manifest_get(name, reference, send_body=False)
+
+    def do_manifest_get(self, name, reference, send_body=True):
+        manifest = self.registry.get_manifest(name, reference)
+        if manifest is None:
+            if send_body:
+                self.send_error_json(404, 'MANIFEST_UNKNOWN', '%s:%s' % (name, reference))
+            else:
+                self.send_body(404, send_body=False)
+            return
+        self.send_body(200, manifest, headers={'Docker-Content-Digest': sha256_digest(manifest)},
+                       content_type=MANIFEST_MEDIA_TYPE, send_body=send_body)
+
+    def do_manifest_put(self, name, reference):
+        body = self.read_body()
+        try:
+            manifest = json.loads(body.decode('utf-8'))
+        except ValueError:
+            self.send_error_json(400, 'MANIFEST_INVALID', "manifest is not valid json")
+            return
+        for blob in [manifest.get('config', {})] + manifest.get('layers', []):
+            if self.registry.get_blob(blob.get('digest')) is None:
+                self.send_error_json(400, 'MANIFEST_BLOB_UNKNOWN', blob.get('digest'))
+                return
+        digest = self.registry.put_manifest(name, reference, body)
+        self.send_body(201, headers={'Location': '/v2/%s/manifests/%s' % (name, digest),
+                                     'Docker-Content-Digest': digest})
+
+    def do_tags_list(self, name):
+        tags = self.registry.get_tags(name)
+        if tags is None:
+            self.send_error_json(404, 'NAME_UNKNOWN', name)
+            return
+        self.send_body(200, json.dumps({'name': name, 'tags': tags}).encode('utf-8'))
+
+
+class FakeRegistryServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeRegistry(object):
+    """
+    fake registry running in a thread
+
+    :param bandwidth: int, bytes per second of blob transfers (both directions), None is unlimited
+    :param latency: float, seconds added to every API call
+    :param address: str, address to listen on
+    :param port: int, 0 picks random free port
+    """
+
+    def __init__(self, bandwidth=None, latency=0.0, address='127.0.0.1', port=0):
+        self.latency = latency
+        self.address = address
+        self.port = port
+        self.throttle = Throttle(bandwidth)
+        self.stats = RegistryStats()
+        self._lock = threading.Lock()
+        self.blobs = {}  # digest -> bytes, shared by all repositories
+        self.manifests = {}  # digest -> bytes
+        self.tags = {}  # repository -> {tag: digest}
+        self.uploads = {}  # upload id -> list of chunks
+        self._server = None
+        self._thread = None
+
+    @property
+    def netloc(self):
+        return '%s:%d' % (self.address, self.port)
+
+    @property
+    def url(self):
+        return 'http://' + self.netloc
+
+    # storage
+
+    def get_blob(self, digest):
+        with self._lock:
+            return self.blobs.get(digest)
+
+    def put_blob(self, digest, data):
+        with self._lock:
+            duplicate = digest in self.blobs
+            self.blobs[digest] = data
+        self.stats.add(blob_uploads=1, bytes_received=len(data),
+                       duplicate_uploads=int(duplicate), duplicate_bytes=len(data) if duplicate else 0)
+
+    def start_upload(self, data=b''):
+        upload_id = str(uuid.uuid4())
+        with self._lock:
+            self.uploads[upload_id] = [data]
+        return upload_id
+
+    def append_upload(self, upload_id, data):
+        """ :return: int, size of uploaded data so far, None if upload doesn't exist """
+        with self._lock:
+            chunks = self.uploads.get(upload_id)
+            if chunks is None:
+                return None
+            chunks.append(data)
+            return sum(len(c) for c in chunks)
+
+    def pop_upload(self, upload_id):
+        with self._lock:
+            return b''.join(self.uploads.pop(upload_id))
+
+    def get_manifest(self, name, reference):
+        with self._lock:
+            digest = reference if reference.startswith('sha256:') else \
+                self.tags.get(name, {}).get(reference)
+            return self.manifests.get(digest)
+
+    def put_manifest(self, name, reference, body):
+        digest = sha256_digest(body)
+        with self._lock:
+            self.manifests[digest] = body
+            if not reference.startswith('sha256:'):
+                self.tags.setdefault(name, {})[reference] = digest
+        self.stats.add(manifests_pushed=1)
+        return digest
+
+    def get_tags(self, name):
+        with self._lock:
+            tags = self.tags.get(name)
+            return None if tags is None else sorted(tags)
+
+    @property
+    def stored_bytes(self):
+        with self._lock:
+            return sum(len(b) for b in self.blobs.values())
+
+    # server
+
+    def start(self):
+        self._server = FakeRegistryServer((self.address, self.port), FakeRegistryHandler)
+        self._server.registry = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-registry")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def push_image(session, registry_url, repository, tag, config, layers):
+    """
+    push image the way docker does: blobs which are present are skipped
+
+    :param session: requests.Session
+    :param registry_url: str, e.g. 'http://127.0.0.1:5000'
+    :param repository: str, name of repository in the registry
+    :param tag: str
+    :param config: bytes, image config
+    :param layers: list of bytes
+    :return: generator of (status, digest, size) tuples; status is 'pushed' or 'exists',
+             last item is ('manifest', digest, size)
+    """
+    descriptors = []
+    for media_type, blob in [(CONFIG_MEDIA_TYPE, config)] + [(LAYER_MEDIA_TYPE, l) for l in layers]:
+        digest = sha256_digest(blob)
+        descriptors.append({'mediaType': media_type, 'digest': digest, 'size': len(blob)})
+        blob_url = '%s/v2/%s/blobs/%s' % (registry_url, repository, digest)
+        if session.head(blob_url).status_code == 200:
+            yield 'exists', digest, len(blob)
+            continue
+        response = session.post('%s/v2/%s/blobs/uploads/' % (registry_url, repository))
+        response.raise_for_status()
+        location = response.headers['Location']
+        if location.startswith('/'):
+            location = registry_url + location
+        response = session.put(location, params={'digest': digest}, data=blob,
+                               headers={'Content-Type': 'application/octet-stream'})
+        response.raise_for_status()
+        yield 'pushed', digest, len(blob)
+    manifest = json.dumps({
+        'schemaVersion': 2,
+        'mediaType': MANIFEST_MEDIA_TYPE,
+        'config': descriptors[0],
+        'layers': descriptors[1:],
+    }, sort_keys=True).encode('utf-8')
+    response = session.put('%s/v2/%s/manifests/%s' % (registry_url, repository, tag),
+                           data=manifest, headers={'Content-Type': MANIFEST_MEDIA_TYPE})
+    response.raise_for_status()
+    yield 'manifest', response.headers['Docker-Content-Digest'], len(manifest)
+
+
+def push_layer(registry, repository, tag, layer):
+    """
+    push image with one layer and empty config to FakeRegistry
+
+    :return: str, digest of manifest
+    """
+    session = requests.Session()
+    return list(push_image(session, registry.url, repository, tag, b'{}', [layer]))[-1][1]
+
+
+def pull_image(session, registry_url, repository, tag):
+    """
+    :return: tuple, (str manifest digest, bytes config, list of bytes layers)
+             or None if the image doesn't exist
+    """
+    response = session.get('%s/v2/%s/manifests/%s' % (registry_url, repository, tag),
+                           headers={'Accept': MANIFEST_MEDIA_TYPE})
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    manifest = response.json()
+    blobs = []
+    for blob in [manifest['config']] + manifest['layers']:
+        blob_response = session.get('%s/v2/%s/blobs/%s' % (registry_url, repository, blob['digest']))
+        blob_response.raise_for_status()
+        if sha256_digest(blob_response.content) != blob['digest']:
+            raise RuntimeError("digest of blob '%s' doesn't match" % blob['digest'])
+        blobs.append(blob_response.content)
+    return response.headers['Docker-Content-Digest'], blobs[0], blobs[1:]
@@ -0,0 +1,29 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import os
+
+import git
+
+
+def make_git_repo(path):
+    """
+    create git repo with a Dockerfile committed
+
+    :param path: str, directory of the repo
+    :return: str, path
+    """
+    repo = git.Repo.init(path)
+    with open(os.path.join(path, 'Dockerfile'), 'w') as fp:
+        fp.write("FROM fedora\nCMD true\n")
+    repo.index.add(['Dockerfile'])
+    actor = git.Actor('Test', 'test@example.com')
+    repo.index.commit('dockerfile', author=actor, committer=actor)
+    return path
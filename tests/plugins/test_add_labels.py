@@ -15,6 +15,7 @@ except ImportError:
     # Python 2.6
     from ordereddict import OrderedDict
 from dock.core import DockerTasker
+from dock.dockerfile import Dockerfile
 from dock.inner import DockerBuildWorkflow
 from dock.plugin import PreBuildPluginsRunner
 from dock.plugins.pre_add_labels_in_df import AddLabelsPlugin
@@ -41,6 +42,7 @@ CMD blabla"""
     workflow = DockerBuildWorkflow("asd", "test-image")
     setattr(workflow, 'builder', X)
     setattr(workflow.builder, 'df_path', tmp_df)
+    setattr(workflow.builder, 'dockerfile', Dockerfile(tmp_df))
 
     labels_conf = OrderedDict({'label1': 'value 1', 'label2': 'long value'})
 
@@ -54,6 +56,7 @@ CMD blabla"""
     )
     runner.run()
     assert AddLabelsPlugin.key is not None
+    workflow.builder.dockerfile.write()
     with open(tmp_df, 'r') as fd:
         altered_df = fd.read()
     # Can't be sure of the order of the labels, expect either
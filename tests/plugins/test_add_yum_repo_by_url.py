@@ -16,10 +16,7 @@ from flexmock import flexmock
 import requests
 
 
-def fake_get(url):
-    # Mock requests.get
-    if url.endswith("2repos.repo"):
-        text = """
+REPO_2REPOS = """
 [test1]
 name=Test 1 $releasever - $basearch (ignored)
 baseurl=http://example.com/xyzzy/repo1/$releasever/
@@ -33,8 +30,8 @@ baseurl=http://example.com/xyzzy/repo2/$releasever/
 enabled=1
 gpgcheck=1
 """
-    else:
-        text = """
+
+REPO_1REPO = """
 [test3]
 name=Test 3 $releasever - $basearch (ignored)
 metalink=https://mirrors.fedoraproject.org/metalink?repo=fedora-$releasever&arch=$basearch
@@ -43,20 +40,27 @@ gpgcheck=1
 gpgkey=file:///etc/pki/rpm-gpg/RPM-GPG-KEY-fedora-$releasever-$basearch
 """
 
-    try:
-        # py2
-        text = unicode(text)
-    except:
-        # py3
-        pass
 
-    response = (flexmock(requests.Response,
-                         text=text)
-                .should_receive(name='raise_for_status')
-                .and_return(None)
-                .mock())
+class FakeResponse(object):
+    def __init__(self, text, status_code=200, headers=None):
+        self.text = text
+        self.status_code = status_code
+        self.headers = headers or {}
 
-    return response
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(self.status_code)
+
+
+def fake_get(url, headers=None):
+    # Mock requests.Session.get
+    if url.endswith("2repos.repo"):
+        text = REPO_2REPOS
+    else:
+        text = REPO_1REPO
+    if headers and headers.get('If-None-Match') == '"%s"' % url:
+        return FakeResponse('', status_code=304)
+    return FakeResponse(text, headers={'ETag': '"%s"' % url})
 
 
 class X(object):
@@ -75,7 +79,7 @@ def prepare(tmpdir):
     setattr(workflow.builder, 'base_image', ImageName(repo='Fedora', tag='21'))
     setattr(workflow.builder, 'git_dockerfile_path', None)
     setattr(workflow.builder, 'git_path', None)
-    flexmock(requests, get=fake_get)
+    flexmock(requests.Session, get=fake_get)
     return tasker, workflow
 
 def test_no_repourls(tmpdir):
@@ -91,8 +95,8 @@ def test_single_repourl(tmpdir):
     tasker, workflow = prepare(tmpdir)
     runner = PreBuildPluginsRunner(tasker, workflow, [{
         'name': AddYumRepoByUrlPlugin.key,
-        'args': { 'repourls': ['http://example.com/2repos.repo'] }}])
-    runner.plugin_classes[AddYumRepoByUrlPlugin.key]._get = fake_get
+        'args': { 'repourls': ['http://example.com/2repos.repo'],
+                  'cache_dir': str(tmpdir) }}])
     runner.run()
 
     assert len (workflow.repos['yum']) == 2
@@ -114,8 +118,8 @@ def test_multiple_repourls(tmpdir):
     runner = PreBuildPluginsRunner(tasker, workflow, [{
         'name': AddYumRepoByUrlPlugin.key,
         'args': { 'repourls': ['http://example.com/2repos.repo',
-                               'http://example.com/xyzzy'] }}])
-    runner.plugin_classes[AddYumRepoByUrlPlugin.key]._get = fake_get
+                               'http://example.com/xyzzy'],
+                  'cache_dir': str(tmpdir) }}])
     runner.run()
 
     assert len (workflow.repos['yum']) == 3
@@ -138,3 +142,16 @@ def test_multiple_repourls(tmpdir):
                   'gpgcheck': r'1',
                   'gpgkey': r'file:///etc/pki/rpm-gpg/RPM-GPG-KEY-fedora-$releasever-$basearch' }
     assert expected3 in workflow.repos['yum']
+
+
+def test_repourls_order_and_cache(tmpdir):
+    repourls = ['http://example.com/xyzzy', 'http://example.com/2repos.repo']
+    for _ in range(2):
+        # second run gets 304 for both repo files and uses cached content
+        tasker, workflow = prepare(tmpdir)
+        runner = PreBuildPluginsRunner(tasker, workflow, [{
+            'name': AddYumRepoByUrlPlugin.key,
+            'args': { 'repourls': repourls,
+                      'cache_dir': str(tmpdir) }}])
+        runner.run()
+        assert [repo['name'] for repo in workflow.repos['yum']] == ['test3', 'test1', 'test2']
@@ -0,0 +1,217 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+import hashlib
+import os
+import threading
+
+import pytest
+
+from dock.artefacts import Artefact, ArtefactStore, parse_sources
+from dock.core import DockerTasker
+from dock.inner import DockerBuildWorkflow
+from dock.plugin import PreBuildPluginsRunner, PluginFailedException
+from dock.plugins.pre_pyrpkg_fetch_artefacts import DistgitFetchArtefactsPlugin
+from dock.util import ImageName
+from dock.yum_proxy import ThreadingHTTPServer
+from tests.constants import DOCKERFILE_GIT
+
+try:
+    # py2
+    from BaseHTTPServer import BaseHTTPRequestHandler
+except ImportError:
+    # py3
+    from http.server import BaseHTTPRequestHandler
+
+
+EMPTY_MD5 = hashlib.md5(b'').hexdigest()
+LOOKASIDE_FILES = {
+    '/pkgs/test/foo-1.0.tar.gz': b'foo' * 1000,
+    '/pkgs/test/bar-2.0.tar.gz': b'bar' * 1000,
+    '/pkgs/test/broken.tar.gz': b'not what sources file says',
+}
+
+
+class LookasideHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        try:
+            content = LOOKASIDE_FILES[self.path]
+        except KeyError:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+@pytest.fixture
+def lookaside(request):
+    LookasideHandler.requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), LookasideHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    def stop():
+        server.shutdown()
+        server.server_close()
+    request.addfinalizer(stop)
+    return 'http://127.0.0.1:%d/pkgs/%%(package)s/%%(filename)s' % server.server_address[1]
+
+
+def sha512(content):
+    return hashlib.sha512(content).hexdigest()
+
+
+class X(object):
+    pass
+
+
+def prepare(git_path):
+    tasker = DockerTasker()
+    workflow = DockerBuildWorkflow(DOCKERFILE_GIT, "test-image")
+    setattr(workflow, 'builder', X)
+    setattr(workflow.builder, 'image_id', "asd123")
+    setattr(workflow.builder, 'base_image', ImageName(repo='Fedora', tag='21'))
+    setattr(workflow.builder, 'git_dockerfile_path', None)
+    setattr(workflow.builder, 'git_path', git_path)
+    return tasker, workflow
+
+
+def test_parse_sources():
+    artefacts = parse_sources("%s  empty.tar.gz\nSHA512 (foo-1.0.tar.gz) = ABCDEF\n" % EMPTY_MD5)
+    assert [(a.filename, a.hashtype, a.checksum) for a in artefacts] == [
+        ('empty.tar.gz', 'md5', EMPTY_MD5),
+        ('foo-1.0.tar.gz', 'sha512', 'abcdef'),
+    ]
+
+
+@pytest.mark.parametrize('filename', ['../../x', '/etc/x', 'dir/x', '..'])
+def test_parse_sources_rejects_paths(filename):
+    with pytest.raises(RuntimeError):
+        parse_sources("SHA512 (%s) = abcdef\n" % filename)
+    with pytest.raises(RuntimeError):
+        parse_sources("%s  %s\n" % (EMPTY_MD5, filename))
+
+
+def test_artefacts_stay_in_clone(tmpdir):
+    victim = tmpdir.join('victim')
+    victim.write('important')
+    git_path = tmpdir.mkdir('clone')
+    sources = "%s  ../victim\n" % EMPTY_MD5
+    # store has the artefact, so it would be linked over the file right away
+    store = ArtefactStore(str(tmpdir.join('cache')))
+    empty = str(tmpdir.join('empty'))
+    open(empty, 'w').close()
+    store.add(Artefact('../victim', 'md5', EMPTY_MD5), empty)
+    with pytest.raises(PluginFailedException):
+        run_fetch(tmpdir, 'clone2', sources, {'command': 'true'})
+    with pytest.raises(RuntimeError):
+        store.link(Artefact('../victim', 'md5', EMPTY_MD5), str(git_path))
+    assert victim.read() == 'important'
+
+
+def test_fetch_artefacts_cached(tmpdir):
+    cache_dir = str(tmpdir.join('cache'))
+    sources = "%s  empty.tar.gz\n" % EMPTY_MD5
+    for attempt in range(2):
+        git_path = str(tmpdir.join('clone%d' % attempt))
+        os.mkdir(git_path)
+        with open(os.path.join(git_path, 'sources'), 'w') as fp:
+            fp.write(sources)
+        tasker, workflow = prepare(git_path)
+        # command doesn't exist second time: artefact has to come from the store
+        command = 'touch empty.tar.gz' if attempt == 0 else 'false'
+        runner = PreBuildPluginsRunner(tasker, workflow, [{
+            'name': DistgitFetchArtefactsPlugin.key,
+            'args': {'command': command, 'cache_dir': cache_dir},
+        }])
+        runner.run()
+        assert workflow.prebuild_results[DistgitFetchArtefactsPlugin.key] == sources
+        assert os.path.isfile(os.path.join(git_path, 'empty.tar.gz'))
+    assert os.path.isfile(os.path.join(cache_dir, 'md5', EMPTY_MD5))
+
+
+def run_fetch(tmpdir, name, sources, args):
+    git_path = str(tmpdir.join(name))
+    os.mkdir(git_path)
+    with open(os.path.join(git_path, 'sources'), 'w') as fp:
+        fp.write(sources)
+    tasker, workflow = prepare(git_path)
+    plugin_args = {'cache_dir': str(tmpdir.join('cache')), 'package': 'test'}
+    plugin_args.update(args)
+    runner = PreBuildPluginsRunner(tasker, workflow, [{
+        'name': DistgitFetchArtefactsPlugin.key,
+        'args': plugin_args,
+    }])
+    runner.run()
+    return git_path
+
+
+def test_fetch_artefacts_from_lookaside(tmpdir, lookaside):
+    foo = LOOKASIDE_FILES['/pkgs/test/foo-1.0.tar.gz']
+    bar = LOOKASIDE_FILES['/pkgs/test/bar-2.0.tar.gz']
+    sources = "SHA512 (foo-1.0.tar.gz) = %s\nSHA512 (bar-2.0.tar.gz) = %s\n" % (
+        sha512(foo), sha512(bar))
+    args = {'command': 'false', 'lookaside_url': lookaside, 'max_workers': 2}
+    for attempt in range(2):
+        git_path = run_fetch(tmpdir, 'clone%d' % attempt, sources, args)
+        for filename, content in (('foo-1.0.tar.gz', foo), ('bar-2.0.tar.gz', bar)):
+            with open(os.path.join(git_path, filename), 'rb') as fp:
+                assert fp.read() == content
+    # second build is served from the store
+    assert sorted(LookasideHandler.requests) == ['/pkgs/test/bar-2.0.tar.gz',
+                                                 '/pkgs/test/foo-1.0.tar.gz']
+
+
+def test_fetch_artefacts_checksum_mismatch(tmpdir, lookaside):
+    sources = "SHA512 (broken.tar.gz) = %s\n" % sha512(b'expected content')
+    args = {'command': 'false', 'lookaside_url': lookaside}
+    with pytest.raises(PluginFailedException):
+        run_fetch(tmpdir, 'clone', sources, args)
+    # nothing is stored
+    assert os.listdir(str(tmpdir.join('cache', 'sha512'))) == []
+
+
+def test_fetch_artefacts_command_gets_only_missing(tmpdir):
+    cached = b'cached'
+    sources = "SHA512 (cached.tar.gz) = %s\nSHA512 (new.tar.gz) = %s\n" % (
+        sha512(cached), sha512(b''))
+    store = ArtefactStore(str(tmpdir.join('cache')))
+    path = str(tmpdir.join('cached.tar.gz'))
+    with open(path, 'wb') as fp:
+        fp.write(cached)
+    store.add(parse_sources(sources)[0], path)
+
+    # the command sees cached artefact in the clone (and fails if it doesn't)
+    script = str(tmpdir.join('fetch.sh'))
+    with open(script, 'w') as fp:
+        fp.write('test -f cached.tar.gz && touch new.tar.gz\n')
+    git_path = run_fetch(tmpdir, 'clone', sources, {'command': 'sh %s' % script})
+    assert os.path.isfile(os.path.join(git_path, 'new.tar.gz'))
+    assert store.contains(parse_sources(sources)[1])
+
+
+def test_store_add_checksum_mismatch(tmpdir):
+    store = ArtefactStore(str(tmpdir.join('cache')))
+    artefact = parse_sources("SHA512 (foo.tar.gz) = %s\n" % sha512(b'foo'))[0]
+    path = str(tmpdir.join('foo.tar.gz'))
+    with open(path, 'wb') as fp:
+        fp.write(b'bar')
+    with pytest.raises(RuntimeError):
+        store.add(artefact, path)
+    assert not store.contains(artefact)
+    assert os.listdir(str(tmpdir.join('cache', 'sha512'))) == []
@@ -0,0 +1,125 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import print_function
+
+import uuid
+
+import pytest
+
+from dock.core import DockerTasker
+from dock.inner import DockerBuildWorkflow
+from dock.plugin import PreBuildPluginsRunner
+from dock.plugins.pre_koji import KojiPlugin
+
+
+class FakeHub(object):
+    """ koji.ClientSession: multicall semantics, counts round trips """
+
+    def __init__(self, targets, repos):
+        self.targets = targets  # target -> build tag name
+        self.repos = repos  # tag -> repo ID
+        self.multicall = False
+        self.round_trips = 0
+        self._calls = []
+
+    def _call(self, method, *args):
+        if self.multicall:
+            self._calls.append((method, args))
+            return None
+        self.round_trips += 1
+        return method(*args)
+
+    def _get_build_target(self, target):
+        if target not in self.targets:
+            return None
+        return {'name': target, 'build_tag_name': self.targets[target]}
+
+    def _get_repo(self, tag):
+        if tag not in self.repos:
+            raise RuntimeError("No such tagInfo: '%s'" % tag)
+        return {'id': self.repos[tag]}
+
+    def getBuildTarget(self, target):
+        return self._call(self._get_build_target, target)
+
+    def getRepo(self, tag):
+        return self._call(self._get_repo, tag)
+
+    def multiCall(self, strict=False):
+        assert not strict
+        self.round_trips += 1
+        results = []
+        for method, args in self._calls:
+            try:
+                results.append([method(*args)])
+            except RuntimeError as ex:
+                results.append({'faultCode': 1000, 'faultString': str(ex)})
+        self.multicall = False
+        self._calls = []
+        return results
+
+
+def make_plugin(hub, target, target_ttl=60):
+    workflow = DockerBuildWorkflow("asd", "test-image")
+    runner = PreBuildPluginsRunner(DockerTasker(), workflow, [])
+    plugin_class = runner.plugin_classes[KojiPlugin.key]
+    # every test has its own hub, so it doesn't share cache entries with other tests
+    plugin = plugin_class(DockerTasker(), workflow, target, 'http://%s/kojihub' % hub, '/mnt/koji',
+                          target_ttl=target_ttl)
+    return plugin
+
+
+def test_resolve_in_one_round_trip():
+    hub = FakeHub({'f22': 'f22-build'}, {'f22-build': 1})
+    plugin = make_plugin(uuid.uuid4().hex, 'f22')
+    plugin.xmlrpc = hub
+    assert plugin.get_repo() == {'build_tag_name': 'f22-build', 'repo_id': 1}
+    assert hub.round_trips == 1
+
+    # cache hit
+    assert plugin.get_repo() == {'build_tag_name': 'f22-build', 'repo_id': 1}
+    assert hub.round_trips == 1
+
+
+def test_resolve_unconventional_tag():
+    hub = FakeHub({'my-target': 'my-tag'}, {'my-tag': 7})
+    plugin = make_plugin(uuid.uuid4().hex, 'my-target')
+    plugin.xmlrpc = hub
+    assert plugin.get_repo() == {'build_tag_name': 'my-tag', 'repo_id': 7}
+    assert hub.round_trips == 2
+
+
+def test_repo_id_change():
+    hub_name = uuid.uuid4().hex
+    hub = FakeHub({'my-target': 'my-tag'}, {'my-tag': 7})
+    plugin = make_plugin(hub_name, 'my-target', target_ttl=0)
+    plugin.xmlrpc = hub
+    assert plugin.get_repo()['repo_id'] == 7
+    assert hub.round_trips == 2
+
+    # expired entry is revalidated in one multicall using its build tag
+    hub.repos['my-tag'] = 8
+    assert plugin.get_repo() == {'build_tag_name': 'my-tag', 'repo_id': 8}
+    assert hub.round_trips == 3
+
+    # instance with different TTL doesn't use entries of the short-lived cache
+    plugin = make_plugin(hub_name, 'my-target', target_ttl=3600)
+    plugin.xmlrpc = hub
+    assert plugin.get_repo()['repo_id'] == 8
+    assert hub.round_trips == 5
+    assert plugin.get_repo()['repo_id'] == 8
+    assert hub.round_trips == 5
+
+
+def test_unknown_target():
+    hub = FakeHub({}, {})
+    plugin = make_plugin(uuid.uuid4().hex, 'missing')
+    plugin.xmlrpc = hub
+    with pytest.raises(RuntimeError):
+        plugin.get_repo()
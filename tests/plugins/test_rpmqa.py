@@ -0,0 +1,115 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import print_function
+
+import uuid
+
+import dock.rpmdb
+from dock.inner import DockerBuildWorkflow
+from dock.plugin import PostBuildPluginsRunner
+from dock.plugins.post_rpmqa import PostBuildRPMqaPlugin
+from dock.util import ImageName
+
+
+BASE_RPM_OUTPUT = [
+    'setup,2.9.6,1.fc22,noarch,(none),696293,12c7b4a8c1bfe1f2a3e8cb1da7e5b6b8,1427728476',
+    'bash,4.3.39,1.fc22,x86_64,(none),3601232,5a2c9f1aa7e1af2d3b2d0a9d02c3e6b4,1432127722',
+    'vim-minimal,7.4.640,4.fc22,x86_64,2,1004416,8e7c1bd36b3fdb0d1ab0e9b97e86f0d9,1431086102',
+]
+RPM_OUTPUT = [
+    'bash,4.3.39,2.fc22,x86_64,(none),3601232,aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa,1434000000',
+    'setup,2.9.6,1.fc22,noarch,(none),696293,12c7b4a8c1bfe1f2a3e8cb1da7e5b6b8,1427728476',
+    'python,2.7.10,1.fc22,x86_64,(none),80000,bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb,1433000000',
+]
+
+
+class FakeTasker(object):
+    """ runs rpm in "containers": output is looked up by image """
+
+    def __init__(self, packages):
+        self.packages = packages  # image -> rpm output
+        # package lists are cached per layer ID within process
+        self.layer_ids = dict((image, uuid.uuid4().hex) for image in packages)
+        self.queried = []
+
+    def inspect_image(self, image):
+        return {'Id': self.layer_ids[str(image)]}
+
+    def run(self, image, **kwargs):
+        self.queried.append(str(image))
+        return str(image)
+
+    def wait(self, container_id):
+        return 0
+
+    def logs(self, container_id, stream=False):
+        return self.packages[container_id]
+
+    def remove_container(self, container_id):
+        pass
+
+
+class X(object):
+    image_id = "my-image"
+    git_dockerfile_path = None
+    git_path = None
+    base_image = ImageName(repo='fedora', tag='22')
+
+
+def run_plugin(tasker, tmpdir, args=None):
+    workflow = DockerBuildWorkflow("asd", "test-image")
+    setattr(workflow, 'builder', X)
+    plugin_args = {'image_id': 'my-image', 'cache_dir': str(tmpdir)}
+    plugin_args.update(args or {})
+    runner = PostBuildPluginsRunner(tasker, workflow, [{
+        'name': PostBuildRPMqaPlugin.key,
+        'args': plugin_args,
+    }])
+    return runner.run()[PostBuildRPMqaPlugin.key]
+
+
+def test_rpmqa_package_table_and_diff(tmpdir):
+    tasker = FakeTasker({'my-image': RPM_OUTPUT, 'fedora:22': BASE_RPM_OUTPUT})
+    result = run_plugin(tasker, tmpdir)
+    assert sorted(result) == ['base_image', 'base_image_diff', 'packages']
+    assert result['packages']['name'] == ['bash', 'python', 'setup']
+    assert result['packages']['epoch'] == [None, None, None]
+    assert result['packages']['buildtime'] == [1434000000, 1433000000, 1427728476]
+    assert result['base_image'] == 'fedora:22'
+    diff = result['base_image_diff']
+    assert diff['added']['name'] == ['python']
+    assert diff['changed']['name'] == ['bash']
+    assert diff['removed']['name'] == ['vim-minimal']
+    assert tasker.queried == ['my-image', 'fedora:22']
+
+    # base image inventory is cached
+    run_plugin(tasker, tmpdir)
+    assert tasker.queried == ['my-image', 'fedora:22']
+    # on disk as well, for builds in other processes
+    dock.rpmdb._packages_cache.clear()
+    run_plugin(tasker, tmpdir)
+    assert tasker.queried == ['my-image', 'fedora:22']
+
+
+def test_rpmqa_without_diff(tmpdir):
+    tasker = FakeTasker({'my-image': RPM_OUTPUT, 'fedora:22': BASE_RPM_OUTPUT})
+    result = run_plugin(tasker, tmpdir, {'diff_base_image': False})
+    assert result['packages']['name'] == ['bash', 'python', 'setup']
+    assert result['base_image'] is None
+    assert result['base_image_diff'] is None
+    assert tasker.queried == ['my-image']
+
+
+def test_rpmqa_base_image_failure(tmpdir):
+    # base image can't be queried: packages are still listed
+    tasker = FakeTasker({'my-image': RPM_OUTPUT})
+    result = run_plugin(tasker, tmpdir)
+    assert result['packages']['name'] == ['bash', 'python', 'setup']
+    assert result['base_image'] == 'fedora:22'
+    assert result['base_image_diff'] is None
@@ -0,0 +1,97 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import print_function
+
+import json
+
+import pytest
+from flexmock import flexmock
+
+from dock.core import DockerTasker
+from dock.inner import DockerBuildWorkflow
+from dock.plugin import PostBuildPluginsRunner
+from dock.plugins.post_store_metadata_in_osv3 import StoreMetadataInOSv3Plugin
+from dock.rpmdb import create_package_table, diff_package_tables
+from dock.util import ImageName
+
+
+BASE_RPM_OUTPUT = [
+    'setup,2.9.6,1.fc22,noarch,(none),696293,12c7b4a8c1bfe1f2a3e8cb1da7e5b6b8,1427728476',
+    'bash,4.3.39,1.fc22,x86_64,(none),3601232,5a2c9f1aa7e1af2d3b2d0a9d02c3e6b4,1432127722',
+]
+RPM_OUTPUT = [
+    'bash,4.3.39,2.fc22,x86_64,(none),3601232,aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa,1434000000',
+    'setup,2.9.6,1.fc22,noarch,(none),696293,12c7b4a8c1bfe1f2a3e8cb1da7e5b6b8,1427728476',
+]
+
+
+class X(object):
+    image_id = "my-image"
+    git_dockerfile_path = None
+    git_path = None
+    base_image = ImageName(repo='fedora', tag='22')
+    image = ImageName(repo='my-image')
+
+
+def prepare(rpm_packages):
+    workflow = DockerBuildWorkflow("asd", "test-image")
+    setattr(workflow, 'builder', X)
+    if rpm_packages is not None:
+        workflow.postbuild_results["all_rpm_packages"] = rpm_packages
+    tasker = DockerTasker()
+    runner = PostBuildPluginsRunner(tasker, workflow, [{
+        'name': StoreMetadataInOSv3Plugin.key,
+        'args': {'url': 'http://example.com/'},
+    }])
+    plugin_class = runner.plugin_classes[StoreMetadataInOSv3Plugin.key]
+    return workflow, runner, plugin_class(tasker, workflow, url='http://example.com/')
+
+
+def test_rpm_packages_with_diff():
+    packages = create_package_table(RPM_OUTPUT)
+    diff = diff_package_tables(create_package_table(BASE_RPM_OUTPUT), packages)
+    _, _, plugin = prepare({"packages": packages, "base_image": "fedora:22",
+                            "base_image_diff": diff})
+    rpm_packages, rpm_packages_diff = plugin.get_rpm_packages()
+    # the annotation keeps its line format
+    assert rpm_packages.split("\n") == sorted(RPM_OUTPUT)
+    assert json.loads(rpm_packages_diff) == diff
+    assert json.loads(rpm_packages_diff)['changed']['name'] == ['bash']
+
+
+def test_rpm_packages_without_diff():
+    packages = create_package_table(RPM_OUTPUT)
+    _, _, plugin = prepare({"packages": packages, "base_image": None, "base_image_diff": None})
+    rpm_packages, rpm_packages_diff = plugin.get_rpm_packages()
+    assert rpm_packages.split("\n") == sorted(RPM_OUTPUT)
+    assert rpm_packages_diff == ""
+
+
+def test_rpm_packages_missing():
+    # all_rpm_packages didn't run or failed
+    _, _, plugin = prepare(None)
+    assert plugin.get_rpm_packages() == ("", "")
+    _, _, plugin = prepare(RuntimeError("rpm failed"))
+    assert plugin.get_rpm_packages() == ("", "")
+
+
+def test_annotations(monkeypatch):
+    pytest.importorskip("osbs")
+    from osbs.core import Openshift
+    monkeypatch.setenv("BUILD", json.dumps({"metadata": {"name": "build-1"}}))
+    packages = create_package_table(RPM_OUTPUT)
+    workflow, runner, _ = prepare({"packages": packages, "base_image": None, "base_image_diff": None})
+    workflow.tag_and_push_conf.add_image("localhost:5000", "my-image")
+    annotations = {}
+    (flexmock(Openshift)
+        .should_receive('set_annotations_on_build')
+        .replace_with(lambda build_id, labels: annotations.update(labels)))
+    runner.run()
+    assert annotations["rpm-packages"].split("\n") == sorted(RPM_OUTPUT)
+    assert annotations["rpm-packages-diff"] == ""
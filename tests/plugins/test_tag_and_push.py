@@ -8,15 +8,22 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import print_function
 
+import threading
+import time
+
+import pytest
+
 from dock.core import DockerTasker
 from dock.inner import DockerBuildWorkflow
-from dock.plugin import PostBuildPluginsRunner
+from dock.plugin import PostBuildPluginsRunner, PluginFailedException
 from dock.plugins.post_tag_and_push import TagAndPushPlugin
 from dock.util import ImageName
 from tests.constants import LOCALHOST_REGISTRY, TEST_IMAGE, INPUT_IMAGE, MOCK
 
 if MOCK:
-    from tests.docker_mock import mock_docker
+    import docker
+    from flexmock import flexmock
+    from tests.docker_mock import mock_docker, mock_push_logs_succeeded
 
 
 class X(object):
@@ -29,6 +36,7 @@ class X(object):
 def test_tag_and_push_plugin(tmpdir):
     if MOCK:
         mock_docker()
+        flexmock(docker.Client, push=lambda iid, **kwargs: mock_push_logs_succeeded)
 
     tasker = DockerTasker()
     workflow = DockerBuildWorkflow("asd", "test-image")
@@ -54,3 +62,93 @@ def test_tag_and_push_plugin(tmpdir):
     output = runner.run()
     image = output[TagAndPushPlugin.key][0]
     tasker.remove_image(image)
+
+
+class ConcurrencyTasker(object):
+    """
+    records how many pushes ran at once, per registry and in total, and which
+    threads used which clone of the tasker
+    """
+
+    def __init__(self, failing=(), root=None):
+        self.root = root or self
+        if root is not None:
+            return
+        self.failing = failing  # names of images which fail to push
+        self.lock = threading.Lock()
+        self.running = {}
+        self.max_running = {}
+        self.max_total = 0
+        self.threads = {}  # id of tasker -> set of idents of threads which used it
+
+    def clone(self):
+        return ConcurrencyTasker(root=self.root)
+
+    def tag_and_push_images(self, image, target_images, insecure=False):
+        root = self.root
+        registry = target_images[0].registry
+        with root.lock:
+            root.threads.setdefault(id(self), set()).add(threading.current_thread().ident)
+            root.running[registry] = root.running.get(registry, 0) + 1
+            root.max_running[registry] = max(root.max_running.get(registry, 0),
+                                             root.running[registry])
+            root.max_total = max(root.max_total, sum(root.running.values()))
+        time.sleep(0.05)
+        with root.lock:
+            root.running[registry] -= 1
+        results = {}
+        for name in target_images:
+            name = name.to_str()
+            if name in root.failing:
+                results[name] = {'result': 'failed', 'seconds': 0.05, 'bytes': 0,
+                                 'bytes_per_second': None, 'error': 'unauthorized'}
+            else:
+                results[name] = {'result': 'pushed', 'seconds': 0.05, 'bytes': 10 ** 6,
+                                 'bytes_per_second': 2 * 10 ** 7, 'error': None}
+        return results
+
+
+def test_tag_and_push_concurrently():
+    tasker = ConcurrencyTasker()
+    workflow = DockerBuildWorkflow("asd", "test-image")
+    setattr(workflow, 'builder', X)
+    names = ["repo%d:%s" % (i, tag) for i in range(4) for tag in ("1", "latest")]
+    runner = PostBuildPluginsRunner(tasker, workflow, [{
+        'name': TagAndPushPlugin.key,
+        'args': {
+            "mapping": {
+                "registry-b.example.com": {"image_names": names},
+                "registry-a.example.com": {"image_names": names[:2]},
+            },
+            "max_pushes_per_registry": 2,
+        }
+    }])
+    output = runner.run()[TagAndPushPlugin.key]
+    assert output == ["registry-a.example.com/" + name for name in names[:2]] + \
+        ["registry-b.example.com/" + name for name in names]
+    assert tasker.max_running == {"registry-a.example.com": 1, "registry-b.example.com": 2}
+    assert tasker.max_total == 3
+    # every worker has its own tasker, the plugin's one isn't used
+    assert id(tasker) not in tasker.threads
+    assert all(len(threads) == 1 for threads in tasker.threads.values())
+    assert [stats['image'] for stats in workflow.push_stats] == output
+
+
+def test_tag_and_push_failure():
+    tasker = ConcurrencyTasker(failing=["registry-a.example.com/repo:1"])
+    workflow = DockerBuildWorkflow("asd", "test-image")
+    setattr(workflow, 'builder', X)
+    runner = PostBuildPluginsRunner(tasker, workflow, [{
+        'name': TagAndPushPlugin.key,
+        'args': {
+            "mapping": {
+                "registry-a.example.com": {"image_names": ["repo:1"]},
+                "registry-b.example.com": {"image_names": ["repo:1"]},
+            },
+        }
+    }])
+    with pytest.raises(PluginFailedException):
+        runner.run()
+    # other pushes finished anyway
+    assert [(stats['image'], stats['result']) for stats in workflow.push_stats] == \
+        [("registry-a.example.com/repo:1", "failed"), ("registry-b.example.com/repo:1", "pushed")]
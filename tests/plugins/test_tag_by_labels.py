@@ -17,7 +17,9 @@ from dock.util import ImageName
 from tests.constants import LOCALHOST_REGISTRY, TEST_IMAGE, INPUT_IMAGE, MOCK
 
 if MOCK:
-    from tests.docker_mock import mock_docker
+    import docker
+    from flexmock import flexmock
+    from tests.docker_mock import mock_docker, mock_push_logs_succeeded
 
 
 class X(object):
@@ -30,6 +32,7 @@ class X(object):
 def test_tag_by_labels_plugin(tmpdir):
     if MOCK:
         mock_docker()
+        flexmock(docker.Client, push=lambda iid, **kwargs: mock_push_logs_succeeded)
 
     tasker = DockerTasker()
     workflow = DockerBuildWorkflow("asd", "test-image")
@@ -0,0 +1,96 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+import os
+
+import git
+
+from dock.core import DockerTasker
+from dock.inner import DockerBuildWorkflow
+from dock.plugin import PrePublishPluginsRunner
+from dock.plugins.prepub_tests_for_image import ImageTestPlugin, merge_results
+from dock.util import ImageName
+from tests.constants import DOCKERFILE_GIT
+
+
+TESTS_PY = """\
+import os
+
+RUNS = []
+
+def run(image_id, tests, git_repo_path, logger, results_dir, calls_file, **kwargs):
+    # module instance is not shared by shards
+    RUNS.append(tests)
+    assert len(RUNS) == 1
+    os.makedirs(results_dir)
+    with open(os.path.join(results_dir, 'result'), 'w') as fp:
+        fp.write(','.join(tests))
+    with open(calls_file, 'a') as fp:
+        fp.write('%s\\n' % ','.join(tests))
+    return dict((test, 'ok') for test in tests), 'fail' not in tests
+"""
+
+
+class X(object):
+    pass
+
+
+def make_tests_repo(path):
+    repo = git.Repo.init(path)
+    with open(os.path.join(path, 'tests.py'), 'w') as fp:
+        fp.write(TESTS_PY)
+    repo.index.add(['tests.py'])
+    actor = git.Actor('Test', 'test@example.com')
+    repo.index.commit('tests', author=actor, committer=actor)
+
+
+def run_plugin(tmpdir, tests):
+    tasker = DockerTasker()
+    workflow = DockerBuildWorkflow(DOCKERFILE_GIT, "test-image")
+    setattr(workflow, 'builder', X)
+    setattr(workflow.builder, 'image_id', "asd123")
+    setattr(workflow.builder, 'base_image', ImageName(repo='Fedora', tag='21'))
+    setattr(workflow.builder, 'git_dockerfile_path', None)
+    setattr(workflow.builder, 'git_path', None)
+    runner = PrePublishPluginsRunner(tasker, workflow, [{
+        'name': ImageTestPlugin.key,
+        'args': {
+            'git_uri': str(tmpdir.join('tests-repo')),
+            'git_commit': None,
+            'image_id': 'asd123',
+            'tests': tests,
+            'cache_dir': str(tmpdir.join('cache')),
+            'calls_file': str(tmpdir.join('calls')),
+            'results_dir': str(tmpdir.join('results')),
+        },
+    }])
+    return runner.run()[ImageTestPlugin.key]
+
+
+def test_merge_results():
+    assert merge_results([('a', {'a': 1}), ('b', {'b': 2})]) == {'a': 1, 'b': 2}
+    assert merge_results([('a', [1]), ('b', [2, 3])]) == [1, 2, 3]
+    assert merge_results([(None, 'x')]) == 'x'
+    # different shapes
+    assert merge_results([('a', {'a': 1}), ('b', 'x')]) == {'a': {'a': 1}, 'b': 'x'}
+
+
+def test_image_tests_sharded_and_cached(tmpdir):
+    make_tests_repo(str(tmpdir.join('tests-repo')))
+    assert run_plugin(tmpdir, ['a', 'b', 'c']) == {'a': 'ok', 'b': 'ok', 'c': 'ok'}
+    with open(str(tmpdir.join('calls'))) as fp:
+        assert sorted(fp.read().split()) == ['a', 'b', 'c']
+    # every shard has its own results dir
+    for test in ('a', 'b', 'c'):
+        with open(str(tmpdir.join('results', test, 'result'))) as fp:
+            assert fp.read() == test
+
+    # passed shards are not executed again
+    assert run_plugin(tmpdir, ['a', 'b', 'd']) == {'a': 'ok', 'b': 'ok', 'd': 'ok'}
+    with open(str(tmpdir.join('calls'))) as fp:
+        assert sorted(fp.read().split()) == ['a', 'b', 'c', 'd']
@@ -15,6 +15,7 @@ except ImportError:
     # Python 2.6
     from ordereddict import OrderedDict
 from dock.core import DockerTasker
+from dock.dockerfile import Dockerfile
 from dock.inner import DockerBuildWorkflow
 from dock.plugin import PreBuildPluginsRunner, PostBuildPluginsRunner
 from dock.plugins.pre_inject_yum_repo import InjectYumRepoPlugin, alter_yum_commands
@@ -49,6 +50,7 @@ CMD blabla"""
 
     setattr(workflow.builder, 'image_id', "asd123")
     setattr(workflow.builder, 'df_path', tmp_df)
+    setattr(workflow.builder, 'dockerfile', Dockerfile(tmp_df))
     setattr(workflow.builder, 'base_image', ImageName(repo='Fedora', tag='21'))
     setattr(workflow.builder, 'git_dockerfile_path', None)
     setattr(workflow.builder, 'git_path', None)
@@ -57,6 +59,7 @@ CMD blabla"""
                                        'args': {}}])
     runner.run()
     assert InjectYumRepoPlugin.key is not None
+    workflow.builder.dockerfile.write()
     with open(tmp_df, 'r') as fd:
         altered_df = fd.read()
     expected_output = r"""FROM fedora
@@ -89,6 +92,7 @@ CMD blabla"""
     )]
     setattr(workflow.builder, 'image_id', "asd123")
     setattr(workflow.builder, 'df_path', tmp_df)
+    setattr(workflow.builder, 'dockerfile', Dockerfile(tmp_df))
     setattr(workflow.builder, 'base_image', ImageName(repo='Fedora', tag='21'))
     setattr(workflow.builder, 'git_dockerfile_path', None)
     setattr(workflow.builder, 'git_path', None)
@@ -96,6 +100,7 @@ CMD blabla"""
                                    [{'name': InjectYumRepoPlugin.key, 'args': {}}])
     runner.run()
     assert InjectYumRepoPlugin.key is not None
+    workflow.builder.dockerfile.write()
     with open(tmp_df, 'r') as fd:
         altered_df = fd.read()
     expected_output = r"""FROM fedora
@@ -125,3 +130,21 @@ ENV x=y
 RUN test && yum install     x     y     && something else && asd
 CMD asd"""
     assert out == expected_output
+
+
+def test_yuminject_continuation_and_lowercase():
+    df = """\
+FROM fedora
+# RUN yum install commented-out
+run yum install -y \\
+    # comment inside of instruction
+    x
+CMD asd"""
+    wrap_cmd = "RUN test && %(yum_command)s && asd"
+    out = alter_yum_commands(df, wrap_cmd)
+    expected_output = """\
+FROM fedora
+# RUN yum install commented-out
+RUN test && yum install -y     x && asd
+CMD asd"""
+    assert out == expected_output
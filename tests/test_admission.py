@@ -0,0 +1,123 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import threading
+import time
+
+import pytest
+
+from dock import admission
+from dock.admission import AdmissionController
+from dock.core import DockerTasker
+from dock.util import ImageName
+
+from tests.docker_mock import mock_docker
+
+
+def run_concurrently(controller, operation, count, duration=0.05):
+    """ :return: max number of operations which ran at once """
+    lock = threading.Lock()
+    state = {'running': 0, 'max': 0}
+
+    def work():
+        with controller.admit(operation):
+            with lock:
+                state['running'] += 1
+                state['max'] = max(state['max'], state['running'])
+            time.sleep(duration)
+            with lock:
+                state['running'] -= 1
+
+    threads = [threading.Thread(target=work) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return state['max']
+
+
+def test_limits():
+    controller = AdmissionController(limits={'build': 2, 'pull': 1}, poll_interval=0.01)
+    assert run_concurrently(controller, 'build', 6) == 2
+    assert run_concurrently(controller, 'pull', 3) == 1
+    assert run_concurrently(controller, 'push', 4) == 4
+    assert controller.stats()['build'] == {'running': 0, 'waiting': 0, 'limit': 2}
+    with pytest.raises(ValueError):
+        controller.configure(limits={'compile': 1})
+    with pytest.raises(ValueError):
+        with controller.admit('compile'):
+            pass
+
+
+def test_limit_timeout():
+    controller = AdmissionController(limits={'export': 1}, poll_interval=0.01)
+    with controller.admit('export'):
+        with pytest.raises(RuntimeError):
+            with controller.admit('export', timeout=0.05):
+                pass
+    with controller.admit('export', timeout=0.05):
+        pass
+
+
+def test_free_space():
+    free = {'/docker': 100, '/tmp': 10 ** 6}
+
+    def free_bytes(path):
+        if path not in free:
+            raise OSError("no such dir")
+        return free[path]
+    controller = AdmissionController(min_free_bytes=1000, paths=['/docker', '/tmp', '/missing'],
+                                     poll_interval=0.01, free_bytes=free_bytes)
+    # pushes don't need disk space
+    with controller.admit('push', timeout=0):
+        pass
+    with pytest.raises(RuntimeError) as ex:
+        with controller.admit('pull', timeout=0.05):
+            pass
+    assert '/docker' in str(ex.value)
+
+    admitted = []
+
+    def pull():
+        with controller.admit('pull'):
+            admitted.append(time.time())
+    thread = threading.Thread(target=pull)
+    thread.start()
+    time.sleep(0.05)
+    assert not admitted
+    assert controller.stats()['pull']['waiting'] == 1
+    # e.g. garbage collector freed some space
+    free['/docker'] = 10 ** 6
+    thread.join(5)
+    assert admitted
+
+
+def test_get_free_bytes(tmpdir):
+    assert admission.get_free_bytes(str(tmpdir)) > 0
+
+
+def test_tasker_pull_is_admitted():
+    mock_docker()
+    controller = admission.controller
+    try:
+        controller.configure(limits={'pull': 0}, poll_interval=0.01)
+        with pytest.raises(RuntimeError):
+            with controller.admit('pull', timeout=0):
+                pass
+        thread = threading.Thread(target=DockerTasker().pull_image,
+                                  args=(ImageName.parse('fedora:latest'), ))
+        thread.start()
+        time.sleep(0.05)
+        assert controller.stats()['pull']['waiting'] == 1
+        controller.configure(limits={'pull': 1})
+        thread.join(5)
+        assert not thread.is_alive()
+    finally:
+        controller.configure()
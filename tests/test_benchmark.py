@@ -0,0 +1,56 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+import json
+
+from flexmock import flexmock
+
+import tests.benchmark
+from tests.benchmark import compare, main
+
+
+def results(**times):
+    return {"meta": {}, "results": dict((name, {"min": t}) for name, t in times.items())}
+
+
+def test_compare():
+    comparison = compare(results(a=1.0, b=1.0, gone=1.0),
+                         results(a=1.1, b=1.5, new=1.0), threshold=0.2)
+    assert [c["name"] for c in comparison] == ["a", "b"]
+    assert [c["regression"] for c in comparison] == [False, True]
+
+
+def test_main_compare(tmpdir):
+    baseline_path = str(tmpdir.join("baseline.json"))
+    assert main(["--scale", "0.001", "--output", baseline_path, "image_name_parse_format"]) == 0
+    with open(baseline_path) as fp:
+        baseline = json.load(fp)
+    assert list(baseline["results"]) == ["image_name_parse_format"]
+
+    # baseline which is impossibly fast
+    baseline["results"]["image_name_parse_format"]["min"] = 1e-12
+    with open(baseline_path, "w") as fp:
+        json.dump(baseline, fp)
+    assert main(["--scale", "0.001", "--compare", baseline_path, "image_name_parse_format"]) == 1
+
+
+def test_failing_benchmark(tmpdir):
+    def broken(scale):
+        def run():
+            raise RuntimeError("docker went away")
+        return run
+
+    benchmarks = tests.benchmark.BENCHMARKS + [("broken", broken, 1, 1)]
+    flexmock(tests.benchmark, BENCHMARKS=benchmarks)
+    output_path = str(tmpdir.join("output.json"))
+    assert main(["--scale", "0.001", "--output", output_path,
+                 "image_name_parse_format", "broken"]) == 2
+    with open(output_path) as fp:
+        output = json.load(fp)
+    assert list(output["results"]) == ["image_name_parse_format"]
+    assert "docker went away" in output["errors"]["broken"]
@@ -6,10 +6,18 @@ This software may be modified and distributed under the terms
 of the BSD license. See the LICENSE file for details.
 """
 
+import os
+
+import docker
+from flexmock import flexmock
+
 from dock.build import InsideBuilder
-from dock.core import DockerTasker
+from dock.core import DockerTasker, DOCKER_SOCKET_PATH
 from dock.util import ImageName
 from tests.constants import LOCALHOST_REGISTRY, DOCKERFILE_GIT, MOCK
+from tests.docker_mock import mock_image, mock_pull_logs
+from tests.fake_registry import FakeRegistry, push_layer
+from tests.helpers import make_git_repo
 
 if MOCK:
     from tests.docker_mock import mock_docker
@@ -36,6 +44,34 @@ def test_pull_base_image(tmpdir):
     t.remove_image(git_base_image)
 
 
+def test_pull_base_image_matching_digest(tmpdir):
+    from tests.docker_mock import mock_docker
+    exists = os.path.exists
+    mock_docker()
+    flexmock(os.path, exists=lambda path: path == DOCKER_SOCKET_PATH or exists(path))
+    git_repo = make_git_repo(str(tmpdir.mkdir('repo')))
+    pulls = []
+    flexmock(docker.Client, pull=lambda img, **kwargs: pulls.append(img) or iter(mock_pull_logs))
+    with FakeRegistry() as registry:
+        digest = push_layer(registry, 'fedora', 'latest', b'fedora')
+        inspect = dict(mock_image, RepoDigests=['%s/fedora@%s' % (registry.netloc, digest)])
+        flexmock(docker.Client, inspect_image=lambda image_id: inspect)
+
+        b = InsideBuilder(git_repo, "test-image", tmpdir=str(tmpdir.mkdir('build1')))
+        assert b.pull_base_image(registry.netloc, insecure=True) == 'fedora:latest'
+        assert b.base_image_pull == {'image': '%s/fedora:latest' % registry.netloc,
+                                     'digest': digest, 'skipped': True}
+        assert pulls == []
+
+        # registry has newer image
+        new_digest = push_layer(registry, 'fedora', 'latest', b'fedora updated')
+        b = InsideBuilder(git_repo, "test-image", tmpdir=str(tmpdir.mkdir('build2')))
+        assert b.pull_base_image(registry.netloc, insecure=True) == 'fedora:latest'
+        assert b.base_image_pull['skipped'] is False
+        assert b.base_image_pull['digest'] == new_digest
+        assert pulls == ['%s/fedora' % registry.netloc]
+
+
 def test_build_image(tmpdir):
     provided_image = "test-build:test_tag"
     if MOCK:
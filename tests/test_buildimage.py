@@ -8,6 +8,9 @@ of the BSD license. See the LICENSE file for details.
 
 from glob import glob
 import os
+import subprocess
+
+from flexmock import flexmock
 
 from dock.buildimage import BuildImageBuilder
 from dock.core import DockerTasker
@@ -58,4 +61,20 @@ def test_image_creation_local_repo():
 
     dt = DockerTasker()
     assert dt.image_exists(TEST_BUILD_IMAGE)
-    dt.remove_image(TEST_BUILD_IMAGE)
\ No newline at end of file
+    dt.remove_image(TEST_BUILD_IMAGE)
+
+
+def test_tarball_cached_local_repo(tmpdir):
+    cache_dir = str(tmpdir.join('cache'))
+    b = BuildImageBuilder(dock_local_path=PARENT_DIR, cache_dir=cache_dir)
+    first_dir = str(tmpdir.mkdir('first'))
+    with open(b.get_dock_tarball_path(first_dir), 'rb') as fp:
+        first = fp.read()
+
+    # second time sdist is not executed at all
+    flexmock(subprocess).should_receive('check_call').never()
+    second_dir = str(tmpdir.mkdir('second'))
+    tarball_path = b.get_dock_tarball_path(second_dir)
+    assert os.path.dirname(tarball_path) == second_dir
+    with open(tarball_path, 'rb') as fp:
+        assert fp.read() == first
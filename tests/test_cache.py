@@ -0,0 +1,35 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from dock.cache import TTLCache, get_cache
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache():
+    clock = Clock()
+    cache = TTLCache(ttl=10, clock=clock)
+    cache.set('key', 'value')
+    assert cache.get('key') == 'value'
+    clock.now = 10
+    assert cache.get('key') is None
+    assert cache.get('key', allow_expired=True) == 'value'
+    cache.invalidate('key')
+    assert cache.get('key', allow_expired=True) is None
+
+
+def test_get_cache():
+    cache = get_cache('test-cache', dict)
+    cache['a'] = 1
+    assert get_cache('test-cache', dict) == {'a': 1}
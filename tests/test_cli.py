@@ -134,3 +134,12 @@ class TestCLISuite(object):
             self.exec_cli(command)
         assert excinfo.value.code == 0
         dt.remove_image(temp_image, noprune=True)
+
+    def test_create_build_image_cache_flags(self):
+        cli = dock.cli.main.CLI()
+        cli.set_arguments()
+        args = ["create-build-image", "--dock-local-path", dock_root, "dir", "image"]
+        assert cli.parser.parse_args(args).use_cache is True
+        assert cli.parser.parse_args(args + ["--no-cache"]).use_cache is False
+        # deprecated, cache is used anyway
+        assert cli.parser.parse_args(args + ["--use-cache"]).use_cache is True
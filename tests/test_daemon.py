@@ -0,0 +1,212 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import logging
+import os
+
+import docker
+import pytest
+import requests
+from flexmock import flexmock
+
+from dock import metrics
+from dock.core import DOCKER_SOCKET_PATH
+from dock.daemon import BuildDaemon, BuildJob, DaemonClient, DaemonServer, JobLogHandler, JobQueue
+from dock.plugin import PluginsRunner
+from dock.scheduler import Scheduler
+from dock.util import thread_pool
+
+from tests.docker_mock import mock_docker, mock_build_logs
+from tests.fake_docker import FakeDocker
+from tests.helpers import make_git_repo
+
+
+@pytest.fixture
+def git_repo(tmpdir):
+    return make_git_repo(str(tmpdir.mkdir('repo')))
+
+
+@pytest.fixture
+def serve(request, tmpdir):
+    """ :return: function which starts daemon and its server, returns DaemonClient """
+    module_cache = PluginsRunner.module_cache
+
+    def start(**kwargs):
+        kwargs.setdefault('git_cache_dir', str(tmpdir.join('git-cache')))
+        daemon = BuildDaemon(**kwargs).start()
+        server = DaemonServer(daemon, socket_path=str(tmpdir.join('dock.sock'))).start()
+
+        def fin():
+            server.stop()
+            daemon.stop()
+            PluginsRunner.module_cache = module_cache
+        request.addfinalizer(fin)
+        return daemon, DaemonClient(server.url, timeout=30)
+    return start
+
+
+def test_job_queue():
+    queue = JobQueue()
+    jobs = [BuildJob({'image': str(i)}) for i in range(3)]
+    for job in jobs:
+        queue.put(job)
+    assert queue.remove(jobs[1])
+    assert not queue.remove(jobs[1])
+    assert queue.get() is jobs[0]
+    assert queue.jobs() == [jobs[2]]
+    assert queue.stats() == {'default': {'queued': 1, 'running': 1, 'started': 1, 'finished': 0}}
+    queue.done(jobs[0])
+    assert queue.stats()['default']['running'] == 0
+    assert queue.stats()['default']['finished'] == 1
+    assert queue.get(timeout=0) is jobs[2]
+    assert queue.get(timeout=0) is None
+    queue.close()
+    assert queue.get() is None
+    with pytest.raises(RuntimeError):
+        queue.put(jobs[0])
+
+
+def test_job_events():
+    job = BuildJob({'image': 'test-image'})
+    job.add_event('log', message='hello')
+    assert not job.wait(timeout=0)
+    assert [e['type'] for e in job.iter_events()] == ['log']
+    job.set_state(BuildJob.FAILED, {'error': 'oops'})
+    assert job.wait(timeout=0)
+    events = list(job.iter_events(follow=True))
+    assert events[-1]['state'] == BuildJob.FAILED
+    assert job.to_dict()['result'] == {'error': 'oops'}
+
+
+def test_job_log_handler():
+    handler = JobLogHandler()
+    logger = logging.getLogger('tests.test_daemon.job_log')
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    job = BuildJob({'image': 'test-image'})
+    try:
+        logger.info("before attach")
+        handler.attach(job)
+        logger.info("in job")
+        # threads spawned by plugins log into the job of their parent
+        pool = thread_pool(2)
+        try:
+            pool.map(lambda i: logger.info("in worker %d", i), range(2))
+        finally:
+            pool.close()
+            pool.join()
+        handler.detach()
+        logger.info("after detach")
+    finally:
+        logger.removeHandler(handler)
+    messages = sorted(e['message'] for e in job.iter_events())
+    assert messages == ["in job", "in worker 0", "in worker 1"]
+
+
+def test_invalid_requests(serve):
+    daemon, client = serve(workers=0)
+    with pytest.raises(RuntimeError) as ex:
+        client.submit({'image': 'test-image'})
+    assert 'git_url' in str(ex.value)
+    with pytest.raises(RuntimeError):
+        client.get('123456')
+    with pytest.raises(RuntimeError):
+        client._json_request('GET', '/nothing-here')
+
+
+def test_cancel_queued_job(serve):
+    # no workers: jobs stay queued
+    daemon, client = serve(workers=0)
+    job_id = client.submit({'git_url': 'file:///dev/null', 'image': 'test-image'})['id']
+    assert client.get(job_id)['state'] == 'queued'
+    assert [j['id'] for j in client.list()] == [job_id]
+    assert client.cancel(job_id)['state'] == 'canceled'
+    with pytest.raises(RuntimeError):
+        client.cancel(job_id)
+    assert [e.get('state') for e in client.follow(job_id)] == ['queued', 'canceled']
+
+
+def test_priorities(serve):
+    daemon, client = serve(workers=0, queue=Scheduler(max_queued=2))
+    build_json = {'git_url': 'file:///dev/null', 'image': 'test-image'}
+    batch = [client.submit(build_json, priority='batch', owner='team a')['id'] for _ in range(2)]
+    urgent = client.submit(build_json, priority='urgent')['id']
+    assert [job.id for job in daemon.queue.jobs()] == [urgent, batch[0]]
+    assert client.get(urgent)['owner'] is None
+    assert client.get(batch[0])['owner'] == 'team a'
+    preempted = client.get(batch[1])
+    assert preempted['state'] == 'canceled'
+    assert urgent in preempted['result']['error']
+    with pytest.raises(RuntimeError) as ex:
+        client.submit(build_json, priority='batch')
+    assert 'queue is full' in str(ex.value)
+    with pytest.raises(RuntimeError):
+        client.submit(build_json, priority='whenever')
+    assert client.queue_stats()['urgent']['queued'] == 1
+
+
+def test_build(serve, git_repo, caplog):
+    caplog.set_level(logging.INFO, logger='dock')
+    exists = os.path.exists
+    mock_docker(provided_image_repotags=["test-image:latest"])
+    # git mirrors have to be checked for real
+    flexmock(os.path, exists=lambda path: path == DOCKER_SOCKET_PATH or exists(path))
+    # every build needs fresh iterator of logs
+    flexmock(docker.Client, build=lambda **kwargs: iter(mock_build_logs))
+    metrics.registry.reset()
+    daemon, client = serve(workers=2)
+
+    job_ids = [client.submit({'git_url': git_repo, 'image': 'test-image'})['id']
+               for _ in range(3)]
+    events = list(client.follow(job_ids[0]))
+    assert events[0]['state'] == 'queued'
+    assert events[-1]['state'] == 'succeeded'
+    assert any(e['type'] == 'log' and 'mirror of git repo' in e['message'] for e in events)
+
+    for job_id in job_ids:
+        job = client.wait(job_id)
+        assert job['state'] == 'succeeded', job
+        assert job['result']['image_id']
+
+    # warm state: plugins were loaded once, repo was mirrored once
+    assert PluginsRunner.module_cache
+    assert len(os.listdir(daemon.git_cache_dir)) == 2  # mirror and its lock
+    assert metrics.registry.get('dock_daemon_jobs_total').labels(state='succeeded').value == 3
+    assert metrics.registry.get('dock_cache_requests_total').labels(
+        cache='git_mirror', result='hit').value == 2
+
+
+def test_failed_build(serve, tmpdir):
+    daemon, client = serve(workers=1)
+    job_id = client.submit({'git_url': str(tmpdir.join('no-such-repo')),
+                            'image': 'test-image'})['id']
+    job = client.wait(job_id)
+    assert job['state'] == 'failed'
+    assert 'error' in job['result']
+
+
+def test_build_against_fake_docker(serve, git_repo, tmpdir):
+    fake = FakeDocker(str(tmpdir.join('docker.sock')), build_log_lines=20)
+    fake.state.add_image(tag='fedora:latest')
+    fake.start()
+    try:
+        try:
+            docker.Client(base_url=fake.base_url).ping()
+        except (requests.exceptions.InvalidURL, TypeError) as ex:
+            # docker-py < 2 doesn't support UNIX sockets with requests >= 2.32 or urllib3 >= 2
+            pytest.skip("docker client can't connect to UNIX socket: %r" % ex)
+        daemon, client = serve(workers=2, docker_url=fake.base_url)
+        job_ids = [client.submit({'git_url': git_repo, 'image': 'test-image-%d' % i})['id']
+                   for i in range(4)]
+        for job_id in job_ids:
+            assert client.wait(job_id)['state'] == 'succeeded'
+        assert fake.state.requests['build'] == 4
+    finally:
+        fake.stop()
@@ -0,0 +1,231 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import os
+
+import docker
+import pytest
+import requests
+from flexmock import flexmock
+
+from dock import admission
+from dock.core import DockerTasker, DOCKER_SOCKET_PATH
+from dock.daemon import BuildDaemon
+from dock.dispatch import Dispatcher, Endpoint, NoEndpointAvailable, parse_size
+
+from tests.docker_mock import mock_docker, mock_build_logs
+from tests.fake_docker import FakeDocker
+from tests.helpers import make_git_repo
+
+
+class FakeEndpoint(Endpoint):
+    def __init__(self, url, images=(), other_containers=0, free_bytes=None, reachable=True,
+                 **kwargs):
+        super(FakeEndpoint, self).__init__(url, **kwargs)
+        self.fake_state = (set(images), other_containers, free_bytes)
+        self.reachable = reachable
+        self.refreshed = 0
+
+    def get_tasker(self):
+        return self.url
+
+    def ping(self):
+        return self.reachable
+
+    def refresh(self):
+        self.refreshed += 1
+        if not self.reachable:
+            raise requests.exceptions.ConnectionError("connection refused")
+        self.images, self.other_containers, self.free_bytes = self.fake_state
+
+
+def test_parse_size():
+    assert parse_size('10.5 GB') == 10500000000
+    assert parse_size('512 kB') == 512000
+    assert parse_size('1 B') == 1
+    assert parse_size('a lot') is None
+    assert parse_size(None) is None
+
+
+def test_least_loaded():
+    endpoints = [FakeEndpoint('a', other_containers=1), FakeEndpoint('b'),
+                 FakeEndpoint('c', reachable=False)]
+    dispatcher = Dispatcher(endpoints)
+    placed = [dispatcher.acquire().url for _ in range(4)]
+    # b is idle, then a and b take turns
+    assert placed == ['b', 'a', 'b', 'a']
+    assert not endpoints[2].is_up()
+    with pytest.raises(NoEndpointAvailable):
+        dispatcher.acquire(timeout=0.01)
+    dispatcher.release(endpoints[0])
+    assert dispatcher.acquire(timeout=0.01) is endpoints[0]
+    assert dispatcher.stats()['endpoints'][2]['up'] is False
+
+
+def test_refresh_interval():
+    endpoint = FakeEndpoint('a')
+    dispatcher = Dispatcher([endpoint], refresh_interval=60)
+    dispatcher.release(dispatcher.acquire())
+    dispatcher.release(dispatcher.acquire())
+    assert endpoint.refreshed == 1
+    dispatcher.refresh(force=True)
+    assert endpoint.refreshed == 2
+
+
+def test_affinity():
+    endpoints = [FakeEndpoint('a'), FakeEndpoint('b', images=['fedora:22'], other_containers=1)]
+    dispatcher = Dispatcher(endpoints)
+    assert dispatcher.acquire(affinity=['fedora:22']) is endpoints[1]
+    assert dispatcher.acquire(affinity=['fedora:22']) is endpoints[0]
+    dispatcher.release(endpoints[0], ['my-image:latest'])
+    # warm layer cache of the previous build
+    assert dispatcher.acquire(affinity=['my-image:latest']) is endpoints[0]
+
+
+def test_free_space():
+    endpoints = [FakeEndpoint('a', free_bytes=10), FakeEndpoint('b', other_containers=1,
+                                                                free_bytes=10 ** 6)]
+    dispatcher = Dispatcher(endpoints, min_free_bytes=1000)
+    assert dispatcher.acquire() is endpoints[1]
+
+
+def test_retry_on_other_host():
+    endpoints = [FakeEndpoint('a'), FakeEndpoint('b', other_containers=1)]
+    dispatcher = Dispatcher(endpoints)
+    calls = []
+
+    def build(tasker):
+        calls.append(tasker)
+        if tasker == 'a':
+            endpoints[0].reachable = False
+            raise requests.exceptions.ConnectionError("connection reset")
+        return 'image-id', ['my-image:latest']
+
+    result, endpoint = dispatcher.run(build)
+    assert (result, endpoint.url) == ('image-id', 'b')
+    assert calls == ['a', 'b']
+    assert not endpoints[0].is_up()
+    assert endpoints[0].running == endpoints[1].running == 0
+    assert endpoints[1].recent == ['my-image:latest']
+
+    # other errors are not retried
+    with pytest.raises(ValueError):
+        dispatcher.run(lambda tasker: int('x'))
+    # neither are connection errors when docker is fine (e.g. registry is down)
+    calls = []
+
+    def push(tasker):
+        calls.append(tasker)
+        raise requests.exceptions.ConnectionError("registry is down")
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        dispatcher.run(push)
+    assert calls == ['b']
+    assert endpoints[1].is_up()
+
+    endpoints[1].reachable = False
+    dispatcher.refresh(force=True)
+    with pytest.raises(NoEndpointAvailable):
+        dispatcher.run(build)
+
+
+def test_no_retry_after_push():
+    endpoints = [FakeEndpoint('a'), FakeEndpoint('b', other_containers=1)]
+    dispatcher = Dispatcher(endpoints)
+    calls = []
+
+    def build(tasker):
+        calls.append(tasker)
+        endpoints[0].reachable = False
+        raise requests.exceptions.ConnectionError("connection reset")
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        dispatcher.run(build, can_retry=lambda: False)
+    assert calls == ['a']
+    assert not endpoints[0].is_up()
+
+
+def test_admission_per_endpoint():
+    endpoints = [Endpoint('tcp://a:2375'), Endpoint('tcp://b:2375')]
+    endpoints[0].controller.configure(limits={'pull': 1})
+    with admission.admit('pull', tasker=endpoints[0].get_tasker()):
+        # other host and process-wide controller are not affected
+        with admission.admit('pull', tasker=endpoints[1].get_tasker(), timeout=0):
+            pass
+        with admission.admit('pull', timeout=0):
+            pass
+        with pytest.raises(RuntimeError):
+            with admission.admit('pull', tasker=endpoints[0].get_tasker(), timeout=0):
+                pass
+    assert endpoints[0].to_dict()['admission']['pull']['limit'] == 1
+
+
+def test_free_space_of_docker_root():
+    endpoint = Endpoint('unix:///var/run/docker.sock')
+    tasker = endpoint.get_tasker()
+    flexmock(tasker.d, images=lambda: [],
+             info=lambda: {'DockerRootDir': '/var/lib/docker',
+                           'DriverStatus': [['Backing Filesystem', 'extfs']]})
+    flexmock(admission).should_receive('get_free_bytes').with_args('/var/lib/docker').and_return(42)
+    endpoint.refresh()
+    assert endpoint.free_bytes == 42
+
+    # root dir of remote host isn't visible here
+    endpoint = Endpoint('tcp://remote:2375')
+    flexmock(endpoint.get_tasker().d, images=lambda: [],
+             info=lambda: {'DockerRootDir': '/var/lib/docker', 'DriverStatus': []})
+    endpoint.refresh()
+    assert endpoint.free_bytes is None
+
+
+def test_daemon_dispatch(tmpdir):
+    exists = os.path.exists
+    mock_docker(provided_image_repotags=["test-image:latest"])
+    flexmock(os.path, exists=lambda path: path == DOCKER_SOCKET_PATH or exists(path))
+    flexmock(docker.Client, build=lambda **kwargs: iter(mock_build_logs))
+    git_repo = make_git_repo(str(tmpdir.mkdir('repo')))
+
+    class MockedEndpoint(FakeEndpoint):
+        def get_tasker(self):
+            return DockerTasker()
+
+    endpoints = [MockedEndpoint('a', capacity=1), MockedEndpoint('b', capacity=1)]
+    daemon = BuildDaemon(workers=2, dispatcher=Dispatcher(endpoints)).start()
+    try:
+        jobs = [daemon.submit({'git_url': git_repo, 'image': 'test-image'}) for _ in range(4)]
+        for job in jobs:
+            assert job.wait(30)
+            assert job.state == 'succeeded', job.result
+        assert set(job.result['docker_url'] for job in jobs) == set(['a', 'b'])
+        for endpoint in endpoints:
+            assert set(endpoint.recent) == set(['test-image:latest', 'fedora:latest'])
+    finally:
+        daemon.stop()
+
+
+def test_fake_docker_hosts(tmpdir):
+    fakes = [FakeDocker(str(tmpdir.join('docker%d.sock' % i))).start() for i in range(2)]
+    try:
+        try:
+            docker.Client(base_url=fakes[0].base_url).ping()
+        except (requests.exceptions.InvalidURL, TypeError) as ex:
+            # docker-py < 2 doesn't support UNIX sockets with requests >= 2.32 or urllib3 >= 2
+            pytest.skip("docker client can't connect to UNIX socket: %r" % ex)
+        fakes[1].state.add_image(tag='fedora:22')
+        endpoints = [Endpoint(fake.base_url) for fake in fakes]
+        endpoints.append(Endpoint('unix://' + str(tmpdir.join('nothing.sock'))))
+        dispatcher = Dispatcher(endpoints)
+        dispatcher.refresh()
+        assert not endpoints[2].is_up()
+        assert endpoints[0].free_bytes == fakes[0].free_bytes
+        assert dispatcher.acquire(affinity=['fedora:22']) is endpoints[1]
+    finally:
+        for fake in fakes:
+            fake.stop()
@@ -19,8 +19,7 @@ def test_hostdocker_build():
         mock_docker()
 
     image_name = ImageName(repo="dock-test-ssh-image")
-    remote_image = image_name.copy()
-    remote_image.registry = LOCALHOST_REGISTRY
+    remote_image = image_name.copy(registry=LOCALHOST_REGISTRY)
     m = DockerhostBuildManager("buildroot-dh-fedora", {
         "git_url": "https://github.com/fedora-cloud/Fedora-Dockerfiles.git",
         "git_dockerfile_path": "ssh/",
@@ -70,8 +69,7 @@ def test_privileged_gitrepo_build():
         mock_docker()
 
     image_name = ImageName(repo="dock-test-ssh-image")
-    remote_image = image_name.copy()
-    remote_image.registry = LOCALHOST_REGISTRY
+    remote_image = image_name.copy(registry=LOCALHOST_REGISTRY)
     m = PrivilegedBuildManager("buildroot-fedora", {
         "git_url": "https://github.com/fedora-cloud/Fedora-Dockerfiles.git",
         "git_dockerfile_path": "ssh/",
@@ -100,8 +98,7 @@ def test_privileged_build():
         mock_docker()
 
     image_name = ImageName(repo=TEST_IMAGE)
-    remote_image = image_name.copy()
-    remote_image.registry = LOCALHOST_REGISTRY
+    remote_image = image_name.copy(registry=LOCALHOST_REGISTRY)
     m = PrivilegedBuildManager("buildroot-fedora", {
         "git_url": DOCKERFILE_GIT,
         "image": remote_image.to_str(),
@@ -0,0 +1,78 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import print_function
+
+import os
+
+from dock.dockerfile import Dockerfile
+from dock.util import get_baseimage_from_dockerfile_path
+
+
+DOCKERFILE = """\
+# base image
+from fedora:22
+MAINTAINER someone
+RUN yum install -y \\
+# comment inside of continued instruction
+      python && \\
+    yum clean all
+
+FROM busybox
+CMD ["sh"]
+"""
+
+
+def test_parse():
+    dockerfile = Dockerfile(content=DOCKERFILE)
+    assert [i.instruction for i in dockerfile.instructions] == \
+        ['FROM', 'MAINTAINER', 'RUN', 'FROM', 'CMD']
+    assert dockerfile.baseimage == 'fedora:22'
+    run = dockerfile.get_instructions('run')[0]
+    assert run.value == 'yum install -y       python &&     yum clean all'
+    assert (run.startline, run.endline) == (3, 6)
+    assert [i.startline for i in dockerfile.get_instructions('FROM')] == [1, 8]
+    assert dockerfile.get_instruction_by_step(4).instruction == 'CMD'
+    assert dockerfile.get_instruction_by_step(5) is None
+
+
+def test_modify(tmpdir):
+    path = os.path.join(str(tmpdir), 'Dockerfile')
+    with open(path, 'w') as fd:
+        fd.write(DOCKERFILE)
+    dockerfile = Dockerfile(path)
+    assert get_baseimage_from_dockerfile_path(path) == 'fedora:22'
+
+    dockerfile.write()
+    assert not dockerfile.modified
+
+    run = dockerfile.get_instructions('RUN')[0]
+    dockerfile.replace(run, 'RUN true')
+    dockerfile.insert_before(dockerfile.instructions[-1], 'LABEL "a"="b"')
+    dockerfile.append('USER 1000')
+    assert dockerfile.modified
+    assert [i.instruction for i in dockerfile.instructions] == \
+        ['FROM', 'MAINTAINER', 'RUN', 'FROM', 'LABEL', 'CMD', 'USER']
+    assert dockerfile.get_instructions('LABEL')[0].startline == 6
+
+    # nothing is written until requested
+    with open(path) as fd:
+        assert fd.read() == DOCKERFILE
+    dockerfile.write()
+    with open(path) as fd:
+        assert fd.read() == """\
+# base image
+from fedora:22
+MAINTAINER someone
+RUN true
+
+FROM busybox
+LABEL "a"="b"
+CMD ["sh"]
+USER 1000
+"""
@@ -0,0 +1,160 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import json
+import os
+import tarfile
+from multiprocessing.pool import ThreadPool
+
+import docker
+import pytest
+import requests
+
+from dock import metrics
+from dock.core import DockerTasker
+from dock.util import ImageName, wait_for_command
+
+from tests.fake_docker import FakeDocker
+from tests.fake_registry import FakeRegistry
+
+
+@pytest.fixture
+def daemon(request, tmpdir):
+    fake = FakeDocker(os.path.join(str(tmpdir), 'docker.sock'), build_log_lines=100,
+                      container_log_lines=5, layer_size=1024, progress_chunk=256)
+    fake.state.add_image(tag='fedora:latest')
+    fake.start()
+    request.addfinalizer(fake.stop)
+    try:
+        docker.Client(base_url=fake.base_url).ping()
+    except (requests.exceptions.InvalidURL, TypeError) as ex:
+        # docker-py < 2 doesn't support UNIX sockets with requests >= 2.32 or urllib3 >= 2
+        pytest.skip("docker client can't connect to UNIX socket: %r" % ex)
+    return fake
+
+
+def build(tasker, context_dir, image):
+    logs = tasker.build_image_from_path(context_dir, image, stream=True)
+    return wait_for_command(logs)
+
+
+def make_context(tmpdir):
+    context_dir = tmpdir.mkdir('context')
+    context_dir.join('Dockerfile').write("FROM fedora\nCMD true\n")
+    context_dir.join('payload').write('x' * 4096)
+    return str(context_dir)
+
+
+def test_build_inspect_tag_push(daemon, tmpdir):
+    tasker = DockerTasker(base_url=daemon.base_url)
+    image = ImageName.parse('test-image:1')
+    result = build(tasker, make_context(tmpdir), image)
+    assert not result.is_failed()
+    assert len(result.logs) == 103
+    image_id = json.loads(result.logs[-1])['stream'].split()[-1]
+    assert tasker.inspect_image(image)['Id'].startswith(image_id)
+    assert tasker.image_exists(image_id)
+    assert len(tasker.get_image_info_by_image_name(image)) == 1
+
+    target = ImageName.parse('localhost:5000/ns/test-image:1')
+    tasker.tag_image(image, target)
+    assert tasker.inspect_image(target)['Id'].startswith(image_id)
+    logs = tasker.push_image(target)
+    assert 'digest: sha256:' in logs
+
+    tasker.remove_image(target)
+    assert not tasker.image_exists(target.to_str())
+    assert tasker.image_exists(image.to_str())
+    assert daemon.state.requests['build'] == 1
+
+
+def test_pull_run_logs(daemon):
+    tasker = DockerTasker(base_url=daemon.base_url)
+    image = ImageName.parse('registry.example.com/busybox:latest')
+    assert not tasker.image_exists(image.to_str())
+    tasker.pull_image(image)
+    assert len(tasker.last_logs) == 3 * (4 + 1) + 2
+    assert tasker.image_exists(image.to_str())
+
+    container_id = tasker.run(image, command='true')
+    assert tasker.wait(container_id) == 0
+    logs = tasker.logs(container_id, stream=False)
+    assert len(logs) == 5
+    assert logs[0].startswith('line 0 ')
+    committed = tasker.commit_container(container_id, image=ImageName.parse('committed:1'))
+    assert tasker.image_exists(committed)
+    tasker.remove_container(container_id)
+    assert daemon.state.containers == {}
+
+
+def test_get_image(daemon):
+    tasker = DockerTasker(base_url=daemon.base_url)
+    stream = tasker.get_image('fedora:latest')
+    tar = tarfile.open(fileobj=stream, mode='r|')
+    names = []
+    for member in tar:
+        names.append(member.name)
+        if member.name.endswith('/json'):
+            assert 'id' in json.loads(tar.extractfile(member).read().decode('utf-8'))
+    assert len(names) == 2
+    assert names[1].endswith('/layer.tar')
+
+
+def test_concurrent_builds(daemon, tmpdir):
+    context_dir = make_context(tmpdir)
+    builds = 8
+
+    def build_one(i):
+        tasker = DockerTasker(base_url=daemon.base_url)
+        return build(tasker, context_dir, ImageName(repo='image-%d' % i))
+
+    pool = ThreadPool(builds)
+    try:
+        results = pool.map(build_one, range(builds))
+    finally:
+        pool.close()
+        pool.join()
+    assert all(not r.is_failed() for r in results)
+    assert daemon.state.requests['build'] == builds
+    assert len(daemon.state.tags) == builds + 1
+
+
+def test_docker_connection(daemon, monkeypatch):
+    monkeypatch.setenv('DOCKER_CONNECTION', daemon.base_url)
+    tasker = DockerTasker()
+    assert tasker.image_exists('fedora:latest')
+
+
+def test_push_pull_registry(daemon):
+    tasker = DockerTasker(base_url=daemon.base_url)
+    with FakeRegistry() as registry:
+        daemon.add_registry(registry)
+        image_id = daemon.state.resolve_image('fedora:latest')['Id']
+        targets = [ImageName(registry=registry.netloc, repo='fedora', tag=tag)
+                   for tag in ('1', '2')]
+        first = tasker.tag_and_push_image(image_id, targets[0])
+        assert 'Pushed' in first
+        pushed_bytes = metrics.registry.get('dock_pushed_bytes_total')
+        assert pushed_bytes.labels(registry=registry.netloc).value == registry.stats.bytes_received
+        second = tasker.tag_and_push_image(image_id, targets[1])
+        assert 'Pushed' not in second
+        assert 'Layer already exists' in second
+        stats = registry.stats.as_dict()
+        assert stats['blob_uploads'] == daemon.layers + 1
+        assert stats['duplicate_uploads'] == 0
+        assert stats['manifests_pushed'] == 2
+        assert len(tasker.inspect_image(image_id)['RepoDigests']) == 1
+
+        tasker.remove_image(targets[0])
+        tasker.pull_image(targets[0])
+        assert tasker.inspect_image(targets[0])['Id'] == image_id
+        missing = targets[0].copy(tag='missing')
+        tasker.pull_image(missing)
+        assert not tasker.image_exists(missing.to_str())
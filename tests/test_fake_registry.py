@@ -0,0 +1,120 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import time
+
+import pytest
+import requests
+
+from tests.fake_registry import FakeRegistry, Throttle, push_image, pull_image, sha256_digest
+
+
+CONFIG = b'{"id": "abc"}'
+BASE_LAYER = b'base' * 1024
+LAYER = b'layer' * 1024
+
+
+@pytest.fixture
+def registry(request):
+    fake = FakeRegistry().start()
+    request.addfinalizer(fake.stop)
+    return fake
+
+
+def test_push_skips_present_blobs(registry):
+    session = requests.Session()
+    first = list(push_image(session, registry.url, 'ns/image', '1', CONFIG, [BASE_LAYER, LAYER]))
+    assert [status for status, _, _ in first] == ['pushed', 'pushed', 'pushed', 'manifest']
+
+    # same layers, another tag and repository
+    second = list(push_image(session, registry.url, 'other', 'latest', CONFIG, [BASE_LAYER, LAYER]))
+    assert [status for status, _, _ in second] == ['exists', 'exists', 'exists', 'manifest']
+    assert first[-1][1] == second[-1][1]
+
+    stats = registry.stats.as_dict()
+    assert stats['blob_uploads'] == 3
+    assert stats['duplicate_uploads'] == 0
+    assert stats['blob_head_hits'] == 3
+    assert stats['manifests_pushed'] == 2
+    assert stats['bytes_received'] == len(CONFIG) + len(BASE_LAYER) + len(LAYER)
+    assert registry.get_tags('ns/image') == ['1']
+
+
+def test_duplicate_upload_is_counted(registry):
+    digest = sha256_digest(LAYER)
+    for _ in range(2):
+        response = requests.post('%s/v2/image/blobs/uploads/' % registry.url,
+                                 params={'digest': digest}, data=LAYER)
+        assert response.status_code == 201
+    stats = registry.stats.as_dict()
+    assert stats['blob_uploads'] == 2
+    assert stats['duplicate_uploads'] == 1
+    assert stats['duplicate_bytes'] == len(LAYER)
+    assert registry.stored_bytes == len(LAYER)
+
+
+def test_chunked_upload_and_mount(registry):
+    digest = sha256_digest(LAYER)
+    response = requests.post('%s/v2/image/blobs/uploads/' % registry.url)
+    assert response.status_code == 202
+    location = registry.url + response.headers['Location']
+    response = requests.patch(location, data=LAYER[:1000])
+    assert response.headers['Range'] == '0-999'
+    response = requests.put(location, params={'digest': digest}, data=LAYER[1000:])
+    assert response.status_code == 201
+    assert requests.get('%s/v2/image/blobs/%s' % (registry.url, digest)).content == LAYER
+
+    response = requests.post('%s/v2/other/blobs/uploads/' % registry.url,
+                             params={'mount': digest, 'from': 'image'})
+    assert response.status_code == 201
+    assert registry.stats.blob_mounts == 1
+
+
+def test_invalid_uploads(registry):
+    response = requests.post('%s/v2/image/blobs/uploads/' % registry.url,
+                             params={'digest': sha256_digest(b'something else')}, data=LAYER)
+    assert response.status_code == 400
+    assert response.json()['errors'][0]['code'] == 'DIGEST_INVALID'
+
+    manifest = '{"config": {"digest": "%s"}, "layers": []}' % sha256_digest(CONFIG)
+    response = requests.put('%s/v2/image/manifests/1' % registry.url, data=manifest)
+    assert response.status_code == 400
+    assert response.json()['errors'][0]['code'] == 'MANIFEST_BLOB_UNKNOWN'
+
+
+def test_pull(registry):
+    session = requests.Session()
+    assert pull_image(session, registry.url, 'image', '1') is None
+    pushed = list(push_image(session, registry.url, 'image', '1', CONFIG, [BASE_LAYER, LAYER]))
+    digest, config, layers = pull_image(session, registry.url, 'image', '1')
+    assert digest == pushed[-1][1]
+    assert config == CONFIG
+    assert layers == [BASE_LAYER, LAYER]
+    assert registry.stats.bytes_sent == len(CONFIG) + len(BASE_LAYER) + len(LAYER)
+
+
+def test_throttle():
+    throttle = Throttle(bytes_per_second=1024 * 1024)
+    start = time.time()
+    for _ in range(4):
+        throttle.consume(64 * 1024)
+    assert time.time() - start >= 0.2
+    # unlimited
+    start = time.time()
+    Throttle().consume(1024 ** 3)
+    assert time.time() - start < 0.1
+
+
+def test_bandwidth_limit():
+    with FakeRegistry(bandwidth=512 * 1024) as registry:
+        start = time.time()
+        list(push_image(requests.Session(), registry.url, 'image', '1', CONFIG,
+                        [b'x' * 128 * 1024]))
+        assert time.time() - start >= 0.2
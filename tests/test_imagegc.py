@@ -0,0 +1,210 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import json
+import os
+
+from flexmock import flexmock
+
+from dock import imagegc
+from dock.constants import BUILD_JSON, CONTAINER_IMAGE_USAGE_PATH
+from dock.core import BuildContainerFactory, DOCKER_SOCKET_PATH
+from dock.imagegc import ImageGarbageCollector, ImageUsageStore
+from dock.inner import DockerBuildWorkflow
+from dock.plugin import PostBuildPluginsRunner
+from dock.plugins.post_remove_built_image import GarbageCollectionPlugin
+from dock.util import ImageName
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 100000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeDockerClient(object):
+    def __init__(self, images, containers=()):
+        self.layers = images
+        self.running = list(containers)
+
+    def images(self, all=False):
+        if all:
+            return list(self.layers)
+        parents = set(i.get('ParentId') for i in self.layers)
+        return [i for i in self.layers if i['Id'] not in parents or
+                i['RepoTags'] != ['<none>:<none>']]
+
+    def containers(self, all=False):
+        return self.running
+
+
+class FakeTasker(object):
+    def __init__(self, images, containers=()):
+        self.d = FakeDockerClient(images, containers)
+        self.removed = []
+
+    def remove_image(self, name):
+        self.removed.append(name)
+        for image in self.d.layers:
+            if name in image['RepoTags']:
+                image['RepoTags'].remove(name)
+            if name == image['Id'] or not image['RepoTags']:
+                image['RepoTags'] = ['<none>:<none>']
+        while True:
+            parents = set(i.get('ParentId') for i in self.d.layers)
+            layers = [i for i in self.d.layers
+                      if i['RepoTags'] != ['<none>:<none>'] or i['Id'] in parents]
+            if len(layers) == len(self.d.layers):
+                break
+            self.d.layers = layers
+
+
+class X(object):
+    image_id = 'my-image'
+    git_dockerfile_path = None
+    git_path = None
+    base_image = ImageName(repo='fedora', tag='22')
+
+
+def image(image_id, tags, size, parent=None, created=0):
+    return {'Id': image_id, 'RepoTags': tags or ['<none>:<none>'], 'Size': size,
+            'ParentId': parent, 'Created': created}
+
+
+def make_images():
+    return [image('fedora', ['fedora:22'], 100),
+            image('my-image', ['my-image:latest'], 10, parent='fedora'),
+            image('layer', [], 30, parent='fedora'),
+            image('sibling', ['sibling:latest'], 10, parent='layer'),
+            image('old', ['old:1'], 50, created=1),
+            image('dangling', [], 5),
+            image('busybox', ['busybox:latest'], 20)]
+
+
+def test_usage_store(tmpdir):
+    clock = Clock()
+    store = ImageUsageStore(str(tmpdir.join('usage.json')), clock=clock)
+    token = store.acquire_lease(['my-image'], base_images=['fedora:22'])
+    clock.now += 10
+    store.record_use(['fedora:22', 'busybox'], base=True)
+    data = store.load()
+    assert list(data['leases'][token]['images']) == ['my-image:latest', 'fedora:22']
+    assert data['images']['fedora:22'] == {'used': [100000.0, 100010.0], 'base': True}
+    assert data['images']['my-image:latest']['base'] is False
+    assert store.base_image_popularity() == [('fedora:22', 2), ('busybox:latest', 1)]
+    store.release_lease(token)
+    assert store.load()['leases'] == {}
+
+    # lease of a process which doesn't exist anymore
+    token = store.acquire_lease(['my-image'])
+    with open(store.path) as fp:
+        data = json.load(fp)
+    data['leases'][token]['pid'] = 2 ** 22 + 1
+    with open(store.path, 'w') as fp:
+        json.dump(data, fp)
+    assert store.load()['leases'] == {}
+
+
+def test_usage_store_forgets_old_uses(tmpdir):
+    clock = Clock()
+    store = ImageUsageStore(str(tmpdir.join('usage.json')), max_age=100, clock=clock)
+    store.record_use(['fedora:22', 'busybox'], base=True)
+    clock.now += 60
+    store.record_use(['fedora:22'], base=True)
+    clock.now += 60
+    store.record_use(['my-image'])
+    images = store.load()['images']
+    assert sorted(images) == ['fedora:22', 'my-image:latest']
+    assert images['fedora:22']['used'] == [100060.0]
+    store.forget(['fedora:22'])
+    assert list(store.load()['images']) == ['my-image:latest']
+
+
+def test_dangling_only(tmpdir):
+    tasker = FakeTasker(make_images())
+    store = ImageUsageStore(str(tmpdir.join('usage.json')))
+    result = ImageGarbageCollector(tasker, store=store).collect()
+    assert tasker.removed == ['dangling']
+    assert result['freed_bytes'] == 5
+    assert result['used_bytes'] == 220
+
+
+def test_lru_keeps_hot_and_leased_images(tmpdir):
+    clock = Clock()
+    store = ImageUsageStore(str(tmpdir.join('usage.json')), clock=clock)
+    for _ in range(3):
+        store.record_use(['fedora:22'], base=True)
+    clock.now += 1
+    store.record_use(['sibling:latest'])
+    clock.now += 1
+    store.acquire_lease(['my-image:latest'])
+    containers = [{'Image': 'busybox', 'Id': 'c1'}]
+    tasker = FakeTasker(make_images(), containers)
+    collector = ImageGarbageCollector(tasker, budget_bytes=150, store=store)
+
+    result = collector.collect(dry_run=True)
+    assert tasker.removed == []
+    assert result['removed'] == ['dangling', 'old:1', 'sibling:latest']
+
+    result = collector.collect()
+    # old is unknown to usage store, it goes first; sibling frees its parent layer too;
+    # hot fedora, leased my-image and busybox used by container stay
+    assert tasker.removed == ['dangling', 'old:1', 'sibling:latest']
+    assert result['freed_bytes'] == 5 + 50 + 40
+    assert result['used_bytes'] == 130
+    assert sorted(i['Id'] for i in tasker.d.layers) == ['busybox', 'fedora', 'my-image']
+    # removed images are forgotten
+    assert sorted(store.load()['images']) == ['fedora:22', 'my-image:latest']
+
+
+def test_plugin_with_budget(tmpdir):
+    store_path = str(tmpdir.join('usage.json'))
+    usage = imagegc.usage
+    imagegc.usage = ImageUsageStore(store_path)
+    try:
+        tasker = FakeTasker(make_images())
+        workflow = DockerBuildWorkflow("asd", "test-image")
+        setattr(workflow, 'builder', X)
+        runner = PostBuildPluginsRunner(tasker, workflow, [{
+            'name': GarbageCollectionPlugin.key,
+            'args': {'image_budget': 10 ** 6},
+        }])
+        result = runner.run()[GarbageCollectionPlugin.key]
+        assert result['removed'] == ['dangling']
+        assert not os.path.exists(store_path)
+    finally:
+        imagegc.usage = usage
+
+
+def test_usage_shared_with_build_container(tmpdir, image_usage):
+    # host mounts directory with its usage file into build container
+    json_args_path = tmpdir.mkdir('share')
+    json_args_path.join(BUILD_JSON).write('{}')
+    factory = BuildContainerFactory()
+    flexmock(factory.tasker).should_receive('image_exists').and_return(True)
+    exists = os.path.exists
+    flexmock(os.path, exists=lambda path: path == DOCKER_SOCKET_PATH or exists(path))
+    binds = {}
+    (flexmock(factory.tasker)
+        .should_receive('run')
+        .replace_with(lambda image, create_kwargs, start_kwargs:
+                      binds.update(start_kwargs['binds'])))
+    factory.build_image_dockerhost('buildroot', str(json_args_path))
+    usage_dir = os.path.dirname(image_usage.path)
+    assert binds[usage_dir]['bind'] == CONTAINER_IMAGE_USAGE_PATH
+
+    # build in the container leases images in the file of the host
+    assert not imagegc.use_mounted_usage(str(tmpdir.join('not-mounted')))
+    assert imagegc.use_mounted_usage(usage_dir)
+    token = imagegc.acquire_lease(['my-image'], base_images=['fedora:22'])
+    host_store = ImageUsageStore(image_usage.path)
+    assert host_store.load()['leases'][token]['images'] == ['my-image:latest', 'fedora:22']
@@ -0,0 +1,138 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+import json
+import os
+
+import pytest
+
+from dock import metrics
+from dock.core import DockerTasker, PushLogParser, get_pushed_bytes
+from dock.inner import DockerBuildWorkflow
+from dock.plugin import PreBuildPluginsRunner, PreBuildPlugin
+from dock.util import ImageName
+
+
+def test_counter():
+    registry = metrics.MetricsRegistry()
+    counter = registry.counter('test_total', 'Test counter', ['kind'])
+    counter.labels(kind='a').inc()
+    counter.labels(kind='a').inc(2)
+    counter.labels(kind='b"').inc()
+    assert registry.counter('test_total', 'Test counter', ['kind']) is counter
+    with pytest.raises(ValueError):
+        registry.counter('test_total', 'Test counter', ['other'])
+    with pytest.raises(ValueError):
+        registry.histogram('test_total', 'Test counter', ['kind'])
+    with pytest.raises(ValueError):
+        counter.labels(kind='a').inc(-1)
+    with pytest.raises(ValueError):
+        counter.inc()
+    assert registry.to_text() == """\
+# HELP test_total Test counter
+# TYPE test_total counter
+test_total{kind="a"} 3
+test_total{kind="b\\""} 1
+"""
+
+
+def test_histogram():
+    registry = metrics.MetricsRegistry()
+    histogram = registry.histogram('test_seconds', 'Test histogram', buckets=(1, 10))
+    histogram.observe(0.5)
+    histogram.observe(5)
+    histogram.observe(50)
+    with histogram.time():
+        pass
+    lines = registry.to_text().splitlines()
+    assert lines[:5] == [
+        '# HELP test_seconds Test histogram',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{le="1"} 2',
+        'test_seconds_bucket{le="10"} 3',
+        'test_seconds_bucket{le="+Inf"} 4',
+    ]
+    assert lines[5].startswith('test_seconds_sum 55.5')
+    assert lines[6] == 'test_seconds_count 4'
+    child = histogram.labels()
+    assert child.count == 4
+    assert child.counts == [2, 1, 1]
+    assert 55.5 <= child.sum < 56
+    registry.reset()
+    assert 'test_seconds_count' not in registry.to_text()
+
+
+def test_write(tmpdir):
+    registry = metrics.MetricsRegistry()
+    registry.counter('test_total', 'Test counter').inc()
+    path = os.path.join(str(tmpdir), 'metrics.prom')
+    registry.write(path)
+    with open(path) as fp:
+        assert 'test_total 1' in fp.read()
+    assert os.listdir(str(tmpdir)) == ['metrics.prom']
+
+
+def test_get_pushed_bytes():
+    lines = [
+        {'status': 'The push refers to a repository [example.com/image] (len: 1)'},
+        {'status': 'Pushing', 'id': 'a', 'progressDetail': {'current': 512, 'total': 1024}},
+        {'status': 'Pushing', 'id': 'a', 'progressDetail': {'current': 1024, 'total': 1024}},
+        {'status': 'Pushed', 'id': 'a', 'progressDetail': {}},
+        {'status': 'Layer already exists', 'id': 'b', 'progressDetail': {}},
+        {'status': 'Pushing', 'id': 'c', 'progressDetail': {'current': 10, 'total': 100}},
+    ]
+    logs = '\r\n'.join(json.dumps(l) for l in lines) + '\r\nnot a json\r\n'
+    assert get_pushed_bytes(logs) == 1124
+    assert get_pushed_bytes(logs.encode('utf-8')) == 1124
+
+
+def test_push_log_parser_chunks():
+    output = (u'{"status": "Pushing", "id": "a", "progressDetail": {"current": 1, "total": 2048}}\r\n'
+              '{"status": "Pushed", "id": "a", "progressDetail": {}}\r\n'
+              '{"status": "1: digest: sha256:0123abcd size: 2048"}\r\n'
+              '{"errorDetail": {"message": "unauthorized \u00e9"}, "error": "unauthorized \u00e9"}')
+    data = output.encode('utf-8')
+    parser = PushLogParser()
+    # chunks don't respect lines nor utf-8 characters
+    for start in range(0, len(data), 7):
+        parser.feed(data[start:start + 7])
+    parser.close()
+    assert parser.pushed_bytes == 2048
+    assert parser.digest == 'sha256:0123abcd'
+    assert parser.error == u'unauthorized \u00e9'
+    # progress lines are not kept
+    assert len(parser.lines) == 3
+    assert 'Pushing' not in parser.logs
+
+
+class X(object):
+    pass
+
+
+class FailingPlugin(PreBuildPlugin):
+    key = 'test_metrics_failing'
+
+    def run(self):
+        raise RuntimeError("failed")
+
+
+def test_plugin_metrics():
+    metrics.registry.reset()
+    workflow = DockerBuildWorkflow("", "")
+    workflow.builder = X()
+    workflow.builder.image_id = "asd123"
+    workflow.builder.base_image = ImageName(repo='fedora', tag='22')
+    workflow.builder.git_dockerfile_path = None
+    workflow.builder.git_path = None
+    runner = PreBuildPluginsRunner(DockerTasker(), workflow,
+                                   [{'name': FailingPlugin.key, 'can_fail': True}])
+    runner.plugin_classes = {FailingPlugin.key: FailingPlugin}
+    runner.run()
+    labels = {'phase': 'prebuild', 'plugin': FailingPlugin.key}
+    assert metrics.registry.get('dock_plugin_seconds').labels(**labels).count == 1
+    assert metrics.registry.get('dock_plugin_failures_total').labels(**labels).value == 1
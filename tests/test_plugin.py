@@ -35,7 +35,7 @@ class X(object):
     pass
 
 
-def test_rpmqa_plugin():
+def test_rpmqa_plugin(tmpdir):
     tasker = DockerTasker()
     workflow = DockerBuildWorkflow(DOCKERFILE_GIT, "test-image")
     setattr(workflow, 'builder', X)
@@ -45,7 +45,8 @@ def test_rpmqa_plugin():
     setattr(workflow.builder, 'git_path', "/non/existent")
     runner = PostBuildPluginsRunner(tasker, workflow,
                                     [{"name": PostBuildRPMqaPlugin.key,
-                                      "args": {'image_id': TEST_IMAGE}}])
+                                      "args": {'image_id': TEST_IMAGE,
+                                               'cache_dir': str(tmpdir)}}])
     results = runner.run()
     assert results is not None
     assert results[PostBuildRPMqaPlugin.key] is not None
@@ -0,0 +1,106 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import requests
+from docker.errors import APIError
+
+from dock import registry
+from dock.admission import AdmissionController
+from dock.imagegc import ImageUsageStore
+from dock.prewarm import PreWarmer
+from dock.util import ImageName
+
+from tests.fake_registry import FakeRegistry, push_layer
+
+
+def test_manifest_digest():
+    with FakeRegistry() as fake:
+        digest = push_layer(fake, 'fedora', '22', b'layer')
+        image = ImageName.parse('%s/fedora:22' % fake.netloc)
+        assert registry.get_manifest_digest(image, insecure=True) == digest
+        assert fake.stats.as_dict()['requests']['manifest_head'] == 1
+        assert registry.get_manifest_digest(image.copy(tag='23'), insecure=True) is None
+        # https only
+        assert registry.get_manifest_digest(image, timeout=5) is None
+
+
+def test_parse_challenge():
+    header = 'Bearer realm="https://auth.docker.io/token",service="registry.docker.io"'
+    assert registry._parse_challenge(header) == {'realm': 'https://auth.docker.io/token',
+                                                 'service': 'registry.docker.io'}
+    assert registry._parse_challenge('Basic realm="x"') is None
+
+
+def test_local_digests():
+    inspect = {'RepoDigests': ['fedora@sha256:1', 'docker.io/fedora@sha256:2',
+                               'example.com/fedora@sha256:3']}
+    assert registry.local_digests(inspect, ImageName.parse('fedora:22')) == \
+        set(['sha256:1', 'sha256:2'])
+    assert registry.local_digests({}, ImageName.parse('fedora:22')) == set()
+
+
+class FakeDockerClient(object):
+    def __init__(self):
+        self.images = {}  # name -> RepoDigests
+
+    def inspect_image(self, name):
+        if name not in self.images:
+            raise APIError("404 Client Error: Not Found", requests.Response())
+        return {'RepoDigests': self.images[name]}
+
+
+class FakeTasker(object):
+    def __init__(self, fake):
+        self.d = FakeDockerClient()
+        self.fake = fake
+        self.pulled = []
+
+    def pull_image(self, image, insecure=False):
+        self.pulled.append(image.to_str())
+        digest = self.fake.tags[image.repo][image.tag]
+        self.d.images[image.to_str()] = ['%s@%s' % (image.to_str(tag=False), digest)]
+
+
+def test_prewarmer(tmpdir):
+    with FakeRegistry() as fake:
+        push_layer(fake, 'fedora', '22', b'fedora')
+        push_layer(fake, 'busybox', 'latest', b'busybox')
+        push_layer(fake, 'centos', '7', b'centos')
+        store = ImageUsageStore(str(tmpdir.join('usage.json')))
+        names = ['%s/%s' % (fake.netloc, name) for name in
+                 ('fedora:22', 'busybox:latest', 'centos:7')]
+        for count, name in zip((3, 2, 1), names):
+            for _ in range(count):
+                store.record_use([name], base=True)
+        store.record_use(['my-image'])
+
+        tasker = FakeTasker(fake)
+        controller = AdmissionController()
+        prewarmer = PreWarmer(tasker, top=2, store=store, insecure=True, controller=controller)
+        assert prewarmer.popular_images() == names[:2]
+        assert prewarmer.run_once() == {names[0]: 'pulled', names[1]: 'pulled'}
+        assert prewarmer.run_once() == {names[0]: 'up-to-date', names[1]: 'up-to-date'}
+
+        # new image in registry
+        push_layer(fake, 'fedora', '22', b'fedora updated')
+        assert prewarmer.run_once() == {names[0]: 'pulled', names[1]: 'up-to-date'}
+        assert tasker.pulled == [names[0], names[1], names[0]]
+
+        # builds are pulling
+        with controller.admit('pull'):
+            assert prewarmer.warm(names[2]) == 'postponed'
+        assert prewarmer.warm(names[2]) == 'pulled'
+
+
+def test_prewarmer_thread(tmpdir):
+    store = ImageUsageStore(str(tmpdir.join('usage.json')))
+    prewarmer = PreWarmer(None, store=store, interval=0.01).start()
+    prewarmer.stop()
+    assert prewarmer._thread is None
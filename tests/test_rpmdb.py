@@ -0,0 +1,123 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import print_function
+
+import io
+import json
+import os
+import tarfile
+
+from flexmock import flexmock
+
+import dock.rpmdb
+from dock.core import DockerTasker
+from dock.rpmdb import extract_rpmdb, get_rpm_packages, create_package_table, \
+    format_package_table, diff_package_tables
+
+
+def add_file(tar, name, content):
+    info = tarfile.TarInfo(name)
+    info.size = len(content)
+    tar.addfile(info, io.BytesIO(content))
+
+
+def make_layer(files):
+    layer = io.BytesIO()
+    tar = tarfile.open(fileobj=layer, mode='w')
+    for name, content in files.items():
+        add_file(tar, name, content)
+    tar.close()
+    return layer.getvalue()
+
+
+def make_image(layers):
+    """ layers: list of (layer_id, parent_id, files), order of layers in tarball is reversed """
+    image = io.BytesIO()
+    tar = tarfile.open(fileobj=image, mode='w')
+    for layer_id, parent_id, files in reversed(layers):
+        add_file(tar, '%s/json' % layer_id,
+                 json.dumps({'id': layer_id, 'parent': parent_id}).encode('utf-8'))
+        add_file(tar, '%s/layer.tar' % layer_id, make_layer(files))
+    tar.close()
+    image.seek(0)
+    return image
+
+
+def test_extract_rpmdb(tmpdir):
+    image = make_image([
+        ('base', None, {'var/lib/rpm/Packages': b'base', 'var/lib/rpm/Name': b'base',
+                        'var/lib/rpm/__db.001': b'lock', 'etc/passwd': b'root'}),
+        ('middle', 'base', {'var/lib/rpm/Packages': b'middle', 'var/lib/rpm/.wh.__db.001': b''}),
+        ('top', 'middle', {'usr/bin/app': b'app'}),
+    ])
+    target = os.path.join(str(tmpdir), 'rpmdb')
+    extract_rpmdb(image, target)
+    assert sorted(os.listdir(target)) == ['Name', 'Packages']
+    with open(os.path.join(target, 'Packages'), 'rb') as fp:
+        assert fp.read() == b'middle'
+
+
+def test_extract_rpmdb_opaque(tmpdir):
+    image = make_image([
+        ('base', None, {'var/lib/rpm/Packages': b'base', 'var/lib/rpm/Name': b'base'}),
+        ('top', 'base', {'var/lib/rpm/.wh..wh..opq': b'', 'var/lib/rpm/Packages': b'top'}),
+    ])
+    target = str(tmpdir)
+    extract_rpmdb(image, target)
+    assert os.listdir(target) == ['Packages']
+
+
+def test_get_rpm_packages_cached(tmpdir):
+    tasker = DockerTasker()
+    image_id = 'cached-top-layer'
+    packages = ['bash,4.3,1.fc22,x86_64,(none),123,abc,1430000000']
+    (flexmock(tasker)
+        .should_receive('inspect_image')
+        .and_return({'Id': image_id}))
+    (flexmock(tasker)
+        .should_receive('get_image')
+        .and_return(make_image([(image_id, None, {'var/lib/rpm/Packages': b'x'})]))
+        .once())
+    flexmock(dock.rpmdb).should_receive('query_rpmdb').and_return(packages).once()
+
+    cache_dir = str(tmpdir)
+    assert get_rpm_packages(tasker, image_id, cache_dir=cache_dir) == packages
+    # second call doesn't touch the image
+    assert get_rpm_packages(tasker, image_id, cache_dir=cache_dir) == packages
+    with open(os.path.join(cache_dir, '%s.json' % image_id)) as fp:
+        assert json.load(fp) == packages
+
+
+BASE_RPM_OUTPUT = [
+    'setup,2.9.6,1.fc22,noarch,(none),696293,12c7b4a8c1bfe1f2a3e8cb1da7e5b6b8,1427728476',
+    'bash,4.3.39,1.fc22,x86_64,(none),3601232,5a2c9f1aa7e1af2d3b2d0a9d02c3e6b4,1432127722',
+    'vim-minimal,7.4.640,4.fc22,x86_64,2,1004416,8e7c1bd36b3fdb0d1ab0e9b97e86f0d9,1431086102',
+]
+RPM_OUTPUT = [
+    'bash,4.3.39,2.fc22,x86_64,(none),3601232,aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa,1434000000',
+    'setup,2.9.6,1.fc22,noarch,(none),696293,12c7b4a8c1bfe1f2a3e8cb1da7e5b6b8,1427728476',
+    'python,2.7.10,1.fc22,x86_64,(none),80000,bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb,1433000000',
+]
+
+
+def test_create_package_table():
+    table = create_package_table(BASE_RPM_OUTPUT + ['garbage'])
+    assert table['name'] == ['bash', 'setup', 'vim-minimal']
+    assert table['epoch'] == [None, None, 2]
+    assert table['size'] == [3601232, 696293, 1004416]
+    assert sorted(format_package_table(table)) == sorted(BASE_RPM_OUTPUT)
+
+
+def test_diff_package_tables():
+    diff = diff_package_tables(create_package_table(BASE_RPM_OUTPUT),
+                               create_package_table(RPM_OUTPUT))
+    assert diff['added']['name'] == ['python']
+    assert diff['changed']['name'] == ['bash']
+    assert diff['changed']['release'] == ['2.fc22']
+    assert diff['removed']['name'] == ['vim-minimal']
@@ -0,0 +1,130 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import pytest
+
+from dock.scheduler import Scheduler, QueueFullError
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Job(object):
+    def __init__(self, clock, job_id, priority=None, owner=None):
+        self.id = job_id
+        self.priority = priority
+        self.owner = owner
+        self.created = clock()
+
+    def __repr__(self):
+        return self.id
+
+
+def run(scheduler, clock, count, duration=10):
+    """ start and finish jobs one by one, return their ids """
+    started = []
+    for _ in range(count):
+        job = scheduler.get(timeout=0)
+        if job is None:
+            break
+        started.append(job.id)
+        clock.now += duration
+        scheduler.done(job)
+    return started
+
+
+def test_priority_classes():
+    clock = Clock()
+    scheduler = Scheduler(clock=clock)
+    for i in range(3):
+        scheduler.put(Job(clock, 'batch%d' % i, priority='batch'))
+    scheduler.put(Job(clock, 'normal', priority=None))
+    scheduler.put(Job(clock, 'urgent', priority='urgent'))
+    assert [j.id for j in scheduler.jobs()] == ['urgent', 'normal', 'batch0', 'batch1', 'batch2']
+    assert run(scheduler, clock, 5, duration=1) == \
+        ['urgent', 'normal', 'batch0', 'batch1', 'batch2']
+    with pytest.raises(ValueError):
+        scheduler.put(Job(clock, 'x', priority='whenever'))
+
+
+def test_aging():
+    clock = Clock()
+    scheduler = Scheduler(clock=clock, aging_rate=1.0)
+    scheduler.put(Job(clock, 'batch', priority='batch'))
+    clock.now += 60
+    scheduler.put(Job(clock, 'normal1', priority='normal'))
+    # batch waited 60s: 0 + 60 > 50 + 0
+    assert run(scheduler, clock, 1) == ['batch']
+    scheduler.put(Job(clock, 'batch2', priority='batch'))
+    assert run(scheduler, clock, 2) == ['normal1', 'batch2']
+
+
+def test_fair_share():
+    clock = Clock()
+    scheduler = Scheduler(clock=clock)
+    for i in range(10):
+        scheduler.put(Job(clock, 'a%d' % i, owner='team-a'))
+    started = run(scheduler, clock, 2)
+    scheduler.put(Job(clock, 'b0', owner='team-b'))
+    scheduler.put(Job(clock, 'b1', owner='team-b'))
+    # team-b hasn't built anything yet, it doesn't wait for rest of team-a's jobs
+    started += run(scheduler, clock, 4)
+    assert started == ['a0', 'a1', 'b0', 'b1', 'a2', 'a3']
+
+
+def test_fair_share_running_jobs_and_weights():
+    clock = Clock()
+    scheduler = Scheduler(clock=clock, owner_weights={'team-b': 2})
+    for i in range(6):
+        scheduler.put(Job(clock, 'a%d' % i, owner='team-a'))
+        scheduler.put(Job(clock, 'b%d' % i, owner='team-b'))
+    # 6 workers take jobs at once; team-b has double weight
+    started = [scheduler.get(timeout=0).id for _ in range(6)]
+    assert sorted(started) == ['a0', 'a1', 'b0', 'b1', 'b2', 'b3']
+
+
+def test_preemption_of_queued_jobs():
+    clock = Clock()
+    scheduler = Scheduler(clock=clock, max_queued=2)
+    batch = [Job(clock, 'batch%d' % i, priority='batch') for i in range(2)]
+    for job in batch:
+        assert scheduler.put(job) == []
+    # running jobs are never preempted
+    running = scheduler.get(timeout=0)
+    assert running is batch[0]
+    clock.now += 1
+    scheduler.put(Job(clock, 'batch2', priority='batch'))
+    with pytest.raises(QueueFullError):
+        scheduler.put(Job(clock, 'batch3', priority='batch'))
+    clock.now += 1
+    preempted = scheduler.put(Job(clock, 'urgent', priority='urgent'))
+    assert [j.id for j in preempted] == ['batch2']
+    assert [j.id for j in scheduler.jobs()] == ['urgent', 'batch1']
+
+
+def test_stats():
+    clock = Clock()
+    scheduler = Scheduler(clock=clock)
+    scheduler.put(Job(clock, 'u', priority='urgent'))
+    scheduler.put(Job(clock, 'b', priority='batch'))
+    clock.now += 5
+    assert run(scheduler, clock, 1, duration=20) == ['u']
+    stats = scheduler.stats()
+    assert stats['urgent'] == {'queued': 0, 'running': 0, 'started': 1, 'finished': 1,
+                               'mean_wait_seconds': 5.0, 'mean_run_seconds': 20.0}
+    assert stats['batch']['queued'] == 1
+    assert stats['batch']['mean_wait_seconds'] is None
+    scheduler.close()
+    assert scheduler.get() is None
@@ -0,0 +1,45 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+CLI is executed in every build container, importing it has to stay cheap:
+heavy modules mustn't be imported. Imports are checked in a fresh interpreter;
+time of the import is measured by benchmark 'cli_import' (see tests/benchmark.py).
+"""
+
+from __future__ import print_function, unicode_literals
+
+import json
+import os
+import subprocess
+import sys
+
+
+HEAVY_MODULES = ('docker', 'git', 'koji', 'osbs', 'pkg_resources', 'dock.inner', 'dock.outer')
+
+MEASURE_SCRIPT = """
+import json, sys
+import dock.cli.main
+print(json.dumps({"modules": sorted(sys.modules)}))
+"""
+
+dock_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_imported_modules():
+    proc = subprocess.Popen([sys.executable, "-c", MEASURE_SCRIPT], cwd=dock_root,
+                            stdout=subprocess.PIPE)
+    output, _ = proc.communicate()
+    assert proc.returncode == 0
+    return json.loads(output.decode('utf-8'))["modules"]
+
+
+def test_cli_import_is_lazy():
+    modules = get_imported_modules()
+    for module in HEAVY_MODULES:
+        assert module not in modules
+
@@ -17,6 +17,11 @@ from tests.constants import LOCALHOST_REGISTRY, INPUT_IMAGE, DOCKERFILE_GIT, MOC
 import git
 import docker, docker.errors
 import pytest
+import requests
+from flexmock import flexmock
+
+from tests.docker_mock import mock_image
+from tests.fake_registry import FakeRegistry, push_image as registry_push
 
 if MOCK:
     from tests.docker_mock import mock_docker
@@ -161,8 +166,7 @@ def test_tag_image(temp_image_name):
         mock_docker()
 
     t = DockerTasker()
-    temp_image_name.registry = "somewhere.example.com"
-    temp_image_name.tag = "1"
+    temp_image_name = temp_image_name.copy(registry="somewhere.example.com", tag="1")
     img = t.tag_image(INPUT_IMAGE, temp_image_name)
     try:
         assert t.image_exists(temp_image_name)
@@ -176,8 +180,7 @@ def test_push_image(temp_image_name):
         mock_docker()
 
     t = DockerTasker()
-    temp_image_name.registry = LOCALHOST_REGISTRY
-    temp_image_name.tag = "1"
+    temp_image_name = temp_image_name.copy(registry=LOCALHOST_REGISTRY, tag="1")
     t.tag_image(INPUT_IMAGE, temp_image_name)
     output = t.push_image(temp_image_name, insecure=True)
     assert output is not None
@@ -189,22 +192,58 @@ def test_tag_and_push(temp_image_name):
         mock_docker()
 
     t = DockerTasker()
-    temp_image_name.registry = LOCALHOST_REGISTRY
-    temp_image_name.tag = "1"
+    temp_image_name = temp_image_name.copy(registry=LOCALHOST_REGISTRY, tag="1")
     output = t.tag_and_push_image(INPUT_IMAGE, temp_image_name, insecure=True)
     assert output is not None
     assert t.image_exists(temp_image_name)
     t.remove_image(temp_image_name)
 
 
+def test_tag_and_push_images_only_once(temp_image_name):
+    mock_docker()
+    with FakeRegistry() as fake:
+        repo_digests = []
+        pushes = []
+
+        def push(repository, tag=None, **kwargs):
+            pushes.append((repository, tag))
+            name = ImageName.parse(repository).to_str(registry=False)
+            digest = list(registry_push(requests.Session(), fake.url, name, tag,
+                                        b'{}', [b'layer']))[-1][1]
+            repo_digests.append('%s@%s' % (repository, digest))
+            return b''
+        flexmock(docker.Client, push=push)
+        flexmock(docker.Client,
+                 inspect_image=lambda image_id: dict(mock_image, RepoDigests=repo_digests))
+
+        t = DockerTasker()
+        names = [ImageName.parse('%s/%s' % (fake.netloc, name))
+                 for name in (temp_image_name.to_str(tag=False) + ':1.0',
+                              temp_image_name.to_str(tag=False) + ':latest', 'other:1.0')]
+        results = t.tag_and_push_images(INPUT_IMAGE, names, insecure=True)
+        # layers are uploaded once, latest gets manifest of 1.0
+        assert [results[name.to_str()]['result'] for name in names] == \
+            ['pushed', 'tagged', 'pushed']
+        assert pushes == [(names[0].to_str(tag=False), '1.0'),
+                          (names[2].to_str(tag=False), '1.0')]
+        assert fake.get_tags(temp_image_name.to_str(tag=False)) == ['1.0', 'latest']
+        assert fake.stats.as_dict()['blob_uploads'] == 2
+
+        # e.g. workflow is run again
+        results = t.tag_and_push_images(INPUT_IMAGE, names, insecure=True)
+        assert set(r['result'] for r in results.values()) == set(['skipped'])
+        assert t.tag_and_push_image(INPUT_IMAGE, names[0], insecure=True) == ''
+        assert t.tag_and_push_image(INPUT_IMAGE, names[0], insecure=True, force=True) == ''
+        assert len(pushes) == 3
+
+
 def test_pull_image():
     if MOCK:
         mock_docker()
 
     t = DockerTasker()
     local_img = input_image_name
-    remote_img = local_img.copy()
-    remote_img.registry = LOCALHOST_REGISTRY
+    remote_img = local_img.copy(registry=LOCALHOST_REGISTRY)
     t.tag_and_push_image(local_img, remote_img, insecure=True)
     got_image = t.pull_image(remote_img, insecure=True)
     assert remote_img.to_str() == got_image
@@ -286,3 +325,12 @@ def test_build_image_from_git(temp_image_name):
     assert response is not None
     assert t.image_exists(temp_image_name)
     t.remove_image(temp_image_name)
+
+
+def test_clone():
+    controller = object()
+    t = DockerTasker(base_url='tcp://docker.example.com:2375', admission_controller=controller)
+    clone = t.clone()
+    assert clone.d is not t.d
+    assert clone.d.base_url == t.d.base_url
+    assert clone.admission_controller is controller
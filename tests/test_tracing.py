@@ -0,0 +1,146 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+import json
+import os
+import time
+
+import pytest
+
+from dock import tracing
+from dock.constants import BUILD_JSON, TRACE_JSON
+from dock.core import DockerTasker
+from dock.outer import BuildManager
+from dock.util import ImageName
+
+from tests.docker_mock import mock_docker
+
+
+@pytest.fixture
+def tracer(request):
+    tracing.tracer.clear()
+    tracing.tracer.enable()
+
+    def fin():
+        tracing.tracer.disable()
+        tracing.tracer.clear()
+    request.addfinalizer(fin)
+    return tracing.tracer
+
+
+def spans_by_name(events):
+    return dict((e['name'], e) for e in events if e['ph'] == 'X')
+
+
+def test_disabled():
+    tracer = tracing.Tracer()
+    with tracer.span('x') as span:
+        span.set_attribute('a', 1)
+    assert tracer.get_context() is None
+    assert [e['ph'] for e in tracer.get_events()] == ['M']
+
+
+def test_nested_spans(tmpdir):
+    tracer = tracing.Tracer()
+    tracer.enable()
+    with tracer.span('outer', image='fedora') as outer:
+        with tracer.span('inner', category='plugin'):
+            pass
+        with pytest.raises(RuntimeError):
+            with tracer.span('failing'):
+                raise RuntimeError("oops")
+
+    path = os.path.join(str(tmpdir), 'trace.json')
+    tracer.write(path)
+    with open(path) as fp:
+        trace = json.load(fp)
+    assert trace['otherData']['trace_id'] == tracer.trace_id
+    spans = spans_by_name(trace['traceEvents'])
+    assert set(spans) == set(['outer', 'inner', 'failing'])
+    assert spans['outer']['args']['image'] == 'fedora'
+    assert 'parent_id' not in spans['outer']['args']
+    assert spans['inner']['args']['parent_id'] == outer.span_id
+    assert spans['inner']['cat'] == 'plugin'
+    assert 'RuntimeError' in spans['failing']['args']['error']
+    assert spans['outer']['ts'] <= spans['inner']['ts']
+    assert spans['inner']['ts'] + spans['inner']['dur'] <= \
+        spans['outer']['ts'] + spans['outer']['dur']
+
+
+def test_context_propagation(tmpdir):
+    parent = tracing.Tracer()
+    parent.enable()
+    child = tracing.Tracer()
+    with parent.span('parent') as parent_span:
+        child.enable(json.loads(json.dumps(parent.get_context())), process_name='child')
+        with child.span('child'):
+            pass
+    assert child.trace_id == parent.trace_id
+    path = os.path.join(str(tmpdir), 'child.json')
+    child.write(path)
+    parent.add_events(tracing.load_events(path))
+    spans = spans_by_name(parent.get_events())
+    assert spans['child']['args']['parent_id'] == parent_span.span_id
+
+
+def test_traced_tasker(tracer):
+    mock_docker()
+    DockerTasker().inspect_image(ImageName.parse('fedora:22'))
+    spans = spans_by_name(tracer.get_events())
+    assert spans['DockerTasker.inspect_image']['args']['arg0'] == 'fedora:22'
+    assert spans['DockerTasker.inspect_image']['cat'] == 'docker'
+
+
+class Streamer(object):
+    @tracing.traced()
+    def stream(self, lines, fail=False):
+        for line in lines:
+            time.sleep(0.01)
+            yield line
+        if fail:
+            raise RuntimeError("stream broke")
+
+
+def test_traced_generator(tracer):
+    streamer = Streamer()
+    stream = streamer.stream(['a', 'b', 'c'])
+    # span is still open
+    assert spans_by_name(tracer.get_events()) == {}
+    assert list(stream) == ['a', 'b', 'c']
+    spans = spans_by_name(tracer.get_events())
+    assert spans['Streamer.stream']['dur'] >= 30000
+    tracer.clear()
+
+    with pytest.raises(RuntimeError):
+        list(streamer.stream(['a'], fail=True))
+    spans = spans_by_name(tracer.get_events())
+    assert 'stream broke' in spans['Streamer.stream']['args']['error']
+
+
+def test_build_manager_passes_context(tracer):
+    mock_docker()
+    manager = BuildManager("buildroot-fedora", {"image": "test-image", "git_url": "file:///dev/null"})
+
+    def build_method(build_image, temp_dir):
+        # what build_inside does within the container
+        with open(os.path.join(temp_dir, BUILD_JSON)) as fp:
+            context = json.load(fp)[tracing.TRACE_CONTEXT_KEY]
+        inner = tracing.Tracer()
+        inner.enable(context, process_name='dock inside-build')
+        with inner.span('build_inside'):
+            pass
+        inner.write(os.path.join(temp_dir, TRACE_JSON))
+        return 'container-id'
+
+    manager._build(build_method)
+    spans = spans_by_name(tracer.get_events())
+    assert spans['start_build_container']['args']['parent_id'] == \
+        spans['BuildManager.build']['args']['span_id']
+    assert spans['build_inside']['args']['parent_id'] == \
+        spans['BuildManager.build']['args']['span_id']
+    assert 'DockerTasker.wait' in spans
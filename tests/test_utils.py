@@ -7,6 +7,7 @@ of the BSD license. See the LICENSE file for details.
 """
 
 import os
+import pytest
 import docker
 from dock.util import ImageName, get_baseimage_from_dockerfile, wait_for_command, \
                       clone_git_repo, LazyGit, figure_out_dockerfile
@@ -81,3 +82,16 @@ def test_lazy_git_with_tmpdir(tmpdir):
     lazy_git = LazyGit(git_url=DOCKERFILE_GIT, tmpdir=t)
     assert lazy_git._tmpdir == t
     assert lazy_git.git_path is not None
+
+
+def test_image_name_immutable_and_hashable():
+    image_name = ImageName.parse("registry:5000/image-name:1")
+    assert ImageName.parse("registry:5000/image-name:1") is image_name
+    with pytest.raises(AttributeError):
+        image_name.tag = "2"
+    copied = image_name.copy(tag="2")
+    assert copied.to_str() == "registry:5000/image-name:2"
+    assert image_name.to_str() == "registry:5000/image-name:1"
+    assert copied != image_name
+    assert len(set([image_name, copied, ImageName(registry="registry:5000",
+                                                  repo="image-name", tag="1")])) == 2
@@ -0,0 +1,216 @@
+"""
+Copyright (c) 2015 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import print_function
+
+import os
+import threading
+
+import requests
+from flexmock import flexmock
+
+from dock.core import DockerTasker
+from dock.inner import DockerBuildWorkflow
+from dock.plugin import PreBuildPluginsRunner, PostBuildPluginsRunner
+from dock.plugins.pre_yum_cache_proxy import YumCacheProxyPlugin
+from dock.plugins.post_yum_cache_proxy_stats import YumCacheProxyStatsPlugin
+from dock.util import ImageName
+from dock.yum_proxy import YumCacheProxy, PackageStore, ThreadingHTTPServer
+from tests.constants import DOCKERFILE_GIT
+
+try:
+    # py2
+    from BaseHTTPServer import BaseHTTPRequestHandler
+except ImportError:
+    # py3
+    from http.server import BaseHTTPRequestHandler
+
+
+UPSTREAM_FILES = {
+    '/repo/x86_64/repodata/repomd.xml': (b'<repomd/>', '"repomd-1"'),
+    '/repo/x86_64/bash-4.3-1.x86_64.rpm': (b'bash' * 100, '"bash"'),
+}
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_HEAD(self):
+        self.requests.append('HEAD ' + self.path)
+        try:
+            content, etag = UPSTREAM_FILES[self.path]
+        except KeyError:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        try:
+            content, etag = UPSTREAM_FILES[self.path]
+        except KeyError:
+            self.send_error(404)
+            return
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def start_upstream():
+    UpstreamHandler.requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), UpstreamHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def test_yum_cache_proxy(tmpdir):
+    upstream = start_upstream()
+    try:
+        proxy = YumCacheProxy(str(tmpdir), 1024 ** 2, '127.0.0.1', bind_address='127.0.0.1')
+        proxy.start()
+        try:
+            upstream_url = 'http://127.0.0.1:%d' % upstream.server_address[1]
+            baseurl = proxy.add_upstream(upstream_url + '/repo/$basearch')
+            assert baseurl.startswith(proxy.url)
+            assert baseurl.endswith('/repo/$basearch')
+            baseurl = baseurl.replace('$basearch', 'x86_64')
+
+            # HEAD doesn't download anything
+            response = requests.head(baseurl + '/bash-4.3-1.x86_64.rpm')
+            assert response.status_code == 200
+            assert response.headers['Content-Length'] == '400'
+            assert requests.head(baseurl + '/missing.rpm').status_code == 404
+            assert proxy.stats.requests == 0
+            assert proxy.store.lookup(upstream_url + '/repo/x86_64/bash-4.3-1.x86_64.rpm') is None
+
+            for _ in range(2):
+                response = requests.get(baseurl + '/repodata/repomd.xml')
+                assert response.content == b'<repomd/>'
+                response = requests.get(baseurl + '/bash-4.3-1.x86_64.rpm')
+                assert response.content == b'bash' * 100
+            assert requests.get(baseurl + '/missing.rpm').status_code == 404
+            # cached package is served from cache for HEAD as well
+            assert requests.head(baseurl + '/bash-4.3-1.x86_64.rpm').status_code == 200
+
+            # blob vanished (other process evicted it) before it was opened: no partial response
+            (flexmock(proxy.store)
+                .should_receive('touch')
+                .replace_with(lambda entry: os.remove(proxy.store.blob_path(entry['digest']))))
+            assert requests.get(baseurl + '/bash-4.3-1.x86_64.rpm').status_code == 502
+        finally:
+            proxy.stop()
+    finally:
+        upstream.shutdown()
+        upstream.server_close()
+
+    # package is fetched once, repodata is revalidated
+    assert UpstreamHandler.requests.count('/repo/x86_64/bash-4.3-1.x86_64.rpm') == 1
+    assert UpstreamHandler.requests.count('/repo/x86_64/repodata/repomd.xml') == 2
+    stats = proxy.stats.as_dict()
+    assert stats['hits'] == 3
+    assert stats['misses'] == 2
+    assert stats['bytes_saved'] == len(b'<repomd/>') + 800
+    assert stats['hit_ratio'] == 0.6
+
+
+def test_yum_cache_proxy_listens_on_advertised_address(tmpdir):
+    proxy = YumCacheProxy(str(tmpdir), 1024 ** 2, '127.0.0.1')
+    proxy.start()
+    try:
+        assert proxy._server.server_address[0] == '127.0.0.1'
+    finally:
+        proxy.stop()
+
+
+def test_package_store_eviction(tmpdir):
+    store = PackageStore(str(tmpdir), 10)
+    for name, content in (('a', b'aaaaaa'), ('b', b'bbbbbb')):
+        path = os.path.join(str(tmpdir), name)
+        with open(path, 'wb') as fp:
+            fp.write(content)
+        store.store('http://x/%s.rpm' % name, path, name, len(content))
+        if name == 'a':
+            # make it least recently used
+            os.utime(store.blob_path('a'), (0, 0))
+    assert store.lookup('http://x/a.rpm') is None
+    assert store.lookup('http://x/b.rpm')['size'] == 6
+
+
+def test_package_store_keeps_pinned_blobs(tmpdir):
+    store = PackageStore(str(tmpdir), 10)
+
+    def add(name, content, pin=False):
+        path = os.path.join(str(tmpdir), name)
+        with open(path, 'wb') as fp:
+            fp.write(content)
+        store.store('http://x/%s.rpm' % name, path, name, len(content), pin=pin)
+        os.utime(store.blob_path(name), (len(name), len(name)))
+
+    add('a', b'aaaaaa', pin=True)  # being served
+    add('bb', b'bbbbbb')
+    # just stored blob is never evicted, even if it doesn't fit
+    add('ccc', b'c' * 20)
+    assert store.lookup('http://x/a.rpm') is not None
+    assert store.lookup('http://x/bb.rpm') is None
+    assert store.lookup('http://x/ccc.rpm') is not None
+
+    store.unpin('a')
+    entry = store.lookup('http://x/ccc.rpm', pin=True)
+    store.evict()
+    assert store.lookup('http://x/a.rpm') is None
+    assert store.lookup('http://x/ccc.rpm') is not None
+    store.unpin(entry['digest'])
+    store.evict()
+    assert store.lookup('http://x/ccc.rpm') is None
+
+
+class X(object):
+    pass
+
+
+def test_yum_cache_proxy_plugins(tmpdir):
+    tasker = DockerTasker()
+    workflow = DockerBuildWorkflow(DOCKERFILE_GIT, "test-image")
+    setattr(workflow, 'builder', X)
+    setattr(workflow.builder, 'image_id', "asd123")
+    setattr(workflow.builder, 'base_image', ImageName(repo='fedora', tag='22'))
+    setattr(workflow.builder, 'git_dockerfile_path', None)
+    setattr(workflow.builder, 'git_path', None)
+    workflow.repos['yum'] = [
+        {'name': 'koji', 'baseurl': r'http://koji.example.com/repos/f22-build/1/\$basearch'},
+        {'name': 'fedora', 'metalink': 'https://mirrors.fedoraproject.org/metalink?repo=fedora'},
+    ]
+    runner = PreBuildPluginsRunner(tasker, workflow, [{
+        'name': YumCacheProxyPlugin.key,
+        'args': {'cache_dir': str(tmpdir), 'host': '127.0.0.1', 'bind_address': '127.0.0.1'},
+    }])
+    runner.run()
+    proxy_url = workflow.prebuild_results[YumCacheProxyPlugin.key]
+    assert workflow.repos['yum'][0]['baseurl'] == proxy_url + r'/r0/repos/f22-build/1/\$basearch'
+    assert 'baseurl' not in workflow.repos['yum'][1]
+
+    runner = PostBuildPluginsRunner(tasker, workflow, [{
+        'name': YumCacheProxyStatsPlugin.key,
+    }])
+    runner.run()
+    assert workflow.postbuild_results[YumCacheProxyStatsPlugin.key]['requests'] == 0